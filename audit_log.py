@@ -0,0 +1,506 @@
+"""
+Append-only audit log of LLM calls (who generated what, with which model, template and settings).
+
+DORA / MaRisk traceability without slowing down requests: `AuditLog.record()` only puts
+the record on an in-memory queue. A background writer thread drains the queue in
+batches, serializes and hash-chains the records and appends each batch as one gzip
+member to the current segment file:
+
+    .audit/audit-000000000001-20261019T101500Z.jsonl.gz
+    .audit/HEAD.json            last sequence number, hash and segment
+
+Every record carries `seq`, `prev` (hash of the previous record) and `hash` (SHA-256
+over its canonical JSON including `prev`), so removing, reordering or editing any
+record - or a whole segment - breaks the chain. The chain continues across segments
+and across worker processes: batches are written under an exclusive file lock and
+HEAD.json hands the chain over. Closed segments are made read-only.
+
+fsync policies: "always" (every batch is durable before the next one), "interval"
+(at most `fsync_interval_s` of records can be lost on a host crash) and "never".
+
+Usage:
+    python audit_log.py verify .audit
+    python audit_log.py show .audit [--request-id ID] [--user U] [--last 20]
+    python audit_log.py bench [--records 20000] [--fsync interval]
+"""
+
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:                     # Windows: the thread lock still serializes this process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DIR = ".audit"
+HEAD_FILE = "HEAD.json"
+LOCK_FILE = ".lock"
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+GENESIS_HASH = "0" * 64
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def canonical(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def record_hash(record: Dict[str, Any]) -> str:
+    """SHA-256 over the canonical JSON of the record without its own `hash`."""
+    return hashlib.sha256(canonical({k: v for k, v in record.items() if k != "hash"})).hexdigest()
+
+
+def sha256_text(text: Optional[str]) -> Optional[str]:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest() if text is not None else None
+
+
+def _segment_name(first_seq: int) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return f"{SEGMENT_PREFIX}{first_seq:012d}-{stamp}{SEGMENT_SUFFIX}"
+
+
+def list_segments(directory: str) -> List[str]:
+    """Segment file names in chain order (the name starts with the first sequence number)."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+
+
+def read_members(data: bytes) -> Tuple[List[bytes], Optional[str]]:
+    """Decompressed gzip members of a segment (or segment tail) and an error for a damaged tail."""
+    members = []
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            payload = decompressor.decompress(data)
+        except zlib.error as e:
+            return members, f"corrupt gzip member ({e})"
+        if not decompressor.eof:
+            return members, "truncated gzip member (interrupted write)"
+        members.append(payload)
+        data = decompressor.unused_data
+    return members, None
+
+
+def _parse_lines(payload: bytes) -> Iterator[Dict[str, Any]]:
+    for line in payload.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+
+@dataclass
+class AuditStats:
+    queued: int = 0
+    written: int = 0
+    dropped: int = 0
+    batches: int = 0
+    max_batch: int = 0
+    fsyncs: int = 0
+    bytes_written: int = 0
+    write_s: float = 0.0
+
+
+class AuditLog:
+    """Queue-fed, batched, hash-chained audit log writer."""
+
+    def __init__(self, directory: str = AUDIT_DIR, fsync: str = "interval", fsync_interval_s: float = 1.0,
+                 batch_max: int = 512, flush_interval_s: float = 0.2, queue_max: int = 50000,
+                 segment_max_bytes: int = 64 << 20, segment_max_age_s: float = 86400.0, compress_level: int = 6):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.fsync = fsync
+        self.fsync_interval_s = fsync_interval_s
+        self.batch_max = batch_max
+        self.flush_interval_s = flush_interval_s
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age_s = segment_max_age_s
+        self.compress_level = compress_level
+        self.stats = AuditStats()
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_max)
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()     # Counters only; _lock is held while a batch is written
+        self._dropped_reported = 0
+        self._last_fsync = 0.0
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # ---------- Request path ----------
+
+    def record(self, event: str, **fields: Any) -> bool:
+        """Queue one record; never blocks or raises. False if the queue was full (counted as dropped)."""
+        fields["event"] = event
+        fields["ts"] = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats.dropped += 1
+            return False
+        with self._stats_lock:
+            self.stats.queued += 1
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything queued so far is written (tests, shutdown, the CLI)."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=10.0)
+
+    # ---------- Writer thread ----------
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, events = [], []
+            deadline = time.monotonic() + self.flush_interval_s
+            while True:
+                if isinstance(item, threading.Event):
+                    events.append(item)
+                    break               # Flush requested: write what we have now
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_max:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch or self.stats.dropped > self._dropped_reported:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    # Keep serving: the records of this batch are lost, which the next gap record shows
+                    with self._stats_lock:
+                        self.stats.dropped += len(batch)
+                    logger.error("Audit batch of %d records not written: %s", len(batch), e)
+            for done in events:
+                done.set()
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Thread lock plus an exclusive file lock, so all worker processes extend one chain."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(os.path.join(self.directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def _read_head(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.directory, HEAD_FILE), encoding="utf-8") as f:
+                head = json.load(f)
+        except (FileNotFoundError, ValueError):
+            head = self._recover_head()
+        segment = head.get("segment")
+        if segment:
+            path = os.path.join(self.directory, segment)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size != head.get("size"):
+                head = self._catch_up_head(head, path, size)
+        return head
+
+    def _recover_head(self) -> Dict[str, Any]:
+        """HEAD.json missing: rebuild it from the last segment."""
+        head = {"seq": 0, "hash": GENESIS_HASH, "segment": None, "size": 0, "started": 0.0}
+        segments = list_segments(self.directory)
+        if segments:
+            head.update(segment=segments[-1], size=0, started=time.time())
+            path = os.path.join(self.directory, segments[-1])
+            head = self._catch_up_head(head, path, os.path.getsize(path))
+        return head
+
+    def _catch_up_head(self, head: Dict[str, Any], path: str, size: int) -> Dict[str, Any]:
+        """A batch was appended without updating HEAD.json (crash in between): take its last record."""
+        with open(path, "rb") as f:
+            f.seek(head.get("size", 0))
+            members, error = read_members(f.read())
+        for payload in members:
+            for record in _parse_lines(payload):
+                head.update(seq=record["seq"], hash=record["hash"])
+        head["size"] = size
+        if error:
+            head["segment"] = None      # Never append behind a damaged tail; verify reports it
+        return head
+
+    def _write_head(self, head: Dict[str, Any]) -> None:
+        path = os.path.join(self.directory, HEAD_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(head, f)
+            if self.fsync == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _rotate(self, head: Dict[str, Any]) -> None:
+        if head.get("segment"):
+            try:
+                os.chmod(os.path.join(self.directory, head["segment"]), 0o440)
+            except OSError:
+                pass
+        head.update(segment=_segment_name(head["seq"] + 1), size=0, started=time.time())
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        with self._stats_lock:
+            reported = self.stats.dropped
+        gap = reported - self._dropped_reported
+        if gap:
+            batch = [{"event": "audit_gap", "dropped": gap,
+                      "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds")}] + batch
+
+        with self._exclusive():
+            head = self._read_head()
+            if (not head.get("segment") or head["size"] >= self.segment_max_bytes
+                    or time.time() - head.get("started", 0.0) >= self.segment_max_age_s):
+                self._rotate(head)
+
+            lines = []
+            seq, prev = head["seq"], head["hash"]
+            for fields in batch:
+                seq += 1
+                record = {"seq": seq, **fields, "prev": prev}
+                record["hash"] = prev = record_hash(record)
+                lines.append(json.dumps(record, ensure_ascii=False))
+                time.sleep(0)           # Let request threads take the GIL between records
+            data = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), self.compress_level, mtime=0)
+
+            path = os.path.join(self.directory, head["segment"])
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+            try:
+                os.write(fd, data)
+                now = time.monotonic()
+                if self.fsync == "always" or (self.fsync == "interval"
+                                              and now - self._last_fsync >= self.fsync_interval_s):
+                    os.fsync(fd)
+                    self._last_fsync = now
+                    self.stats.fsyncs += 1
+            finally:
+                os.close(fd)
+            head.update(seq=seq, hash=prev, size=head["size"] + len(data))
+            self._write_head(head)
+
+        self._dropped_reported = reported
+        self.stats.written += len(batch)
+        self.stats.batches += 1
+        self.stats.max_batch = max(self.stats.max_batch, len(batch))
+        self.stats.bytes_written += len(data)
+        self.stats.write_s += time.perf_counter() - start
+
+
+def audit_from_settings(cfg: Dict) -> Optional[AuditLog]:
+    """Build from a secrets-style [audit] table; None when disabled."""
+    cfg = dict(cfg or {})
+    if not cfg.get("enabled", True):
+        return None
+    return AuditLog(
+        directory=cfg.get("directory", AUDIT_DIR),
+        fsync=cfg.get("fsync", "interval"),
+        fsync_interval_s=float(cfg.get("fsync_interval_s", 1.0)),
+        batch_max=int(cfg.get("batch_max", 512)),
+        flush_interval_s=float(cfg.get("flush_interval_s", 0.2)),
+        queue_max=int(cfg.get("queue_max", 50000)),
+        segment_max_bytes=int(float(cfg.get("segment_max_mb", 64)) * (1 << 20)),
+        segment_max_age_s=float(cfg.get("segment_max_age_h", 24)) * 3600,
+    )
+
+# ============================
+# Verification & Reading
+# ============================
+
+@dataclass
+class VerifyReport:
+    segments: int = 0
+    records: int = 0
+    gaps: int = 0                   # audit_gap records (queue overflow, write errors)
+    first_ts: Optional[str] = None
+    last_ts: Optional[str] = None
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def iter_records(directory: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """(segment, record) for every readable record, in chain order."""
+    for segment in list_segments(directory):
+        with open(os.path.join(directory, segment), "rb") as f:
+            members, _ = read_members(f.read())
+        for payload in members:
+            for record in _parse_lines(payload):
+                yield segment, record
+
+
+def verify(directory: str) -> VerifyReport:
+    """Check sequence numbers, hash links and record hashes across all segments and HEAD.json."""
+    report = VerifyReport()
+    expected_seq, prev = 1, GENESIS_HASH
+    for segment in list_segments(directory):
+        report.segments += 1
+        with open(os.path.join(directory, segment), "rb") as f:
+            members, error = read_members(f.read())
+        if error:
+            report.errors.append(f"{segment}: {error}")
+        first = True
+        for payload in members:
+            try:
+                records = list(_parse_lines(payload))
+            except ValueError:
+                report.errors.append(f"{segment}: unreadable record line")
+                continue
+            for record in records:
+                seq = record.get("seq")
+                if first and isinstance(seq, int) and not segment.startswith(f"{SEGMENT_PREFIX}{seq:012d}-"):
+                    report.errors.append(f"{segment}: first record is seq {seq}")
+                first = False
+                if seq != expected_seq:
+                    report.errors.append(f"{segment}: seq {seq} where {expected_seq} was expected (records missing)")
+                if record.get("prev") != prev:
+                    report.errors.append(f"{segment}: seq {seq} does not link to the previous record")
+                if record_hash(record) != record.get("hash"):
+                    report.errors.append(f"{segment}: seq {seq} was modified (hash mismatch)")
+                if record.get("event") == "audit_gap":
+                    report.gaps += 1
+                report.records += 1
+                report.first_ts = report.first_ts or record.get("ts")
+                report.last_ts = record.get("ts")
+                expected_seq, prev = (seq if isinstance(seq, int) else expected_seq) + 1, record.get("hash")
+
+    try:
+        with open(os.path.join(directory, HEAD_FILE), encoding="utf-8") as f:
+            head = json.load(f)
+        if head.get("seq", 0) > expected_seq - 1:
+            report.errors.append(f"HEAD.json points at seq {head['seq']}, last record is {expected_seq - 1} "
+                                 "(records removed from the end)")
+    except FileNotFoundError:
+        if report.records:
+            report.errors.append("HEAD.json missing")
+    except ValueError:
+        report.errors.append("HEAD.json unreadable")
+    return report
+
+# ============================
+# CLI
+# ============================
+
+def _bench(records: int, fsync: str) -> int:
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp(prefix="audit-bench-")
+    audit = AuditLog(directory, fsync=fsync)
+    prompt = "Explain the following issue clearly for NetApp ONTAP. " * 70         # ~4 KB
+    output = "## Root Cause\nSnapMirror transfer lagged behind the schedule. " * 100   # ~6 KB
+    timings = []
+    try:
+        start = time.perf_counter()
+        for i in range(records):
+            t0 = time.perf_counter()
+            audit.record("llm_call", request_id=f"req-{i}", user="bench@example.com", team="storage",
+                         task_key="Generate Incident RCA", vendor="NetApp ONTAP", model="gpt-4o-mini",
+                         settings={"temperature": 0.25, "top_p": 0.9, "max_tokens": 1500},
+                         prompt=prompt, output=output, usage={"total_tokens": 2500})
+            timings.append((time.perf_counter() - t0) * 1000)
+            if i % 50 == 49:
+                time.sleep(0.001)       # Request threads do other work between calls
+        queued_s = time.perf_counter() - start
+        audit.flush(timeout=120)
+        total_s = time.perf_counter() - start
+        timings.sort()
+        stats = audit.stats
+        print(f"record(): p50 {timings[len(timings) // 2] * 1000:.1f} us, "
+              f"p99 {timings[int(len(timings) * 0.99)] * 1000:.1f} us, max {timings[-1]:.2f} ms")
+        print(f"writer: {stats.written:,} records in {stats.batches} batches (max {stats.max_batch}), "
+              f"{stats.written / total_s:,.0f} records/s, {stats.fsyncs} fsyncs, "
+              f"{stats.bytes_written / 1e6:.1f} MB on disk "
+              f"({stats.written * (len(prompt) + len(output)) / max(stats.bytes_written, 1):.0f}x smaller), "
+              f"queueing took {queued_s:.2f} s")
+        report = verify(directory)
+        print(f"verify: {report.records:,} records, {report.segments} segments, ok={report.ok}")
+        return 0 if report.ok else 1
+    finally:
+        audit.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Audit log verification and inspection")
+    sub = parser.add_subparsers(dest="command", required=True)
+    verify_cmd = sub.add_parser("verify")
+    verify_cmd.add_argument("directory", nargs="?", default=AUDIT_DIR)
+    show_cmd = sub.add_parser("show")
+    show_cmd.add_argument("directory", nargs="?", default=AUDIT_DIR)
+    show_cmd.add_argument("--request-id")
+    show_cmd.add_argument("--user")
+    show_cmd.add_argument("--last", type=int, default=20)
+    bench_cmd = sub.add_parser("bench")
+    bench_cmd.add_argument("--records", type=int, default=20000)
+    bench_cmd.add_argument("--fsync", choices=FSYNC_POLICIES, default="interval")
+    args = parser.parse_args(argv)
+
+    if args.command == "verify":
+        report = verify(args.directory)
+        print(f"{report.records:,} records in {report.segments} segments, {report.gaps} gap records, "
+              f"{report.first_ts} .. {report.last_ts}")
+        for error in report.errors:
+            print(f"ERROR {error}")
+        print("OK: chain intact" if report.ok else f"FAILED: {len(report.errors)} problems")
+        return 0 if report.ok else 1
+    if args.command == "show":
+        matches = [record for _, record in iter_records(args.directory)
+                   if (not args.request_id or record.get("request_id") == args.request_id)
+                   and (not args.user or record.get("user") == args.user)]
+        for record in matches[-args.last:]:
+            print(json.dumps(record, ensure_ascii=False))
+        return 0
+    return _bench(args.records, args.fsync)
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,804 @@
+"""
+Local bottleneck classifier for pasted performance metrics (Performance Analysis).
+
+Performance data arrives as exported time series (Unisphere / Active IQ CSV, `purearray
+monitor`, `qos statistics ... show`, `statistics show-periodic`, iostat) or as summary
+figures in prose ("write latency rose from 0.4 ms to 3.5 ms, array CPU 85%"). Instead of
+the raw samples, the model gets a compact findings table:
+
+  1. Tables (comma, semicolon, tab, pipe separated or column-aligned) and summary figures
+     are parsed; columns are mapped to canonical metrics (latency, IOPS, throughput,
+     controller CPU, front-end port and back-end busy, write pending, cache hit, queue
+     depth, QoS latency / throttling, replication lag, I/O size) by their names, with
+     units converted (us -> ms, B/s -> MB/s, hh:mm:ss lag -> s). A text column (host,
+     port, volume) makes one series per entity. Other numeric columns of such a table are
+     summarised (median, max, last); tables without a known metric column stay as pasted.
+  2. Every series gets numpy statistics: median / p95 / max, rolling z-scores against the
+     preceding window (spikes), and the single most significant mean shift found from
+     cumulative sums (change point, e.g. latency 0.4 -> 3.5 ms from 01:05).
+  3. Per-vendor threshold rules classify the likely bottlenecks: front-end port
+     saturation, back-end / disk contention, QoS throttling, replication lag, cache
+     misses, per-host queue depth and controller CPU saturation, each with its evidence.
+
+Usage:
+    python bottleneck_classifier.py analyze metrics.csv [--vendor "Pure FlashArray"]
+    python bottleneck_classifier.py bench [--hosts 200 --samples 1440]
+"""
+
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from log_compaction import TIMESTAMP
+
+Z_THRESHOLD = 4.0               # |rolling z| from which a sample is a spike
+Z_WINDOW = 30                   # Preceding samples the rolling z-score compares against
+SPIKE_MIN_RELATIVE = 0.25       # ... and it must be at least 25% off the rolling mean
+MIN_SEGMENT = 3                 # Samples on each side of a change point
+CHANGE_T = 4.0                  # t-statistic of the mean shift from which it is a change point
+CHANGE_MIN_RELATIVE = 0.2       # ... and the shift must be at least 20% of the lower mean
+MIN_TABLE_ROWS = 3
+LOOKAHEAD_LINES = 200           # Lines looks_like_metrics inspects
+MAX_SUMMARY_ROWS = 12           # Series listed in the metrics summary (findings first)
+MAX_ENTITY_EVIDENCE = 3         # Entities named per finding
+
+# ============================
+# Metrics
+# ============================
+
+@dataclass(frozen=True)
+class MetricSpec:
+    key: str
+    label: str
+    unit: str
+    pattern: str        # Matched against the lowercased column name / phrase, "_" and "-" as spaces
+
+
+# Most specific first: the first matching spec names a column
+METRICS = [
+    MetricSpec("qos_latency", "QoS latency", "ms", r"\bqos\b.*\blat|policy group.*lat|throttl\w* lat|qos delay"),
+    MetricSpec("qos_throttled", "QoS throttled I/O", "%", r"throttl|\bqos\b.*(limit|delay|hit)|limit hit"),
+    MetricSpec("be_latency", "Back-end latency", "ms", r"\b(disk|drive|back ?end|be|da|ssd)\b.*\b(lat\w*|resp\w*|svc|await)"),
+    MetricSpec("repl_lag", "Replication lag", "s", r"\blag\b|lag time|\brpo\b|cycle time|transfer delay|\brdf\b.*time|snapmirror.*(lag|delay)"),
+    MetricSpec("read_latency", "Read latency", "ms", r"read\w*.*(latenc|resp\w* time|us ?/ ?op|\blat\b|await)|(latenc|us ?/ ?op|\blat\b).*\bread|\br ?lat|\br_await"),
+    MetricSpec("write_latency", "Write latency", "ms", r"write\w*.*(latenc|resp\w* time|us ?/ ?op|\blat\b|await)|(latenc|us ?/ ?op|\blat\b).*\bwrite|\bw ?lat|\bw_await"),
+    MetricSpec("latency", "Latency", "ms", r"latenc|resp\w* time|us ?/ ?op|\blat\b|\bawait\b|service time|\bsvctm"),
+    MetricSpec("fe_port_util", "Front-end port busy", "%", r"\b(fe|front ?end|host port|target port|fc port|port|fa|director fa|hba|lif)\b.*\b(util\w*|busy|%)|port util"),
+    MetricSpec("be_util", "Back-end / disk busy", "%", r"\b(disk|drive|be|back ?end|da|dx|aggr\w*|raid|ssd|flash)\b.*\b(util\w*|busy|%)|disk busy|%util"),
+    MetricSpec("write_pending", "Write pending", "%", r"write pending|\bwp\b|nvram|nvlog"),
+    MetricSpec("cache_hit", "Cache hit", "%", r"cache.*hit|hit (ratio|rate|%)|read hit|\bhit ?%"),
+    MetricSpec("cache_miss", "Cache miss", "%", r"\bmiss"),
+    MetricSpec("cpu", "Controller CPU", "%", r"\bcpu\b|processor|node util|controller (util|busy)|\bsp (util|busy)"),
+    MetricSpec("queue_depth", "Queue depth", "", r"queue|q ?depth|\bqlen\b|outstanding|\baqu ?sz\b|\bavgqu"),
+    MetricSpec("read_iops", "Read IOPS", "IOPS", r"read\w*.*(iops|op ?/ ?s|\bops\b|io ?/ ?s|r ?/ ?s)|(iops|op ?/ ?s|\bops\b).*\bread|\br ?/ ?s\b|\br_iops"),
+    MetricSpec("write_iops", "Write IOPS", "IOPS", r"write\w*.*(iops|op ?/ ?s|\bops\b|io ?/ ?s|w ?/ ?s)|(iops|op ?/ ?s|\bops\b).*\bwrite|\bw ?/ ?s\b|\bw_iops"),
+    MetricSpec("read_mbps", "Read throughput", "MB/s", r"read\w*.*(b ?/ ?s|bandwidth|throughput|mbps)|(b ?/ ?s|bandwidth|throughput).*\bread|\brkb ?/ ?s|\brmb ?/ ?s"),
+    MetricSpec("write_mbps", "Write throughput", "MB/s", r"write\w*.*(b ?/ ?s|bandwidth|throughput|mbps)|(b ?/ ?s|bandwidth|throughput).*\bwrite|\bwkb ?/ ?s|\bwmb ?/ ?s"),
+    MetricSpec("iops", "IOPS", "IOPS", r"\biops\b|op ?/ ?s|\bops\b|io ?/ ?s|\bios? ?per ?sec|total ops|\btps\b"),
+    MetricSpec("mbps", "Throughput", "MB/s", r"throughput|bandwidth|\b[kmg]?b ?/ ?s\b|\bmbps\b|\bgbps\b"),
+    MetricSpec("io_size", "I/O size", "KB", r"io size|block size|xfer|avg size|kb ?/ ?op|request size"),
+]
+METRIC_SPECS = {spec.key: spec for spec in METRICS}
+_COMPILED = [(spec, re.compile(spec.pattern)) for spec in METRICS]
+
+# Columns that name the sample time or the entity, never a metric
+TIME_COLUMN = re.compile(r"^(time|timestamp|date|datetime|zeit|interval|sample)\b")
+TIME_VALUE = re.compile(r"^(?:" + TIMESTAMP.pattern + r"|\d{1,2}:\d{2}(?::\d{2})?|\d{10}(?:\.\d+)?)$")
+DURATION = re.compile(r"^(?:(\d+)d)?\s*(\d+):(\d{2}):(\d{2})$")
+NUMBER = re.compile(r"^([-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:[.,]\d+)?)\s*([a-zA-Zµ/%]*)$")
+DELIMITERS = (",", ";", "\t", "|")
+COLUMN_GAP = re.compile(r"\s{2,}|\t")
+SEPARATOR = re.compile(r"(?=.*[-=]{3})[\s|:+=-]+")      # Rule lines: "-----", "|---|---|", "===== ====="
+
+# Summary figures in prose: "<metric> ... [from] 0.4 ms [to 3.5 ms]"
+VALUE_PATTERN = r"(?P<{0}>[-+]?\d[\d,]*(?:\.\d+)?)\s*(?P<{0}_unit>k|m|ms|us|µs|μs|%|iops|mb/s|gb/s|kb/s|kb|mb|s|sec|min|h)?\b"
+PHRASE_GAP = r"[^\n.;\d]{0,60}?"
+
+# ============================
+# Thresholds & Categories
+# ============================
+
+DEFAULT_THRESHOLDS = {
+    "fe_port_util": 70.0,       # % busy
+    "be_util": 70.0,            # % busy
+    "be_latency": 5.0,          # ms
+    "write_pending": 60.0,      # % of the write-pending limit
+    "cpu": 80.0,                # %
+    "cache_hit": 80.0,          # % (below is a finding)
+    "queue_depth": 32.0,        # Outstanding I/Os per host / LUN
+    "repl_lag": 900.0,          # s
+    "qos_share": 0.3,           # QoS latency as share of the total latency
+    "qos_throttled": 1.0,       # % of I/Os throttled
+    "latency": 2.0,             # ms; latency above it is named with the findings
+}
+VENDOR_THRESHOLDS = {
+    "NetApp ONTAP": {"be_util": 60.0, "cpu": 80.0, "latency": 2.0},
+    "Pure FlashArray": {"latency": 1.0, "be_latency": 2.0, "cpu": 90.0},      # Purity runs CPU hot by design
+    "Dell EMC PowerMax": {"fe_port_util": 70.0, "be_util": 60.0, "cache_hit": 70.0, "write_pending": 60.0},
+}
+# Vendor vocabulary per category, named in the finding so the model uses the right objects
+VENDOR_TERMS = {
+    "NetApp ONTAP": {"fe_port": "FC / Ethernet LIF ports", "be": "aggregate disks", "qos": "QoS policy group",
+                     "repl": "SnapMirror lag-time", "cpu": "node CPU", "cache": "Flash Cache / buffer cache"},
+    "Pure FlashArray": {"fe_port": "FC / iSCSI target ports", "be": "flash modules / backend",
+                        "qos": "volume / pod QoS limits", "repl": "ActiveDR / async replication lag",
+                        "cpu": "controller load", "cache": "DRAM / NVRAM"},
+    "Dell EMC PowerMax": {"fe_port": "FA director ports", "be": "DA / back-end directors", "qos": "host I/O limits",
+                          "repl": "SRDF/A cycle time", "cpu": "director utilization", "cache": "global memory / write pending"},
+}
+CATEGORIES = {
+    "fe_port": "Front-end port saturation",
+    "be": "Back-end / disk contention",
+    "qos": "QoS throttling",
+    "repl": "Replication lag",
+    "cache": "Cache misses",
+    "queue": "Host queue depth",
+    "cpu": "Controller CPU saturation",
+}
+
+
+@dataclass
+class Series:
+    metric: str                     # MetricSpec key
+    entity: str                     # Host / port / volume, "" for array-level figures
+    values: np.ndarray
+    times: List[str] = field(default_factory=list)
+    source: str = "table"           # "table" or "summary"
+
+    @property
+    def spec(self) -> MetricSpec:
+        return METRIC_SPECS[self.metric]
+
+
+@dataclass
+class SeriesStats:
+    series: Series
+    median: float
+    p95: float
+    max: float
+    last: float
+    spikes: int = 0
+    max_z: float = 0.0
+    spike_at: str = ""
+    shift: Optional[Tuple[float, float, str]] = None   # (before, after, where)
+
+
+@dataclass
+class Finding:
+    category: str                   # Key of CATEGORIES
+    severity: str                   # "high" or "medium"
+    evidence: str
+
+
+@dataclass
+class OtherColumn:
+    """Numeric column of an analysed table that maps to no known metric: summarised, not dropped."""
+    name: str
+    samples: int
+    median: float
+    max: float
+    last: float
+    unit: str = ""
+
+
+@dataclass
+class MetricsAnalysis:
+    vendor: str
+    stats: List[SeriesStats]
+    findings: List[Finding]
+    context: str                    # Input without the rows of the analysed tables
+    tables: int                     # Tables with at least one known metric column
+    samples: int
+    input_chars: int
+    elapsed_s: float = 0.0
+    other_columns: List[OtherColumn] = field(default_factory=list)
+
+    @property
+    def series(self) -> int:
+        return len(self.stats)
+
+    def render(self) -> str:
+        return render_analysis(self)
+
+# ============================
+# Parsing
+# ============================
+
+def _column_name(name: str) -> str:
+    return re.sub(r"[_\-]+", " ", name.strip().lower())
+
+
+def metric_for(name: str) -> Optional[str]:
+    """Canonical metric of a column name or phrase, None if not a known metric."""
+    text = _column_name(name)
+    for spec, pattern in _COMPILED:
+        if pattern.search(text):
+            return spec.key
+    return None
+
+
+def _scale(metric: str, unit: str, column: str = "") -> float:
+    """Factor from the unit of a value (or its column header) to the metric's canonical unit."""
+    unit, column = unit.lower(), _column_name(column)
+    spec_unit = METRIC_SPECS[metric].unit
+    if spec_unit == "ms":
+        if unit in ("us", "µs", "μs", "usec") or re.search(r"\(u?s(ec)?\)|\bus\b|µs|μs|usec|us ?/ ?op|microsec", column):
+            return 0.001
+        if unit in ("s", "sec"):
+            return 1000.0
+    elif spec_unit == "MB/s":
+        if unit in ("k", "kb/s") or re.search(r"\bkb ?/ ?s|\bkbps|\(kb", column):
+            return 0.001
+        if unit == "gb/s" or re.search(r"\bgb ?/ ?s|\bgbps", column):
+            return 1000.0
+        if re.search(r"(^|[^kmg])b ?/ ?s|\(b\)|bytes", column) and unit != "mb/s":
+            return 1e-6
+    elif spec_unit == "s":
+        if unit == "min" or re.search(r"\(min|minutes", column):
+            return 60.0
+        if unit == "h" or re.search(r"\(h\)|hours", column):
+            return 3600.0
+        if unit == "ms":
+            return 0.001
+    elif spec_unit == "IOPS" and unit == "k":
+        return 1000.0
+    elif spec_unit == "KB" and unit == "mb":
+        return 1024.0
+    if unit == "k":
+        return 1000.0
+    if unit == "m" and spec_unit in ("IOPS", ""):
+        return 1e6
+    return 1.0
+
+
+def parse_number(text: str) -> Optional[Tuple[float, str]]:
+    """(value, unit suffix) of a cell such as "1,200", "0.4ms", "85%", "120k"; None if not numeric."""
+    duration = DURATION.match(text.strip())
+    if duration:
+        days, hours, minutes, seconds = (int(g or 0) for g in duration.groups())
+        return float(((days * 24 + hours) * 60 + minutes) * 60 + seconds), "s"
+    match = NUMBER.match(text.strip())
+    if not match:
+        return None
+    number, unit = match.groups()
+    if re.fullmatch(r"\d+,\d{1,2}", number):
+        number = number.replace(",", ".")          # Decimal comma
+    try:
+        return float(number.replace(",", "")), unit
+    except ValueError:
+        return None
+
+
+def _split_row(line: str, delimiter: Optional[str]) -> List[str]:
+    if delimiter is None:
+        return [cell for cell in COLUMN_GAP.split(line.strip()) if cell]
+    cells = [cell.strip() for cell in line.strip().strip(delimiter).split(delimiter)]
+    return cells
+
+
+def _delimiter(line: str) -> Optional[str]:
+    counts = {d: line.count(d) for d in DELIMITERS}
+    best = max(counts, key=counts.get)
+    return best if counts[best] else None
+
+
+def _is_separator(line: str) -> bool:
+    return SEPARATOR.fullmatch(line) is not None
+
+
+def _numeric_cells(cells: List[str]) -> int:
+    """Cells starting like a number (cheap check used while scanning for tables)."""
+    return sum(1 for cell in cells if cell[:1].isdigit() or (cell[:1] in "+-." and cell[1:2].isdigit()))
+
+
+def _table_blocks(lines: List[str]) -> List[Tuple[int, int, List[str], List[List[str]]]]:
+    """(first line, end line, header cells, row cells) of every table: a header row followed by numeric rows."""
+    blocks, i = [], 0
+    while i < len(lines):
+        delimiter = _delimiter(lines[i])
+        cells = _split_row(lines[i], delimiter)
+        if len(cells) < 2 or _numeric_cells(cells) > len(cells) // 2:
+            i += 1
+            continue
+        end, rows = i + 1, []
+        while end < len(lines):
+            if _is_separator(lines[end]):
+                end += 1
+                continue
+            row = _split_row(lines[end], delimiter)
+            if abs(len(row) - len(cells)) > 1 or _numeric_cells(row) < max(1, len(row) // 2):
+                break
+            rows.append(row)
+            end += 1
+        if len(rows) >= MIN_TABLE_ROWS:
+            blocks.append((i, end, cells, rows))
+            i = end
+        else:
+            i += 1
+    return blocks
+
+
+def _column_values(values: Tuple[str, ...], metric: str, name: str) -> np.ndarray:
+    """A metric column as floats in the metric's unit; NaN where a cell is not numeric."""
+    try:
+        # Plain numbers (the common case for exports) convert in one call
+        parsed, unit = np.array(values, dtype=float), ""
+    except ValueError:
+        cells = [parse_number(value) for value in values]
+        parsed = np.array([cell[0] if cell else np.nan for cell in cells])
+        unit = next((cell[1] for cell in cells if cell), "")
+    return parsed * _scale(metric, unit, name)
+
+
+def _other_column(name: str, values: Tuple[str, ...]) -> Optional[OtherColumn]:
+    try:
+        parsed, unit = np.array(values, dtype=float), ""
+    except ValueError:
+        cells = [parse_number(value) for value in values]
+        parsed = np.array([cell[0] if cell else np.nan for cell in cells])
+        unit = next((cell[1] for cell in cells if cell), "")
+    parsed = parsed[~np.isnan(parsed)]
+    if not len(parsed):
+        return None
+    return OtherColumn(name, len(parsed), float(np.median(parsed)), float(parsed.max()), float(parsed[-1]), unit)
+
+
+def _table_series(header: List[str], rows: List[List[str]]) -> Tuple[List[Series], List[OtherColumn]]:
+    """Series of the known metric columns, and a summary of the other numeric columns."""
+    width = len(header)
+    rows = [row if len(row) == width else (row + [""] * width)[:width] for row in rows]
+    columns = list(zip(*rows))
+
+    # Column roles from a sample of the rows
+    time_col = entity_col = None
+    metric_cols: List[Tuple[int, str]] = []
+    other_cols: List[int] = []
+    for index, (name, values) in enumerate(zip(header, columns)):
+        sample = values[:50]
+        if time_col is None and (TIME_COLUMN.match(_column_name(name))
+                                 or sum(1 for value in sample if TIME_VALUE.match(value)) > len(sample) // 2):
+            time_col = index
+        elif sum(1 for value in sample if parse_number(value) is None) > len(sample) // 2:
+            entity_col = index if entity_col is None else entity_col
+        else:
+            metric = metric_for(name)
+            if metric:
+                metric_cols.append((index, metric))
+            else:
+                other_cols.append(index)
+    if not metric_cols:
+        return [], []
+
+    times = np.array(columns[time_col]) if time_col is not None else None
+    entities = np.array(columns[entity_col]) if entity_col is not None else np.full(len(rows), "")
+    groups = [(entity, entities == entity) for entity in dict.fromkeys(entities.tolist())]
+    series = []
+    for index, metric in metric_cols:
+        values = _column_values(columns[index], metric, header[index])
+        for entity, mask in groups:
+            mask = mask & ~np.isnan(values)
+            if mask.any():
+                series.append(Series(metric, entity, values[mask], times[mask].tolist() if times is not None else []))
+    others = [_other_column(header[index], columns[index]) for index in other_cols]
+    return series, [other for other in others if other is not None]
+
+
+def _summary_series(text: str) -> List[Series]:
+    """Figures named in prose or "key: value" lines; "from a to b" becomes a two-point series."""
+    found: List[Series] = []
+    taken: List[Tuple[int, int]] = []
+    lowered = _column_name(text)
+    for spec, _ in _COMPILED:
+        phrase = re.compile(rf"(?:{spec.pattern}){PHRASE_GAP}(?:from\s+|von\s+)?{VALUE_PATTERN.format('a')}"
+                            rf"(?:\s*(?:to|->|→|auf|bis)\s*{VALUE_PATTERN.format('b')})?")
+        for match in phrase.finditer(lowered):
+            if any(start <= match.start() < end for start, end in taken):
+                continue
+            parsed = parse_number(match.group("a"))
+            if parsed is None:
+                continue
+            values = [parsed[0] * _scale(spec.key, match.group("a_unit") or "")]
+            if match.group("b"):
+                after = parse_number(match.group("b"))
+                if after:
+                    values.append(after[0] * _scale(spec.key, match.group("b_unit") or match.group("a_unit") or ""))
+            taken.append((match.start(), match.end()))
+            found.append(Series(spec.key, "", np.asarray(values, dtype=float),
+                                ["before", "after"] if len(values) == 2 else [], source="summary"))
+    return found
+
+
+def parse_metrics(text: str) -> Tuple[List[Series], List[OtherColumn], str, int]:
+    """Series from the tables and summary figures of `text`, the other numeric columns of those tables,
+    the text without their rows, and the number of tables analysed.
+
+    Tables without a known metric column stay in the text as they are.
+    """
+    lines = text.splitlines()
+    series: List[Series] = []
+    others: List[OtherColumn] = []
+    keep = [True] * len(lines)
+    tables = 0
+    for start, end, header, rows in _table_blocks(lines):
+        table_series, table_others = _table_series(header, rows)
+        if not table_series:
+            continue
+        series.extend(table_series)
+        others.extend(table_others)
+        keep[start:end] = [False] * (end - start)
+        tables += 1
+    context = "\n".join(line for line, kept in zip(lines, keep) if kept).strip()
+    series.extend(_summary_series(context))
+    return series, others, context, tables
+
+
+def looks_like_metrics(text: str) -> bool:
+    """A table with a known metric column, or at least two known figures, worth analysing locally."""
+    if not text.strip():
+        return False
+    # The head of a long export is enough to see a table; this runs on every keystroke rerun
+    head = text.splitlines()[:LOOKAHEAD_LINES]
+    if any(_table_series(header, rows)[0] for _, _, header, rows in _table_blocks(head)):
+        return True
+    return len(_summary_series("\n".join(head))) >= 2
+
+# ============================
+# Statistics (vectorized)
+# ============================
+
+def rolling_z(values: np.ndarray, window: int = Z_WINDOW) -> np.ndarray:
+    """z-score of every sample against the mean / std of the `window` samples before it (0 for the first)."""
+    n = len(values)
+    z = np.zeros(n)
+    if n <= window:
+        return z
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values * values)))
+    index = np.arange(window, n)
+    mean = (sums[index] - sums[index - window]) / window
+    variance = np.maximum((squares[index] - squares[index - window]) / window - mean * mean, 0.0)
+    # Floor the spread so that Z_THRESHOLD means at least SPIKE_MIN_RELATIVE of the level:
+    # flat series would otherwise turn noise into huge z-scores
+    std = np.maximum(np.sqrt(variance), SPIKE_MIN_RELATIVE / Z_THRESHOLD * np.abs(mean) + 1e-9)
+    z[window:] = (values[window:] - mean) / std
+    return z
+
+
+def change_point(values: np.ndarray, min_segment: int = MIN_SEGMENT) -> Optional[Tuple[int, float, float]]:
+    """Most significant single mean shift: (first index after it, mean before, mean after), or None.
+
+    Every split is scored from cumulative sums at once (between-segment difference over
+    the pooled standard error); the best one counts if its t-statistic reaches CHANGE_T
+    and the shift is at least CHANGE_MIN_RELATIVE of the lower mean.
+    """
+    n = len(values)
+    if n < 2 * min_segment:
+        return None
+    sums = np.cumsum(values)
+    squares = np.cumsum(values * values)
+    k = np.arange(min_segment, n - min_segment + 1)
+    left_n, right_n = k.astype(float), (n - k).astype(float)
+    left_sum, right_sum = sums[k - 1], sums[-1] - sums[k - 1]
+    left_mean, right_mean = left_sum / left_n, right_sum / right_n
+    left_ss = squares[k - 1] - left_n * left_mean ** 2
+    right_ss = (squares[-1] - squares[k - 1]) - right_n * right_mean ** 2
+    pooled = np.sqrt(np.maximum(left_ss + right_ss, 0.0) / max(n - 2, 1))
+    floor = 0.02 * np.maximum(np.abs(left_mean), np.abs(right_mean)) + 1e-9
+    t = np.abs(right_mean - left_mean) / (np.maximum(pooled, floor) * np.sqrt(1 / left_n + 1 / right_n))
+    best = int(np.argmax(t))
+    before, after = float(left_mean[best]), float(right_mean[best])
+    if t[best] < CHANGE_T or abs(after - before) < CHANGE_MIN_RELATIVE * max(min(abs(before), abs(after)), 1e-9):
+        return None
+    return int(k[best]), before, after
+
+
+def describe_series(series: Series) -> SeriesStats:
+    values = series.values
+    stats = SeriesStats(series, median=float(np.median(values)), p95=float(np.percentile(values, 95)),
+                        max=float(values.max()), last=float(values[-1]))
+    if series.source == "summary":
+        stats.p95 = stats.max           # "from a to b": the reported level is the latest one, not a percentile
+        if len(values) == 2 and abs(values[1] - values[0]) >= CHANGE_MIN_RELATIVE * max(min(values), 1e-9):
+            stats.shift = (float(values[0]), float(values[1]), "")
+        return stats
+    window = min(Z_WINDOW, max(MIN_SEGMENT, len(values) // 3))
+    z = rolling_z(values, window)
+    # Long series need longer segments: a handful of noisy samples at either end is not a shift
+    shift = change_point(values, max(MIN_SEGMENT, len(values) // 20))
+    if shift:
+        index, before, after = shift
+        where = series.times[index] if series.times and series.times[index] else f"sample {index + 1}"
+        stats.shift = (before, after, where)
+        # Samples right after a level shift stand out against the old window; they are the shift, not spikes
+        z[index:index + window] = 0.0
+    spikes = np.flatnonzero(np.abs(z) >= Z_THRESHOLD)
+    if spikes.size:
+        top = int(spikes[np.argmax(np.abs(z[spikes]))])
+        stats.spikes, stats.max_z = int(spikes.size), float(z[top])
+        stats.spike_at = series.times[top] if series.times and series.times[top] else f"sample {top + 1}"
+    return stats
+
+# ============================
+# Rules
+# ============================
+
+def _fmt(value: float, unit: str) -> str:
+    if unit == "IOPS":
+        return f"{value:,.0f} IOPS"
+    if unit == "s" and value >= 120:
+        return f"{value / 60:,.0f} min"
+    text = f"{value:,.2f}".rstrip("0").rstrip(".") if abs(value) < 10 else f"{value:,.0f}"
+    return f"{text}%" if unit == "%" else f"{text} {unit}".strip()
+
+
+def _name(stats: SeriesStats) -> str:
+    return f"{stats.series.spec.label} ({stats.series.entity})" if stats.series.entity else stats.series.spec.label
+
+
+def _over(stats: List[SeriesStats], metric: str, threshold: float, below: bool = False) -> List[SeriesStats]:
+    """Series of a metric past the threshold (p95 above, or median below), worst first."""
+    hits = [s for s in stats if s.series.metric == metric
+            and (s.median < threshold if below else s.p95 >= threshold)]
+    return sorted(hits, key=lambda s: s.median if below else -s.p95)
+
+
+def _evidence(hits: List[SeriesStats], threshold: float, below: bool = False) -> str:
+    unit = hits[0].series.spec.unit
+    stat = "median" if below else "p95"
+    shown = [f"{_name(s)} {stat} {_fmt(s.median if below else s.p95, unit)}" for s in hits[:MAX_ENTITY_EVIDENCE]]
+    more = f" (+{len(hits) - MAX_ENTITY_EVIDENCE} more)" if len(hits) > MAX_ENTITY_EVIDENCE else ""
+    return f"{', '.join(shown)}{more}; threshold {_fmt(threshold, unit)}"
+
+
+def _severity(hits: List[SeriesStats], threshold: float, below: bool = False) -> str:
+    worst = hits[0].median if below else hits[0].p95
+    return "high" if (worst <= threshold * 0.75 if below else worst >= threshold * 1.2) else "medium"
+
+
+def classify(stats: List[SeriesStats], vendor: str) -> List[Finding]:
+    """Likely bottlenecks from the series statistics, with per-vendor thresholds."""
+    limits = {**DEFAULT_THRESHOLDS, **VENDOR_THRESHOLDS.get(vendor, {})}
+    terms = VENDOR_TERMS.get(vendor, {})
+    findings: List[Finding] = []
+
+    def add(category: str, severity: str, evidence: str) -> None:
+        term = terms.get(category)
+        findings.append(Finding(category, severity, f"{evidence} [{term}]" if term else evidence))
+
+    for category, metric in (("fe_port", "fe_port_util"), ("cpu", "cpu")):
+        hits = _over(stats, metric, limits[metric])
+        if hits:
+            add(category, _severity(hits, limits[metric]), _evidence(hits, limits[metric]))
+
+    backend = [(metric, _over(stats, metric, limits[metric])) for metric in ("be_util", "be_latency", "write_pending")]
+    backend = [(metric, hits) for metric, hits in backend if hits]
+    if backend:
+        add("be", "high" if len(backend) > 1 or any(_severity(h, limits[m]) == "high" for m, h in backend) else "medium",
+            "; ".join(_evidence(hits, limits[metric]) for metric, hits in backend))
+
+    qos_evidence, qos_high = [], False
+    throttled = _over(stats, "qos_throttled", limits["qos_throttled"])
+    if throttled:
+        qos_evidence.append(_evidence(throttled, limits["qos_throttled"]))
+        qos_high = True
+    latency = {s.series.entity: s for s in stats if s.series.metric in ("latency", "write_latency", "read_latency")}
+    for qos in (s for s in stats if s.series.metric == "qos_latency"):
+        total = latency.get(qos.series.entity)
+        if total and total.median > 0 and qos.median / total.median >= limits["qos_share"]:
+            qos_evidence.append(f"{_name(qos)} median {_fmt(qos.median, 'ms')} = "
+                                f"{qos.median / total.median:.0%} of {total.series.spec.label.lower()}")
+            qos_high = qos_high or qos.median / total.median >= 2 * limits["qos_share"]
+    for ops in (s for s in stats if s.series.metric in ("iops", "write_iops", "read_iops") and s.series.source == "table"):
+        # Flat ceiling: a third of the samples within 2% of the maximum while latency rises
+        total = latency.get(ops.series.entity)
+        values = ops.series.values
+        at_ceiling = values >= 0.98 * values.max()
+        if (total is not None and len(values) == len(total.series.values) and len(values) >= 2 * MIN_SEGMENT
+                and at_ceiling.mean() >= 1 / 3 and not at_ceiling.all()):
+            lat = total.series.values
+            if lat[at_ceiling].mean() >= 1.5 * max(lat[~at_ceiling].mean(), 1e-9):
+                qos_evidence.append(f"{_name(ops)} flat at {_fmt(values.max(), 'IOPS')} in {at_ceiling.mean():.0%} "
+                                    f"of samples while {total.series.spec.label.lower()} rises "
+                                    f"{_fmt(lat[~at_ceiling].mean(), 'ms')} -> {_fmt(lat[at_ceiling].mean(), 'ms')}")
+    if qos_evidence:
+        add("qos", "high" if qos_high else "medium", "; ".join(qos_evidence))
+
+    lag_hits = _over(stats, "repl_lag", limits["repl_lag"])
+    growing = [s for s in stats if s.series.metric == "repl_lag" and s.shift and s.shift[1] > s.shift[0]
+               and s not in lag_hits]
+    if lag_hits or growing:
+        parts = [_evidence(lag_hits, limits["repl_lag"])] if lag_hits else []
+        parts += [f"{_name(s)} growing {_fmt(s.shift[0], 's')} -> {_fmt(s.shift[1], 's')}" for s in growing]
+        add("repl", _severity(lag_hits, limits["repl_lag"]) if lag_hits else "medium", "; ".join(parts))
+
+    hit_limit = limits["cache_hit"]
+    cache_hits = _over(stats, "cache_hit", hit_limit, below=True)
+    misses = _over(stats, "cache_miss", 100 - hit_limit)
+    if cache_hits or misses:
+        parts = [_evidence(cache_hits, hit_limit, below=True)] if cache_hits else []
+        parts += [_evidence(misses, 100 - hit_limit)] if misses else []
+        severity = _severity(cache_hits, hit_limit, below=True) if cache_hits else _severity(misses, 100 - hit_limit)
+        add("cache", severity, "; ".join(parts))
+
+    queues = [s for s in stats if s.series.metric == "queue_depth"]
+    queue_hits = _over(stats, "queue_depth", limits["queue_depth"])
+    if queue_hits:
+        add("queue", _severity(queue_hits, limits["queue_depth"]), _evidence(queue_hits, limits["queue_depth"]))
+    elif len(queues) >= 3:
+        # One host far above the others: queue depth setting or path imbalance on that host
+        typical = float(np.median([s.p95 for s in queues]))
+        outliers = sorted((s for s in queues if s.p95 >= 3 * max(typical, 1.0)), key=lambda s: -s.p95)
+        if outliers:
+            add("queue", "medium", f"{_evidence(outliers, limits['queue_depth'])}; median of "
+                                   f"{len(queues)} hosts {_fmt(typical, '')}")
+
+    order = list(CATEGORIES)
+    findings.sort(key=lambda f: (f.severity != "high", order.index(f.category)))
+    return findings
+
+
+def analyze_metrics(text: str, vendor: str = "") -> MetricsAnalysis:
+    """Parse, describe and classify the metrics in `text`."""
+    started = time.perf_counter()
+    series, others, context, tables = parse_metrics(text)
+    stats = [describe_series(s) for s in series if len(s.values)]
+    analysis = MetricsAnalysis(vendor=vendor, stats=stats, findings=classify(stats, vendor), context=context,
+                               tables=tables, samples=sum(len(s.values) for s in series), input_chars=len(text),
+                               other_columns=others)
+    analysis.elapsed_s = time.perf_counter() - started
+    return analysis
+
+# ============================
+# Rendering
+# ============================
+
+def _anomaly(stats: SeriesStats) -> str:
+    unit = stats.series.spec.unit
+    parts = []
+    if stats.shift:
+        before, after, where = stats.shift
+        change = f" ({(after - before) / before:+.0%})" if before else ""
+        parts.append(f"shift {_fmt(before, unit)} -> {_fmt(after, unit)}{change}" + (f" at {where}" if where else ""))
+    if stats.spikes:
+        parts.append(f"{stats.spikes} spike{'s' if stats.spikes > 1 else ''}, max z {stats.max_z:+.1f} at {stats.spike_at}")
+    return "; ".join(parts)
+
+
+def _by_metric(stats: List[SeriesStats]) -> List[List[SeriesStats]]:
+    """Series grouped per metric, in METRICS order."""
+    order = {spec.key: i for i, spec in enumerate(METRICS)}
+    groups: dict = {}
+    for s in stats:
+        groups.setdefault(s.series.metric, []).append(s)
+    return [groups[key] for key in sorted(groups, key=order.get)]
+
+
+def _group_anomalies(group: List[SeriesStats]) -> List[Tuple[str, str]]:
+    """(metric, anomaly) rows: one per series for a few entities, one per metric across many."""
+    shifted = [s for s in group if s.shift]
+    spiky = [s for s in group if s.spikes and not s.shift]
+    label, unit, total = group[0].series.spec.label, group[0].series.spec.unit, len(group)
+    rows = []
+    if len(shifted) <= MAX_ENTITY_EVIDENCE:
+        rows += [(_name(s), _anomaly(s)) for s in shifted]
+    else:
+        before = float(np.median([s.shift[0] for s in shifted]))
+        after = float(np.median([s.shift[1] for s in shifted]))
+        wheres = [s.shift[2] for s in shifted if s.shift[2]]
+        where = f" at {max(set(wheres), key=wheres.count)}" if wheres else ""
+        change = f" ({(after - before) / before:+.0%})" if before else ""
+        rows.append((label, f"shift {_fmt(before, unit)} -> {_fmt(after, unit)}{change}{where} "
+                            f"on {len(shifted)}/{total} series (median of the shifts)"))
+    if len(spiky) <= MAX_ENTITY_EVIDENCE:
+        rows += [(_name(s), _anomaly(s)) for s in spiky]
+    else:
+        top = max(spiky, key=lambda s: abs(s.max_z))
+        rows.append((label, f"isolated spikes on {len(spiky)}/{total} series, largest {_name(top)} "
+                            f"z {top.max_z:+.1f} at {top.spike_at}"))
+    return rows
+
+
+def render_analysis(analysis: MetricsAnalysis) -> str:
+    """Compact Markdown findings for the prompt: bottlenecks, anomalies, metric summary."""
+    lines = [f"Local metrics analysis ({analysis.vendor or 'any vendor'}): {analysis.series} series, "
+             f"{analysis.samples:,} samples" + ("; the raw samples are not included." if analysis.tables else ".")]
+    limit = {**DEFAULT_THRESHOLDS, **VENDOR_THRESHOLDS.get(analysis.vendor, {})}["latency"]
+    slow = sorted((s for s in analysis.stats if s.series.metric in ("latency", "read_latency", "write_latency")
+                   and s.p95 >= limit), key=lambda s: -s.p95)
+    if slow:
+        lines.append(f"Latency above {_fmt(limit, 'ms')}: {_evidence(slow, limit).rsplit(';', 1)[0]}.")
+    lines += ["", "| Likely bottleneck | Severity | Evidence |", "|---|---|---|"]
+    lines += [f"| {CATEGORIES[f.category]} | {f.severity} | {f.evidence} |" for f in analysis.findings] \
+        or ["| none detected by the local rules | - | - |"]
+    groups = _by_metric(analysis.stats)
+    # Level shifts matter more than isolated spikes
+    anomalies = sorted((row for group in groups for row in _group_anomalies(group)),
+                       key=lambda row: not row[1].startswith("shift"))
+    if anomalies:
+        lines += ["", "| Metric | Anomaly |", "|---|---|"]
+        lines += [f"| {name} | {text} |" for name, text in anomalies[:MAX_SUMMARY_ROWS]]
+        if len(anomalies) > MAX_SUMMARY_ROWS:
+            lines.append(f"| … {len(anomalies) - MAX_SUMMARY_ROWS} more | |")
+    tabled = [[s for s in group if s.series.source == "table"] for group in groups]
+    tabled = [group for group in tabled if group]
+    if tabled:
+        lines += ["", "| Metric | Series | median | p95 (worst series) | max | last (median) |",
+                  "|---|---|---|---|---|---|"]
+        for group in tabled:
+            unit, worst = group[0].series.spec.unit, max(group, key=lambda s: s.p95)
+            where = f" ({worst.series.entity})" if len(group) > 1 and worst.series.entity else ""
+            lines.append(f"| {_name(group[0]) if len(group) == 1 else group[0].series.spec.label} | {len(group)} | "
+                         f"{_fmt(float(np.median([s.median for s in group])), unit)} | "
+                         f"{_fmt(worst.p95, unit)}{where} | {_fmt(max(s.max for s in group), unit)} | "
+                         f"{_fmt(float(np.median([s.last for s in group])), unit)} |")
+    if analysis.other_columns:
+        lines += ["", "| Other column (not classified) | values | median | max | last |", "|---|---|---|---|---|"]
+        lines += [f"| {c.name} | {c.samples:,} | {_fmt(c.median, c.unit)} | {_fmt(c.max, c.unit)} | "
+                  f"{_fmt(c.last, c.unit)} |" for c in analysis.other_columns]
+    return "\n".join(lines)
+
+
+def digest_input(text: str, vendor: str = "") -> Tuple[str, MetricsAnalysis]:
+    """Performance data for the prompt: the text around the tables plus the findings instead of the samples."""
+    analysis = analyze_metrics(text, vendor)
+    if not analysis.series:
+        # Nothing recognised: the input goes to the model as it is
+        return text.strip(), analysis
+    context = analysis.context if analysis.tables else text.strip()
+    return (f"{context}\n\n{analysis.render()}" if context else analysis.render()), analysis
+
+# ============================
+# CLI
+# ============================
+
+def _sample_metrics(hosts: int, samples: int) -> str:
+    """Synthetic per-host export: latency step at two thirds, one host with a deep queue."""
+    rng = np.random.default_rng(7)
+    rows = ["Time,Host,Read IOPS,Write IOPS,Read Latency (us),Write Latency (us),Queue Depth,FE Port Util %"]
+    for minute in range(samples):
+        stamp = f"{minute // 60:02d}:{minute % 60:02d}"
+        step = 4.0 if minute >= samples * 2 // 3 else 1.0
+        for host in range(hosts):
+            queue = 48 if host == 3 else 8
+            rows.append(f"{stamp},esx{host:03d},{rng.normal(2000, 150):.0f},{rng.normal(1500, 120):.0f},"
+                        f"{rng.normal(400, 40):.0f},{rng.normal(600, 60) * step:.0f},"
+                        f"{rng.normal(queue, 2):.0f},{rng.normal(55, 5):.1f}")
+    return "\n".join(rows)
+
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local storage bottleneck classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    analyze_cmd = sub.add_parser("analyze")
+    analyze_cmd.add_argument("file", help="metrics export or notes, - for stdin")
+    analyze_cmd.add_argument("--vendor", default="")
+    bench_cmd = sub.add_parser("bench")
+    bench_cmd.add_argument("--hosts", type=int, default=50)
+    bench_cmd.add_argument("--samples", type=int, default=288)
+    bench_cmd.add_argument("--vendor", default="Pure FlashArray")
+    args = parser.parse_args(argv)
+
+    if args.command == "analyze":
+        handle = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8", errors="replace")
+        with handle:
+            text = handle.read()
+        prompt_text, analysis = digest_input(text, args.vendor)
+        print(prompt_text)
+    else:
+        text = _sample_metrics(args.hosts, args.samples)
+        prompt_text, analysis = digest_input(text, args.vendor)
+        print(analysis.render())
+    print(f"{analysis.tables} tables, {analysis.series} series, {analysis.samples:,} samples, "
+          f"{analysis.input_chars:,} -> {len(prompt_text):,} chars, {analysis.elapsed_s * 1000:.1f} ms",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,512 @@
+"""
+Command library: vendor CLI commands and Ansible tasks extracted from generated outputs.
+
+Runbooks, CRs, migration plans and playbooks carry the commands engineers come back for
+(`volume show`, `snapmirror update`, `purevol snap`, `symsnapvx establish`). After every
+generation the output is scanned for
+
+- CLI commands in fenced code blocks and inline code spans, recognised by the vendor's
+  command names (ONTAP command directories, pure*, sym*, host-side tools); prompts such
+  as "cluster1::>" or "$" are dropped and continuation lines joined;
+- Ansible tasks using the vendor collections (netapp.ontap, purestorage.flasharray,
+  dellemc.powermax), plus the commands of command/shell tasks (needs PyYAML).
+
+Each command is reduced to a normalized form (option values and names replaced by
+<placeholders>, options sorted), e.g.
+    volume show -vserver svm1 -volume vol01   ->   volume show -volume <volume> -vserver <vserver>
+so repeats of the same command shape are counted instead of stored again. Occurrences go
+to an append-only JSONL file; the in-memory index updates incrementally and picks up lines
+written by other worker processes before every query. Lookups by words, vendor, object
+and verb are answered from memory without an LLM call.
+
+Usage:
+    python command_library.py search "snapmirror update" [--vendor "NetApp ONTAP"] [--verb update]
+    python command_library.py extract output.md [--vendor "Pure FlashArray"]   # what would be indexed
+    python command_library.py add output.md --vendor ... --use-case ...       # index a saved output
+    python command_library.py stats
+"""
+
+import argparse
+import bisect
+import json
+import os
+import re
+import shlex
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import yaml
+except ImportError:                     # Ansible tasks are skipped without PyYAML
+    yaml = None
+
+COMMAND_LIBRARY_PATH = os.path.join(".index", "commands.jsonl")
+HOST = "Host"                           # Host-side tools (multipathing, rescans), any array vendor
+MAX_COMMAND_CHARS = 400                 # Longer "commands" are prose or scripts, not reusable commands
+DEFAULT_LIMIT = 20
+
+# First word of an ONTAP command (command directories); at least one more word must follow
+ONTAP_COMMANDS = {
+    "volume", "snapmirror", "lun", "igroup", "vserver", "storage", "network", "system", "cluster",
+    "event", "qos", "security", "job", "statistics", "metrocluster", "snaplock", "aggr", "df", "set",
+}
+PURE_OBJECTS = {
+    "vol": "volume", "host": "host", "hgroup": "host group", "pgroup": "protection group", "pod": "pod",
+    "array": "array", "port": "port", "alert": "alert", "network": "network", "drive": "drive",
+    "hw": "hardware", "policy": "policy", "ds": "directory service", "cert": "certificate",
+    "admin": "admin", "snmp": "snmp", "message": "message", "dns": "dns", "ntp": "ntp",
+}
+POWERMAX_OBJECTS = {
+    "snapvx": "snapvx", "rdf": "rdf", "cfg": "config", "access": "masking", "dev": "device",
+    "sg": "storage group", "dg": "device group", "cg": "consistency group", "configure": "configure",
+    "stat": "statistics", "qos": "qos", "cli": "cli", "disk": "disk", "inq": "inquiry", "mask": "masking",
+}
+HOST_COMMANDS = {"esxcli", "multipath", "multipathd", "iscsiadm", "rescan-scsi-bus.sh", "powermt", "sanlun",
+                 "lsscsi", "nvme"}
+# Verbs that end the object words of ONTAP / host commands and name the action of pure* / sym* commands
+VERBS = {
+    "show", "list", "create", "modify", "delete", "destroy", "eradicate", "recover", "update", "resync",
+    "break", "quiesce", "resume", "initialize", "abort", "release", "add", "remove", "rename", "mount",
+    "unmount", "online", "offline", "restore", "map", "unmap", "connect", "disconnect", "snap", "copy",
+    "move", "start", "stop", "enable", "disable", "set", "establish", "terminate", "link", "unlink",
+    "relink", "failover", "failback", "split", "swap", "suspend", "query", "verify", "createpair",
+    "deletepair", "rescan", "resize", "expand", "promote", "demote", "clone", "setattr", "monitor",
+    "reload", "discover", "login", "logout", "commit", "preview", "prepare", "apply", "flush",
+}
+
+PROMPT_PREFIX = re.compile(r"^\s*(?:[\w.-]+::\*?>\s*|::\*?>\s*|\$\s+|PS>\s*|>\s+)")
+FENCED_BLOCK = re.compile(r"```([\w+-]*)[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+INLINE_CODE = re.compile(r"`([^`\n]+)`")
+TRAILING_COMMENT = re.compile(r"\s+#\s.*$")
+TERM = re.compile(r"[a-z0-9][a-z0-9_.-]*")
+
+# Ansible: keys of a task that are not the module
+TASK_KEYWORDS = {
+    "name", "when", "register", "loop", "loop_control", "with_items", "with_dict", "tags", "vars", "become",
+    "become_user", "delegate_to", "run_once", "ignore_errors", "failed_when", "changed_when", "until",
+    "retries", "delay", "notify", "no_log", "environment", "args", "block", "rescue", "always",
+    "collections", "module_defaults", "any_errors_fatal", "check_mode", "diff", "timeout", "throttle",
+}
+COLLECTION_VENDORS = (
+    ("netapp.ontap.", "NetApp ONTAP"), ("na_ontap_", "NetApp ONTAP"),
+    ("purestorage.flasharray.", "Pure FlashArray"), ("purefa_", "Pure FlashArray"),
+    ("dellemc.powermax.", "Dell EMC PowerMax"), ("dellemc_powermax_", "Dell EMC PowerMax"),
+)
+SHELL_MODULES = {"command", "shell", "ansible.builtin.command", "ansible.builtin.shell"}
+# Connection parameters: the same in every task, not part of the command shape
+CONNECTION_PARAMS = {"hostname", "username", "password", "https", "validate_certs", "fa_url", "api_token",
+                     "unispherehost", "universion", "verifycert", "user", "serial_no", "use_rest"}
+STATE_VERBS = {"present": "create", "absent": "delete"}
+
+VENDOR_TERMS = {
+    "NetApp ONTAP": "netapp ontap", "Pure FlashArray": "pure flasharray purity",
+    "Dell EMC PowerMax": "dell emc powermax vmax", HOST: "host",
+}
+
+
+@dataclass
+class ExtractedCommand:
+    key: str            # Normalized form, the deduplication key
+    kind: str           # "cli" or "ansible"
+    vendor: str         # Vendor the command belongs to (from the command itself), or HOST
+    object: str
+    verb: str
+    example: str        # Command (or task YAML) as written
+
+
+@dataclass
+class LibraryCommand:
+    key: str
+    kind: str
+    vendor: str
+    object: str
+    verb: str
+    example: str        # Latest occurrence
+    count: int = 0      # Outputs the command appeared in
+    first_seen: str = ""
+    last_seen: str = ""
+    use_cases: List[str] = field(default_factory=list)
+
+# ============================
+# Extraction
+# ============================
+
+def _split(command: str) -> List[str]:
+    try:
+        return shlex.split(command)
+    except ValueError:                  # Unbalanced quotes: plain whitespace split
+        return command.split()
+
+
+def _is_option(token: str) -> bool:
+    return token.startswith("-") and len(token) > 1 and not token[1:2].isdigit()
+
+
+def _placeholder(option: str) -> str:
+    return f"<{option.lstrip('-').split('=', 1)[0] or 'value'}>"
+
+
+def _normalize_options(tokens: List[str]) -> Tuple[List[str], int]:
+    """Options with their values replaced by placeholders (sorted), and the number of positional arguments."""
+    options, positional, i = [], 0, 0
+    while i < len(tokens):
+        token = tokens[i]
+        if _is_option(token):
+            name = token.split("=", 1)[0]
+            if "=" in token:
+                options.append(f"{name} {_placeholder(name)}")
+            elif i + 1 < len(tokens) and not _is_option(tokens[i + 1]):
+                options.append(f"{name} {_placeholder(name)}")
+                i += 1
+            else:
+                options.append(name)
+        else:
+            positional += 1
+        i += 1
+    return sorted(options), positional
+
+
+def _vendor_of(command: str) -> Optional[str]:
+    if command in ONTAP_COMMANDS:
+        return "NetApp ONTAP"
+    if command.startswith("pure") and command[4:] in PURE_OBJECTS:
+        return "Pure FlashArray"
+    if command.startswith("sym") and command[3:] in POWERMAX_OBJECTS:
+        return "Dell EMC PowerMax"
+    if command in HOST_COMMANDS:
+        return HOST
+    return None
+
+
+def parse_command(line: str) -> Optional[ExtractedCommand]:
+    """A vendor CLI command with its object, verb and normalized form; None for anything else."""
+    text = TRAILING_COMMENT.sub("", PROMPT_PREFIX.sub("", line)).strip().rstrip(";")
+    if not text or len(text) > MAX_COMMAND_CHARS:
+        return None
+    tokens = _split(text)
+    if tokens and tokens[0] == "sudo":
+        tokens = tokens[1:]
+    if not tokens:
+        return None
+    command = tokens[0].lower()
+    vendor = _vendor_of(command)
+    if vendor is None:
+        return None
+
+    if vendor in ("NetApp ONTAP", HOST) and command not in ("powermt", "sanlun"):
+        # Command directory words up to the first option: "volume snapshot create -vserver ..."
+        words = []
+        for token in tokens:
+            if _is_option(token) or not re.fullmatch(r"[a-z][a-z0-9._-]*", token):
+                break
+            words.append(token)
+        if vendor == "NetApp ONTAP" and len(words) < 2:
+            return None
+        verb_at = next((i for i in range(len(words) - 1, 0, -1) if words[i] in VERBS), len(words) - 1)
+        if len(words) > 1:
+            object_words, verb = words[:verb_at], words[verb_at]
+        else:
+            object_words, verb = words, ""      # "multipath -ll": the tool is the object
+        rest = tokens[len(words):]
+        head = words
+    else:
+        # pure* / sym* / powermt / sanlun: the object is the command, the verb the first action word
+        suffix = command[4:] if vendor == "Pure FlashArray" else command[3:] if vendor == "Dell EMC PowerMax" else command
+        object_words = [PURE_OBJECTS.get(suffix) or POWERMAX_OBJECTS.get(suffix) or suffix]
+        verb_index = next((i for i, token in enumerate(tokens[1:], start=1) if token.lower() in VERBS), None)
+        if verb_index is None and len(tokens) > 1 and not _is_option(tokens[1]):
+            verb_index = 1
+        verb = tokens[verb_index].lower() if verb_index is not None else ""
+        rest = [token for i, token in enumerate(tokens[1:], start=1) if i != verb_index]
+        head = [command] + ([verb] if verb else [])
+
+    options, positional = _normalize_options(rest)
+    key = " ".join(head + options + ["<arg>"] * positional)
+    return ExtractedCommand(key=key, kind="cli", vendor=vendor, object=" ".join(object_words),
+                            verb=verb, example=" ".join(tokens) if len(tokens) > 1 else text)
+
+
+def _code_lines(code: str) -> Iterator[str]:
+    """Lines of a code block with backslash continuations joined."""
+    pending = ""
+    for line in code.splitlines():
+        stripped = line.rstrip()
+        if stripped.endswith("\\"):
+            pending += stripped[:-1] + " "
+            continue
+        yield pending + stripped
+        pending = ""
+    if pending:
+        yield pending
+
+
+def _task_lists(node) -> Iterator[List]:
+    """Every task list in parsed Ansible YAML: plays' tasks/pre_tasks/post_tasks/handlers and blocks."""
+    if isinstance(node, list):
+        if node and all(isinstance(item, dict) and "hosts" not in item for item in node):
+            yield node
+        for item in node:
+            if isinstance(item, dict):
+                yield from _task_lists(item)
+    elif isinstance(node, dict):
+        for key in ("tasks", "pre_tasks", "post_tasks", "handlers", "block", "rescue", "always"):
+            if isinstance(node.get(key), list):
+                yield from _task_lists(node[key])
+
+
+def _task_commands(task: Dict) -> Iterator[ExtractedCommand]:
+    module = next((key for key in task if key not in TASK_KEYWORDS), None)
+    if module is None:
+        return
+    params = task[module]
+    if module in SHELL_MODULES:
+        command = params.get("cmd") if isinstance(params, dict) else params
+        for line in _code_lines(str(command or "")):
+            parsed = parse_command(line)
+            if parsed:
+                yield parsed
+        return
+    vendor = next((name for prefix, name in COLLECTION_VENDORS if module.startswith(prefix)), None)
+    if vendor is None or not isinstance(params, dict):
+        return
+    short = module.rsplit(".", 1)[-1]
+    for prefix in ("na_ontap_", "purefa_", "dellemc_powermax_"):
+        short = short[len(prefix):] if short.startswith(prefix) else short
+    state = str(params.get("state", "")).lower()
+    verb = STATE_VERBS.get(state, state) or ("show" if short.endswith("info") else "")
+    names = sorted(f"{name}=<{name}>" for name in params if name not in CONNECTION_PARAMS and name != "state")
+    key = " ".join([module] + ([f"state={state}"] if state else []) + names)
+    shown = {k: v for k, v in task.items() if k in ("name", module)}
+    example = yaml.safe_dump([shown], sort_keys=False, default_flow_style=False).strip()
+    yield ExtractedCommand(key=key, kind="ansible", vendor=vendor, object=short.replace("_", " "),
+                           verb=verb, example=example)
+
+
+def _ansible_commands(code: str) -> Iterator[ExtractedCommand]:
+    if yaml is None:
+        return
+    try:
+        parsed = yaml.safe_load(code)
+    except yaml.YAMLError:
+        return
+    for tasks in _task_lists(parsed):
+        for task in tasks:
+            if isinstance(task, dict):
+                yield from _task_commands(task)
+
+
+def extract_commands(text: str) -> List[ExtractedCommand]:
+    """Commands and Ansible tasks of one output, each normalized form once, in order of appearance."""
+    found: Dict[str, ExtractedCommand] = {}
+    stripped = text.strip()
+    blocks = [(m.group(1).lower(), m.group(2)) for m in FENCED_BLOCK.finditer(text)]
+    if not blocks and re.match(r"^(---\s*\n)?-\s+(name|hosts):", stripped):
+        blocks = [("yaml", stripped)]            # Playbook output without fences
+    for language, code in blocks:
+        if language in ("yaml", "yml") or re.search(r"^\s*-?\s*hosts:\s", code, re.MULTILINE):
+            commands = list(_ansible_commands(code))
+        else:
+            commands = [parsed for parsed in map(parse_command, _code_lines(code)) if parsed]
+        for command in commands:
+            found.setdefault(command.key, command)
+    for match in INLINE_CODE.finditer(FENCED_BLOCK.sub("", text)):
+        parsed = parse_command(match.group(1))
+        if parsed:
+            found.setdefault(parsed.key, parsed)
+    return list(found.values())
+
+# ============================
+# Index
+# ============================
+
+def _terms(*texts: str) -> Set[str]:
+    terms = set()
+    for text in texts:
+        for term in TERM.findall(text.lower()):
+            terms.add(term)
+            terms.update(part for part in re.split(r"[._-]", term) if len(part) > 1)
+    return terms
+
+
+class CommandLibrary:
+    """Deduplicated command index over an append-only JSONL file of occurrences."""
+
+    def __init__(self, path: str = COMMAND_LIBRARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._commands: Dict[str, LibraryCommand] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._terms: List[str] = []             # Sorted, for prefix lookups
+        self._offset = 0
+
+    def _index(self, record: Dict) -> None:
+        key = f"{record['kind']}:{record['key']}"
+        entry = self._commands.get(key)
+        if entry is None:
+            entry = self._commands[key] = LibraryCommand(
+                key=record["key"], kind=record["kind"], vendor=record["vendor"], object=record["object"],
+                verb=record["verb"], example=record["example"], first_seen=record["timestamp"])
+            for term in _terms(entry.key, entry.object, entry.verb, VENDOR_TERMS.get(entry.vendor, "")):
+                if term not in self._postings:
+                    self._postings[term] = set()
+                    bisect.insort(self._terms, term)
+                self._postings[term].add(key)
+        entry.count += 1
+        entry.example, entry.last_seen = record["example"], record["timestamp"]
+        if record.get("task_key") and record["task_key"] not in entry.use_cases:
+            entry.use_cases.append(record["task_key"])
+
+    def _catch_up(self) -> None:
+        """Index lines appended since the last read (by this or another worker)."""
+        try:
+            if os.path.getsize(self.path) <= self._offset:
+                return
+        except FileNotFoundError:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break       # Partially written line; picked up next time
+                self._offset += len(line)
+                try:
+                    self._index(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+
+    def add_output(self, task_key: str, vendor: str, output: str) -> int:
+        """Extract and index the commands of one output; returns how many were found."""
+        commands = extract_commands(output)
+        if not commands:
+            return 0
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        lines = b"".join((json.dumps({
+            "timestamp": timestamp, "task_key": task_key, "output_vendor": vendor,
+            "kind": c.kind, "key": c.key, "vendor": c.vendor, "object": c.object, "verb": c.verb,
+            "example": c.example,
+        }, ensure_ascii=False) + "\n").encode("utf-8") for c in commands)
+        with self._lock:
+            self._catch_up()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # One O_APPEND write per output keeps concurrent writers from interleaving lines
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            try:
+                os.write(fd, lines)
+            finally:
+                os.close(fd)
+            self._catch_up()
+        return len(commands)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._catch_up()
+            return len(self._commands)
+
+    def _matching(self, word: str) -> Set[str]:
+        """Commands with a term starting with `word`."""
+        keys: Set[str] = set()
+        start = bisect.bisect_left(self._terms, word)
+        for term in self._terms[start:]:
+            if not term.startswith(word):
+                break
+            keys |= self._postings[term]
+        return keys
+
+    def search(self, query: str = "", vendor: Optional[str] = None, object: Optional[str] = None,
+               verb: Optional[str] = None, kind: Optional[str] = None,
+               limit: int = DEFAULT_LIMIT) -> Tuple[List[LibraryCommand], float]:
+        """Commands matching every query word (prefix match), most used first, and the time in ms.
+
+        `vendor` also admits host-side commands; `object` and `verb` match exactly.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._catch_up()
+            keys: Optional[Set[str]] = None
+            for word in TERM.findall(query.lower()):
+                matched = self._matching(word)
+                keys = matched if keys is None else keys & matched
+                if not keys:
+                    break
+            candidates = [self._commands[key] for key in (self._commands if keys is None else keys)]
+            results = [
+                c for c in candidates
+                if (vendor is None or c.vendor in (vendor, HOST))
+                and (object is None or c.object == object.lower())
+                and (verb is None or c.verb == verb.lower())
+                and (kind is None or c.kind == kind)
+            ]
+            results.sort(key=lambda c: (c.count, c.last_seen), reverse=True)
+            results = results[:limit]
+        return results, (time.perf_counter() - start) * 1000
+
+    def facets(self, vendor: Optional[str] = None) -> Dict[str, List[str]]:
+        """Objects and verbs in the library (for filter menus), most frequent first."""
+        with self._lock:
+            self._catch_up()
+            objects: Dict[str, int] = {}
+            verbs: Dict[str, int] = {}
+            for c in self._commands.values():
+                if vendor is None or c.vendor in (vendor, HOST):
+                    objects[c.object] = objects.get(c.object, 0) + c.count
+                    if c.verb:
+                        verbs[c.verb] = verbs.get(c.verb, 0) + c.count
+        return {"objects": sorted(objects, key=objects.get, reverse=True),
+                "verbs": sorted(verbs, key=verbs.get, reverse=True)}
+
+# ============================
+# CLI
+# ============================
+
+def _main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Command library extracted from generated outputs")
+    parser.add_argument("--path", default=COMMAND_LIBRARY_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    search = sub.add_parser("search", help="look up commands")
+    search.add_argument("query", nargs="?", default="")
+    search.add_argument("--vendor")
+    search.add_argument("--object")
+    search.add_argument("--verb")
+    search.add_argument("--kind", choices=["cli", "ansible"])
+    search.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    extract = sub.add_parser("extract", help="print what would be indexed from a saved output")
+    extract.add_argument("file")
+    add = sub.add_parser("add", help="index a saved output")
+    add.add_argument("file")
+    add.add_argument("--vendor", required=True)
+    add.add_argument("--use-case", default="")
+    sub.add_parser("stats", help="library size per vendor and kind")
+    args = parser.parse_args(argv)
+
+    if args.command == "extract":
+        with open(args.file, encoding="utf-8") as f:
+            for c in extract_commands(f.read()):
+                print(f"[{c.kind}] {c.vendor} | {c.object} | {c.verb or '-'}\n    {c.key}")
+        return 0
+    library = CommandLibrary(args.path)
+    if args.command == "add":
+        with open(args.file, encoding="utf-8") as f:
+            print(f"{library.add_output(args.use_case, args.vendor, f.read())} commands indexed")
+        return 0
+    if args.command == "stats":
+        counts: Dict[Tuple[str, str], int] = {}
+        for c in library.search(limit=len(library))[0]:
+            counts[(c.vendor, c.kind)] = counts.get((c.vendor, c.kind), 0) + 1
+        for (vendor, kind), count in sorted(counts.items()):
+            print(f"{vendor:20} {kind:8} {count}")
+        print(f"{len(library)} distinct commands")
+        return 0
+    results, elapsed_ms = library.search(args.query, args.vendor, args.object, args.verb, args.kind, args.limit)
+    for c in results:
+        print(f"{c.count:>4}x  [{c.vendor}] {c.object} / {c.verb or '-'}   last {c.last_seen[:10]}")
+        print("      " + c.example.replace("\n", "\n      "))
+    print(f"{len(results)} results in {elapsed_ms:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
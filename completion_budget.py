@@ -0,0 +1,102 @@
+"""
+Adaptive completion budgets (max_tokens) learned from observed output lengths.
+
+Every finished call records its completion tokens and finish_reason per use case,
+vendor and language. The budget for the next request is a high percentile of the
+recent lengths plus headroom, clamped to [min_tokens, max_tokens]. Short explanations
+then stop reserving the full default against the token quota, while long documents
+(CRs, migration plans) that kept getting truncated get a larger limit.
+
+Histories live in the shared state store, so all replicas (app and REST API) learn
+from the same traffic. Until a key has `min_samples` observations, the per-use-case
+history is used, and until that has enough, the static default.
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+HISTORY_TTL_S = 30 * 86400
+TRUNCATION_GROWTH = 1.5         # A truncated answer needed more than its limit; assume 1.5x
+BUDGET_STEP = 50                # Budgets are rounded up to a multiple of this
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for no values. Shared by the load tests and reports."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * pct / 100) - 1))]
+
+
+class CompletionBudgets:
+    """Rolling per-(use case, vendor, language) completion length estimates."""
+
+    def __init__(self, store, default_tokens: int, min_tokens: int = 400, max_tokens: int = 4000,
+                 pct: float = 95.0, headroom: float = 1.15, window: int = 200, min_samples: int = 10,
+                 enabled: bool = True):
+        self.store = store
+        self.default_tokens = default_tokens
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.pct = pct
+        self.headroom = headroom
+        self.window = window
+        self.min_samples = min_samples
+        self.enabled = enabled
+
+    @staticmethod
+    def _keys(task_key: str, vendor: str, language: str) -> List[str]:
+        """Most specific first: use case + vendor + language, then use case alone."""
+        return [f"budget:{task_key}|{vendor}|{language}", f"budget:{task_key}"]
+
+    def budget(self, task_key: str, vendor: str, language: str) -> Tuple[int, str]:
+        """(max_tokens, basis) for the next request; basis is "learned", "use_case" or "default"."""
+        if not self.enabled:
+            return self.default_tokens, "default"
+        for key, basis in zip(self._keys(task_key, vendor, language), ("learned", "use_case")):
+            history = self.store.get(key) or []
+            if len(history) >= self.min_samples:
+                estimate = percentile([tokens for tokens, _ in history], self.pct) * self.headroom
+                # A recent truncation raises the budget at once instead of waiting to reach the percentile
+                recent_truncated = [tokens for tokens, truncated in history[-self.min_samples:] if truncated]
+                estimate = max([estimate] + recent_truncated)
+                estimate = math.ceil(estimate / BUDGET_STEP) * BUDGET_STEP
+                return int(min(self.max_tokens, max(self.min_tokens, estimate))), basis
+        return self.default_tokens, "default"
+
+    def record(self, task_key: str, vendor: str, language: str, completion_tokens: int,
+               finish_reason: Optional[str], max_tokens: int) -> None:
+        """Add one observation; a truncated answer counts as longer than the limit it hit."""
+        if not self.enabled or completion_tokens <= 0:
+            return
+        truncated = finish_reason == "length"
+        tokens = int(max(completion_tokens, max_tokens) * TRUNCATION_GROWTH) if truncated else completion_tokens
+        for key in self._keys(task_key, vendor, language):
+            with self.store.lock(key):
+                history = (self.store.get(key) or [])[-(self.window - 1):]
+                history.append([tokens, int(truncated)])
+                self.store.set(key, history, ttl_s=HISTORY_TTL_S)
+
+    def stats(self, task_key: str, vendor: str, language: str) -> Dict[str, float]:
+        """Samples and truncation rate of the most specific history (for dashboards)."""
+        history = self.store.get(self._keys(task_key, vendor, language)[0]) or []
+        return {
+            "samples": len(history),
+            "truncation_rate": round(sum(t for _, t in history) / len(history), 3) if history else 0.0,
+        }
+
+
+def budgets_from_settings(cfg: Dict, store, default_tokens: int) -> CompletionBudgets:
+    """Build from a secrets-style [completion_budget] table."""
+    cfg = dict(cfg or {})
+    return CompletionBudgets(
+        store,
+        default_tokens=int(cfg.get("default_tokens", default_tokens)),
+        min_tokens=int(cfg.get("min_tokens", 400)),
+        max_tokens=int(cfg.get("max_tokens", 4000)),
+        pct=float(cfg.get("percentile", 95)),
+        headroom=float(cfg.get("headroom", 1.15)),
+        window=int(cfg.get("window", 200)),
+        min_samples=int(cfg.get("min_samples", 10)),
+        enabled=bool(cfg.get("enabled", True))
+    )
@@ -0,0 +1,79 @@
+"""
+Automatic continuation of completions truncated at max_tokens.
+
+When a completion stops with finish_reason "length", a follow-up request asks the model
+to continue exactly where the text stops. It carries only a compact context (use case,
+outline of what is already written, the last characters of the partial output) instead
+of the original prompt. Pieces are joined without duplicated overlap; a continuation
+inside an open code block (e.g. the YAML of an Ansible playbook) is told so, and a fence
+it re-opens anyway is dropped.
+"""
+
+import re
+from typing import Dict, Optional
+
+from markdown_sections import FENCE, outline, split_sections
+
+MAX_CONTINUATIONS = 2               # Continuation rounds per request
+CONTINUATION_TAIL_CHARS = 1200      # Partial output sent back with each continuation (~300 tokens)
+MIN_OVERLAP_CHARS = 8               # Shorter repeats at the seam are left alone (could be legitimate)
+
+CONTINUATION_TEMPLATE = """
+You are continuing a {use_case} document for {vendor} that was cut off at the output limit.
+{outline}
+The document so far ends with:
+<<<
+{tail}
+>>>
+
+Continue from exactly the last character, even mid-word or mid-line. Do not repeat text that
+is already written, do not restart the document, add no preamble or commentary.{note}
+"""
+
+FENCE_NOTE = (" The text stops inside a ``` code block: continue the code only, do not open a new "
+              "fence, and close the block where the code ends.")
+JSON_NOTE = " The document is a JSON object: continue the JSON text so that the whole object is valid."
+
+OPENING_FENCE = re.compile(r"^\s*(```|~~~)[^\n]*\n?")
+
+
+def open_fence(text: str) -> Optional[str]:
+    """Opening fence line of a code block that is still open at the end of `text`, else None."""
+    opened = None
+    for line in text.splitlines():
+        if FENCE.match(line):
+            opened = None if opened else line.strip()
+    return opened
+
+
+def continuation_prompt(partial: str, use_case: str, vendor: Optional[str], structured: bool = False) -> str:
+    headings = "" if structured else outline(split_sections(partial))
+    note = JSON_NOTE if structured else (FENCE_NOTE if open_fence(partial) else "")
+    return CONTINUATION_TEMPLATE.format(
+        use_case=use_case,
+        vendor=vendor or "the selected vendor",
+        outline=f"\nOutline of what is already written:\n{headings}\n" if headings else "",
+        tail=partial[-CONTINUATION_TAIL_CHARS:],
+        note=note,
+    )
+
+
+def join_continuation(partial: str, continuation: str) -> str:
+    """Append `continuation` to `partial`, dropping a re-opened fence and text repeated at the seam."""
+    if open_fence(partial) and OPENING_FENCE.match(continuation):
+        continuation = OPENING_FENCE.sub("", continuation, count=1)
+
+    # Models often restate the last words before continuing: remove the longest such overlap
+    longest = min(len(partial), len(continuation), CONTINUATION_TAIL_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if partial.endswith(continuation[:size]):
+            continuation = continuation[size:]
+            break
+    return partial + continuation
+
+
+def merge_usage(total: Dict[str, int], usage: Dict[str, int]) -> Dict[str, int]:
+    merged = dict(total)
+    for key, value in usage.items():
+        merged[key] = merged.get(key, 0) + value
+    return merged
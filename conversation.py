@@ -0,0 +1,139 @@
+"""
+Follow-up conversation state with bounded prompt context.
+
+A conversation starts from one generated document. Each refinement ("add rollback
+for step 7") is sent with only what it needs: a rolling summary of older turns, the
+last few turns, the document outline and the sections the request touches. The model
+returns only the revised sections, which are spliced into the document. Once the kept
+turns exceed a token threshold, older turns are folded into the rolling summary.
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from markdown_sections import outline, relevant_sections, splice_sections, split_sections
+
+FOLLOWUP_CONTEXT_TOKENS = 2000     # Kept turns above this are compacted into the rolling summary
+FOLLOWUP_SECTION_TOKENS = 1500     # Budget for document sections sent with a follow-up
+KEEP_RECENT_TURNS = 2              # Turns (user + assistant messages) always kept verbatim
+
+SUMMARY_SYSTEM_PROMPT = """
+You maintain the running summary of a storage engineering conversation.
+Merge the existing summary and the new turns into one concise summary (max 200 words).
+Keep: vendor, use case, key facts from the original request, every refinement requested and what was changed.
+Drop: wording, formatting and anything already visible in the document itself.
+"""
+
+FOLLOWUP_TEMPLATE = """
+Refine the existing {use_case} document for {vendor}.
+
+Document outline:
+{outline}
+
+Current content of the affected sections:
+{sections}
+
+Refinement request:
+{request}
+
+Return ONLY the sections you changed or added, each starting with its exact original heading line
+(new sections with a new heading). Do not repeat unchanged sections.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) - good enough for budgeting."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def _truncate_to_tokens(text: str, tokens: int) -> str:
+    limit = tokens * 4
+    return text if len(text) <= limit else text[:limit] + "\n[...]"
+
+
+@dataclass
+class Turn:
+    role: str           # "user" or "assistant"
+    content: str
+
+
+@dataclass
+class Conversation:
+    task_key: str
+    vendor: str
+    document: str
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+
+    @classmethod
+    def start(cls, task_key: str, vendor: str, user_input: str, document: str) -> "Conversation":
+        # The full first answer lives in `document`; the turn only records that it was produced
+        return cls(
+            task_key=task_key,
+            vendor=vendor,
+            document=document,
+            turns=[
+                Turn("user", f"Original {task_key} request for {vendor}:\n{user_input}"),
+                Turn("assistant", "Generated the initial document."),
+            ],
+        )
+
+    def context_tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(estimate_tokens(t.content) for t in self.turns)
+
+    def needs_compaction(self) -> bool:
+        return len(self.turns) > KEEP_RECENT_TURNS and self.context_tokens() > FOLLOWUP_CONTEXT_TOKENS
+
+    def compact(self, summarize: Callable[[str], Optional[str]]) -> bool:
+        """Fold all but the most recent turns into the rolling summary.
+
+        `summarize` receives the existing summary plus the old turns and returns the new
+        summary, or None on failure (the turns are then kept and compaction retried later).
+        """
+        old, recent = self.turns[:-KEEP_RECENT_TURNS], self.turns[-KEEP_RECENT_TURNS:]
+        if not old:
+            return False
+        transcript = "\n\n".join(f"{t.role.upper()}: {t.content}" for t in old)
+        new_summary = summarize(f"Existing summary:\n{self.summary or '(none)'}\n\nNew turns:\n{transcript}")
+        if not new_summary:
+            return False
+        self.summary = new_summary.strip()
+        self.turns = recent
+        return True
+
+    def build_followup(self, request: str) -> Tuple[List[Dict[str, str]], str]:
+        """Return (history messages, follow-up prompt) for the next refinement."""
+        sections = split_sections(self.document)
+        affected = relevant_sections(sections, request)
+        if not any(s.heading for s in sections):
+            # No headings (e.g. a YAML playbook): the document itself is the only section
+            affected = sections
+        section_text = "\n\n".join(s.render() for s in affected) or "(none - add new sections as needed)"
+
+        prompt = FOLLOWUP_TEMPLATE.format(
+            use_case=self.task_key,
+            vendor=self.vendor,
+            outline=outline(sections) or "(no headings)",
+            sections=_truncate_to_tokens(section_text, FOLLOWUP_SECTION_TOKENS),
+            request=request,
+        )
+
+        history = []
+        if self.summary:
+            history.append({"role": "user", "content": f"Summary of the conversation so far:\n{self.summary}"})
+            history.append({"role": "assistant", "content": "Understood."})
+        history.extend({"role": t.role, "content": t.content} for t in self.turns)
+        return history, prompt
+
+    def apply(self, request: str, revision: str) -> List[str]:
+        """Splice the model's revised sections into the document and record the turn.
+
+        Returns the changed headings; empty if the revision did not fit the document, which
+        is then left as it was and the turn is not recorded.
+        """
+        self.document, changed = splice_sections(self.document, revision)
+        if not changed:
+            return changed
+        self.turns.append(Turn("user", request))
+        self.turns.append(Turn("assistant", "Revised sections: " + ", ".join(changed)))
+        return changed
@@ -0,0 +1,665 @@
+"""
+Async REST API of the Storage Engineering AI Assistant for ITSM tooling (ServiceNow flows).
+
+Every use case is exposed under its slug, with the same prompts, system prompt and input
+validation as the Streamlit app (see copilot_core). Responses are JSON, or Server-Sent
+Events when the client asks for a token stream. Every response carries an X-Request-ID.
+Document use cases (CR, RCA, DR plan, decommissioning) can return their sections as JSON
+("structured": true); streams then also emit a `section` event per completed section.
+
+Run:
+    uvicorn copilot_api:app --host 0.0.0.0 --port 8080
+
+Endpoints:
+    GET  /healthz
+    GET  /v1/use-cases
+    POST /v1/use-cases/{slug}          {"vendor": ..., "input": ..., "language": "English", "stream": false,
+                                        "structured": false, "compact_logs": false,
+                                        "analyze_metrics": false, "assembled": false,
+                                        "known_error_context": false}
+    GET  /v1/requests/{request_id}     status of a request (running / done / failed)
+    GET  /v1/mappings?q=...&vendor=... rows of the cross-vendor mapping table (all rows without q)
+    GET  /v1/mappings/equivalent?term=...&target=...[&source=...]
+    GET  /v1/known-errors?q=...&vendor=...
+                                       known-error signatures in q, database version and hit rate
+    GET  /v1/lanes                     priority lanes and per-lane queue metrics per backend
+    GET  /v1/commands?q=...&vendor=...&object=...&verb=...&kind=cli|ansible
+                                       commands and Ansible tasks extracted from earlier outputs
+
+Configuration comes from the Streamlit secrets file (COPILOT_SECRETS, default
+.streamlit/secrets.toml): [llm_backends.*], [use_case_backends], [quota],
+[completion_budget], [redaction], [audit], [priority_lanes], STATE_STORE_URL, VENDOR_MAPPING_PATH,
+COMMAND_LIBRARY_PATH and KNOWN_ERRORS_PATH. OPENAI_API_KEY in the environment
+takes precedence over the file. Without "max_tokens" in the body, the completion budget
+learned for the use case, vendor and language applies. Sensitive values in the input are
+replaced by placeholders before the prompt is sent and restored in the output. For the
+migration use cases, an input that is only an "equivalent of X on Y" question is answered
+from the cross-vendor mapping table without an LLM call (metadata "answered_from":
+"vendor_mapping"); other inputs asking for an equivalent get the matching rows as context.
+Requests wait for a backend slot in the priority lane of their use case and requester; an
+X-Priority-Lane header can move a request to a lower lane (bulk jobs), never to a higher one. Commands and Ansible tasks in
+every output go to the command library, where they can be looked up without an LLM call.
+With "analyze_metrics" (Performance Analysis), pasted metrics are classified locally and the
+model gets the findings table instead of the raw samples (metadata "bottlenecks"). With
+"assembled" (CR, compliance evidence, decommissioning), approvals, regulatory references and
+sign-off come from the approved templates and the model writes only the case-specific
+sections; streams emit those as tokens and the assembled document with the `done` event.
+An issue explanation whose input is just a known vendor alert (EMS event, alert, replication
+state) is answered with the approved explanation from the known-error database without an
+LLM call (metadata "answered_from": "known_errors"). Input with more to it than the alert,
+or "known_error_context": true, goes to the model with that explanation as context
+(metadata "known_errors").
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from audit_log import AuditLog, audit_from_settings, sha256_text
+from bottleneck_classifier import digest_input
+from command_library import COMMAND_LIBRARY_PATH, DEFAULT_LIMIT, CommandLibrary
+from completion_budget import CompletionBudgets, budgets_from_settings
+from copilot_core import (
+    KNOWN_ERROR_CONTEXT_TEMPLATE, MAPPING_CONTEXT_TEMPLATE, MAX_INPUT_LENGTH, MAX_OUTPUT_TOKENS, MODEL_VERSION,
+    USE_CASE_SLUGS, USE_CASES, VENDORS, build_prompt, build_system_prompt, template_version, use_case_slug,
+    validate_input
+)
+from document_assembly import assemble, assembly_prompt, supports_assembly
+from known_errors import KNOWN_ERROR_USE_CASES, KNOWN_ERRORS_PATH, KnownErrors
+from log_compaction import compact_log
+from llm_backends import BackendRegistry, registry_from_settings
+from quota_governor import QuotaExceeded, QuotaGovernor, Reservation, governor_from_settings, team_for
+from redaction import Redactor, redactor_from_settings
+from state_store import STORE_ERRORS, StateStore, open_state_store
+from structured_output import (
+    SECTION_SCHEMAS, IncrementalJSONParser, parse_document, response_format, structured_instructions,
+    supports_structured, to_markdown
+)
+from vendor_mapping import (
+    MAPPING_USE_CASES, VENDOR_MAPPING_PATH, VendorMapping, format_mapping_context, load_mapping, mapping_vendors,
+    mentions_equivalent
+)
+
+try:
+    import tomllib
+except ImportError:                     # Python < 3.11
+    import toml as tomllib
+
+logger = logging.getLogger(__name__)
+
+SECRETS_PATH = os.environ.get("COPILOT_SECRETS", os.path.join(".streamlit", "secrets.toml"))
+LANGUAGES = ("English", "German / Deutsch")
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+DEFAULT_REQUESTER = "api-client"
+STREAM_FLUSH_S = 0.05           # Deltas arriving within this interval go out as one SSE event
+STORE_RETRY_AFTER_S = 5         # Retry-After of the 503 returned while the state store is unreachable
+QUOTA_WAIT_THREADS = 32         # Requests queued for token budget at once; [quota] wait_threads overrides
+
+# ============================
+# Configuration & Shared Resources
+# ============================
+
+def load_settings(path: str = SECRETS_PATH) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return tomllib.loads(f.read())
+
+
+class Resources:
+    """Backends, quota governor, state store, redactor, audit log, mapping table, command library and known errors."""
+
+    def __init__(self, settings: Dict):
+        self.settings = settings
+        self.registry: BackendRegistry = registry_from_settings(
+            settings, os.environ.get("OPENAI_API_KEY") or settings.get("OPENAI_API_KEY"), MODEL_VERSION
+        )
+        self.store: StateStore = open_state_store(settings.get("STATE_STORE_URL", "memory://"))
+        self.governor: QuotaGovernor = governor_from_settings(settings.get("quota", {}), store=self.store)
+        # Quota waits block a thread for up to queue_timeout_s; kept out of the default executor
+        self.quota_waits = ThreadPoolExecutor(
+            max_workers=int(settings.get("quota", {}).get("wait_threads", QUOTA_WAIT_THREADS)),
+            thread_name_prefix="quota-wait",
+        )
+        self.budgets: CompletionBudgets = budgets_from_settings(settings.get("completion_budget", {}), self.store,
+                                                                MAX_OUTPUT_TOKENS)
+        self.redactor: Redactor = redactor_from_settings(settings.get("redaction", {}))
+        self.audit: Optional[AuditLog] = audit_from_settings(settings.get("audit", {}))
+        self.mapping: Optional[VendorMapping] = load_mapping(settings.get("VENDOR_MAPPING_PATH", VENDOR_MAPPING_PATH))
+        self.commands = CommandLibrary(settings.get("COMMAND_LIBRARY_PATH", COMMAND_LIBRARY_PATH))
+        self.known_errors = KnownErrors(settings.get("KNOWN_ERRORS_PATH", KNOWN_ERRORS_PATH))
+
+    def requester(self, request: Request) -> Tuple[str, str]:
+        """(user, team): identity set by the auth proxy in front of the API, else a shared client id."""
+        user = (request.headers.get("X-Forwarded-Email") or request.headers.get("X-Forwarded-User")
+                or DEFAULT_REQUESTER)
+        return user, team_for(self.settings.get("quota", {}), user)
+
+
+_resources: Optional[Resources] = None
+
+def get_resources() -> Resources:
+    global _resources
+    if _resources is None:
+        _resources = Resources(load_settings())
+    return _resources
+
+# ============================
+# Helpers
+# ============================
+
+def get_request_id(request: Request) -> str:
+    """Caller's X-Request-ID (ServiceNow correlation id) if well-formed, else a new one."""
+    supplied = request.headers.get("X-Request-ID", "")
+    return supplied if REQUEST_ID_PATTERN.match(supplied) else uuid.uuid4().hex
+
+def error_response(status: int, code: str, message: str, request_id: str,
+                   headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"code": code, "message": message}, "request_id": request_id},
+        status_code=status,
+        headers={"X-Request-ID": request_id, **(headers or {})}
+    )
+
+async def acquire_quota(resources: Resources, user: str, team: str, tokens: int) -> Reservation:
+    """Reserve quota; only a request that has to queue for budget occupies a quota-wait thread."""
+    try:
+        return await asyncio.to_thread(resources.governor.acquire, user, team, tokens, 0)
+    except QuotaExceeded as e:
+        if e.retry_after > resources.governor.queue_timeout_s:
+            raise
+    # The queue timeout runs from now, also while waiting for a free quota-wait thread
+    deadline = time.time() + resources.governor.queue_timeout_s
+    return await asyncio.get_running_loop().run_in_executor(
+        resources.quota_waits,
+        lambda: resources.governor.acquire(user, team, tokens, max(0.0, deadline - time.time())),
+    )
+
+def store_unavailable(e: Exception, request_id: str) -> JSONResponse:
+    """503 for a request that cannot be checked against quotas or budgets without the state store."""
+    logger.warning("State store unavailable (request %s): %s", request_id, e)
+    return error_response(503, "state_store_unavailable", "shared state store unavailable, retry shortly",
+                          request_id, {"Retry-After": str(STORE_RETRY_AFTER_S)})
+
+async def bookkeeping(what: str, func: Callable, *args) -> None:
+    """Job records, quota settlement and budget history after the decision: a store outage is logged, not raised."""
+    try:
+        await asyncio.to_thread(func, *args)
+    except STORE_ERRORS as e:
+        logger.warning("%s not written to the state store: %s", what, e)
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _number(body: Dict, name: str, default: float, low: float, high: float) -> float:
+    value = body.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        raise ValueError(f"'{name}' must be a number between {low} and {high}")
+    return value
+
+def parse_generate_body(body: Dict) -> Dict:
+    """Validate a generate request body; raises ValueError with a client-facing message."""
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    vendor = body.get("vendor")
+    if vendor not in VENDORS:
+        raise ValueError(f"'vendor' must be one of: {', '.join(VENDORS)}")
+    language = body.get("language", "English")
+    if language not in LANGUAGES:
+        raise ValueError(f"'language' must be one of: {', '.join(LANGUAGES)}")
+    user_input = body.get("input")
+    if not isinstance(user_input, str):
+        raise ValueError("'input' must be a string")
+    return {
+        "vendor": vendor,
+        "language": language,
+        "input": user_input,
+        "temperature": _number(body, "temperature", 0.25, 0.0, 1.0),
+        "top_p": _number(body, "top_p", 0.90, 0.5, 1.0),
+        # None = learned completion budget (completion_budget)
+        "max_tokens": int(_number(body, "max_tokens", 0, 500, 4000)) if "max_tokens" in body else None,
+        "stream": bool(body.get("stream", False)),
+        "structured": bool(body.get("structured", False)),
+        "compact_logs": bool(body.get("compact_logs", False)),
+        "analyze_metrics": bool(body.get("analyze_metrics", False)),
+        "assembled": bool(body.get("assembled", False)),
+        "known_error_context": bool(body.get("known_error_context", False)),
+    }
+
+def classify_error(e: Exception) -> Tuple[int, str]:
+    """HTTP status and error code for an upstream LLM failure (same classes as the app)."""
+    error_type = type(e).__name__.lower()
+    error_message = str(e).lower()
+    if "rate" in error_message or "ratelimit" in error_type:
+        return 503, "upstream_rate_limited"
+    if "auth" in error_message or "authentication" in error_type:
+        return 502, "upstream_auth_error"
+    if "timeout" in error_type:
+        return 504, "upstream_timeout"
+    if "connection" in error_message or "apiconnectionerror" in error_type:
+        return 502, "upstream_unreachable"
+    return 502, "upstream_error"
+
+# ============================
+# Endpoints
+# ============================
+
+async def healthz(request: Request) -> JSONResponse:
+    return JSONResponse({"status": "ok"})
+
+async def list_use_cases(request: Request) -> JSONResponse:
+    return JSONResponse({
+        "use_cases": [
+            {"slug": use_case_slug(key), "key": key, "display_en": en, "display_de": de,
+             "structured": supports_structured(key)}
+            for key, en, de in USE_CASES
+        ],
+        "vendors": VENDORS,
+        "languages": list(LANGUAGES),
+        "max_input_length": MAX_INPUT_LENGTH,
+    })
+
+async def get_request_status(request: Request) -> JSONResponse:
+    request_id = request.path_params["request_id"]
+    try:
+        job = await asyncio.to_thread(get_resources().store.get_job, request_id)
+    except STORE_ERRORS as e:
+        return store_unavailable(e, request_id)
+    if job is None:
+        return error_response(404, "not_found", "unknown request id", request_id)
+    return JSONResponse({"request_id": request_id, **job}, headers={"X-Request-ID": request_id})
+
+async def list_mappings(request: Request) -> JSONResponse:
+    request_id = get_request_id(request)
+    mapping = get_resources().mapping
+    if mapping is None:
+        return error_response(503, "mapping_unavailable", "cross-vendor mapping table not loaded", request_id)
+    query, vendor = request.query_params.get("q", ""), request.query_params.get("vendor")
+    if vendor is not None and vendor not in VENDORS:
+        return error_response(422, "invalid_parameter", f"'vendor' must be one of: {', '.join(VENDORS)}", request_id)
+    if query:
+        rows = [{**asdict(row), "score": score} for row, score in mapping.lookup(query, vendor=vendor)]
+    else:
+        rows = [asdict(row) for row in mapping.rows]
+    return JSONResponse({"version": mapping.version, "rows": rows}, headers={"X-Request-ID": request_id})
+
+async def get_equivalent(request: Request) -> JSONResponse:
+    request_id = get_request_id(request)
+    mapping = get_resources().mapping
+    if mapping is None:
+        return error_response(503, "mapping_unavailable", "cross-vendor mapping table not loaded", request_id)
+    term, target = request.query_params.get("term", ""), request.query_params.get("target")
+    source = request.query_params.get("source")
+    if not term.strip():
+        return error_response(422, "invalid_parameter", "'term' is required", request_id)
+    for name, value in (("target", target), ("source", source)):
+        if (value is not None or name == "target") and value not in VENDORS:
+            return error_response(422, "invalid_parameter", f"'{name}' must be one of: {', '.join(VENDORS)}", request_id)
+    equivalent = mapping.equivalent(term, target, source)
+    if equivalent is None:
+        return error_response(404, "not_found", "no matching row in the mapping table", request_id)
+    return JSONResponse({
+        "version": mapping.version,
+        "term": term,
+        "source_vendor": equivalent.source_vendor,
+        "target_vendor": target,
+        "row": asdict(equivalent.row),
+        "output": equivalent.render(request.query_params.get("language", "English")),
+    }, headers={"X-Request-ID": request_id})
+
+async def list_lanes(request: Request) -> JSONResponse:
+    registry = get_resources().registry
+    return JSONResponse({
+        "lanes": [asdict(lane) for lane in registry.lanes.lanes],
+        "default_lane": registry.lanes.default,
+        "backends": registry.lane_stats(),
+    })
+
+async def list_commands(request: Request) -> JSONResponse:
+    request_id = get_request_id(request)
+    query = request.query_params
+    vendor, kind = query.get("vendor"), query.get("kind")
+    if vendor is not None and vendor not in VENDORS:
+        return error_response(422, "invalid_parameter", f"'vendor' must be one of: {', '.join(VENDORS)}", request_id)
+    if kind not in (None, "cli", "ansible"):
+        return error_response(422, "invalid_parameter", "'kind' must be 'cli' or 'ansible'", request_id)
+    try:
+        limit = int(query.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        return error_response(422, "invalid_parameter", "'limit' must be an integer", request_id)
+    results, elapsed_ms = await asyncio.to_thread(
+        get_resources().commands.search, query.get("q", ""), vendor, query.get("object"), query.get("verb"),
+        kind, max(1, min(limit, 200))
+    )
+    return JSONResponse({"commands": [asdict(command) for command in results], "search_ms": round(elapsed_ms, 2)},
+                        headers={"X-Request-ID": request_id})
+
+async def list_known_errors(request: Request) -> JSONResponse:
+    request_id = get_request_id(request)
+    vendor = request.query_params.get("vendor")
+    if vendor is not None and vendor not in VENDORS:
+        return error_response(422, "invalid_parameter", f"'vendor' must be one of: {', '.join(VENDORS)}", request_id)
+    known_errors = get_resources().known_errors
+    query = request.query_params.get("q", "")
+    # Lookups from here do not count towards the hit rate of the triage requests
+    answer = known_errors.lookup(query, vendor, record=False) if query else None
+    matches = [{"id": m.signature.id, "vendor": m.signature.vendor, "title": m.signature.title,
+                "severity": m.signature.severity, "matched": m.matched} for m in answer.matches] if answer else []
+    return JSONResponse({"matches": matches, "lookup_us": answer.elapsed_us if answer else None,
+                         **known_errors.stats()}, headers={"X-Request-ID": request_id})
+
+async def generate(request: Request):
+    request_id = get_request_id(request)
+    task_key = USE_CASE_SLUGS.get(request.path_params["slug"])
+    if task_key is None:
+        return error_response(404, "unknown_use_case", "see GET /v1/use-cases", request_id)
+
+    try:
+        params = parse_generate_body(await request.json())
+    except json.JSONDecodeError:
+        return error_response(400, "invalid_json", "request body is not valid JSON", request_id)
+    except ValueError as e:
+        return error_response(422, "invalid_parameter", str(e), request_id)
+
+    if params["structured"] and not supports_structured(task_key):
+        return error_response(422, "invalid_parameter", "'structured' is not available for this use case",
+                              request_id)
+
+    if params["assembled"] and (params["structured"] or not supports_assembly(task_key)):
+        return error_response(422, "invalid_parameter",
+                              "'assembled' is not available for this use case or with 'structured'", request_id)
+
+    if params["known_error_context"] and task_key not in KNOWN_ERROR_USE_CASES:
+        return error_response(422, "invalid_parameter",
+                              "'known_error_context' is only available for Explain Issue and Error", request_id)
+
+    if params["analyze_metrics"] and task_key != "Performance Analysis":
+        return error_response(422, "invalid_parameter", "'analyze_metrics' is only available for Performance Analysis",
+                              request_id)
+
+    bottlenecks = None
+    if params["analyze_metrics"]:
+        # Metrics exports: the model gets the local findings table instead of the raw samples
+        params["input"], analysis = await asyncio.to_thread(digest_input, params["input"], params["vendor"])
+        bottlenecks = [finding.category for finding in analysis.findings]
+
+    if params["compact_logs"]:
+        # Pasted logs: repeated lines collapse into templates; the length limit applies afterwards
+        params["input"] = (await asyncio.to_thread(compact_log, params["input"])).text
+
+    is_valid, error_code = validate_input(params["input"])
+    if not is_valid:
+        message = f"input must be 1-{MAX_INPUT_LENGTH} characters"
+        return error_response(400, error_code, message, request_id)
+
+    resources = get_resources()
+    wants_stream = params["stream"] or "text/event-stream" in request.headers.get("accept", "")
+    # A migration input that is only an "equivalent of X on Y" question is answered from the table
+    equivalent = resources.mapping.answer(params["input"], default_source=params["vendor"]) \
+        if resources.mapping is not None and task_key in MAPPING_USE_CASES and not params["structured"] else None
+    if equivalent is not None:
+        return await local_answer(request_id, task_key, params, equivalent.render(params["language"]),
+                                  "vendor_mapping", {"mapping_version": equivalent.version,
+                                                     "mapping_rows": [equivalent.row.id]}, wants_stream)
+    # A pasted known vendor alert gets the approved explanation; anything more, or "known_error_context",
+    # goes to the model with that explanation as context
+    known_error = resources.known_errors.lookup(params["input"], params["vendor"]) \
+        if task_key in KNOWN_ERROR_USE_CASES else None
+    if known_error is not None and known_error.alert_only and not params["known_error_context"]:
+        return await local_answer(request_id, task_key, params, known_error.render(params["language"]),
+                                  "known_errors", {"known_errors_version": known_error.version,
+                                                   "known_errors": [m.signature.id for m in known_error.matches],
+                                                   "lookup_us": known_error.elapsed_us}, wants_stream)
+
+    llm = resources.registry.for_use_case(task_key)
+    budget_use_case = f"{task_key} (structured)" if params["structured"] else \
+        f"{task_key} (assembled)" if params["assembled"] else task_key
+    budget_basis = "explicit"
+    if params["max_tokens"] is None:
+        try:
+            params["max_tokens"], budget_basis = await asyncio.to_thread(
+                resources.budgets.budget, budget_use_case, params["vendor"], params["language"])
+        except STORE_ERRORS as e:
+            return store_unavailable(e, request_id)
+    prompt = build_prompt(task_key, params["vendor"], params["input"])
+    # Migration plans, and requests asking for an equivalent, get only the mapping rows the details mention,
+    # for source and target vendors
+    mapping_rows = [row for row, _ in resources.mapping.lookup(params["input"], vendor=params["vendor"])] \
+        if resources.mapping is not None and (task_key in MAPPING_USE_CASES
+                                              or mentions_equivalent(params["input"])) else []
+    if mapping_rows:
+        prompt += MAPPING_CONTEXT_TEMPLATE.format(version=resources.mapping.version, context=format_mapping_context(
+            mapping_rows, mapping_vendors(task_key, params["vendor"], params["input"])))
+    if known_error is not None:
+        prompt += KNOWN_ERROR_CONTEXT_TEMPLATE.format(version=known_error.version, context=known_error.context())
+    if params["structured"]:
+        prompt += structured_instructions(task_key, llm.config.json_schema)
+    if params["assembled"]:
+        prompt = assembly_prompt(prompt, task_key)
+    # Placeholders go out instead of sensitive values; restored in the output (JSON-escaped in JSON mode)
+    redaction = resources.redactor.session()
+    prompt = redaction.redact(prompt)
+    messages = [
+        {"role": "system", "content": build_system_prompt(params["language"])},
+        {"role": "user", "content": prompt},
+    ]
+
+    # Same worst-case reservation as the app; acquire() may wait, so it runs off the event loop
+    user, team = resources.requester(request)
+    lane = resources.registry.lanes.lane_for(task_key, user, team, request.headers.get("X-Priority-Lane"))
+    estimated_tokens = sum(len(m["content"]) for m in messages) // 4 + params["max_tokens"]
+    try:
+        reservation = await acquire_quota(resources, user, team, estimated_tokens)
+    except QuotaExceeded as e:
+        retry_after = "3600" if e.retry_after == float("inf") else str(max(1, round(e.retry_after)))
+        return error_response(429, "quota_exceeded", str(e), request_id, {"Retry-After": retry_after})
+    except STORE_ERRORS as e:
+        return store_unavailable(e, request_id)
+
+    job = {"status": "running", "user": user, "team": team, "task_key": task_key,
+           "backend": llm.name, "lane": lane, "started": datetime.now().isoformat(), "source": "api"}
+    await bookkeeping("Job record", resources.store.put_job, request_id, job)
+
+    def audit(status: str, **fields) -> None:
+        """Queue the audit record (prompt and output as sent, i.e. redacted); never blocks the event loop."""
+        if resources.audit is None:
+            return
+        resources.audit.record(
+            "llm_call", status=status, request_id=request_id, source="api", user=user, team=team,
+            task_key=task_key, vendor=params["vendor"], language=params["language"], backend=llm.name,
+            template=template_version(task_key), system_prompt_sha256=sha256_text(messages[0]["content"]),
+            settings={"model": llm.config.model, "temperature": params["temperature"], "top_p": params["top_p"],
+                      "max_tokens": params["max_tokens"], "max_tokens_basis": budget_basis,
+                      "response_format": completion_args.get("response_format", {}).get("type")},
+            prompt=prompt, history=[], **fields
+        )
+
+    async def finish(response, error: Optional[Exception] = None) -> Dict:
+        """Settle quota, job record and audit trail; returns the response metadata."""
+        if error is not None:
+            audit("failed", error=type(error).__name__)
+            await bookkeeping("Quota settlement", resources.governor.settle, reservation, 0)
+            await bookkeeping("Job record", resources.store.put_job, request_id,
+                              {**job, "status": "failed", "error": type(error).__name__})
+            return {}
+        await bookkeeping("Quota settlement", resources.governor.settle, reservation,
+                          response.total_tokens or estimated_tokens)
+        await bookkeeping("Completion length", resources.budgets.record, budget_use_case, params["vendor"],
+                          params["language"], response.usage.get("completion_tokens", 0), response.finish_reason,
+                          params["max_tokens"])
+        await bookkeeping("Job record", resources.store.put_job, request_id,
+                          {**job, "status": "done", "total_tokens": response.total_tokens,
+                           "latency_s": round(response.latency_s, 3)})
+        # The output as generated still has placeholders instead of the redacted values
+        output = response.content or ""
+        if params["structured"]:
+            output = to_markdown(task_key, parse_document(task_key, output)[0], params["language"])
+        elif params["assembled"]:
+            output = assemble(task_key, output, params["vendor"], params["language"]).text
+        await asyncio.to_thread(resources.commands.add_output, task_key, params["vendor"], output)
+        audit("done", model=response.model, output=response.content or "", usage=response.usage,
+              finish_reason=response.finish_reason, continuations=0, redactions=dict(redaction.counts),
+              latency_s=round(response.latency_s, 3))
+        return {
+            "request_id": request_id,
+            "use_case": task_key,
+            "vendor": params["vendor"],
+            "model": response.model,
+            "backend": llm.name,
+            "lane": lane,
+            "queue_s": round(response.queue_s, 3),
+            "usage": response.usage,
+            "finish_reason": response.finish_reason,
+            "max_tokens": params["max_tokens"],
+            "max_tokens_basis": budget_basis,
+            "redactions": dict(redaction.counts),
+            "mapping_rows": [row.id for row in mapping_rows],
+            "known_errors": [m.signature.id for m in known_error.matches] if known_error is not None else [],
+            "bottlenecks": bottlenecks,
+            "latency_s": round(response.latency_s, 3),
+            "first_token_s": round(response.first_token_s, 3) if response.first_token_s is not None else None,
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    completion_args = dict(messages=messages, temperature=params["temperature"], top_p=params["top_p"],
+                           max_tokens=params["max_tokens"], frequency_penalty=0.0, presence_penalty=0.0, lane=lane)
+    if params["structured"]:
+        completion_args["response_format"] = response_format(task_key, llm.config.json_schema)
+
+    def structured_fields(content: Optional[str]) -> Dict:
+        """`sections` plus the Markdown rendering as `output` for structured requests."""
+        if not params["structured"]:
+            return {}
+        sections, missing = parse_document(task_key, content or "")
+        return {"output": to_markdown(task_key, sections, params["language"]), "sections": sections,
+                "missing_sections": missing}
+
+    def assembled_fields(content: Optional[str]) -> Dict:
+        """The assembled document as `output` and what came from templates, for assembled requests."""
+        if not params["assembled"]:
+            return {}
+        document = assemble(task_key, content or "", params["vendor"], params["language"])
+        return {"output": document.text, "assembly": {"static": document.static, "missing": document.missing,
+                                                      "static_chars": document.static_chars,
+                                                      "version": document.version}}
+
+    if not wants_stream:
+        try:
+            response = await llm.acomplete(**completion_args)
+        except Exception as e:
+            await finish(None, e)
+            status, code = classify_error(e)
+            return error_response(status, code, f"LLM backend '{llm.name}' failed", request_id)
+        metadata = await finish(response)
+        content = redaction.restore(response.content, json_escape=params["structured"])
+        return JSONResponse({"request_id": request_id, "output": content or "", "metadata": metadata,
+                             **structured_fields(content), **assembled_fields(content)},
+                            headers={"X-Request-ID": request_id})
+
+    async def events() -> AsyncIterator[str]:
+        yield sse_event("start", {"request_id": request_id, "use_case": task_key, "backend": llm.name})
+        stream = llm.astream(**completion_args)
+        parser = IncrementalJSONParser() if params["structured"] else None
+        titles = {s.key: s.title(params["language"]) for s in SECTION_SCHEMAS.get(task_key, [])}
+        restorer = redaction.stream_restorer(json_escape=params["structured"])
+        pending, last_flush = [], 0.0
+        try:
+            async for delta in stream:
+                delta = restorer.feed(delta)
+                if not delta:
+                    continue
+                if parser is not None:
+                    for key, value in parser.feed(delta):
+                        yield sse_event("section", {"key": key, "title": titles.get(key, key), "value": value})
+                pending.append(delta)
+                now = time.monotonic()
+                # First token goes out at once; after that, coalesce to cut per-event overhead
+                if now - last_flush >= STREAM_FLUSH_S:
+                    yield sse_event("token", {"text": "".join(pending)})
+                    pending, last_flush = [], now
+            tail = restorer.flush()
+            if tail:
+                pending.append(tail)
+                if parser is not None:
+                    for key, value in parser.feed(tail):
+                        yield sse_event("section", {"key": key, "title": titles.get(key, key), "value": value})
+            if pending:
+                yield sse_event("token", {"text": "".join(pending)})
+        except asyncio.CancelledError:
+            # Client disconnected: release the reservation and mark the request failed
+            await finish(None, ConnectionAbortedError("client disconnected"))
+            raise
+        except Exception as e:
+            await finish(None, e)
+            status, code = classify_error(e)
+            yield sse_event("error", {"request_id": request_id, "code": code, "status": status})
+            return
+        metadata = await finish(stream.response)
+        if parser is not None:
+            structured = structured_fields(redaction.restore(stream.response.content, json_escape=True))
+            metadata.update(sections=structured["sections"], missing_sections=structured["missing_sections"])
+        if params["assembled"]:
+            metadata.update(assembled_fields(redaction.restore(stream.response.content)))
+        yield sse_event("done", metadata)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "X-Request-ID": request_id,
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",      # Disable response buffering in nginx ingress
+    })
+
+async def local_answer(request_id: str, task_key: str, params: Dict, output: str, answered_from: str,
+                       details: Dict, wants_stream: bool):
+    """Response answered from a reviewed table (mapping, known errors): same shape as a generated one, no LLM call."""
+    metadata = {
+        "request_id": request_id,
+        "use_case": task_key,
+        "vendor": params["vendor"],
+        "answered_from": answered_from,
+        **details,
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        "timestamp": datetime.now().isoformat(),
+    }
+    await bookkeeping("Job record", get_resources().store.put_job, request_id, {
+        "status": "done", "task_key": task_key, "answered_from": answered_from,
+        "started": metadata["timestamp"], "source": "api"})
+    if not wants_stream:
+        return JSONResponse({"request_id": request_id, "output": output, "metadata": metadata},
+                            headers={"X-Request-ID": request_id})
+
+    async def events() -> AsyncIterator[str]:
+        yield sse_event("start", {"request_id": request_id, "use_case": task_key, "backend": None})
+        yield sse_event("token", {"text": output})
+        yield sse_event("done", metadata)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"X-Request-ID": request_id, "Cache-Control": "no-cache"})
+
+# ============================
+# Application
+# ============================
+
+app = Starlette(routes=[
+    Route("/healthz", healthz),
+    Route("/v1/use-cases", list_use_cases),
+    Route("/v1/use-cases/{slug}", generate, methods=["POST"]),
+    Route("/v1/requests/{request_id}", get_request_status),
+    Route("/v1/mappings", list_mappings),
+    Route("/v1/mappings/equivalent", get_equivalent),
+    Route("/v1/known-errors", list_known_errors),
+    Route("/v1/lanes", list_lanes),
+    Route("/v1/commands", list_commands),
+])
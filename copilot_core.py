@@ -0,0 +1,328 @@
+"""
+Core prompts, use cases and input rules of the Storage Engineering AI Assistant.
+
+Shared by the Streamlit app and the REST API, so this module must not import Streamlit.
+"""
+
+import hashlib
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Constants
+MAX_INPUT_LENGTH = 5000
+MAX_OUTPUT_TOKENS = 1500         # Reduced default for output tokens (practical balance)
+MODEL_VERSION = "gpt-4o-mini"  
+TRANSLATION_MODEL = "gpt-4.1-nano"   # Smaller/cheaper model used only for EN -> DE translation of cached results
+SUMMARY_MODEL = "gpt-4.1-nano"       # Rolling summaries of older follow-up turns
+
+VENDORS = ["NetApp ONTAP", "Pure FlashArray", "Dell EMC PowerMax"]
+
+# ============================
+# 12 Use cases : (English display, German display). 
+# English key for prompt lookup, same applies for other langauages es, fr, ja or zh
+# ============================
+USE_CASES = [
+    ("Explain Issue and Error", "Explain Issue and Error", "Problem/Fehler erklären"),
+    ("Generate Runbook", "Generate Runbook", "Runbook generieren"),
+    ("Generate Incident RCA", "Generate Incident RCA", "Incident RCA generieren"),
+    ("Capacity Planning", "Capacity Planning", "Kapazitätsplanung"),
+    ("Performance Analysis", "Performance Analysis", "Performance-Analyse"),
+    ("DR Test Planning", "DR Test Planning", "DR-Testplanung"),
+    ("Storage Migration", "Storage Migration", "Storage-Migration"),
+    ("Generate Ansible Playbook", "Generate Ansible Playbook", "Ansible Playbook generieren"),
+    ("Generate Change Request Documentation", "Generate Change Request Documentation", "Change Request Dokumentation generieren"),
+    ("Storage Compliance & Audit Evidence", "Storage Compliance & Audit Evidence", "Storage Compliance & Audit-Nachweise"),
+    ("Cross-Vendor Migration", "Cross-Vendor Migration Plan", "Herstellerübergreifende Migration"),
+    ("Decommissioning & Data Retirement Procedure", "Decommissioning Procedure", "Decommissioning & Datenrückgabe Prozedur"),
+]
+
+# ============================
+# Global System Prompt 
+# ============================
+
+SYSTEM_PROMPT = """
+You are a Senior Storage Engineer & Architect with 20+ years of experience in large-scale, highly regulated banking environments (European global systemically important bank - G-SIB).
+You have deep expertise in NetApp ONTAP, Pure Storage FlashArray//X, Dell EMC PowerMax and storage-related automation (Ansible).
+
+Your responses must be:
+- Precise, professional and audit-ready
+- Always consider banking regulatory requirements (DORA, BaFin, ECB, MaRisk, GDPR, 4-eyes principle, strict change management, traceability)
+- Use formal technical language suitable for L3 engineers, architects and auditors
+- Provide step-by-step clarity when giving procedures
+- Include risk considerations, rollback options and validation steps where appropriate
+- Always respond in {response_language}
+"""
+
+# ============================
+# Translation Prompt (cached English result -> German)
+# ============================
+
+TRANSLATION_SYSTEM_PROMPT = """
+You are a professional technical translator for storage engineering documentation in a European bank.
+Translate the user's text from English into German.
+
+Rules:
+- Keep the Markdown structure (headings, lists, tables, emphasis) exactly as it is
+- Keep placeholders of the form [[CODE_n]] unchanged and in place; they contain commands and YAML
+- Do not translate vendor product names, CLI commands, parameters, regulatory acronyms (DORA, BaFin, ECB, MaRisk, GDPR) or CR placeholders
+- Do not add, remove or summarize content; output the translation only
+"""
+
+# Appended to a use case prompt when knowledge base passages were found
+GROUNDING_TEMPLATE = """
+
+Reference material from the internal knowledge base (vendor documentation, KB articles, approved runbooks):
+{context}
+
+Prefer the command syntax and regulatory references from the reference material where it applies and cite it as [n].
+"""
+
+# Appended to RCA / issue prompts when the user opts in to similar past incidents
+INCIDENT_CONTEXT_TEMPLATE = """
+
+Similar past incidents from our own history (for reference only; verify that they apply):
+{context}
+"""
+
+# Appended to migration prompts: rows of the reviewed cross-vendor mapping table the details mention
+MAPPING_CONTEXT_TEMPLATE = """
+
+Cross-vendor equivalents from our reviewed mapping table (v{version}); use these object names, commands and Ansible modules:
+{context}
+"""
+
+KNOWN_ERROR_CONTEXT_TEMPLATE = """
+
+Known errors identified in the input, with the approved explanation from our known-error database (v{version}); build on these and explain the rest of the input:
+{context}
+"""
+
+# ============================
+# Prompt Templates (keys = English internal name in use_cases)
+# ============================
+PROMPT_TEMPLATES = {
+    "Explain Issue and Error": """
+Explain the following issue clearly for {vendor}.
+
+Include:
+- What happened (symptoms and timeline)
+- Likely root cause(s)
+- Immediate remediation steps
+- Preventive best practices
+- Validation checks after remediation
+
+Issue details:
+{user_input}
+""",
+
+    "Generate Runbook": """
+Create a detailed engineering runbook for the following task on {vendor}.
+
+Include:
+- Purpose and scope
+- Preconditions and assumptions
+- Step-by-step execution procedure
+- Validation and success checks
+- Rollback and recovery steps
+- Risks and mitigation measures
+Task:
+{user_input}
+""",
+
+    "Generate Incident RCA": """
+Generate a professional incident Root Cause Analysis for {vendor}.
+Include:
+- Incident summary
+- Timeline of events
+- Technical root cause
+- Business and technical impact
+- Corrective actions taken
+- Preventive actions and long-term improvements
+- Lessons learned
+Incident details:
+{user_input}
+""",
+
+    "Capacity Planning": """
+Perform capacity planning analysis for {vendor}.
+Include: 
+- Current capacity usage and utilization trends
+- Growth assumptions and projections
+- Performance and tiering considerations
+- Capacity thresholds and risk points
+- Procurement and expansion timeline
+- High-level cost estimation
+Requirements:
+{user_input}
+""",
+
+    "Performance Analysis": """
+Analyze performance issues on {vendor}.
+Include: 
+- Observed symptoms and affected workloads
+- Key performance metrics to review
+- Likely bottlenecks and constraints
+- Recommended tuning and configuration changes
+- Monitoring and alerting improvements
+- Validation steps after optimization
+Performance data:
+{user_input}
+""",
+
+    "DR Test Planning": """
+Create a Disaster Recovery test plan for {vendor}.
+Include: 
+- Test objectives and success criteria
+- Scope and systems included
+- Detailed test procedures
+- Roles and responsibilities
+- Rollback and failback steps
+- Evidence and documentation requirements
+DR environment:
+{user_input}
+""",
+
+    "Storage Migration": """
+Create a storage migration plan for {vendor} within the same vendor or platform family.
+Include: 
+- Migration scope and objectives
+- Pre-migration checks and prerequisites
+- Migration strategy and approach
+- Step-by-step migration procedure
+- Data validation and consistency checks
+- Post-migration activities
+- Risks, mitigations, and rollback strategy
+Migration details:
+{user_input}
+""",
+
+    "Generate Ansible Playbook": """
+Generate a production-ready Ansible playbook for {vendor}.
+Include:
+- Variables and inputs required
+- Clearly named and structured tasks
+- Idempotent logic and error handling
+- Use of appropriate vendor modules
+- Comments explaining critical steps
+
+Constraints:
+- Follow Ansible best practices
+- Do not include explanatory text outside YAML
+
+User requirement:
+{user_input}
+
+Output:
+- YAML playbook only
+""",
+
+    "Generate Change Request Documentation": """
+Create a professional, audit-ready Change Request (CR) document section for {vendor}.
+Include:
+- Change title and CR reference placeholder
+- Business and technical justification
+- Risk assessment and mitigation
+- Detailed implementation steps
+- Backout and recovery plan
+- Impacted systems and outage window
+- Required approvals (CAB, 4-eyes principle)
+- Post-implementation validation steps
+Change description:
+{user_input}
+""",
+
+    "Storage Compliance & Audit Evidence": """
+Act as a storage compliance specialist in a European global bank.
+Generate audit-compliant documentation/explanation for the following storage-related audit topic on {vendor}.
+Include:
+- Relevant regulatory references (DORA, BaFin, ECB, GDPR)
+- Current configuration/status explanation
+- Evidence collection steps (commands/reports)
+- Gap analysis (if any)
+- Remediation recommendations
+Audit question or topic:
+{user_input}
+""",
+
+    "Cross-Vendor Migration": """
+Create a detailed cross-vendor storage migration plan from current {vendor} to a different platform (NetApp ONTAP / Pure FlashArray / PowerMax).
+- Current-state assessment and constraints
+- Target platform recommendation and justification
+- Compatibility and interoperability considerations
+- Chosen migration strategy (host-based, replication, tools, etc.)
+- High-level step-by-step migration workflow
+- Data validation and cutover approach
+- Rollback and fallback strategy
+- Timeline, effort estimation, and risks
+
+Migration context:
+{user_input}
+""",
+
+    "Decommissioning & Data Retirement Procedure": """
+Create a secure, compliant decommissioning and data retirement procedure for {vendor} in a banking environment.
+
+Include:
+- Scope and assets involved
+- Pre-decommissioning checks
+- Data sanitization method and standards
+- Validation and evidence for auditors
+- Documentation and sign-off requirements
+- Stakeholder notification steps
+
+Decommissioning scope:
+{user_input}
+"""
+}
+
+# ============================
+# Helper Functions
+# ============================
+
+def get_displayed_use_cases(language: str) -> list:
+    idx = 1 if language == "English" else 2
+    return [case[idx] for case in USE_CASES]
+
+def get_task_key_from_display(display_name: str, language: str) -> Optional[str]:
+    for key, en, de in USE_CASES:
+        if (language == "English" and display_name == en) or (language == "German / Deutsch" and display_name == de):
+            return key
+    return None
+
+def validate_input(user_input: str) -> Tuple[bool, Optional[str]]:
+    if not user_input.strip():
+        return False, "empty"
+    if len(user_input) > MAX_INPUT_LENGTH:
+        return False, "too_long"
+    return True, None
+
+def get_response_language(language: str) -> str:
+    return "German" if language == "German / Deutsch" else "English"
+
+def build_system_prompt(language: str) -> str:
+    return SYSTEM_PROMPT.format(response_language=get_response_language(language))
+
+def build_prompt(task_key: str, vendor: str, user_input: str) -> str:
+    return PROMPT_TEMPLATES[task_key].format(vendor=vendor, user_input=user_input)
+
+def include_items(template: str) -> List[str]:
+    """The bullet items of the template's first list (its "Include:" list)."""
+    items: List[str] = []
+    for line in template.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("- "):
+            items.append(stripped[2:].strip())
+        elif items:
+            break
+    return items
+
+def template_version(task_key: Optional[str]) -> Optional[str]:
+    """Short content hash of the use case prompt template (audit records: which template produced an output)."""
+    template = PROMPT_TEMPLATES.get(task_key or "")
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12] if template else None
+
+def use_case_slug(task_key: str) -> str:
+    """URL-safe use case name: 'Generate Incident RCA' -> 'generate-incident-rca'."""
+    return re.sub(r"[^a-z0-9]+", "-", task_key.lower()).strip("-")
+
+USE_CASE_SLUGS: Dict[str, str] = {use_case_slug(key): key for key, _, _ in USE_CASES}
@@ -0,0 +1,414 @@
+"""
+Hybrid document assembly for the boilerplate-heavy use cases.
+
+A large part of every change request, compliance evidence pack and decommissioning
+procedure is fixed bank wording: approval tables (CAB, 4-eyes), regulatory reference
+lists (DORA, BaFin / MaRisk, ECB, GDPR), evidence checklists and sign-off blocks.
+Generating it token by token costs output tokens and latency on every call, and the
+wording drifts from document to document. Each use case has a skeleton instead:
+
+  - static parts are rendered locally from the approved templates below, in English or
+    German, with parameters (vendor, date, vendor audit / inventory commands);
+  - generated parts are the case-specific sections; the model is asked for those only,
+    each under a level-2 heading in skeleton order (`assembly_prompt`).
+
+`assemble` slots the model's sections into the skeleton and numbers the whole document,
+so the output looks like a single-request result. `skeleton_version` is a content hash
+of a skeleton (audit: which wording a document was assembled with).
+
+This module has no Streamlit dependency.
+"""
+
+import hashlib
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from markdown_sections import Section, normalize_heading, split_sections
+
+ASSEMBLY_TEMPLATE = """
+
+ASSEMBLY MODE:
+The following sections are inserted afterwards from the bank's approved templates; do NOT write them
+and do not repeat their content: {static}.
+Write ONLY these sections, in this order, each starting with its level-2 heading (translated into the
+response language, without numbers):
+{generated}
+No document title, no introduction or closing remarks.
+"""
+
+MISSING_NOTE = {
+    "English": "_⚠️ This section was not generated. Please try again._",
+    "German": "_⚠️ Dieser Abschnitt wurde nicht generiert. Bitte erneut versuchen._",
+}
+FOOTER = {
+    "English": "_Sections {numbers} are inserted from the approved templates (skeleton {version}, {date})._",
+    "German": "_Die Abschnitte {numbers} stammen aus den freigegebenen Vorlagen (Skelett {version}, {date})._",
+}
+
+# Vendor commands named in the static checklists
+AUDIT_LOG_COMMANDS = {
+    "NetApp ONTAP": "security audit log show",
+    "Pure FlashArray": "puremessage list --audit",
+    "Dell EMC PowerMax": "symaudit list -sid <SID>",
+}
+INVENTORY_COMMANDS = {
+    "NetApp ONTAP": "storage disk show -fields serial-number",
+    "Pure FlashArray": "purehw list; puredrive list",
+    "Dell EMC PowerMax": "symcfg list -sid <SID> -v; symdisk list -sid <SID>",
+}
+
+# ============================
+# Skeletons
+# ============================
+
+@dataclass(frozen=True)
+class Part:
+    title_en: str
+    title_de: str
+    instruction: str = ""      # Generated parts: content guidance for the model
+    text_en: str = ""          # Static parts: approved wording, str.format parameters
+    text_de: str = ""
+
+    @property
+    def static(self) -> bool:
+        return bool(self.text_en)
+
+    def title(self, language: str = "English") -> str:
+        return self.title_de if language.startswith("German") else self.title_en
+
+    def render(self, language: str, params: Dict[str, str]) -> str:
+        return (self.text_de if language.startswith("German") else self.text_en).strip().format(**params)
+
+
+CR_APPROVALS = Part(
+    "Required Approvals", "Erforderliche Genehmigungen",
+    text_en="""
+| Role | Responsibility | Name | Decision | Date |
+|---|---|---|---|---|
+| Change Requester | Raises the change and owns this document | [Name] | - | [Date] |
+| Technical Reviewer (4-eyes) | Independent review of implementation and backout steps | [Name] | Approved / Rejected | [Date] |
+| Service / Application Owner | Accepts the service impact and the outage window | [Name] | Approved / Rejected | [Date] |
+| Information Security | Confirms that security controls are not weakened (if applicable) | [Name] | Approved / Rejected / n.a. | [Date] |
+| Change Advisory Board (CAB) | Authorises the change for the planned window | [CAB reference] | Approved / Rejected | [Date] |
+
+- The implementer and the 4-eyes reviewer must be different persons.
+- No implementation before all approvals above are recorded in the change ticket.
+- Emergency changes are approved by the Emergency CAB and reviewed at the next regular CAB.
+""",
+    text_de="""
+| Rolle | Verantwortung | Name | Entscheidung | Datum |
+|---|---|---|---|---|
+| Change Requester | Stellt den Change und verantwortet dieses Dokument | [Name] | - | [Datum] |
+| Technischer Reviewer (4-Augen) | Unabhängige Prüfung der Umsetzungs- und Backout-Schritte | [Name] | Genehmigt / Abgelehnt | [Datum] |
+| Service- / Applikationsverantwortlicher | Akzeptiert die Service-Auswirkung und das Ausfallfenster | [Name] | Genehmigt / Abgelehnt | [Datum] |
+| Informationssicherheit | Bestätigt, dass Sicherheitskontrollen nicht geschwächt werden (falls zutreffend) | [Name] | Genehmigt / Abgelehnt / n. z. | [Datum] |
+| Change Advisory Board (CAB) | Gibt den Change für das geplante Fenster frei | [CAB-Referenz] | Genehmigt / Abgelehnt | [Datum] |
+
+- Umsetzender und 4-Augen-Reviewer müssen verschiedene Personen sein.
+- Keine Umsetzung, bevor alle obigen Genehmigungen im Change-Ticket dokumentiert sind.
+- Emergency Changes werden vom Emergency CAB genehmigt und im nächsten regulären CAB nachbetrachtet.
+""")
+
+CR_REGULATORY = Part(
+    "Regulatory References", "Regulatorische Referenzen",
+    text_en="""
+- DORA (Regulation (EU) 2022/2554), Art. 9(4)(e): documented ICT change management policies, procedures and controls
+- EBA Guidelines on ICT and security risk management (EBA/GL/2019/04), section 3.6.3: ICT change management
+- BaFin MaRisk AT 7.2: testing and approval of changes to IT systems before production use
+- ECB Banking Supervision: supervisory expectations on ICT risk management (SREP)
+- GDPR Art. 32: security of processing, where systems holding personal data are affected
+""",
+    text_de="""
+- DORA (Verordnung (EU) 2022/2554), Art. 9 Abs. 4 lit. e: dokumentierte Richtlinien, Verfahren und Kontrollen für das IKT-Änderungsmanagement
+- EBA-Leitlinien für das Management von IKT- und Sicherheitsrisiken (EBA/GL/2019/04), Abschnitt 3.6.3: IKT-Änderungsmanagement
+- BaFin MaRisk AT 7.2: Test und Abnahme von Änderungen an IT-Systemen vor der produktiven Nutzung
+- EZB-Bankenaufsicht: aufsichtliche Erwartungen an das IKT-Risikomanagement (SREP)
+- DSGVO Art. 32: Sicherheit der Verarbeitung, sofern Systeme mit personenbezogenen Daten betroffen sind
+""")
+
+COMPLIANCE_REGULATORY = Part(
+    "Regulatory References", "Regulatorische Referenzen",
+    text_en="""
+- DORA (Regulation (EU) 2022/2554), Art. 6: ICT risk management framework; Art. 9: protection and prevention; Art. 12: backup policies, restoration and recovery
+- EBA Guidelines on ICT and security risk management (EBA/GL/2019/04)
+- BaFin MaRisk AT 7.2 (technical-organisational resources) and AT 7.3 (emergency management)
+- ECB Banking Supervision: supervisory expectations on ICT risk management (SREP)
+- GDPR Art. 5(1)(f): integrity and confidentiality; Art. 32: security of processing
+""",
+    text_de="""
+- DORA (Verordnung (EU) 2022/2554), Art. 6: IKT-Risikomanagementrahmen; Art. 9: Schutz und Prävention; Art. 12: Datensicherung, Wiederherstellung
+- EBA-Leitlinien für das Management von IKT- und Sicherheitsrisiken (EBA/GL/2019/04)
+- BaFin MaRisk AT 7.2 (technisch-organisatorische Ausstattung) und AT 7.3 (Notfallmanagement)
+- EZB-Bankenaufsicht: aufsichtliche Erwartungen an das IKT-Risikomanagement (SREP)
+- DSGVO Art. 5 Abs. 1 lit. f: Integrität und Vertraulichkeit; Art. 32: Sicherheit der Verarbeitung
+""")
+
+COMPLIANCE_EVIDENCE = Part(
+    "Evidence Requirements", "Anforderungen an Nachweise",
+    text_en="""
+- [ ] Every evidence item names the system, the command or report and a UTC timestamp
+- [ ] Raw command and report outputs are exported unaltered; screenshots only as a supplement
+- [ ] The {vendor} audit log for the review period is exported: `{audit_log_command}`
+- [ ] A SHA-256 checksum of every export is recorded in the evidence register
+- [ ] Evidence is collected by one person and reviewed by a second (4-eyes)
+- [ ] Evidence is filed in the audit evidence repository and retained according to the records retention policy
+""",
+    text_de="""
+- [ ] Jeder Nachweis nennt das System, den Befehl bzw. Report und einen UTC-Zeitstempel
+- [ ] Befehls- und Report-Ausgaben werden unverändert exportiert; Screenshots nur ergänzend
+- [ ] Das {vendor}-Audit-Log für den Prüfzeitraum wird exportiert: `{audit_log_command}`
+- [ ] Für jeden Export wird eine SHA-256-Prüfsumme im Nachweisregister erfasst
+- [ ] Nachweise werden von einer Person erhoben und von einer zweiten geprüft (4-Augen)
+- [ ] Nachweise werden in der Audit-Nachweisablage gespeichert und gemäß der Aufbewahrungsrichtlinie aufbewahrt
+""")
+
+COMPLIANCE_SIGN_OFF = Part(
+    "Review and Sign-off", "Prüfung und Freigabe",
+    text_en="""
+| Role | Name | Signature | Date |
+|---|---|---|---|
+| Prepared by (Storage Engineering) | [Name] | | [Date] |
+| Reviewed by (4-eyes) | [Name] | | [Date] |
+| Accepted by (Compliance / Internal Audit liaison) | [Name] | | [Date] |
+""",
+    text_de="""
+| Rolle | Name | Unterschrift | Datum |
+|---|---|---|---|
+| Erstellt von (Storage Engineering) | [Name] | | [Datum] |
+| Geprüft von (4-Augen) | [Name] | | [Datum] |
+| Abgenommen von (Compliance / Ansprechpartner Interne Revision) | [Name] | | [Datum] |
+""")
+
+DECOMMISSIONING_EVIDENCE = Part(
+    "Evidence Checklist", "Nachweis-Checkliste",
+    text_en="""
+- [ ] Certificate of sanitization per NIST SP 800-88 Rev. 1 (method, tool, serial numbers, date, operator, verifier)
+- [ ] Array, controller and drive serial numbers recorded before removal: `{inventory_command}`
+- [ ] Records Management confirms that no data under legal hold or within its retention period remains
+- [ ] Certificate of destruction and chain of custody from the disposal vendor for physically destroyed media
+- [ ] CMDB and asset register set to "retired"; monitoring, backup and replication jobs removed
+- [ ] Evidence reviewed by a second person (4-eyes) and filed in the audit evidence repository
+""",
+    text_de="""
+- [ ] Löschzertifikat nach NIST SP 800-88 Rev. 1 (Methode, Werkzeug, Seriennummern, Datum, Durchführender, Prüfer)
+- [ ] Seriennummern von Array, Controllern und Laufwerken vor dem Ausbau erfasst: `{inventory_command}`
+- [ ] Records Management bestätigt, dass keine Daten unter Legal Hold oder innerhalb der Aufbewahrungsfrist verbleiben
+- [ ] Vernichtungszertifikat und Chain of Custody des Entsorgungsdienstleisters für physisch vernichtete Medien
+- [ ] CMDB und Anlagenverzeichnis auf „außer Betrieb" gesetzt; Monitoring-, Backup- und Replikationsjobs entfernt
+- [ ] Nachweise von einer zweiten Person geprüft (4-Augen) und in der Audit-Nachweisablage abgelegt
+""")
+
+DECOMMISSIONING_REGULATORY = Part(
+    "Regulatory References", "Regulatorische Referenzen",
+    text_en="""
+- GDPR Art. 5(1)(e): storage limitation; Art. 17: right to erasure; Art. 32: security of processing
+- HGB §257 and AO §147: statutory retention periods, checked before any data is deleted
+- DORA (Regulation (EU) 2022/2554), Art. 9: protection of ICT assets throughout their lifecycle
+- BaFin MaRisk AT 7.2: technical-organisational resources, including their secure retirement
+- BSI IT-Grundschutz CON.6 (deletion and destruction); NIST SP 800-88 Rev. 1 and ISO/IEC 27040 (media sanitization)
+""",
+    text_de="""
+- DSGVO Art. 5 Abs. 1 lit. e: Speicherbegrenzung; Art. 17: Recht auf Löschung; Art. 32: Sicherheit der Verarbeitung
+- HGB §257 und AO §147: gesetzliche Aufbewahrungsfristen, vor jeder Löschung geprüft
+- DORA (Verordnung (EU) 2022/2554), Art. 9: Schutz der IKT-Assets über ihren gesamten Lebenszyklus
+- BaFin MaRisk AT 7.2: technisch-organisatorische Ausstattung einschließlich ihrer sicheren Außerbetriebnahme
+- BSI IT-Grundschutz CON.6 (Löschen und Vernichten); NIST SP 800-88 Rev. 1 und ISO/IEC 27040 (Datenträgerbereinigung)
+""")
+
+DECOMMISSIONING_SIGN_OFF = Part(
+    "Documentation and Sign-off", "Dokumentation und Freigabe",
+    text_en="""
+| Role | Confirms | Name | Signature | Date |
+|---|---|---|---|---|
+| Storage Engineer (executing) | Sanitization performed as documented | [Name] | | [Date] |
+| Verifier (4-eyes) | Sanitization and evidence verified | [Name] | | [Date] |
+| Data Owner | Data no longer required, retention checked | [Name] | | [Date] |
+| Information Security | Method meets the data classification | [Name] | | [Date] |
+| Asset Management | CMDB and asset register updated | [Name] | | [Date] |
+""",
+    text_de="""
+| Rolle | Bestätigt | Name | Unterschrift | Datum |
+|---|---|---|---|---|
+| Storage Engineer (durchführend) | Löschung wie dokumentiert durchgeführt | [Name] | | [Datum] |
+| Prüfer (4-Augen) | Löschung und Nachweise geprüft | [Name] | | [Datum] |
+| Dateneigentümer | Daten nicht mehr benötigt, Aufbewahrung geprüft | [Name] | | [Datum] |
+| Informationssicherheit | Methode entspricht der Datenklassifizierung | [Name] | | [Datum] |
+| Asset Management | CMDB und Anlagenverzeichnis aktualisiert | [Name] | | [Datum] |
+""")
+
+SIGN_OFF = Part(
+    "Sign-off", "Freigabe",
+    text_en="""
+| Role | Name | Signature | Date |
+|---|---|---|---|
+| Implementer | [Name] | | [Date] |
+| Technical Reviewer (4-eyes) | [Name] | | [Date] |
+| Change Manager (closure) | [Name] | | [Date] |
+""",
+    text_de="""
+| Rolle | Name | Unterschrift | Datum |
+|---|---|---|---|
+| Umsetzender | [Name] | | [Datum] |
+| Technischer Reviewer (4-Augen) | [Name] | | [Datum] |
+| Change Manager (Abschluss) | [Name] | | [Datum] |
+""")
+
+SKELETONS: Dict[str, List[Part]] = {
+    "Generate Change Request Documentation": [
+        Part("Change Title and Reference", "Change-Titel und Referenz",
+             "One line: the change title, then the CR reference placeholder CHG-XXXXXXX."),
+        Part("Business and Technical Justification", "Fachliche und technische Begründung", "2-4 sentences."),
+        Part("Risk Assessment and Mitigation", "Risikobewertung und Maßnahmen",
+             "One risk per bullet with its likelihood, impact and mitigation."),
+        Part("Implementation Steps", "Implementierungsschritte",
+             "Numbered steps, vendor CLI commands in backticks."),
+        Part("Backout and Recovery Plan", "Backout- und Wiederherstellungsplan",
+             "The trigger for backing out, then numbered backout steps."),
+        Part("Impacted Systems and Outage Window", "Betroffene Systeme und Ausfallfenster",
+             "Affected systems, services and the expected outage window."),
+        CR_APPROVALS,
+        Part("Post-Implementation Validation", "Validierung nach der Umsetzung",
+             "Numbered verification checks with the commands to run."),
+        CR_REGULATORY,
+        SIGN_OFF,
+    ],
+    "Storage Compliance & Audit Evidence": [
+        COMPLIANCE_REGULATORY,
+        Part("Current Configuration and Status", "Aktuelle Konfiguration und Status",
+             "How the audit topic is configured and operated today on the platform."),
+        Part("Evidence Collection Steps", "Schritte zur Nachweiserhebung",
+             "Numbered steps with the vendor commands / reports that produce the evidence for this topic."),
+        COMPLIANCE_EVIDENCE,
+        Part("Gap Analysis", "Gap-Analyse", "Gaps against the regulatory requirements, one per bullet, or none."),
+        Part("Remediation Recommendations", "Empfehlungen zur Behebung",
+             "One recommendation per bullet with priority and owner placeholder."),
+        COMPLIANCE_SIGN_OFF,
+    ],
+    "Decommissioning & Data Retirement Procedure": [
+        Part("Scope and Assets", "Umfang und Assets", "Systems, arrays and data sets to retire."),
+        Part("Pre-Decommissioning Checks", "Prüfungen vor der Stilllegung",
+             "Dependencies, host mappings, replication, backups and retention holds; one check per bullet."),
+        Part("Data Sanitization Method", "Datenbereinigungsmethode",
+             "Method and standard (NIST 800-88 clear / purge / destroy) with the vendor commands."),
+        Part("Validation and Evidence", "Validierung und Nachweise",
+             "How the sanitization is verified on this platform, with commands."),
+        DECOMMISSIONING_EVIDENCE,
+        DECOMMISSIONING_REGULATORY,
+        DECOMMISSIONING_SIGN_OFF,
+        Part("Stakeholder Notification", "Benachrichtigung der Stakeholder",
+             "Who is informed and when, one per bullet."),
+    ],
+}
+
+
+def supports_assembly(task_key: Optional[str]) -> bool:
+    return task_key in SKELETONS
+
+
+def skeleton_version(task_key: str) -> str:
+    """Short content hash of a skeleton's titles and approved wording."""
+    parts = SKELETONS[task_key]
+    text = "\n".join(f"{p.title_en}|{p.title_de}|{p.instruction}|{p.text_en}|{p.text_de}" for p in parts)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+
+def template_params(vendor: str, today: Optional[date] = None) -> Dict[str, str]:
+    return {
+        "vendor": vendor,
+        "date": (today or date.today()).isoformat(),
+        "audit_log_command": AUDIT_LOG_COMMANDS.get(vendor, "<audit log export>"),
+        "inventory_command": INVENTORY_COMMANDS.get(vendor, "<hardware inventory>"),
+    }
+
+# ============================
+# Prompt
+# ============================
+
+def assembly_prompt(prompt: str, task_key: str) -> str:
+    """The full use case prompt (with any reference material), asking for the generated parts only."""
+    parts = SKELETONS[task_key]
+    static = ", ".join(f'"{p.title_en}"' for p in parts if p.static)
+    generated = "\n".join(f"## {p.title_en} - {p.instruction}" for p in parts if not p.static)
+    return prompt + ASSEMBLY_TEMPLATE.format(static=static, generated=generated)
+
+# ============================
+# Assembly
+# ============================
+
+@dataclass
+class AssembledDocument:
+    text: str
+    static: List[str]          # Titles of the parts rendered from templates
+    generated: List[str]       # Titles of the parts the model wrote
+    missing: List[str]         # Generated parts the model did not deliver
+    static_chars: int
+    version: str
+
+
+def _top_sections(text: str) -> Tuple[str, List[Section]]:
+    """Preamble and the top-level sections; deeper headings stay in their parent's body."""
+    sections = split_sections(text)
+    preamble = sections.pop(0).body if sections and not sections[0].heading else ""
+    if not sections:
+        return preamble, []
+    top = min(s.level for s in sections)
+    merged: List[Section] = []
+    for section in sections:
+        if section.level == top or not merged:
+            merged.append(Section(section.heading, section.level, section.body))
+        else:
+            parent = merged[-1]
+            parent.body = f"{parent.body}\n\n{section.render()}".strip("\n")
+    return preamble, merged
+
+
+def _match(parts: List[Part], sections: List[Section]) -> List[Optional[Section]]:
+    """The model's section for every generated part: by title (English or German), else by position."""
+    found: List[Optional[Section]] = []
+    for part in parts:
+        keys = {normalize_heading(part.title_en), normalize_heading(part.title_de)}
+        # Exact title, or a title the model lengthened ("Risk Assessment and Mitigation Measures")
+        found.append(next((s for s in sections if s.key in keys), None)
+                     or next((s for s in sections if any(s.key.startswith(key) for key in keys)), None))
+    if not all(found) and len(sections) == len(parts):
+        # Rephrased headings: the order still tells which section is which
+        return list(sections)
+    return found
+
+
+def assemble(task_key: str, generated: str, vendor: str, language: str = "English",
+             today: Optional[date] = None) -> AssembledDocument:
+    """Static parts rendered locally plus the model's sections, numbered in skeleton order."""
+    parts = SKELETONS[task_key]
+    language = "German" if language.startswith("German") else "English"
+    params = template_params(vendor, today)
+    preamble, sections = _top_sections(generated or "")
+    generated_parts = [p for p in parts if not p.static]
+    matched = dict(zip(map(id, generated_parts), _match(generated_parts, sections)))
+
+    rendered, static, written, missing, static_numbers = [], [], [], [], []
+    static_chars = 0
+    for number, part in enumerate(parts, start=1):
+        title = part.title(language)
+        if part.static:
+            body = part.render(language, params)
+            static.append(part.title_en)
+            static_numbers.append(str(number))
+            static_chars += len(body)
+        else:
+            section = matched[id(part)]
+            body = section.body.strip() if section is not None else ""
+            if not written and preamble.strip():
+                # Text the model wrote before its first heading belongs to the first section
+                body = f"{preamble.strip()}\n\n{body}".strip()
+            if body:
+                written.append(part.title_en)
+            else:
+                missing.append(part.title_en)
+                body = MISSING_NOTE[language]
+        rendered.append(f"## {number}. {title}\n\n{body}")
+    version = skeleton_version(task_key)
+    rendered.append(FOOTER[language].format(numbers=", ".join(static_numbers), version=version,
+                                            date=params["date"]))
+    return AssembledDocument("\n\n".join(rendered).strip() + "\n", static, written, missing, static_chars, version)
@@ -1,7 +1,68 @@
 import streamlit as st
-from openai import OpenAI
 from datetime import datetime
-from typing import Optional, Dict, List, Tuple
+from typing import Any, Callable, Optional, Dict, List, Tuple
+import gc
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from audit_log import AuditLog, audit_from_settings, sha256_text
+from completion_budget import CompletionBudgets, budgets_from_settings
+from continuation import MAX_CONTINUATIONS, continuation_prompt, join_continuation, merge_usage
+from conversation import SUMMARY_SYSTEM_PROMPT, Conversation
+from document_assembly import assemble, assembly_prompt, supports_assembly
+from command_library import COMMAND_LIBRARY_PATH, CommandLibrary
+from copilot_core import (
+    GROUNDING_TEMPLATE, INCIDENT_CONTEXT_TEMPLATE, KNOWN_ERROR_CONTEXT_TEMPLATE, MAPPING_CONTEXT_TEMPLATE,
+    MAX_INPUT_LENGTH, MAX_OUTPUT_TOKENS, MODEL_VERSION, PROMPT_TEMPLATES, SUMMARY_MODEL, TRANSLATION_MODEL,
+    TRANSLATION_SYSTEM_PROMPT, USE_CASES, VENDORS, build_prompt, build_system_prompt, get_displayed_use_cases,
+    get_task_key_from_display, template_version, validate_input
+)
+from incremental_regeneration import (
+    RegenerationPlan, document_diff, join_units, merge_regeneration_metadata, plan_regeneration, regenerated_unit,
+    regeneration_prompt
+)
+from incident_index import INCIDENT_INDEX_PATH, INCIDENT_USE_CASES, IncidentIndex, format_incident_context
+from bottleneck_classifier import digest_input, looks_like_metrics
+from known_errors import KNOWN_ERROR_USE_CASES, KNOWN_ERRORS_PATH, KnownErrors
+from log_compaction import compact_log, looks_like_log
+from llm_backends import DEFAULT_BACKEND, BackendRegistry, registry_from_settings
+from quota_governor import QuotaExceeded, QuotaGovernor, Reservation, governor_from_settings, team_for
+from redaction import Redactor, redactor_from_settings
+from retrieval import INDEX_DIR, BM25Index, format_context
+from sectioned_generation import (
+    OUTLINE_MAX_TOKENS, document_sections, generate_sections, merge_section_metadata, outline_prompt,
+    section_prompt, supports_sectioned
+)
+from state_store import STORE_ERRORS, StateStore, open_state_store
+from structured_output import (
+    IncrementalJSONParser, parse_document, response_format, section_markdown, structured_instructions,
+    supports_structured, to_markdown
+)
+from vendor_mapping import (
+    MAPPING_USE_CASES, VENDOR_MAPPING_PATH, VendorMapping, format_mapping_context, load_mapping, mapping_vendors,
+    mentions_equivalent
+)
+
+@st.cache_resource(show_spinner=False)
+def freeze_import_heap() -> bool:
+    """Move the ~100k objects created by the imports above (openai, pydantic, numpy) out of GC.
+
+    Streamlit runs a full gc.collect() after every rerun, fragment reruns included; with the
+    import heap frozen that collection only walks objects created by the sessions themselves.
+    """
+    gc.freeze()
+    return True
+
+freeze_import_heap()
 
 # ============================
 # Configuration & Constants
@@ -21,16 +82,25 @@ st.warning(
     "All outputs must be independently reviewed and validated. "
 )
 
-# Constants
-MAX_INPUT_LENGTH = 5000
-MAX_OUTPUT_TOKENS = 1500         # Reduced default for output tokens (practical balance)
-MODEL_VERSION = "gpt-4o-mini"  
+logger = logging.getLogger(__name__)
+
+# Constants (prompts, use cases and model defaults live in copilot_core)
+RESULT_CACHE_TTL_S = 7 * 86400       # Cached results (and their translations) expire after a week
+RETRIEVAL_TOP_K = 4                  # Knowledge base passages added to a grounded prompt
+RETRIEVAL_TOKEN_BUDGET = 800         # Max prompt tokens spent on those passages
+SIMILAR_INCIDENTS_K = 3
+QUEUE_CAPTION_S = 0.5                # Waits for a backend slot from this long on are shown in the caption
+TRANSLATION_GROWTH = 1.5             # German prose needs noticeably more tokens than the English source
+TRANSLATION_MAX_TOKENS = 16000       # Longer translations are not attempted (full generation instead)
 
 # ============================
 # Session State Initialization (minimal - only for token tracking)
 # ============================
 if "token_usage" not in st.session_state:
     st.session_state.token_usage = {"total_tokens": 0, "requests": 0}
+if "token_usage_lock" not in st.session_state:
+    # ask_llm also runs in worker threads (section-wise and incremental generation)
+    st.session_state.token_usage_lock = threading.Lock()
 
 # ============================
 # Secrets and API Client Initialization
@@ -41,29 +111,25 @@ if "OPENAI_API_KEY" not in st.secrets:
     st.info("Create a secrets.toml in UI or locally with in .streamlit/secrets.toml with: OPENAI_API_KEY = 'YOUR_API_KEY'")
     st.stop()
 
-# Initialize the OpenAI client with the API key from secrets
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-VENDORS = ["NetApp ONTAP", "Pure FlashArray", "Dell EMC PowerMax"]
-TAB_NAMES = ["📊 Management Dashboard", "💾 Storage Engineering"]
-
 # ============================
-# 12 Use cases : (English display, German display). 
-# English key for prompt lookup, same applies for other langauages es, fr, ja or zh
+# LLM Backends
 # ============================
-USE_CASES = [
-    ("Explain Issue and Error", "Explain Issue and Error", "Problem/Fehler erklären"),
-    ("Generate Runbook", "Generate Runbook", "Runbook generieren"),
-    ("Generate Incident RCA", "Generate Incident RCA", "Incident RCA generieren"),
-    ("Capacity Planning", "Capacity Planning", "Kapazitätsplanung"),
-    ("Performance Analysis", "Performance Analysis", "Performance-Analyse"),
-    ("DR Test Planning", "DR Test Planning", "DR-Testplanung"),
-    ("Storage Migration", "Storage Migration", "Storage-Migration"),
-    ("Generate Ansible Playbook", "Generate Ansible Playbook", "Ansible Playbook generieren"),
-    ("Generate Change Request Documentation", "Generate Change Request Documentation", "Change Request Dokumentation generieren"),
-    ("Storage Compliance & Audit Evidence", "Storage Compliance & Audit Evidence", "Storage Compliance & Audit-Nachweise"),
-    ("Cross-Vendor Migration", "Cross-Vendor Migration Plan", "Herstellerübergreifende Migration"),
-    ("Decommissioning & Data Retirement Procedure", "Decommissioning Procedure", "Decommissioning & Datenrückgabe Prozedur"),
-]
+# "openai" is always available. Further OpenAI-compatible endpoints (e.g. an on-prem
+# llama.cpp / vLLM server) and the use case routing come from secrets:
+#
+#   [llm_backends.local]
+#   base_url = "http://llm.internal:8080/v1"
+#   model = "qwen2.5-14b-instruct"
+#   max_concurrency = 2
+#
+#   [use_case_backends]
+#   "Explain Issue and Error" = "local"
+
+@st.cache_resource
+def get_backend_registry() -> BackendRegistry:
+    return registry_from_settings(st.secrets, st.secrets["OPENAI_API_KEY"], MODEL_VERSION)
+
+TAB_NAMES = ["📊 Management Dashboard", "💾 Storage Engineering"]
 
 # ============================
 # Translations
@@ -110,7 +176,70 @@ TRANSLATIONS = {
         "export_label": "Export Output",
         "copy_label": "Copy to Clipboard",
         "char_count": "Characters: {count}/{max}",
-        "token_info": "Tokens: {tokens} | Requests: {requests}"
+        "token_info": "Tokens: {tokens} | Requests: {requests}",
+        "translate_toggle": "Reuse cached English result (translate instead of regenerating)",
+        "translated_caption": "Translated from cached English result",
+        "cached_caption": "Served from cache",
+        "followup_title": "Follow-up",
+        "followup_label": "Refine the result above (e.g. \"add rollback for step 7\")",
+        "followup_button": "Send Follow-up",
+        "followup_caption": "Updated sections: {sections}",
+        "followup_not_spliced": "⚠️ The answer has no section headings, so nothing was changed in the document. The answer is shown below; ask again naming the section to update.",
+        "warning_empty_followup": "Please describe the refinement first.",
+        "grounding_toggle": "Ground answer in knowledge base (vendor docs, KB articles, approved runbooks)",
+        "sources_title": "📚 Knowledge base sources",
+        "similar_title": "🔎 Similar past incidents",
+        "similar_toggle": "Include similar past incidents as context",
+        "quota_title": "💰 Remaining budget",
+        "quota_exceeded": "⚠️ Token budget exceeded: {reason}",
+        "state_store_unavailable": "⚠️ Shared state store unavailable, so the token budget cannot be checked. Please try again shortly.",
+        "structured_toggle": "Structured output (JSON sections, rendered as they arrive)",
+        "structured_failed": "⚠️ The model did not return a valid structured document. Please try again or disable structured output.",
+        "structured_missing": "⚠️ Output truncated, missing sections: {sections}",
+        "sectioned_toggle": "Section-wise generation (outline first, then all sections in parallel)",
+        "sectioned_caption": "{sections} sections in parallel: {sections_s}s after a {outline_s}s outline (one after another ≈ {sequential_s}s)",
+        "sectioned_failed": "⚠️ Sections not generated: {sections}",
+        "sectioned_failed_note": "_⚠️ This section could not be generated. Please try again._",
+        "assembly_toggle": "Approved boilerplate from templates (approvals, regulatory references, sign-off); the model writes only the case-specific sections",
+        "assembly_caption": "{static} of {sections} sections from approved templates ({static_chars:,} characters not generated, skeleton {version})",
+        "assembly_missing": "⚠️ Sections not generated: {sections}",
+        "export_json_label": "Export JSON",
+        "continued_caption": "continued {count}× after hitting the token limit",
+        "queued_caption": "⏳ {seconds}s queued ({lane} lane)",
+        "incremental_toggle": "♻️ Only regenerate the sections affected by the input change",
+        "incremental_plan": "The input change affects {count} of {total} sections: {sections}",
+        "incremental_full": "The whole document will be regenerated: {reason}.",
+        "incremental_reason_no_sections": "the previous output has no sections",
+        "incremental_reason_input_rewritten": "most of the input changed",
+        "incremental_reason_most_sections": "most sections depend on the change",
+        "incremental_reason_no_dependency": "no section depends on the changed details",
+        "incremental_caption": "♻️ Regenerated {count} of {total} sections: {sections}",
+        "incremental_failed": "⚠️ Not updated: {sections}",
+        "diff_title": "🔍 Changes to the previous version",
+        "commands_title": "🧰 Command library",
+        "commands_search": "Search commands (e.g. snapmirror update, purevol snap)",
+        "commands_object": "Object",
+        "commands_verb": "Action",
+        "commands_all": "All",
+        "commands_empty": "No commands yet — commands and Ansible tasks from generated outputs are collected here.",
+        "commands_none": "No matching commands.",
+        "commands_entry": "{count}× · {vendor} · {object} / {verb} · last used {last_seen}",
+        "commands_footer": "{results} of {total} commands · {ms} ms · no LLM call",
+        "truncated_caption": "⚠️ still truncated at the token limit",
+        "redacted_caption": "🔒 {count} sensitive values redacted before sending",
+        "compact_toggle": "Compact pasted logs (collapse repeated lines into templates)",
+        "compact_caption": "Log compaction: {input_chars:,} → {output_chars:,} characters ({ratio}×), {input_lines:,} lines → {templates} entries, {elapsed_ms} ms",
+        "compact_preview": "Compacted evidence (sent to the model)",
+        "metrics_toggle": "Analyze pasted metrics locally (send a findings table instead of the raw samples)",
+        "metrics_caption": "Metrics analysis: {series} series, {samples:,} samples, {findings} likely bottleneck(s), {input_chars:,} → {output_chars:,} characters, {elapsed_ms} ms",
+        "metrics_preview": "Findings (sent to the model)",
+        "mapping_caption": "🔁 Cross-vendor mapping table v{version}: {rows} rows added",
+        "mapping_answer_caption": "🔁 Answered from the cross-vendor mapping table v{version} — no LLM call",
+        "known_error_preview": "📕 Known error: {signatures}",
+        "known_error_toggle": "Ask the model anyway, with the approved explanation as context",
+        "known_error_context_preview": "📕 Known error: {signatures} — its approved explanation goes to the model as context for the rest of the input",
+        "known_error_answer_caption": "📕 Answered from the known-error database v{version} — no LLM call, {elapsed_us} µs, hit rate {hit_rate:.0%}",
+        "known_error_caption": "📕 Known-error database v{version}: {signatures} added as context"
     },
 
     "German / Deutsch": {
@@ -154,331 +283,275 @@ TRANSLATIONS = {
         "export_label": "Ausgabe exportieren",
         "copy_label": "In Zwischenablage kopieren",
         "char_count": "Zeichen: {count}/{max}",
-        "token_info": "Tokens: {tokens} | Anfragen: {requests}"
+        "token_info": "Tokens: {tokens} | Anfragen: {requests}",
+        "translate_toggle": "Vorhandenes englisches Ergebnis wiederverwenden (übersetzen statt neu generieren)",
+        "translated_caption": "Aus zwischengespeichertem englischem Ergebnis übersetzt",
+        "cached_caption": "Aus dem Cache geladen",
+        "followup_title": "Nachfrage",
+        "followup_label": "Ergebnis oben verfeinern (z. B. \"Rollback für Schritt 7 ergänzen\")",
+        "followup_button": "Nachfrage senden",
+        "followup_caption": "Aktualisierte Abschnitte: {sections}",
+        "followup_not_spliced": "⚠️ Die Antwort enthält keine Abschnittsüberschriften, daher wurde am Dokument nichts geändert. Die Antwort steht unten; bitte erneut mit dem zu ändernden Abschnitt anfragen.",
+        "warning_empty_followup": "Bitte beschreiben Sie zuerst die gewünschte Änderung.",
+        "grounding_toggle": "Antwort mit Wissensbasis absichern (Herstellerdoku, KB-Artikel, freigegebene Runbooks)",
+        "sources_title": "📚 Quellen aus der Wissensbasis",
+        "similar_title": "🔎 Ähnliche frühere Incidents",
+        "similar_toggle": "Ähnliche frühere Incidents als Kontext mitgeben",
+        "quota_title": "💰 Verbleibendes Budget",
+        "quota_exceeded": "⚠️ Token-Budget überschritten: {reason}",
+        "state_store_unavailable": "⚠️ Gemeinsamer Zustandsspeicher nicht erreichbar, das Token-Budget kann nicht geprüft werden. Bitte gleich erneut versuchen.",
+        "structured_toggle": "Strukturierte Ausgabe (JSON-Abschnitte, Anzeige sobald fertig)",
+        "structured_failed": "⚠️ Das Modell hat kein gültiges strukturiertes Dokument geliefert. Bitte erneut versuchen oder strukturierte Ausgabe deaktivieren.",
+        "structured_missing": "⚠️ Ausgabe abgeschnitten, fehlende Abschnitte: {sections}",
+        "sectioned_toggle": "Abschnittsweise Generierung (zuerst Gliederung, dann alle Abschnitte parallel)",
+        "sectioned_caption": "{sections} Abschnitte parallel: {sections_s}s nach {outline_s}s Gliederung (nacheinander ≈ {sequential_s}s)",
+        "sectioned_failed": "⚠️ Nicht generierte Abschnitte: {sections}",
+        "sectioned_failed_note": "_⚠️ Dieser Abschnitt konnte nicht generiert werden. Bitte erneut versuchen._",
+        "assembly_toggle": "Freigegebene Standardtexte aus Vorlagen (Genehmigungen, regulatorische Referenzen, Freigabe); das Modell schreibt nur die fallspezifischen Abschnitte",
+        "assembly_caption": "{static} von {sections} Abschnitten aus freigegebenen Vorlagen ({static_chars:,} Zeichen nicht generiert, Skelett {version})",
+        "assembly_missing": "⚠️ Nicht generierte Abschnitte: {sections}",
+        "export_json_label": "JSON exportieren",
+        "continued_caption": "nach Erreichen des Token-Limits {count}× fortgesetzt",
+        "queued_caption": "⏳ {seconds}s in der Warteschlange (Spur {lane})",
+        "incremental_toggle": "♻️ Nur die von der Eingabeänderung betroffenen Abschnitte neu generieren",
+        "incremental_plan": "Die Eingabeänderung betrifft {count} von {total} Abschnitten: {sections}",
+        "incremental_full": "Das gesamte Dokument wird neu generiert: {reason}.",
+        "incremental_reason_no_sections": "die vorherige Ausgabe hat keine Abschnitte",
+        "incremental_reason_input_rewritten": "der Großteil der Eingabe wurde geändert",
+        "incremental_reason_most_sections": "die meisten Abschnitte hängen von der Änderung ab",
+        "incremental_reason_no_dependency": "kein Abschnitt hängt von den geänderten Angaben ab",
+        "incremental_caption": "♻️ {count} von {total} Abschnitten neu generiert: {sections}",
+        "incremental_failed": "⚠️ Nicht aktualisiert: {sections}",
+        "diff_title": "🔍 Änderungen gegenüber der vorherigen Version",
+        "commands_title": "🧰 Befehlsbibliothek",
+        "commands_search": "Befehle suchen (z. B. snapmirror update, purevol snap)",
+        "commands_object": "Objekt",
+        "commands_verb": "Aktion",
+        "commands_all": "Alle",
+        "commands_empty": "Noch keine Befehle — Befehle und Ansible-Tasks aus generierten Ausgaben werden hier gesammelt.",
+        "commands_none": "Keine passenden Befehle.",
+        "commands_entry": "{count}× · {vendor} · {object} / {verb} · zuletzt verwendet {last_seen}",
+        "commands_footer": "{results} von {total} Befehlen · {ms} ms · ohne LLM-Aufruf",
+        "truncated_caption": "⚠️ weiterhin am Token-Limit abgeschnitten",
+        "redacted_caption": "🔒 {count} sensible Werte vor dem Senden maskiert",
+        "compact_toggle": "Eingefügte Logs verdichten (wiederholte Zeilen zu Vorlagen zusammenfassen)",
+        "compact_caption": "Log-Verdichtung: {input_chars:,} → {output_chars:,} Zeichen ({ratio}×), {input_lines:,} Zeilen → {templates} Einträge, {elapsed_ms} ms",
+        "compact_preview": "Verdichtete Nachweise (werden an das Modell gesendet)",
+        "metrics_toggle": "Eingefügte Metriken lokal analysieren (Befundtabelle statt Rohdaten senden)",
+        "metrics_caption": "Metrik-Analyse: {series} Reihen, {samples:,} Messwerte, {findings} wahrscheinliche(r) Engpass/Engpässe, {input_chars:,} → {output_chars:,} Zeichen, {elapsed_ms} ms",
+        "metrics_preview": "Befunde (werden an das Modell gesendet)",
+        "mapping_caption": "🔁 Herstellerübergreifende Zuordnungstabelle v{version}: {rows} Zeilen ergänzt",
+        "mapping_answer_caption": "🔁 Aus der herstellerübergreifenden Zuordnungstabelle v{version} beantwortet — ohne LLM-Aufruf",
+        "known_error_preview": "📕 Bekannter Fehler: {signatures}",
+        "known_error_toggle": "Trotzdem das Modell fragen, mit der freigegebenen Erklärung als Kontext",
+        "known_error_context_preview": "📕 Bekannter Fehler: {signatures} — die freigegebene Erklärung geht als Kontext für die übrige Eingabe an das Modell",
+        "known_error_answer_caption": "📕 Aus der Known-Error-Datenbank v{version} beantwortet — ohne LLM-Aufruf, {elapsed_us} µs, Trefferquote {hit_rate:.0%}",
+        "known_error_caption": "📕 Known-Error-Datenbank v{version}: {signatures} als Kontext ergänzt"
     }
 }
-# ============================
-# Global System Prompt 
-# ============================
-
-SYSTEM_PROMPT = """
-You are a Senior Storage Engineer & Architect with 20+ years of experience in large-scale, highly regulated banking environments (European global systemically important bank - G-SIB).
-You have deep expertise in NetApp ONTAP, Pure Storage FlashArray//X, Dell EMC PowerMax and storage-related automation (Ansible).
-
-Your responses must be:
-- Precise, professional and audit-ready
-- Always consider banking regulatory requirements (DORA, BaFin, ECB, MaRisk, GDPR, 4-eyes principle, strict change management, traceability)
-- Use formal technical language suitable for L3 engineers, architects and auditors
-- Provide step-by-step clarity when giving procedures
-- Include risk considerations, rollback options and validation steps where appropriate
-- Always respond in {response_language}
-"""
-
-# ============================
-# Prompt Templates (keys = English internal name in use_cases)
-# ============================
-PROMPT_TEMPLATES = {
-    "Explain Issue and Error": """
-Explain the following issue clearly for {vendor}.
-
-Include:
-- What happened (symptoms and timeline)
-- Likely root cause(s)
-- Immediate remediation steps
-- Preventive best practices
-- Validation checks after remediation
-
-Issue details:
-{user_input}
-""",
-
-    "Generate Runbook": """
-Create a detailed engineering runbook for the following task on {vendor}.
-
-Include:
-- Purpose and scope
-- Preconditions and assumptions
-- Step-by-step execution procedure
-- Validation and success checks
-- Rollback and recovery steps
-- Risks and mitigation measures
-Task:
-{user_input}
-""",
-
-    "Generate Incident RCA": """
-Generate a professional incident Root Cause Analysis for {vendor}.
-Include:
-- Incident summary
-- Timeline of events
-- Technical root cause
-- Business and technical impact
-- Corrective actions taken
-- Preventive actions and long-term improvements
-- Lessons learned
-Incident details:
-{user_input}
-""",
-
-    "Capacity Planning": """
-Perform capacity planning analysis for {vendor}.
-Include: 
-- Current capacity usage and utilization trends
-- Growth assumptions and projections
-- Performance and tiering considerations
-- Capacity thresholds and risk points
-- Procurement and expansion timeline
-- High-level cost estimation
-Requirements:
-{user_input}
-""",
-
-    "Performance Analysis": """
-Analyze performance issues on {vendor}.
-Include: 
-- Observed symptoms and affected workloads
-- Key performance metrics to review
-- Likely bottlenecks and constraints
-- Recommended tuning and configuration changes
-- Monitoring and alerting improvements
-- Validation steps after optimization
-Performance data:
-{user_input}
-""",
-
-    "DR Test Planning": """
-Create a Disaster Recovery test plan for {vendor}.
-Include: 
-- Test objectives and success criteria
-- Scope and systems included
-- Detailed test procedures
-- Roles and responsibilities
-- Rollback and failback steps
-- Evidence and documentation requirements
-DR environment:
-{user_input}
-""",
-
-    "Storage Migration": """
-Create a storage migration plan for {vendor} within the same vendor or platform family.
-Include: 
-- Migration scope and objectives
-- Pre-migration checks and prerequisites
-- Migration strategy and approach
-- Step-by-step migration procedure
-- Data validation and consistency checks
-- Post-migration activities
-- Risks, mitigations, and rollback strategy
-Migration details:
-{user_input}
-""",
-
-    "Generate Ansible Playbook": """
-Generate a production-ready Ansible playbook for {vendor}.
-Include:
-- Variables and inputs required
-- Clearly named and structured tasks
-- Idempotent logic and error handling
-- Use of appropriate vendor modules
-- Comments explaining critical steps
-
-Constraints:
-- Follow Ansible best practices
-- Do not include explanatory text outside YAML
-
-User requirement:
-{user_input}
-
-Output:
-- YAML playbook only
-""",
-
-    "Generate Change Request Documentation": """
-Create a professional, audit-ready Change Request (CR) document section for {vendor}.
-Include:
-- Change title and CR reference placeholder
-- Business and technical justification
-- Risk assessment and mitigation
-- Detailed implementation steps
-- Backout and recovery plan
-- Impacted systems and outage window
-- Required approvals (CAB, 4-eyes principle)
-- Post-implementation validation steps
-Change description:
-{user_input}
-""",
-
-    "Storage Compliance & Audit Evidence": """
-Act as a storage compliance specialist in a European global bank.
-Generate audit-compliant documentation/explanation for the following storage-related audit topic on {vendor}.
-Include:
-- Relevant regulatory references (DORA, BaFin, ECB, GDPR)
-- Current configuration/status explanation
-- Evidence collection steps (commands/reports)
-- Gap analysis (if any)
-- Remediation recommendations
-Audit question or topic:
-{user_input}
-""",
-
-    "Cross-Vendor Migration": """
-Create a detailed cross-vendor storage migration plan from current {vendor} to a different platform (NetApp ONTAP / Pure FlashArray / PowerMax).
-- Current-state assessment and constraints
-- Target platform recommendation and justification
-- Compatibility and interoperability considerations
-- Chosen migration strategy (host-based, replication, tools, etc.)
-- High-level step-by-step migration workflow
-- Data validation and cutover approach
-- Rollback and fallback strategy
-- Timeline, effort estimation, and risks
-
-Migration context:
-{user_input}
-""",
-
-    "Decommissioning & Data Retirement Procedure": """
-Create a secure, compliant decommissioning and data retirement procedure for {vendor} in a banking environment.
-
-Include:
-- Scope and assets involved
-- Pre-decommissioning checks
-- Data sanitization method and standards
-- Validation and evidence for auditors
-- Documentation and sign-off requirements
-- Stakeholder notification steps
-
-Decommissioning scope:
-{user_input}
-"""
-}
-
 # ============================
 # Helper Functions
 # ============================
 
-def get_displayed_use_cases(language: str) -> list:
-    idx = 1 if language == "English" else 2
-    return [case[idx] for case in USE_CASES]
-
-def get_task_key_from_display(display_name: str, language: str) -> Optional[str]:
-    for key, en, de in USE_CASES:
-        if (language == "English" and display_name == en) or (language == "German / Deutsch" and display_name == de):
-            return key
-    return None
-
-def validate_input(user_input: str) -> Tuple[bool, Optional[str]]:
-    if not user_input.strip():
-        return False, "empty"
-    if len(user_input) > MAX_INPUT_LENGTH:
-        return False, "too_long"
-    return True, None
-
-def ask_llm(prompt: str, language: str, temperature: float = 0.25, top_p: float = 0.90, max_tokens: Optional[int] = None) -> Tuple[Optional[str], Optional[Dict]]:
-    """Call OpenAI API with defensive parsing and robust token accounting.
-
-    This function tolerates multiple response shapes (dict-like or SDK objects),
-    safely extracts content, usage and model name, and updates Streamlit token accounting
-    without raising on unexpected/missing fields.
+def ask_llm(prompt: str, language: str, temperature: float = 0.25, top_p: float = 0.90, max_tokens: Optional[int] = None,
+            model: Optional[str] = None, system_prompt: Optional[str] = None,
+            backend: Optional[str] = None, task_key: Optional[str] = None,
+            history: Optional[List[Dict[str, str]]] = None, json_format: Optional[Dict[str, Any]] = None,
+            on_delta: Optional[Callable[[str], None]] = None,
+            vendor: Optional[str] = None, budget_use_case: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+    """Call the configured LLM backend with robust token accounting.
+
+    The backend is `backend` if given, otherwise the one routed for `task_key`
+    (see `use_case_backends`). Response parsing is done by the backend, so content,
+    usage and model name arrive normalized; accounting never raises.
+
+    `model` and `system_prompt` override the backend model and the global SYSTEM_PROMPT
+    (used by the translation pass). `history` holds earlier conversation messages that
+    go between the system prompt and `prompt` (follow-up mode). `json_format` is sent as
+    `response_format` (structured output); with `on_delta` the response is streamed and
+    every content delta is passed to it as it arrives.
+
+    With `task_key` and `vendor` the call feeds the adaptive completion budgets, and
+    without an explicit `max_tokens` it uses the budget learned for that use case,
+    vendor and language; `budget_use_case` keeps the budget of partial requests (outline,
+    single section) apart from the one of the whole document.
+
+    Sensitive values in `prompt` and `history` are replaced by placeholders before
+    anything is sent; the returned content and the streamed deltas have them restored.
     """
-    response_language = "German" if language == "German / Deutsch" else "English"
-    full_system = SYSTEM_PROMPT.format(response_language=response_language)
-
-    # Use provided max_tokens or fallback to global constant
+    full_system = system_prompt or build_system_prompt(language)
+
+    # Redact before sending; content stays redacted until returned, so continuation prompts are too
+    redaction = get_redactor().session()
+    prompt = redaction.redact(prompt)
+    if history:
+        history = [{**m, "content": redaction.redact(m.get("content", ""))} for m in history]
+    if on_delta and redaction.placeholders:
+        restorer, emit = redaction.stream_restorer(json_escape=bool(json_format)), on_delta
+
+        def on_delta(delta: str) -> None:
+            restored = restorer.feed(delta)
+            if restored:
+                emit(restored)
+
+    # Use provided max_tokens, else the learned budget, else the global constant
+    budgets = get_completion_budgets() if task_key and vendor else None
+    budget_use_case = budget_use_case or (f"{task_key} (structured)" if json_format else task_key)
+    budget_basis = "explicit" if max_tokens else "default"
     requested_max_tokens = max_tokens or MAX_OUTPUT_TOKENS
+    if budgets and not max_tokens:
+        try:
+            requested_max_tokens, budget_basis = budgets.budget(budget_use_case, vendor, language)
+        except STORE_ERRORS as e:
+            logger.warning("Completion budget history unavailable, using the default: %s", e)
+
+    registry = get_backend_registry()
+    llm = registry.get(backend) if backend else registry.for_use_case(task_key)
+
+    # Reserve the worst case (prompt + full completion budget) before sending; settled below
+    governor = get_quota_governor()
+    user, team = get_requester()
+    # Priority lane for the backend's concurrency slots (incident triage ahead of documentation)
+    lane = registry.lanes.lane_for(task_key, user, team)
+    history_chars = sum(len(m.get("content", "")) for m in (history or []))
+    estimated_tokens = (len(full_system) + history_chars + len(prompt)) // 4 + requested_max_tokens
+    try:
+        reservation = governor.acquire(user, team, estimated_tokens)
+    except QuotaExceeded as e:
+        st.error(TRANSLATIONS.get(language, TRANSLATIONS["English"])["quota_exceeded"].format(reason=str(e)))
+        return None, None
+    except STORE_ERRORS as e:
+        # Budgets cannot be checked without the shared store; fail this request, not the page
+        logger.warning("State store unavailable for the quota check: %s", e)
+        st.error(TRANSLATIONS.get(language, TRANSLATIONS["English"])["state_store_unavailable"])
+        return None, None
+
+    # In-flight request record, visible to every replica sharing the state store
+    request_id = uuid.uuid4().hex
+    job = {"status": "running", "user": user, "team": team, "task_key": task_key,
+           "backend": llm.name, "lane": lane, "started": datetime.now().isoformat()}
+    record_job(request_id, job)
+
+    # Audit trail: queued here, written by the background writer (prompt and output as sent, i.e. redacted)
+    audit_log = get_audit_log()
+
+    def audit(status: str, **fields: Any) -> None:
+        if audit_log is None:
+            return
+        audit_log.record(
+            "llm_call", status=status, request_id=request_id, source="app", user=user, team=team,
+            task_key=task_key, vendor=vendor, language=language, backend=llm.name,
+            template=template_version(task_key), system_prompt_sha256=sha256_text(full_system),
+            settings={"model": model or llm.config.model, "temperature": temperature, "top_p": top_p,
+                      "max_tokens": requested_max_tokens, "max_tokens_basis": budget_basis,
+                      "response_format": (json_format or {}).get("type")},
+            prompt=prompt, history=history or [], **fields
+        )
 
     try:
-        response = client.chat.completions.create(
-            model=MODEL_VERSION,
+        completion_args = dict(
             messages=[
                 {"role": "system", "content": full_system},
+                *(history or []),
                 {"role": "user", "content": prompt}
             ],
             temperature=temperature,
-            max_tokens=requested_max_tokens,
             top_p=top_p,
+            max_tokens=requested_max_tokens,
+            model=model,
             frequency_penalty=0.0,
-            presence_penalty=0.0
+            presence_penalty=0.0,
+            lane=lane
         )
-
-        # --- Defensive extractors ---
-        def _get_attr_or_key(obj, key, default=None):
+        if json_format:
+            completion_args["response_format"] = json_format
+        if on_delta:
+            stream = llm.stream(**completion_args)
+            for delta in stream:
+                on_delta(delta)
+            response = stream.response
+        else:
+            response = llm.complete(**completion_args)
+
+        settle_quota(governor, reservation, response.total_tokens or estimated_tokens)
+        content, usage, latency_s = response.content or "", dict(response.usage), response.latency_s
+        queue_s = response.queue_s
+
+        # Truncated at max_tokens: continue from a compact tail of the output instead of a rerun.
+        # Continuation failures keep the partial result rather than losing it.
+        continuations = 0
+        while task_key and response.finish_reason == "length" and content and continuations < MAX_CONTINUATIONS:
+            continue_prompt = continuation_prompt(content, task_key, vendor, structured=bool(json_format))
+            continue_estimate = (len(full_system) + len(continue_prompt)) // 4 + requested_max_tokens
             try:
-                if obj is None:
-                    return default
-                if isinstance(obj, dict):
-                    return obj.get(key, default)
-                return getattr(obj, key, default)
-            except Exception:
-                return default
-
-        # Model name
-        model_name = _get_attr_or_key(response, "model", None)
-
-        # Usage extraction - result as a dict if possible
-        usage_raw = _get_attr_or_key(response, "usage", {}) or {}
-        usage = {}
-        try:
-            # If it's an SDK object with model_dump / dict method
-            if hasattr(usage_raw, "model_dump"):
-                usage = usage_raw.model_dump() or {}
-            elif hasattr(usage_raw, "to_dict"):
-                usage = usage_raw.to_dict() or {}
-            elif isinstance(usage_raw, dict):
-                usage = usage_raw
-            else:
-                # Last resort: try to convert
-                usage = dict(usage_raw) if usage_raw else {}
-        except Exception:
-            usage = usage_raw if isinstance(usage_raw, dict) else {}
-
-        # Extract total tokens robustly
-        total_tokens = 0
-        for k in ("total_tokens", "total", "completion_tokens"):
+                continue_reservation = governor.acquire(user, team, continue_estimate)
+            except (QuotaExceeded, *STORE_ERRORS):
+                break
             try:
-                v = usage.get(k) if isinstance(usage, dict) else None
-                if v is not None:
-                    total_tokens = int(v)
-                    break
+                # Without response_format: schema mode would start a new JSON object
+                response = llm.complete(**{
+                    **{k: v for k, v in completion_args.items() if k != "response_format"},
+                    "messages": [{"role": "system", "content": full_system},
+                                 {"role": "user", "content": continue_prompt}],
+                })
             except Exception:
-                continue
-
-        # Content extraction - support multiple shapes:
-        content = None
-        choices = _get_attr_or_key(response, "choices", None)
-        if choices:
+                settle_quota(governor, continue_reservation, 0)
+                break
+            settle_quota(governor, continue_reservation, response.total_tokens or continue_estimate)
+            joined = join_continuation(content, response.content or "")
+            if on_delta and len(joined) > len(content):
+                on_delta(joined[len(content):])
+            content, usage = joined, merge_usage(usage, response.usage)
+            latency_s += response.latency_s
+            queue_s += response.queue_s
+            continuations += 1
+        if on_delta and redaction.placeholders:
+            tail = restorer.flush()
+            if tail:
+                emit(tail)
+        redacted_content = content
+        content = redaction.restore(content, json_escape=bool(json_format))
+
+        total_tokens = usage.get("total_tokens") or usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        if budgets:
+            # Total length over all rounds, so the budget learns to avoid the continuation next time
             try:
-                first = choices[0]
-                # If first is dict-like
-                if isinstance(first, dict):
-                    # new-format: message -> content
-                    content = first.get("message", {}).get("content") or first.get("text") or first.get("content")
-                else:
-                    # SDK object - try message.content then text
-                    msg = _get_attr_or_key(first, "message", None)
-                    content = _get_attr_or_key(msg, "content", None) or _get_attr_or_key(first, "text", None)
-            except Exception:
-                content = None
-
-        # Fallback content locations
-        if content is None:
-            content = _get_attr_or_key(response, "text", None) or _get_attr_or_key(response, "content", None)
-
-        # Build metadata (safe)
+                budgets.record(budget_use_case, vendor, language, completion_tokens, response.finish_reason,
+                               requested_max_tokens)
+            except STORE_ERRORS as e:
+                logger.warning("Completion length not recorded: %s", e)
+        record_job(request_id, {**job, "status": "done", "total_tokens": total_tokens,
+                                "latency_s": round(latency_s, 3)})
         metadata = {
-            "model": model_name or "unknown",
-            "usage": usage if isinstance(usage, dict) else {},
+            "request_id": request_id,
+            "model": response.model,
+            "backend": llm.name,
+            "lane": lane,
+            "queue_s": round(queue_s, 3),
+            "usage": usage,
+            "finish_reason": response.finish_reason,
+            "continuations": continuations,
             "requested_max_tokens": requested_max_tokens,
+            "max_tokens_basis": budget_basis,
+            "redactions": dict(redaction.counts),
+            "redaction_ms": round(redaction.elapsed_s * 1000, 3),
+            "latency_s": round(latency_s, 3),
+            "tokens_per_s": round(completion_tokens / latency_s, 1) if latency_s else 0.0,
+            "backend_stats": llm.stats.snapshot(),
             "timestamp": datetime.now().isoformat()
         }
+        audit("done", model=response.model, output=redacted_content, usage=usage,
+              finish_reason=response.finish_reason, continuations=continuations,
+              redactions=metadata["redactions"], latency_s=metadata["latency_s"])
 
         # --- Safe session token accounting ---
         try:
-            # ensure session_state keys exist
-            if "token_usage" not in st.session_state:
-                st.session_state.token_usage = {"total_tokens": 0, "requests": 0}
-
-            st.session_state.token_usage["total_tokens"] = st.session_state.token_usage.get("total_tokens", 0) + int(total_tokens or 0)
-            st.session_state.token_usage["requests"] = st.session_state.token_usage.get("requests", 0) + 1
+            # Read-modify-write under the session lock: concurrent section requests must not lose updates
+            with st.session_state.token_usage_lock:
+                usage_totals = st.session_state.token_usage
+                usage_totals["total_tokens"] = usage_totals.get("total_tokens", 0) + int(total_tokens or 0)
+                usage_totals["requests"] = usage_totals.get("requests", 0) + 1
         except Exception:
             # Never let accounting errors crash the app; log server-side if available
             try:
@@ -486,10 +559,12 @@ def ask_llm(prompt: str, language: str, temperature: float = 0.25, top_p: float
             except Exception:
                 pass
 
-        # Return the best effort content + metadata
         return content, metadata
 
     except Exception as e:
+        settle_quota(governor, reservation, 0)
+        record_job(request_id, {**job, "status": "failed", "error": type(e).__name__})
+        audit("failed", error=type(e).__name__)
         # Classify and show user-friendly messages, without exposing internals
         error_type = type(e).__name__
         error_message = str(e).lower()
@@ -504,9 +579,495 @@ def ask_llm(prompt: str, language: str, temperature: float = 0.25, top_p: float
             st.error(f"⚠️ Invalid request: {str(e)}")
         else:
             # Generic fallback
-            st.error(f"⚠️ Error contacting OpenAI API: {str(e)}")
+            st.error(f"⚠️ Error contacting LLM backend '{llm.name}': {str(e)}")
+
+        return None, None
+
+# ============================
+# Shared State (counters, cache entries, job records, locks)
+# ============================
+# STATE_STORE_URL in secrets: "memory://" (default, this process only),
+# "sqlite:////var/lib/copilot/state.db" (all workers on one host) or
+# "redis://redis.internal:6379/0" (all replicas).
+
+@st.cache_resource
+def get_state_store() -> StateStore:
+    return open_state_store(st.secrets.get("STATE_STORE_URL", "memory://"))
+
+# Job records, quota settlement and cached results are bookkeeping: a store outage (Redis
+# unreachable, lock timeout) is logged and the request goes on without them
+
+def record_job(request_id: str, record: Dict) -> None:
+    try:
+        get_state_store().put_job(request_id, record)
+    except STORE_ERRORS as e:
+        logger.warning("Job record %s not written to the state store: %s", request_id, e)
+
+def settle_quota(governor: QuotaGovernor, reservation: Reservation, actual_tokens: int) -> None:
+    try:
+        governor.settle(reservation, actual_tokens)
+    except STORE_ERRORS as e:
+        logger.warning("Quota reservation not settled in the state store: %s", e)
+
+# ============================
+# Token Quota Governor (shared by all sessions and, with a shared state store, all replicas)
+# ============================
+# Budgets come from secrets; 0 = unlimited:
+#
+#   [quota]
+#   user_tokens_per_minute = 30000
+#   user_requests_per_minute = 20
+#   team_tokens_per_minute = 150000
+#   team_tokens_per_day = 0
+#   queue_timeout_s = 15
+#   [quota.teams.storage-oncall]
+#   tokens_per_minute = 300000
+#   [quota.members]
+#   "jane.doe@bank.example" = "storage-oncall"
+
+@st.cache_resource
+def get_quota_governor() -> QuotaGovernor:
+    return governor_from_settings(st.secrets.get("quota", {}), store=get_state_store())
+
+# ============================
+# Adaptive Completion Budgets (max_tokens learned per use case, vendor and language)
+# ============================
+# Optional tuning in secrets:
+#
+#   [completion_budget]
+#   percentile = 95
+#   headroom = 1.15
+#   min_tokens = 400
+#   max_tokens = 4000
+
+@st.cache_resource
+def get_completion_budgets() -> CompletionBudgets:
+    return budgets_from_settings(st.secrets.get("completion_budget", {}), get_state_store(), MAX_OUTPUT_TOKENS)
+
+def get_requester() -> Tuple[str, str]:
+    """(user, team) for quota accounting: SSO user, else auth proxy header, else this browser session."""
+    user = None
+    try:
+        if st.user.is_logged_in:
+            user = st.user.email
+    except Exception:
+        pass
+    if not user:
+        try:
+            user = st.context.headers.get("X-Forwarded-Email") or st.context.headers.get("X-Forwarded-User")
+        except Exception:
+            user = None
+    if not user:
+        if "session_id" not in st.session_state:
+            st.session_state.session_id = uuid.uuid4().hex[:8]
+        user = f"session-{st.session_state.session_id}"
+    return user, team_for(st.secrets.get("quota", {}), user)
+
+# ============================
+# Sensitive Data Redaction (applied to every prompt in ask_llm)
+# ============================
+# Optional settings in secrets:
+#
+#   [redaction]
+#   enabled = true
+#   customer_id_pattern = "(?:CUST|KD|CIF)[-_ ]?\\d{6,12}\\b"
+#   disabled = ["HOST"]          # categories to leave untouched
+
+@st.cache_resource
+def get_redactor() -> Redactor:
+    return redactor_from_settings(st.secrets.get("redaction", {}))
+
+def redact_for_storage(*texts: str) -> List[str]:
+    """Texts with sensitive values replaced (one placeholder numbering), for persisted indexes."""
+    redaction = get_redactor().session()
+    return [redaction.redact(text) for text in texts]
+
+# ============================
+# Audit Log (DORA / MaRisk traceability of every LLM call)
+# ============================
+# Enabled by default, written to .audit/; optional settings in secrets:
+#
+#   [audit]
+#   directory = "/var/lib/copilot/audit"
+#   fsync = "interval"           # "always" | "interval" | "never"
+#   segment_max_mb = 64
+#   segment_max_age_h = 24
+#
+# Verify the hash chain with: python audit_log.py verify /var/lib/copilot/audit
+
+@st.cache_resource
+def get_audit_log() -> Optional[AuditLog]:
+    return audit_from_settings(st.secrets.get("audit", {}))
+
+# ============================
+# Knowledge Base Retrieval (BM25, built with `python retrieval.py index knowledge/`)
+# ============================
+
+@st.cache_resource
+def open_knowledge_index(index_dir: str) -> BM25Index:
+    return BM25Index(index_dir)
+
+def get_knowledge_index() -> Optional[BM25Index]:
+    # Not cached while the index is missing, so grounding switches on once it has been built
+    index_dir = st.secrets.get("RETRIEVAL_INDEX_DIR", INDEX_DIR)
+    if not os.path.exists(os.path.join(index_dir, "manifest.json")):
+        return None
+    return open_knowledge_index(index_dir)
+
+@st.cache_resource
+def get_incident_index() -> IncidentIndex:
+    return IncidentIndex(st.secrets.get("INCIDENT_INDEX_PATH", INCIDENT_INDEX_PATH))
+
+# ============================
+# Command Library (commands and Ansible tasks extracted from outputs; COMMAND_LIBRARY_PATH overrides)
+# ============================
+
+@st.cache_resource
+def get_command_library() -> CommandLibrary:
+    return CommandLibrary(st.secrets.get("COMMAND_LIBRARY_PATH", COMMAND_LIBRARY_PATH))
+
+# ============================
+# Cross-Vendor Mapping Table (versioned vendor_mapping.json; VENDOR_MAPPING_PATH overrides)
+# ============================
+
+@st.cache_resource
+def get_vendor_mapping() -> Optional[VendorMapping]:
+    return load_mapping(st.secrets.get("VENDOR_MAPPING_PATH", VENDOR_MAPPING_PATH))
+
+# ============================
+# Known-Error Signatures (known_errors.json, reloaded on change; KNOWN_ERRORS_PATH overrides)
+# ============================
+
+@st.cache_resource
+def get_known_errors() -> KnownErrors:
+    return KnownErrors(st.secrets.get("KNOWN_ERRORS_PATH", KNOWN_ERRORS_PATH))
+
+# ============================
+# Result Cache & Translation (shared across sessions)
+# ============================
+
+# Fenced code blocks (also unterminated ones at the end of a truncated output) and inline code spans
+CODE_SPAN_PATTERN = re.compile(r"```.*?(?:```|\Z)|`[^`\n]+`", re.DOTALL)
+CODE_PLACEHOLDER_PATTERN = re.compile(r"\[\[CODE_(\d+)\]\]")
+
+def make_request_key(task_key: str, vendor: str, user_input: str, temperature: float, top_p: float,
+                     structured: bool = False, sectioned: bool = False, assembled: bool = False,
+                     backend: str = "", context: str = "") -> str:
+    """Language-independent key, so the English and German result of one request sit side by side.
+
+    `backend` is the backend name and model; `context` is the grounding, incident, mapping and
+    known-error context added to the prompt (with the table versions), hashed so a changed knowledge
+    base or signature database misses the cache instead of serving an answer built on the old one.
+    """
+    context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest() if context else ""
+    parts = [task_key, vendor, user_input.strip(), f"{temperature:.2f}", f"{top_p:.2f}", backend, context_hash]
+    if structured:
+        parts.append("structured")
+    if sectioned:
+        parts.append("sectioned")
+    if assembled:
+        parts.append("assembled")
+    raw = "\x1f".join(parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def get_cached_result(request_key: str, language: str) -> Optional[Tuple[str, Dict]]:
+    """Cached (result, metadata) for one language; entries are {language: [result, metadata]}."""
+    try:
+        entry = (get_state_store().get(f"result:{request_key}") or {}).get(language)
+    except STORE_ERRORS as e:
+        logger.warning("Result cache unavailable: %s", e)
+        return None
+    return tuple(entry) if entry else None
+
+def cache_result(request_key: str, language: str, result: str, metadata: Optional[Dict]) -> None:
+    store = get_state_store()
+    try:
+        with store.lock(f"result:{request_key}"):
+            entry = store.get(f"result:{request_key}") or {}
+            entry[language] = [result, metadata or {}]
+            store.set(f"result:{request_key}", entry, ttl_s=RESULT_CACHE_TTL_S)
+    except STORE_ERRORS as e:
+        logger.warning("Result not cached: %s", e)
+
+def protect_code_spans(text: str) -> Tuple[str, List[str]]:
+    """Replace code blocks and inline code with [[CODE_n]] placeholders so they are never translated."""
+    spans: List[str] = []
+
+    def _placeholder(match):
+        spans.append(match.group(0))
+        return f"[[CODE_{len(spans) - 1}]]"
+
+    return CODE_SPAN_PATTERN.sub(_placeholder, text), spans
+
+def restore_code_spans(text: str, spans: List[str]) -> Optional[str]:
+    """Put the original code back; returns None if the model dropped or duplicated a placeholder."""
+    for i in range(len(spans)):
+        if text.count(f"[[CODE_{i}]]") != 1:
+            return None
+    return CODE_PLACEHOLDER_PATTERN.sub(lambda m: spans[int(m.group(1))], text)
+
+def translate_cached_result(english_result: str, task_key: str) -> Tuple[Optional[str], Optional[Dict]]:
+    """Produce the German version of a cached English result with a cheap translation pass.
+
+    Ansible playbooks are YAML only and are reused verbatim. Returns (None, None) when the
+    translation fails, is cut off at max_tokens or breaks a code placeholder; the caller then
+    falls back to full generation.
+    """
+    if task_key == "Generate Ansible Playbook":
+        return english_result, {
+            "model": "none",
+            "usage": {},
+            "translated_from": "English",
+            "timestamp": datetime.now().isoformat()
+        }
+
+    protected, spans = protect_code_spans(english_result)
+    # Sized from the source, which may be a learned budget plus continuations long
+    max_tokens = max(MAX_OUTPUT_TOKENS, math.ceil(len(protected) / 4 * TRANSLATION_GROWTH) + 100)
+    if max_tokens > TRANSLATION_MAX_TOKENS:
+        return None, None
+    translated, metadata = ask_llm(
+        protected,
+        "German / Deutsch",
+        temperature=0.0,
+        top_p=1.0,
+        max_tokens=max_tokens,
+        model=TRANSLATION_MODEL,
+        system_prompt=TRANSLATION_SYSTEM_PROMPT,
+        backend=DEFAULT_BACKEND
+    )
+    if not translated or metadata.get("finish_reason") == "length":
+        # A truncated translation must never be cached or served as the German result
+        return None, None
+
+    restored = restore_code_spans(translated, spans)
+    if restored is None:
+        return None, None
+
+    metadata["translated_from"] = "English"
+    return restored, metadata
+
+def summarize_turns(text: str, language: str) -> Optional[str]:
+    """Rolling summary for follow-up compaction, on the small summary model."""
+    summary, _ = ask_llm(
+        text,
+        language,
+        temperature=0.0,
+        top_p=1.0,
+        max_tokens=400,
+        model=SUMMARY_MODEL,
+        system_prompt=SUMMARY_SYSTEM_PROMPT,
+        backend=DEFAULT_BACKEND
+    )
+    return summary
+
+# ============================
+# Structured Output (CR, RCA, DR plan, decommissioning)
+# ============================
+
+def generate_structured(prompt: str, language: str, task_key: str, vendor: str, settings: Dict,
+                        live) -> Tuple[Optional[str], Optional[Dict]]:
+    """Generate a schema-constrained document, rendering each section into `live` as soon as it closes.
+
+    Returns the Markdown rendering (used for display, cache, follow-ups and the incident
+    index); the sections themselves go to metadata["sections"] for exports.
+    """
+    registry = get_backend_registry()
+    llm = registry.get(settings["backend"]) if settings["backend"] else registry.for_use_case(task_key)
+    schema_supported = llm.config.json_schema
+    parser = IncrementalJSONParser()
+
+    def on_delta(delta: str) -> None:
+        for key, value in parser.feed(delta):
+            live.markdown(section_markdown(task_key, key, value, language))
+
+    raw, metadata = ask_llm(prompt + structured_instructions(task_key, schema_supported), language,
+                            settings["temperature"], settings["top_p"], backend=llm.name, task_key=task_key,
+                            json_format=response_format(task_key, schema_supported), on_delta=on_delta,
+                            vendor=vendor)
+    if not raw:
+        return None, None
+
+    sections, missing = parse_document(task_key, raw)
+    if not sections:
+        st.error(TRANSLATIONS.get(language, TRANSLATIONS["English"])["structured_failed"])
+        return None, None
+    metadata.update(sections=sections, missing_sections=missing,
+                    response_format="json_schema" if schema_supported else "json_object")
+    return to_markdown(task_key, sections, language), metadata
+
+def generate_sectioned(prompt: str, language: str, task_key: str, vendor: str, settings: Dict,
+                       live) -> Tuple[Optional[str], Optional[Dict]]:
+    """Generate a long document as a shared outline plus one concurrent request per section.
+
+    The sections stream into an output expander in `live`, in template order, while they
+    are generated; the assembled Markdown is returned like a single-request result.
+    """
+    lang = TRANSLATIONS.get(language, TRANSLATIONS["English"])
+    temperature, top_p, backend = settings["temperature"], settings["top_p"], settings["backend"]
+    started = time.perf_counter()
+    outline, outline_meta = ask_llm(outline_prompt(prompt), language, temperature, top_p,
+                                    max_tokens=OUTLINE_MAX_TOKENS, backend=backend, task_key=task_key,
+                                    vendor=vendor, budget_use_case=f"{task_key} (outline)")
+    outline_s = time.perf_counter() - started
+    if not outline:
+        return None, None
+
+    titles = document_sections(task_key)
+    ctx = get_script_run_ctx()
+    with live.expander(lang.get("output_title", "Result"), expanded=True):
+        placeholder = st.empty()
+
+    def generate(index: int, on_delta: Callable[[str], None]) -> Tuple[Optional[str], Optional[Dict]]:
+        # Worker threads need the script context for session state, secrets and cached resources
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return ask_llm(section_prompt(prompt, outline, titles, index), language, temperature, top_p,
+                       backend=backend, task_key=task_key, on_delta=on_delta, vendor=vendor,
+                       budget_use_case=f"{task_key} (section)")
 
+    def on_progress(document) -> None:
+        placeholder.markdown(document.render(lang["sectioned_failed_note"]))
+
+    document, section_metas, sections_s = generate_sections(titles, generate, on_progress)
+    if not any(section_metas):
         return None, None
+    metadata = merge_section_metadata(outline_meta, section_metas, titles, outline_s, sections_s)
+    metadata["outline"] = outline
+    return document.render(lang["sectioned_failed_note"]), metadata
+
+def generate_assembled(prompt: str, language: str, task_key: str, vendor: str, settings: Dict,
+                       live) -> Tuple[Optional[str], Optional[Dict]]:
+    """Generate only the case-specific sections; approvals, references and sign-off come from templates.
+
+    The assembled document streams into an output expander in `live`, with the static
+    parts in place from the first token on.
+    """
+    lang = TRANSLATIONS.get(language, TRANSLATIONS["English"])
+    with live.expander(lang.get("output_title", "Result"), expanded=True):
+        placeholder = st.empty()
+    streamed: List[str] = []
+
+    def on_delta(delta: str) -> None:
+        streamed.append(delta)
+        # Re-assembling is cheap; only redraw when a line is complete
+        if "\n" in delta:
+            placeholder.markdown(assemble(task_key, "".join(streamed), vendor, language).text)
+
+    generated, metadata = ask_llm(assembly_prompt(prompt, task_key), language, settings["temperature"],
+                                  settings["top_p"], backend=settings["backend"], task_key=task_key,
+                                  on_delta=on_delta, vendor=vendor, budget_use_case=f"{task_key} (assembled)")
+    if not generated:
+        return None, None
+    document = assemble(task_key, generated, vendor, language)
+    metadata["assembly"] = {
+        "sections": len(document.static) + len(document.generated) + len(document.missing),
+        "static": len(document.static),
+        "static_chars": document.static_chars,
+        "missing": document.missing,
+        "version": document.version,
+    }
+    return document.text, metadata
+
+def regenerate_affected(plan: RegenerationPlan, details: str, language: str, task_key: str, vendor: str,
+                        settings: Dict, live) -> Tuple[Optional[str], Optional[Dict]]:
+    """Rewrite only the sections of the last output that depend on the edited details, concurrently.
+
+    The previous document is shown in `live` with the affected sections streaming in
+    place; a section that fails keeps its previous text.
+    """
+    lang = TRANSLATIONS.get(language, TRANSLATIONS["English"])
+    temperature, top_p, backend = settings["temperature"], settings["top_p"], settings["backend"]
+    ctx = get_script_run_ctx()
+    with live.expander(lang.get("output_title", "Result"), expanded=True):
+        placeholder = st.empty()
+
+    def generate(position: int, on_delta: Callable[[str], None]) -> Tuple[Optional[str], Optional[Dict]]:
+        add_script_run_ctx(threading.current_thread(), ctx)
+        prompt = regeneration_prompt(plan, plan.affected[position], task_key, vendor, details)
+        return ask_llm(prompt, language, temperature, top_p, backend=backend, task_key=task_key,
+                       on_delta=on_delta, vendor=vendor, budget_use_case=f"{task_key} (section)")
+
+    def spliced(document) -> str:
+        return join_units(plan.units, {
+            index: regenerated_unit(plan.units[index], document.text(position))
+            for position, index in enumerate(plan.affected) if document.text(position).strip()
+        })
+
+    document, section_metas, elapsed_s = generate_sections(
+        plan.titles, generate, lambda document: placeholder.markdown(spliced(document)))
+    if not any(section_metas):
+        return None, None
+    return spliced(document), merge_regeneration_metadata(section_metas, plan, elapsed_s)
+
+# ============================
+# Log Compaction (pasted evidence)
+# ============================
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def compact_evidence(text: str) -> Tuple[str, Dict]:
+    """Compacted evidence and its stats; cached so fragment reruns while typing stay cheap."""
+    result = compact_log(text)
+    return result.text, {
+        "input_chars": result.input_chars,
+        "output_chars": result.output_chars,
+        "ratio": round(result.ratio, 1),
+        "input_lines": result.input_lines,
+        "templates": result.templates,
+        "elapsed_ms": round(result.elapsed_s * 1000, 1),
+    }
+
+# ============================
+# Metrics Analysis (Performance Analysis)
+# ============================
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def digest_metrics(text: str, vendor: str) -> Tuple[str, Dict]:
+    """Input with the findings table instead of the raw samples, and its stats; cached like compact_evidence."""
+    digest, analysis = digest_input(text, vendor)
+    return digest, {
+        "series": analysis.series,
+        "samples": analysis.samples,
+        "findings": len(analysis.findings),
+        "input_chars": analysis.input_chars,
+        "output_chars": len(digest),
+        "elapsed_ms": round(analysis.elapsed_s * 1000, 1),
+    }
+
+# ============================
+# UI Helpers
+# ============================
+
+def render_output(result: str, task_key: str, lang: Dict, sections: Optional[Dict[str, Any]] = None) -> None:
+    with st.expander(lang.get("output_title", "Result"), expanded=True):
+        if task_key == "Generate Ansible Playbook":
+            st.code(result, language="yaml")
+        else:
+            st.markdown(result)
+        
+        # Action buttons
+        col_export, col_copy = st.columns(2)
+        
+        with col_export:
+            st.download_button(
+                label=lang.get("export_label", "Export"),
+                data=result,
+                file_name=f"storage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                mime="text/plain",
+                on_click="ignore"       # Downloading must not rerun the page
+            )
+            if sections:
+                # Structured documents: sections as JSON for ITSM imports and tooling
+                st.download_button(
+                    label=lang.get("export_json_label", "Export JSON"),
+                    data=json.dumps({"use_case": task_key, "sections": sections}, ensure_ascii=False, indent=2),
+                    file_name=f"storage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    mime="application/json",
+                    on_click="ignore"
+                )
+        
+        with col_copy:
+            # Simple copy instruction - Streamlit doesn't support direct clipboard access
+            st.info("💡 Select the text above and use Ctrl+C (Cmd+C on Mac) to copy")
 
 # ============================
 # UI Sidebar & Language Setup
@@ -529,6 +1090,8 @@ st.sidebar.caption(lang["token_info"].format(
     tokens=st.session_state.token_usage["total_tokens"],
     requests=st.session_state.token_usage["requests"]
 ))
+# Filled at the end of the run so it reflects this run's requests
+quota_placeholder = st.sidebar.empty()
 
 st.title(lang.get("page_title"))
 st.caption(lang.get("page_caption"))
@@ -553,16 +1116,13 @@ with tab_dashboard:
 # ============================
 # Engineering Dashboard Tab 
 # ============================
-with tab_storage:
-    st.subheader(lang.get("storage_title"))
-    
-    vendor = st.selectbox(lang.get("vendor_label", "Storage Vendor"), VENDORS)
-    
-    displayed_tasks = get_displayed_use_cases(language)
-    selected_task = st.selectbox(lang.get("task_label", "Use Case"), displayed_tasks)
-    
-    task_key = get_task_key_from_display(selected_task, language)
-    
+# Settings, request and follow-up are fragments: interacting with their widgets reruns only
+# that fragment, not the page, and never re-sends the output. The output lives in
+# st.session_state.storage_output and is rendered by full runs only; a new result or
+# follow-up revision triggers one full rerun to show it.
+
+@st.fragment
+def settings_panel(task_key: Optional[str]) -> None:
     st.markdown("### Generation Settings")
     col1, col2 = st.columns([5, 4])
     
@@ -592,6 +1152,18 @@ with tab_storage:
         • Brainstorming / alternatives → **0.50–0.75** temp / **0.92–0.96** top_p
         """)
     
+    # Backend selection (only shown when more than one backend is configured)
+    backend_names = get_backend_registry().names()
+    selected_backend = None
+    if len(backend_names) > 1:
+        routed_backend = get_backend_registry().for_use_case(task_key).name
+        selected_backend = st.selectbox("LLM Backend", backend_names, index=backend_names.index(routed_backend))
+    
+    # Read by the request and follow-up fragments when they call the LLM
+    st.session_state.generation_settings = {"temperature": temperature, "top_p": top_p, "backend": selected_backend}
+
+@st.fragment
+def request_panel(vendor: str, task_key: Optional[str], language: str, lang: Dict) -> None:
     # Input & Generation
     user_input = st.text_area(
         lang.get("input_label", "Your input..."),
@@ -600,13 +1172,97 @@ with tab_storage:
         key="storage_input"
     )
     
+    # Pasted logs: repeated lines collapse into templates before prompting, so the length
+    # limit applies to the compacted evidence and more of it fits
+    evidence = user_input
+    # Performance data: local rules classify the bottlenecks; the model gets the findings table
+    if (task_key == "Performance Analysis" and looks_like_metrics(user_input)
+            and st.checkbox(lang.get("metrics_toggle"), value=True)):
+        evidence, metrics = digest_metrics(user_input, vendor)
+        st.caption(lang["metrics_caption"].format(**metrics))
+        with st.expander(lang.get("metrics_preview"), expanded=False):
+            st.markdown(evidence)
+    elif looks_like_log(user_input) and st.checkbox(lang.get("compact_toggle"), value=True):
+        evidence, compaction = compact_evidence(user_input)
+        st.caption(lang["compact_caption"].format(**compaction))
+        with st.expander(lang.get("compact_preview"), expanded=False):
+            st.code(evidence, language="text")
+    
     # Character counter
-    char_count = len(user_input) if user_input else 0
+    char_count = len(evidence) if evidence else 0
     char_color = "green" if char_count <= MAX_INPUT_LENGTH else "red"
     st.caption(f'<span style="color:{char_color}">{lang["char_count"].format(count=char_count, max=MAX_INPUT_LENGTH)}</span>', unsafe_allow_html=True)
     
+    # Similar past incidents are shown before generation for RCA / issue explanations
+    similar_incidents = []
+    use_incident_context = False
+    incident_index = get_incident_index()
+    if task_key in INCIDENT_USE_CASES and evidence.strip() and len(incident_index):
+        similar_incidents, query_ms = incident_index.search(evidence, k=SIMILAR_INCIDENTS_K, vendor=vendor)
+        if similar_incidents:
+            with st.expander(f"{lang.get('similar_title')} ({len(similar_incidents)})", expanded=True):
+                for incident in similar_incidents:
+                    st.markdown(
+                        f"**{incident.title}** — {incident.vendor}, {incident.timestamp[:10]} "
+                        f"(similarity {incident.similarity:.2f})\n\n{incident.summary}"
+                    )
+                st.caption(f"{query_ms:.1f} ms")
+            use_incident_context = st.checkbox(lang.get("similar_toggle"), value=False)
+    
+    knowledge_index = get_knowledge_index()
+    use_grounding = knowledge_index is not None and st.checkbox(lang.get("grounding_toggle"), value=True)
+    
+    # Schema-constrained JSON document, each section shown the moment it is complete
+    structured = supports_structured(task_key) and st.checkbox(lang.get("structured_toggle"), value=False)
+    
+    # Edited details of the last request: only the sections depending on the change are rewritten
+    regeneration = None
+    previous = st.session_state.get("last_request")
+    conversation = st.session_state.get("conversation")
+    if (previous and conversation and not structured and evidence.strip()
+            and (previous["task_key"], previous["vendor"], previous["language"]) == (task_key, vendor, language)):
+        plan = plan_regeneration(conversation.document, previous["input"], evidence)
+        if plan.incremental:
+            st.caption(lang["incremental_plan"].format(count=len(plan.affected), sections=", ".join(plan.titles),
+                                                       total=len([unit for unit in plan.units if unit.heading])))
+            regeneration = plan if st.checkbox(lang.get("incremental_toggle"), value=True) else None
+        elif plan.reason != "unchanged":
+            st.caption(lang["incremental_full"].format(reason=lang[f"incremental_reason_{plan.reason}"]))
+    
+    # Boilerplate-heavy documents: fixed bank wording is rendered locally, the model writes the rest
+    assembled = not structured and regeneration is None and supports_assembly(task_key) \
+        and st.checkbox(lang.get("assembly_toggle"), value=True)
+    
+    # Long documents: shared outline first, then every section as its own concurrent request
+    sectioned = not structured and not assembled and regeneration is None and supports_sectioned(task_key) \
+        and st.checkbox(lang.get("sectioned_toggle"), value=False)
+    
+    # Only relevant for German: reuse an English result of the same request instead of regenerating
+    reuse_cached = language != "English" and st.checkbox(lang.get("translate_toggle"), value=True)
+    
+    mapping = get_vendor_mapping()
+    
+    # A pasted known vendor alert is answered with the approved explanation, without an LLM call;
+    # input with more to it goes to the model with that explanation as context
+    known_errors = get_known_errors()
+    use_known_error_context = False
+    if task_key in KNOWN_ERROR_USE_CASES and evidence.strip():
+        preview = known_errors.lookup(evidence, vendor, record=False)
+        if preview is not None:
+            signatures = ", ".join(f"{m.signature.title} ({m.matched})" for m in preview.matches)
+            if preview.alert_only:
+                st.caption(lang["known_error_preview"].format(signatures=signatures))
+                use_known_error_context = st.checkbox(lang.get("known_error_toggle"), value=False)
+            else:
+                st.caption(lang["known_error_context_preview"].format(signatures=signatures))
+    
     if st.button(lang.get("button_label", "Generate →"), type="primary"):
-        is_valid, error_type = validate_input(user_input)
+        is_valid, error_type = validate_input(evidence)
+        # A migration input that is only an "equivalent of X on Y" question is answered from the table
+        equivalent = mapping.answer(evidence, default_source=vendor) \
+            if is_valid and mapping is not None and task_key in MAPPING_USE_CASES else None
+        known_error = known_errors.lookup(evidence, vendor) \
+            if is_valid and equivalent is None and task_key in KNOWN_ERROR_USE_CASES else None
         
         if not is_valid:
             if error_type == "empty":
@@ -615,38 +1271,296 @@ with tab_storage:
                 st.warning(lang.get("warning_input_too_long"))
         elif not task_key or task_key not in PROMPT_TEMPLATES:
             st.error("Selected task not implemented.")
+        elif equivalent is not None:
+            answer = equivalent.render(language)
+            st.session_state.storage_output = {
+                "result": answer,
+                "task_key": task_key,
+                "caption": lang["mapping_answer_caption"].format(version=mapping.version),
+                "sources": [],
+                "sections": None,
+            }
+            st.session_state.conversation = Conversation.start(task_key, vendor, evidence, answer)
+            st.session_state.pop("last_request", None)
+            st.rerun()
+        elif known_error is not None and known_error.alert_only and not use_known_error_context:
+            answer = known_error.render(language)
+            st.session_state.storage_output = {
+                "result": answer,
+                "task_key": task_key,
+                "caption": lang["known_error_answer_caption"].format(
+                    version=known_error.version, elapsed_us=known_error.elapsed_us,
+                    hit_rate=known_errors.stats()["hit_rate"]),
+                "sources": [],
+                "sections": None,
+            }
+            st.session_state.conversation = Conversation.start(task_key, vendor, evidence, answer)
+            st.session_state.pop("last_request", None)
+            st.rerun()
         else:
-            prompt = PROMPT_TEMPLATES[task_key].format(vendor=vendor, user_input=user_input)
+            settings = st.session_state.generation_settings
+            temperature, top_p = settings["temperature"], settings["top_p"]
+            # Everything added after the base prompt also goes into the cache key
+            context = ""
+            # The evidence alone: use case names ("explain issue error") only add frequent terms
+            passages = knowledge_index.search(evidence, k=RETRIEVAL_TOP_K, vendor=vendor) if use_grounding else []
+            if passages:
+                context += GROUNDING_TEMPLATE.format(context=format_context(passages, RETRIEVAL_TOKEN_BUDGET))
+            if use_incident_context:
+                context += INCIDENT_CONTEXT_TEMPLATE.format(context=format_incident_context(similar_incidents))
+            # Migration plans, and requests asking for an equivalent, get only the mapping rows the details
+            # mention, for source and target vendors
+            mapping_rows = [row for row, _ in mapping.lookup(evidence, vendor=vendor)] \
+                if mapping is not None and (task_key in MAPPING_USE_CASES or mentions_equivalent(evidence)) else []
+            if mapping_rows:
+                context += MAPPING_CONTEXT_TEMPLATE.format(version=mapping.version, context=format_mapping_context(
+                    mapping_rows, mapping_vendors(task_key, vendor, evidence)))
+            if known_error is not None:
+                context += KNOWN_ERROR_CONTEXT_TEMPLATE.format(version=known_error.version,
+                                                               context=known_error.context())
+            prompt = build_prompt(task_key, vendor, evidence) + context
+            registry = get_backend_registry()
+            llm = registry.get(settings["backend"]) if settings["backend"] else registry.for_use_case(task_key)
+            request_key = make_request_key(task_key, vendor, evidence, temperature, top_p, structured, sectioned,
+                                           assembled, backend=f"{llm.name}/{llm.config.model}", context=context)
+            result, metadata, source_caption, diff = None, None, None, None
             
-            with st.spinner(lang.get("spinner_text", "Generating...")):
-                # Pass the new default explicitly
-                result, metadata = ask_llm(prompt, language, temperature, top_p, max_tokens=MAX_OUTPUT_TOKENS)
+            if reuse_cached:
+                cached = get_cached_result(request_key, language)
+                if cached:
+                    result, metadata = cached
+                    source_caption = lang.get("cached_caption")
+                else:
+                    # Translating the Markdown would lose the sections (structured) or reword the approved
+                    # templates (assembled): those results are regenerated
+                    cached_english = None if structured or assembled else get_cached_result(request_key, "English")
+                    if cached_english:
+                        with st.spinner(lang.get("spinner_text", "Generating...")):
+                            result, metadata = translate_cached_result(cached_english[0], task_key)
+                        if result:
+                            source_caption = lang.get("translated_caption")
+                            cache_result(request_key, language, result, metadata)
+            
+            if not result and regeneration is not None:
+                live = st.container()
+                with st.spinner(lang.get("spinner_text", "Generating...")):
+                    result, metadata = regenerate_affected(regeneration, evidence, language, task_key, vendor,
+                                                           settings, live)
+                if result:
+                    diff = document_diff(join_units(regeneration.units), result)
+                    cache_result(request_key, language, result, metadata)
+                    if task_key in INCIDENT_USE_CASES:
+                        incident_index.add(task_key, vendor, language, *redact_for_storage(evidence, result))
+            elif not result and structured:
+                live = st.container()
+                with st.spinner(lang.get("spinner_text", "Generating...")):
+                    result, metadata = generate_structured(prompt, language, task_key, vendor, settings, live)
+                if result:
+                    cache_result(request_key, language, result, metadata)
+                    if task_key in INCIDENT_USE_CASES:
+                        incident_index.add(task_key, vendor, language, *redact_for_storage(evidence, result))
+            elif not result and assembled:
+                live = st.container()
+                with st.spinner(lang.get("spinner_text", "Generating...")):
+                    result, metadata = generate_assembled(prompt, language, task_key, vendor, settings, live)
+                if result:
+                    cache_result(request_key, language, result, metadata)
+            elif not result and sectioned:
+                live = st.container()
+                with st.spinner(lang.get("spinner_text", "Generating...")):
+                    result, metadata = generate_sectioned(prompt, language, task_key, vendor, settings, live)
+                if result:
+                    cache_result(request_key, language, result, metadata)
+            elif not result:
+                with st.spinner(lang.get("spinner_text", "Generating...")):
+                    # max_tokens comes from the completion budget learned for this use case and vendor
+                    result, metadata = ask_llm(prompt, language, temperature, top_p,
+                                               backend=settings["backend"], task_key=task_key, vendor=vendor)
+                if result:
+                    cache_result(request_key, language, result, metadata)
+                    if task_key in INCIDENT_USE_CASES:
+                        incident_index.add(task_key, vendor, language, *redact_for_storage(evidence, result))
+            
+            if result and source_caption is None:
+                # Newly generated: collect its commands (cached and translated results are already in the library)
+                get_command_library().add_output(task_key, vendor, *redact_for_storage(result))
             
             if result:
+                caption = None
                 if metadata:
                     total_tokens_display = metadata.get('usage', {}).get('total_tokens', 'N/A')
-                    st.caption(f"Model: {metadata.get('model', 'unknown')} • Tokens: {total_tokens_display}")
+                    caption = f"Model: {metadata.get('model', 'unknown')} • Tokens: {total_tokens_display}"
+                    if metadata.get("backend"):
+                        caption += f" • Backend: {metadata['backend']} • {metadata.get('latency_s', 0)}s • {metadata.get('tokens_per_s', 0)} tok/s"
+                    caption = f"{source_caption} • {caption}" if source_caption else caption
+                    if metadata.get("queue_s", 0) >= QUEUE_CAPTION_S:
+                        caption += " • " + lang.get("queued_caption").format(seconds=metadata["queue_s"],
+                                                                            lane=metadata.get("lane"))
+                    if metadata.get("continuations"):
+                        caption += " • " + lang.get("continued_caption").format(count=metadata["continuations"])
+                    if metadata.get("redactions"):
+                        caption += " • " + lang.get("redacted_caption").format(count=sum(metadata["redactions"].values()))
+                    if metadata.get("finish_reason") == "length":
+                        caption += " • " + lang.get("truncated_caption")
+                    if metadata.get("missing_sections"):
+                        caption += " • " + lang.get("structured_missing").format(
+                            sections=", ".join(metadata["missing_sections"]))
+                    if metadata.get("sectioned"):
+                        caption += " • " + lang.get("sectioned_caption").format(**metadata["sectioned"])
+                        if metadata["sectioned"]["failed"]:
+                            caption += " • " + lang.get("sectioned_failed").format(
+                                sections=", ".join(metadata["sectioned"]["failed"]))
+                    if metadata.get("assembly"):
+                        caption += " • " + lang.get("assembly_caption").format(**metadata["assembly"])
+                        if metadata["assembly"]["missing"]:
+                            caption += " • " + lang.get("assembly_missing").format(
+                                sections=", ".join(metadata["assembly"]["missing"]))
+                    if metadata.get("incremental"):
+                        incremental = metadata["incremental"]
+                        caption += " • " + lang.get("incremental_caption").format(
+                            count=len(incremental["regenerated"]), total=incremental["sections"],
+                            sections=", ".join(incremental["regenerated"]))
+                        if incremental["failed"]:
+                            caption += " • " + lang.get("incremental_failed").format(
+                                sections=", ".join(incremental["failed"]))
+                    if mapping_rows:
+                        caption += " • " + lang.get("mapping_caption").format(version=mapping.version,
+                                                                             rows=len(mapping_rows))
+                    if known_error is not None:
+                        caption += " • " + lang.get("known_error_caption").format(
+                            version=known_error.version, signatures=", ".join(m.matched for m in known_error.matches))
                 
-                with st.expander(lang.get("output_title", "Result"), expanded=True):
-                    if task_key == "Generate Ansible Playbook":
-                        st.code(result, language="yaml")
-                    else:
-                        st.markdown(result)
-                    
-                    # Action buttons
-                    col_export, col_copy = st.columns(2)
-                    
-                    with col_export:
-                        st.download_button(
-                            label=lang.get("export_label", "Export"),
-                            data=result,
-                            file_name=f"storage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                            mime="text/plain"
-                        )
-                    
-                    with col_copy:
-                        # Simple copy instruction - Streamlit doesn't support direct clipboard access
-                        st.info("💡 Select the text above and use Ctrl+C (Cmd+C on Mac) to copy")
+                st.session_state.storage_output = {
+                    "result": result,
+                    "task_key": task_key,
+                    "caption": caption,
+                    "sources": [(p.source, p.vendor, p.score) for p in passages],
+                    "sections": (metadata or {}).get("sections"),
+                    "diff": diff,
+                }
+                # New result starts a new follow-up thread; its details are the base for the next edit
+                st.session_state.conversation = Conversation.start(task_key, vendor, evidence, result)
+                st.session_state.last_request = {"task_key": task_key, "vendor": vendor, "language": language,
+                                                 "input": evidence}
+                st.rerun()
+
+def output_panel(lang: Dict) -> None:
+    output = st.session_state.get("storage_output")
+    if not output:
+        return
+    if output["caption"]:
+        st.caption(output["caption"])
+    render_output(output["result"], output["task_key"], lang, output.get("sections"))
+    if output.get("diff"):
+        with st.expander(lang.get("diff_title"), expanded=True):
+            st.code(output["diff"], language="diff")
+    if output["sources"]:
+        with st.expander(lang.get("sources_title"), expanded=False):
+            for number, (source, vendor, score) in enumerate(output["sources"], start=1):
+                st.markdown(f"**[{number}]** `{source}` ({vendor}, score {score})")
+
+@st.fragment
+def followup_panel(language: str, lang: Dict) -> None:
+    # Follow-up refinement of the last result: only the affected sections are sent and regenerated
+    conversation = st.session_state.get("conversation")
+    if not conversation:
+        return
+    st.markdown(f"### {lang.get('followup_title')}")
+    followup = st.text_input(lang.get("followup_label"), key="followup_input")
+    
+    if st.button(lang.get("followup_button")):
+        if not followup.strip():
+            st.warning(lang.get("warning_empty_followup"))
+        else:
+            settings = st.session_state.generation_settings
+            with st.spinner(lang.get("spinner_text", "Generating...")):
+                if conversation.needs_compaction():
+                    conversation.compact(lambda text: summarize_turns(text, language))
+                history, prompt = conversation.build_followup(followup)
+                revision, metadata = ask_llm(prompt, language, settings["temperature"], settings["top_p"],
+                                             max_tokens=MAX_OUTPUT_TOKENS, backend=settings["backend"],
+                                             task_key=conversation.task_key, history=history)
+            
+            changed = conversation.apply(followup, revision) if revision else []
+            if revision and not changed:
+                # No headings in the answer: the document is kept, the answer is only shown here
+                st.warning(lang.get("followup_not_spliced"))
+                st.markdown(revision)
+            elif revision:
+                get_command_library().add_output(conversation.task_key, conversation.vendor,
+                                                 *redact_for_storage(revision))
+                caption = lang.get("followup_caption").format(sections=", ".join(changed))
+                if metadata:
+                    caption += f" • Tokens: {metadata.get('usage', {}).get('total_tokens', 'N/A')}"
+                st.session_state.storage_output = {
+                    "result": conversation.document,
+                    "task_key": conversation.task_key,
+                    "caption": caption,
+                    "sources": [],
+                    "sections": None,       # The revision is Markdown; the JSON export no longer matches
+                }
+                st.rerun()
+
+@st.fragment
+def command_library_panel(vendor: str, lang: Dict) -> None:
+    # Commands from earlier outputs, for this vendor (plus host-side commands); lookups never call the LLM
+    library = get_command_library()
+    with st.expander(lang.get("commands_title"), expanded=False):
+        total = len(library)
+        if not total:
+            st.caption(lang.get("commands_empty"))
+            return
+        query = st.text_input(lang.get("commands_search"), key="commands_query")
+        facets = library.facets(vendor)
+        all_label = lang.get("commands_all")
+        col_object, col_verb = st.columns(2)
+        with col_object:
+            selected_object = st.selectbox(lang.get("commands_object"), [all_label] + facets["objects"],
+                                           key="commands_object")
+        with col_verb:
+            selected_verb = st.selectbox(lang.get("commands_verb"), [all_label] + facets["verbs"],
+                                         key="commands_verb")
+        results, elapsed_ms = library.search(
+            query, vendor=vendor,
+            object=None if selected_object == all_label else selected_object,
+            verb=None if selected_verb == all_label else selected_verb,
+        )
+        if not results:
+            st.caption(lang.get("commands_none"))
+        for command in results:
+            st.caption(lang.get("commands_entry").format(
+                count=command.count, vendor=command.vendor, object=command.object, verb=command.verb or "–",
+                last_seen=command.last_seen[:10]))
+            st.code(command.example, language="yaml" if command.kind == "ansible" else "bash")
+        st.caption(lang.get("commands_footer").format(results=len(results), total=total, ms=f"{elapsed_ms:.1f}"))
+
+with tab_storage:
+    st.subheader(lang.get("storage_title"))
+    
+    # Vendor and use case drive everything below, so changing them reruns the page
+    vendor = st.selectbox(lang.get("vendor_label", "Storage Vendor"), VENDORS)
+    
+    displayed_tasks = get_displayed_use_cases(language)
+    selected_task = st.selectbox(lang.get("task_label", "Use Case"), displayed_tasks)
+    
+    task_key = get_task_key_from_display(selected_task, language)
+    
+    settings_panel(task_key)
+    request_panel(vendor, task_key, language, lang)
+    output_panel(lang)
+    followup_panel(language, lang)
+    command_library_panel(vendor, lang)
+
+# Live remaining budget (user and team, across all sessions)
+with quota_placeholder.container():
+    st.caption(lang.get("quota_title"))
+    try:
+        remaining = get_quota_governor().remaining(*get_requester())
+    except STORE_ERRORS as e:
+        logger.warning("Remaining budget unavailable: %s", e)
+        remaining = {}
+    for scope, limits in remaining.items():
+        st.caption(f"{scope}: " + " · ".join(f"{value:,} {name.replace('_', ' ')}" for name, value in limits.items()))
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,212 @@
+"""
+"Similar past incidents" index over generated RCAs and issue explanations.
+
+Every stored incident (input + generated output) becomes a sparse TF-IDF vector over
+hashed unigrams and bigrams. Approximate nearest neighbours come from random-hyperplane
+LSH (SimHash): each vector gets a 128-bit signature whose Hamming distance estimates the
+angle between vectors. A query scans all signatures with vectorized XOR/popcount, and
+the closest candidates are re-ranked by exact cosine similarity.
+
+Incidents are persisted in an append-only JSONL file. The index updates online: `add()`
+appends and indexes immediately, and every query first picks up lines appended by other
+worker processes.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from markdown_sections import split_sections
+from retrieval import tokenize
+
+INCIDENT_INDEX_PATH = os.path.join(".index", "incidents.jsonl")
+INCIDENT_USE_CASES = ("Generate Incident RCA", "Explain Issue and Error")
+HASH_BITS = 16                  # 65,536 hashed feature dimensions
+SIGNATURE_BITS = 128            # SimHash signature length
+RERANK_CANDIDATES = 64          # Closest signatures re-ranked by exact cosine
+MIN_SIMILARITY = 0.15
+
+
+@dataclass
+class SimilarIncident:
+    incident_id: int
+    similarity: float
+    timestamp: str
+    task_key: str
+    vendor: str
+    title: str
+    summary: str
+
+
+def _features(text: str) -> Dict[int, float]:
+    """Hashed unigram + bigram counts with sublinear TF."""
+    terms = tokenize(text)
+    grams = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+    mask = (1 << HASH_BITS) - 1
+    counts = Counter(hash_feature(g) & mask for g in grams)
+    return {index: 1.0 + math.log(count) for index, count in counts.items()}
+
+
+def hash_feature(gram: str) -> int:
+    """Stable across processes (unlike hash(), which is salted per interpreter)."""
+    h = 2166136261
+    for byte in gram.encode("utf-8"):
+        h = ((h ^ byte) * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def _root_cause_summary(output: str, limit: int = 320) -> str:
+    """Root cause (or first) section of a generated output, shortened for display and prompts."""
+    sections = [s for s in split_sections(output) if s.body.strip()]
+    chosen = next((s for s in sections if "cause" in s.key or "ursache" in s.key), sections[0] if sections else None)
+    text = " ".join((chosen.body if chosen else output).split())
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + " ..."
+
+
+class IncidentIndex:
+    def __init__(self, path: str = INCIDENT_INDEX_PATH, seed: int = 7):
+        self.path = path
+        self._lock = threading.Lock()
+        rng = np.random.default_rng(seed)
+        # One random +/-1 hyperplane per signature bit, stored row-wise per hashed feature (8 MB)
+        self._planes = rng.choice(np.array([-1, 1], dtype=np.int8), size=(1 << HASH_BITS, SIGNATURE_BITS))
+        self._signatures = np.zeros((1024, SIGNATURE_BITS // 8), dtype=np.uint8)
+        self._records: List[Dict] = []
+        self._vectors: List[Dict[int, float]] = []
+        self._df: Counter = Counter()
+        self._offset = 0
+
+    # ---------- Vectorization ----------
+
+    def _idf(self, feature: int) -> float:
+        return math.log((1 + len(self._records)) / (1 + self._df.get(feature, 0))) + 1.0
+
+    def _vector(self, features: Dict[int, float]) -> Dict[int, float]:
+        weighted = {f: w * self._idf(f) for f, w in features.items()}
+        norm = math.sqrt(sum(w * w for w in weighted.values())) or 1.0
+        return {f: w / norm for f, w in weighted.items()}
+
+    def _signature(self, vector: Dict[int, float]) -> np.ndarray:
+        if not vector:
+            return np.zeros(SIGNATURE_BITS // 8, dtype=np.uint8)
+        indices = np.fromiter(vector.keys(), dtype=np.int64, count=len(vector))
+        weights = np.fromiter(vector.values(), dtype=np.float32, count=len(vector))
+        return np.packbits((weights @ self._planes[indices]) > 0)
+
+    # ---------- Persistence / online updates ----------
+
+    def _index_record(self, record: Dict) -> None:
+        features = _features(f"{record['vendor']} {record['input']} {record['output']}")
+        self._df.update(features.keys())
+        vector = self._vector(features)
+        incident_id = len(self._records)
+        if incident_id == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.zeros_like(self._signatures)])
+        self._signatures[incident_id] = self._signature(vector)
+        self._records.append(record)
+        self._vectors.append(vector)
+
+    def _catch_up(self) -> None:
+        """Index lines appended to the file since the last read (by this or another worker)."""
+        try:
+            if os.path.getsize(self.path) <= self._offset:
+                return
+        except FileNotFoundError:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break       # Partially written line; picked up next time
+                self._offset += len(line)
+                try:
+                    self._index_record(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+
+    def add(self, task_key: str, vendor: str, language: str, user_input: str, output: str) -> None:
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "task_key": task_key,
+            "vendor": vendor,
+            "language": language,
+            "input": user_input,
+            "output": output,
+        }
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._catch_up()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # O_APPEND keeps concurrent writers from interleaving within a line
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._catch_up()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._catch_up()
+            return len(self._records)
+
+    # ---------- Queries ----------
+
+    def _candidates(self, vector: Dict[int, float]) -> List[int]:
+        """Incidents with the smallest signature Hamming distance to `vector`."""
+        count = len(self._records)
+        if count <= RERANK_CANDIDATES:
+            return list(range(count))
+        xor = np.bitwise_xor(self._signatures[:count], self._signature(vector))
+        if hasattr(np, "bitwise_count"):
+            distances = np.bitwise_count(xor).sum(axis=1, dtype=np.int32)
+        else:
+            distances = np.unpackbits(xor, axis=1).sum(axis=1, dtype=np.int32)
+        return np.argpartition(distances, RERANK_CANDIDATES)[:RERANK_CANDIDATES].tolist()
+
+    def search(self, text: str, k: int = 3, vendor: Optional[str] = None) -> Tuple[List[SimilarIncident], float]:
+        """Top-k similar incidents and the query time in milliseconds."""
+        start = time.perf_counter()
+        with self._lock:
+            self._catch_up()
+            query = self._vector(_features(f"{vendor or ''} {text}"))
+            scored = []
+            for incident_id in self._candidates(query):
+                stored = self._vectors[incident_id]
+                similarity = sum(w * stored.get(f, 0.0) for f, w in query.items())
+                if similarity >= MIN_SIMILARITY:
+                    scored.append((similarity, incident_id))
+            scored.sort(reverse=True)
+
+            results = []
+            for similarity, incident_id in scored[:k]:
+                record = self._records[incident_id]
+                results.append(SimilarIncident(
+                    incident_id=incident_id,
+                    similarity=round(similarity, 3),
+                    timestamp=record["timestamp"],
+                    task_key=record["task_key"],
+                    vendor=record["vendor"],
+                    title=record["input"].strip().splitlines()[0][:120] if record["input"].strip() else "",
+                    summary=_root_cause_summary(record["output"]),
+                ))
+        return results, (time.perf_counter() - start) * 1000
+
+
+def format_incident_context(incidents: List[SimilarIncident]) -> str:
+    """Compact prompt block: one short entry per similar incident."""
+    lines = []
+    for number, incident in enumerate(incidents, start=1):
+        lines.append(
+            f"[P{number}] {incident.timestamp[:10]} {incident.vendor} - {incident.title}\n"
+            f"      Previous finding: {incident.summary}"
+        )
+    return "\n".join(lines)
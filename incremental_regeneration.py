@@ -0,0 +1,320 @@
+"""
+Incremental regeneration after an edit of the request details.
+
+Iterating on a document usually means changing one detail of the request ("Planned
+maintenance window: Saturday 22:00 - Sunday 06:00" -> "Sunday 01:00 - 05:00") and
+generating again. Instead of the whole document, only the sections that depend on the
+changed facts are rewritten:
+
+1. the new details are diffed against the previous ones word by word; every change
+   keeps the clause around it and the values it removed and added;
+2. each top-level section of the previous output is checked against the changes: it
+   depends on them if it still quotes a removed value, or if its heading or body shares
+   enough terms with the changed clauses;
+3. the affected sections are rewritten concurrently, each with the change spelled out,
+   and spliced into the previous output in place; `document_diff` shows what changed.
+
+Changes touching most of the input or most of the sections are regenerated in full.
+This module has no Streamlit dependency; the caller supplies the LLM calls.
+"""
+
+import difflib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from continuation import merge_usage
+from markdown_sections import ATX_HEADING, BOLD_HEADING, FENCE, STOPWORDS, outline, split_sections
+
+MAX_CHANGED_INPUT_SHARE = 0.5       # More of the input rewritten than this: regenerate in full
+MAX_AFFECTED_SHARE = 0.6            # More of the sections affected than this: regenerate in full
+CONTEXT_WORDS = 6                   # Words kept on each side of a change (within its clause)
+MIN_SHARED_TERMS = 2                # Terms of a changed clause a section must share (heading terms count twice)
+COMMON_TERM_SHARE = 0.5             # Terms in more of the sections than this are the topic, not a dependency
+DIFF_CONTEXT_LINES = 1
+
+VALUE = re.compile(r"[0-9A-Za-zäöüÄÖÜß][0-9A-Za-zäöüÄÖÜß:./_+%-]*")
+TERM = re.compile(r"[a-zA-ZäöüÄÖÜß][a-zA-ZäöüÄÖÜß_-]{2,}")
+CLAUSE_END = re.compile(r"[.;!?]$")
+# Words too generic to tie a clause to a section
+GENERIC_TERMS = STOPWORDS | {
+    "storage", "system", "systems", "production", "planned", "plan", "new", "all", "will", "are", "has",
+    "have", "not", "any", "per", "via", "must", "should", "within", "possible", "after", "before", "during",
+    "der", "den", "des", "ein", "eine", "ist", "sind", "wird", "von",
+}
+
+REGENERATE_TEMPLATE = """
+An existing {use_case} document for {vendor} is being updated because its request details were edited.
+
+Updated request details:
+{details}
+
+What changed:
+{changes}
+
+Document outline:
+{outline}
+
+Current text of the section to update:
+{section}
+
+Rewrite ONLY this section so it is consistent with the updated details. Keep its structure and
+everything the change does not affect; update every value, time, step and statement that depends
+on it. Start with the section's heading line (unchanged unless it quotes a changed detail), keep its
+sub-sections, and return nothing else.
+"""
+
+
+@dataclass
+class FactChange:
+    before: str         # Clause around the change in the previous details ("" for an addition at the end)
+    after: str          # Same clause in the new details
+    removed: List[str]  # Words removed by the change
+    added: List[str]    # Words added by the change
+
+
+@dataclass
+class InputDiff:
+    changes: List[FactChange]
+    changed_share: float            # Share of the previous words removed or replaced
+
+    @property
+    def removed_values(self) -> Set[str]:
+        return {v for change in self.changes for v in _values(" ".join(change.removed))}
+
+    @property
+    def context_terms(self) -> Set[str]:
+        return {t for change in self.changes for t in _terms(f"{change.before} {change.after}")}
+
+    def describe(self) -> str:
+        """The changes as prompt lines: before -> after."""
+        lines: List[str] = []
+        for change in self.changes:
+            if any(f'"{change.before}"' in line and f'"{change.after}"' in line for line in lines):
+                continue        # Several edits within one clause
+            if change.before and change.after:
+                lines.append(f'- was: "{change.before}" -> now: "{change.after}"')
+            elif change.after:
+                lines.append(f'- added: "{change.after}"')
+            else:
+                lines.append(f'- removed: "{change.before}"')
+        return "\n".join(lines)
+
+
+@dataclass
+class Unit:
+    """A top-level section of a document, with its sub-sections."""
+    heading: str
+    text: str
+
+    @property
+    def title(self) -> str:
+        return self.heading.strip().lstrip("#").strip().strip("*").strip().rstrip(":") or "(preamble)"
+
+
+@dataclass
+class RegenerationPlan:
+    diff: InputDiff
+    units: List[Unit]
+    affected: List[int] = field(default_factory=list)
+    reason: Optional[str] = None    # Why the document has to be regenerated in full; None if incremental
+
+    @property
+    def incremental(self) -> bool:
+        return self.reason is None and bool(self.affected)
+
+    @property
+    def titles(self) -> List[str]:
+        return [self.units[index].title for index in self.affected]
+
+
+def _values(text: str) -> Set[str]:
+    """Literal values of a text (names, numbers, times, versions), lowercased, without trailing punctuation."""
+    values = set()
+    for match in VALUE.findall(text):
+        value = match.rstrip(".:/-").lower()
+        # Single digits are list numbering as often as they are facts
+        if value not in GENERIC_TERMS and (len(value) > 2 or (len(value) == 2 and any(c.isdigit() for c in value))):
+            values.add(value)
+    return values
+
+
+def _terms(text: str) -> Set[str]:
+    return {t for t in (m.lower() for m in TERM.findall(text)) if t not in GENERIC_TERMS}
+
+
+def _words(text: str) -> Tuple[List[str], Set[int]]:
+    """Words of a text and the positions of words that end a line."""
+    words: List[str] = []
+    line_ends: Set[int] = set()
+    for line in text.splitlines():
+        words.extend(line.split())
+        if words:
+            line_ends.add(len(words) - 1)
+    return words, line_ends
+
+
+def _clause(words: List[str], line_ends: Set[int], start: int, end: int) -> str:
+    """Words[start:end] widened by up to CONTEXT_WORDS on each side, not across a sentence or line end."""
+    def ends_clause(position: int) -> bool:
+        return position in line_ends or bool(CLAUSE_END.search(words[position]))
+
+    left = start
+    while left > 0 and start - left < CONTEXT_WORDS and not ends_clause(left - 1):
+        left -= 1
+    right = end
+    while right < len(words) and right - end < CONTEXT_WORDS and not (right > start and ends_clause(right - 1)):
+        right += 1
+    return " ".join(words[left:right])
+
+
+def diff_inputs(previous: str, current: str) -> InputDiff:
+    """Word-level changes from the previous request details to the current ones."""
+    (old, old_ends), (new, new_ends) = _words(previous), _words(current)
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    changes, changed = [], 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        changed += i2 - i1
+        changes.append(FactChange(
+            before=_clause(old, old_ends, i1, i2) if old else "",
+            after=_clause(new, new_ends, j1, j2) if new else "",
+            removed=old[i1:i2],
+            added=new[j1:j2],
+        ))
+    # Values that only moved (removed here, added elsewhere) are not changed facts
+    new_values = _values(current)
+    for change in changes:
+        change.removed = [w for w in change.removed if not (_values(w) and _values(w) <= new_values)]
+    share = changed / len(old) if old else 1.0
+    return InputDiff(changes=changes, changed_share=share)
+
+
+def document_units(document: str) -> List[Unit]:
+    """Top-level sections: split at the highest heading level that occurs more than once.
+
+    A single title heading ("# Change Request: ...") stays a unit of its own with any
+    text after it; deeper headings belong to the unit above them.
+    """
+    lines = document.strip("\n").splitlines()
+    headings, in_fence = [], False         # (line number, level), as split_sections finds them
+    for number, line in enumerate(lines):
+        if FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and ATX_HEADING.match(line):
+            headings.append((number, len(ATX_HEADING.match(line).group(1))))
+        elif not in_fence and BOLD_HEADING.match(line):
+            headings.append((number, 4))
+    if not headings:
+        return [Unit("", document.strip())] if document.strip() else []
+    levels = [level for _, level in headings]
+    repeated = [level for level in set(levels) if levels.count(level) > 1]
+    unit_level = min(repeated) if repeated else min(levels)
+    # Slices of the original lines, so unchanged sections are reproduced exactly
+    starts = [number for number, level in headings if level <= unit_level]
+    if starts[0] > 0 and "".join(lines[:starts[0]]).strip():
+        starts.insert(0, 0)
+    units = []
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        heading = lines[start].rstrip() if any(start == number for number, _ in headings) else ""
+        units.append(Unit(heading, "\n".join(lines[start:end]).strip("\n")))
+    return units
+
+
+def join_units(units: List[Unit], replacements: Optional[Dict[int, str]] = None) -> str:
+    replacements = replacements or {}
+    texts = [replacements.get(index) or unit.text for index, unit in enumerate(units)]
+    return "\n\n".join(text.strip("\n") for text in texts).strip() + "\n"
+
+
+def _affected(units: List[Unit], diff: InputDiff) -> List[int]:
+    """Sections that quote a removed value or share enough specific terms with a changed clause."""
+    removed = diff.removed_values
+    headed = [index for index, unit in enumerate(units) if unit.heading]
+    unit_terms = {index: _terms(units[index].text) for index in headed}
+    frequency: Dict[str, int] = {}
+    for terms in unit_terms.values():
+        for term in terms:
+            frequency[term] = frequency.get(term, 0) + 1
+    context = {t for t in diff.context_terms if frequency.get(t, 0) <= COMMON_TERM_SHARE * len(headed)}
+    affected = []
+    for index in headed:
+        shared = len(context & unit_terms[index]) + len(context & _terms(units[index].heading))
+        if removed & _values(units[index].text) or shared >= MIN_SHARED_TERMS:
+            affected.append(index)
+    return affected
+
+
+def plan_regeneration(document: str, previous_input: str, current_input: str) -> RegenerationPlan:
+    """Which sections of `document` (generated from `previous_input`) the edit affects."""
+    diff = diff_inputs(previous_input, current_input)
+    units = document_units(document)
+    plan = RegenerationPlan(diff=diff, units=units)
+    headed = [unit for unit in units if unit.heading]
+    if not diff.changes:
+        plan.reason = "unchanged"
+    elif len(headed) < 2:
+        plan.reason = "no_sections"
+    elif diff.changed_share > MAX_CHANGED_INPUT_SHARE:
+        plan.reason = "input_rewritten"
+    else:
+        plan.affected = _affected(units, diff)
+        if not plan.affected:
+            plan.reason = "no_dependency"
+        elif len(plan.affected) > MAX_AFFECTED_SHARE * len(headed):
+            plan.reason = "most_sections"
+    return plan
+
+
+def regeneration_prompt(plan: RegenerationPlan, index: int, use_case: str, vendor: str, current_input: str) -> str:
+    return REGENERATE_TEMPLATE.format(
+        use_case=use_case, vendor=vendor, details=current_input.strip(), changes=plan.diff.describe(),
+        outline=outline(split_sections(join_units(plan.units))) or "(no headings)",
+        section=plan.units[index].text,
+    )
+
+
+def regenerated_unit(unit: Unit, content: str) -> str:
+    """A rewritten section as returned by the model, under the original heading if it dropped it."""
+    text = content.strip("\n")
+    sections = split_sections(text)
+    if sections and sections[0].heading:
+        return text
+    return f"{unit.heading}\n{text}" if unit.heading else text
+
+
+def document_diff(previous: str, current: str) -> str:
+    """Unified line diff of two versions of a document."""
+    return "\n".join(difflib.unified_diff(previous.splitlines(), current.splitlines(), "previous", "updated",
+                                          n=DIFF_CONTEXT_LINES, lineterm=""))
+
+
+def merge_regeneration_metadata(section_metas: List[Optional[Dict]], plan: RegenerationPlan,
+                                elapsed_s: float) -> Dict:
+    """One metadata record for the update: usage summed, latency as the user saw it."""
+    done = [meta for meta in section_metas if meta]
+    usage: Dict = {}
+    redactions: Dict[str, int] = {}
+    for meta in done:
+        usage = merge_usage(usage, meta.get("usage") or {})
+        # Every request carries the same details, so a value redacted in each of them still counts once
+        for kind, count in (meta.get("redactions") or {}).items():
+            redactions[kind] = max(redactions.get(kind, 0), count)
+    completion_tokens = usage.get("completion_tokens", 0)
+    return {
+        **done[0],
+        "usage": usage,
+        "finish_reason": "length" if any(meta.get("finish_reason") == "length" for meta in done) else "stop",
+        "continuations": sum(meta.get("continuations", 0) for meta in done),
+        "redactions": redactions,
+        "latency_s": round(elapsed_s, 3),
+        "queue_s": round(max(meta.get("queue_s", 0.0) for meta in done), 3),
+        "tokens_per_s": round(completion_tokens / elapsed_s, 1) if elapsed_s else 0.0,
+        "incremental": {
+            "sections": len([unit for unit in plan.units if unit.heading]),
+            "regenerated": [title for title, meta in zip(plan.titles, section_metas) if meta],
+            "failed": [title for title, meta in zip(plan.titles, section_metas) if not meta],
+            "request_ids": [meta.get("request_id") for meta in done],
+        },
+    }
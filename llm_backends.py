@@ -0,0 +1,432 @@
+"""
+Pluggable LLM backends for the Storage Engineering AI Assistant.
+
+A backend is any OpenAI-compatible chat completions endpoint: the public OpenAI API
+or an on-premises model server (llama.cpp server, vLLM, ...) reachable via base URL.
+Each backend has its own model, concurrency limit and latency/throughput statistics,
+and normalizes responses into an `LLMResponse` so callers never parse SDK objects.
+Requests waiting for a concurrency slot are served by priority lane (priority_lanes).
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from openai import AsyncOpenAI, OpenAI
+
+from priority_lanes import LanePolicy, PriorityDispatcher, default_policy, lanes_from_settings
+
+DEFAULT_BACKEND = "openai"
+
+
+@dataclass
+class BackendConfig:
+    name: str
+    model: str
+    base_url: Optional[str] = None      # None = public OpenAI API
+    api_key: Optional[str] = None
+    max_concurrency: int = 8            # Parallel in-flight requests allowed against this backend
+    timeout: float = 120.0
+    stream_usage: bool = True           # Ask for usage in the last stream chunk (stream_options)
+    json_schema: bool = True            # Server supports response_format json_schema (else json_object)
+
+
+@dataclass
+class LLMResponse:
+    content: Optional[str]
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+    finish_reason: Optional[str] = None
+    latency_s: float = 0.0
+    first_token_s: Optional[float] = None     # Streaming only: time to first content delta
+    queue_s: float = 0.0                      # Time spent waiting for a concurrency slot
+
+    @property
+    def total_tokens(self) -> int:
+        return self.usage.get("total_tokens") or (
+            self.usage.get("prompt_tokens", 0) + self.usage.get("completion_tokens", 0)
+        )
+
+
+def _to_dict(obj: Any) -> Dict:
+    """Best-effort conversion of SDK objects / dicts to a plain dict."""
+    if obj is None:
+        return {}
+    if isinstance(obj, dict):
+        return obj
+    for method in ("model_dump", "to_dict"):
+        if hasattr(obj, method):
+            try:
+                return getattr(obj, method)() or {}
+            except Exception:
+                pass
+    try:
+        return dict(obj)
+    except Exception:
+        return {}
+
+
+def normalize_response(response: Any, default_model: str) -> LLMResponse:
+    """Normalize an OpenAI-style chat completion (SDK object or dict) into an LLMResponse.
+
+    OpenAI-compatible servers differ in what they fill in: some omit `usage` or `model`,
+    older ones put the text in `choices[0].text`. Missing fields fall back to safe defaults.
+    """
+    raw = _to_dict(response)
+
+    content, finish_reason = None, None
+    choices = raw.get("choices") or []
+    if choices:
+        first = _to_dict(choices[0])
+        message = _to_dict(first.get("message"))
+        content = message.get("content") or first.get("text") or first.get("content")
+        finish_reason = first.get("finish_reason")
+    if content is None:
+        content = raw.get("text") or raw.get("content")
+
+    usage = {}
+    for key, value in _to_dict(raw.get("usage")).items():
+        if isinstance(value, (int, float)):
+            usage[key] = int(value)
+
+    return LLMResponse(
+        content=content,
+        model=raw.get("model") or default_model,
+        usage=usage,
+        finish_reason=finish_reason,
+    )
+
+
+class BackendStats:
+    """Thread-safe request, latency and throughput counters for one backend."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.completion_tokens = 0
+        self.busy_seconds = 0.0
+
+    def record(self, latency_s: float, completion_tokens: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.completion_tokens += completion_tokens
+            self.busy_seconds += latency_s
+            self._latencies.append(latency_s)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            requests, errors = self.requests, self.errors
+            completion_tokens, busy = self.completion_tokens, self.busy_seconds
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+        return {
+            "requests": requests,
+            "errors": errors,
+            "avg_latency_s": round(busy / requests, 3) if requests else 0.0,
+            "p95_latency_s": round(p95, 3),
+            "completion_tokens_per_s": round(completion_tokens / busy, 1) if busy else 0.0,
+        }
+
+
+class LLMBackend:
+    """One OpenAI-compatible endpoint with a bounded number of concurrent requests.
+
+    The slots are handed out by `lanes` (see priority_lanes); `lane` on every call names
+    the request's lane, None is the policy's default lane.
+    """
+
+    def __init__(self, config: BackendConfig, lanes: Optional[LanePolicy] = None):
+        self.config = config
+        # Local servers usually ignore the key, but the SDK requires a non-empty one
+        self.client = OpenAI(
+            api_key=config.api_key or "not-needed",
+            base_url=config.base_url,
+            timeout=config.timeout,
+        )
+        # One dispatcher for threads and asyncio tasks: a process runs either the app or the API
+        self.slots = PriorityDispatcher(config.max_concurrency, lanes)
+        self._async_client: Optional[AsyncOpenAI] = None
+        self.stats = BackendStats()
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def normalize(self, response: Any) -> LLMResponse:
+        return normalize_response(response, self.config.model)
+
+    def complete(self, messages: List[Dict[str, str]], temperature: float, top_p: float,
+                 max_tokens: int, model: Optional[str] = None, lane: Optional[str] = None,
+                 **extra) -> LLMResponse:
+        """Send a chat completion; blocks while the backend's concurrency limit is reached.
+
+        Exceptions from the SDK propagate unchanged so callers can classify them.
+        """
+        with self.slots.slot(lane) as queue_s:
+            start = time.perf_counter()
+            try:
+                response = self.client.chat.completions.create(
+                    model=model or self.config.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p,
+                    **extra
+                )
+            except Exception:
+                self.stats.record_error()
+                raise
+            latency = time.perf_counter() - start
+
+        result = self.normalize(response)
+        result.latency_s, result.queue_s = latency, queue_s
+        self.stats.record(latency, result.usage.get("completion_tokens", 0))
+        return result
+
+    def stream(self, messages: List[Dict[str, str]], temperature: float, top_p: float,
+               max_tokens: int, model: Optional[str] = None, lane: Optional[str] = None,
+               **extra) -> "TextStream":
+        """Stream content deltas; `.response` holds the normalized totals once exhausted.
+
+        Holds one of the backend's concurrency slots while the stream is consumed.
+        """
+        return TextStream(self, lane, dict(
+            model=model or self.config.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            **extra
+        ))
+
+    # ---------- asyncio (REST API) ----------
+
+    def _async(self) -> AsyncOpenAI:
+        """Async client, created on first use inside the running event loop."""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                api_key=self.config.api_key or "not-needed",
+                base_url=self.config.base_url,
+                timeout=self.config.timeout,
+            )
+        return self._async_client
+
+    async def acomplete(self, messages: List[Dict[str, str]], temperature: float, top_p: float,
+                        max_tokens: int, model: Optional[str] = None, lane: Optional[str] = None,
+                        **extra) -> LLMResponse:
+        client = self._async()
+        async with self.slots.aslot(lane) as queue_s:
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(
+                    model=model or self.config.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=top_p,
+                    **extra
+                )
+            except Exception:
+                self.stats.record_error()
+                raise
+            latency = time.perf_counter() - start
+
+        result = self.normalize(response)
+        result.latency_s, result.queue_s = latency, queue_s
+        self.stats.record(latency, result.usage.get("completion_tokens", 0))
+        return result
+
+    def astream(self, messages: List[Dict[str, str]], temperature: float, top_p: float,
+                max_tokens: int, model: Optional[str] = None, lane: Optional[str] = None,
+                **extra) -> "AsyncTextStream":
+        """Stream content deltas; `.response` holds the normalized totals once exhausted."""
+        return AsyncTextStream(self, lane, dict(
+            model=model or self.config.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            **extra
+        ))
+
+
+class _StreamAccumulator:
+    """Parses the raw SSE lines of a streamed chat completion and collects the totals.
+
+    Raw lines + json.loads instead of SDK chunk objects: building a model object per
+    chunk dominated the CPU profile of the API's streaming path.
+    """
+
+    def __init__(self, default_model: str):
+        self.default_model = default_model
+        self.parts: List[str] = []
+        self.model, self.usage, self.finish_reason, self.first_token = None, {}, None, None
+        self.start = time.perf_counter()
+        self.done = False
+
+    def feed(self, line: str) -> Optional[str]:
+        """Content delta carried by one SSE line, if any."""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            self.done = True
+            return None
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            raise RuntimeError(f"stream error: {_to_dict(chunk['error']).get('message', chunk['error'])}")
+        self.model = chunk.get("model") or self.model
+        if chunk.get("usage"):
+            self.usage = {k: int(v) for k, v in chunk["usage"].items() if isinstance(v, (int, float))}
+        text = []
+        for choice in chunk.get("choices") or []:
+            self.finish_reason = choice.get("finish_reason") or self.finish_reason
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                text.append(delta)
+        if not text:
+            return None
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+        delta = "".join(text)
+        self.parts.append(delta)
+        return delta
+
+    def response(self) -> LLMResponse:
+        content = "".join(self.parts)
+        usage = self.usage
+        if not usage:
+            # Server without stream usage support: estimate (~4 characters per token)
+            usage = {"completion_tokens": len(content) // 4, "estimated": 1}
+        return LLMResponse(
+            content=content,
+            model=self.model or self.default_model,
+            usage=usage,
+            finish_reason=self.finish_reason,
+            latency_s=time.perf_counter() - self.start,
+            first_token_s=self.first_token,
+        )
+
+
+class TextStream:
+    """Iterator over the text deltas of one streamed completion; `.response` once exhausted."""
+
+    def __init__(self, backend: LLMBackend, lane: Optional[str], params: Dict[str, Any]):
+        self.backend = backend
+        self.lane = lane
+        self.params = params
+        self.response: Optional[LLMResponse] = None
+
+    def __iter__(self) -> Iterator[str]:
+        params = dict(self.params, stream=True)
+        if self.backend.config.stream_usage:
+            params["stream_options"] = {"include_usage": True}
+
+        with self.backend.slots.slot(self.lane) as queue_s:
+            acc = _StreamAccumulator(self.params["model"])
+            try:
+                with self.backend.client.chat.completions.with_streaming_response.create(**params) as raw:
+                    for line in raw.iter_lines():
+                        delta = acc.feed(line)
+                        if delta:
+                            yield delta
+                        if acc.done:
+                            break
+            except Exception:
+                self.backend.stats.record_error()
+                raise
+            self.response = acc.response()
+            self.response.queue_s = queue_s
+        self.backend.stats.record(self.response.latency_s, self.response.usage.get("completion_tokens", 0))
+
+
+class AsyncTextStream(TextStream):
+    """Async iterator over the text deltas of one streamed completion."""
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._run()
+
+    async def _run(self) -> AsyncIterator[str]:
+        client = self.backend._async()
+        params = dict(self.params, stream=True)
+        if self.backend.config.stream_usage:
+            params["stream_options"] = {"include_usage": True}
+
+        async with self.backend.slots.aslot(self.lane) as queue_s:
+            acc = _StreamAccumulator(self.params["model"])
+            try:
+                async with client.chat.completions.with_streaming_response.create(**params) as raw:
+                    async for line in raw.iter_lines():
+                        delta = acc.feed(line)
+                        if delta:
+                            yield delta
+                        if acc.done:
+                            break
+            except Exception:
+                self.backend.stats.record_error()
+                raise
+            self.response = acc.response()
+            self.response.queue_s = queue_s
+        self.backend.stats.record(self.response.latency_s, self.response.usage.get("completion_tokens", 0))
+
+
+class BackendRegistry:
+    """Named backends plus the use case -> backend routing table and the priority lanes."""
+
+    def __init__(self, configs: List[BackendConfig], use_case_backends: Optional[Dict[str, str]] = None,
+                 default: str = DEFAULT_BACKEND, lanes: Optional[LanePolicy] = None):
+        self.lanes = lanes or default_policy()
+        self.backends = {config.name: LLMBackend(config, self.lanes) for config in configs}
+        self.use_case_backends = dict(use_case_backends or {})
+        self.default = default if default in self.backends else next(iter(self.backends))
+
+    def names(self) -> List[str]:
+        return list(self.backends)
+
+    def get(self, name: Optional[str] = None) -> LLMBackend:
+        return self.backends.get(name or self.default) or self.backends[self.default]
+
+    def for_use_case(self, task_key: Optional[str]) -> LLMBackend:
+        return self.get(self.use_case_backends.get(task_key or ""))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: backend.stats.snapshot() for name, backend in self.backends.items()}
+
+    def lane_stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Per-lane queue metrics of every backend."""
+        return {name: backend.slots.snapshot() for name, backend in self.backends.items()}
+
+
+def registry_from_settings(settings: Dict, openai_api_key: Optional[str], default_model: str) -> BackendRegistry:
+    """Build the registry from secrets-style settings ([llm_backends.*], [use_case_backends]
+    and [priority_lanes]).
+
+    The default "openai" backend always exists; an [llm_backends.openai] table overrides its
+    settings (e.g. max_concurrency for the REST API).
+    """
+    backends = {DEFAULT_BACKEND: {}}
+    backends.update({name: dict(cfg) for name, cfg in dict(settings.get("llm_backends", {})).items()})
+    configs = []
+    for name, cfg in backends.items():
+        is_default = name == DEFAULT_BACKEND
+        configs.append(BackendConfig(
+            name=name,
+            model=cfg.get("model", default_model) if is_default else cfg["model"],
+            base_url=cfg.get("base_url"),
+            api_key=cfg.get("api_key", openai_api_key if is_default else None),
+            max_concurrency=int(cfg.get("max_concurrency", 8 if is_default else 4)),
+            timeout=float(cfg.get("timeout", 120)),
+            stream_usage=bool(cfg.get("stream_usage", True)),
+            json_schema=bool(cfg.get("json_schema", True))
+        ))
+    return BackendRegistry(configs, dict(settings.get("use_case_backends", {})),
+                           lanes=lanes_from_settings(settings.get("priority_lanes", {})))
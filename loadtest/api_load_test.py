@@ -0,0 +1,160 @@
+"""
+Load test for the REST API (copilot_api.py): N concurrent clients for a fixed duration.
+
+Each client keeps one HTTP/1.1 keep-alive connection and sends generate requests back to
+back, either as JSON or as SSE streams. Reports sustained requests/s, latency percentiles,
+time to first token (SSE) and errors. Uses only the standard library.
+
+    python loadtest/mock_llm.py --port 18999 &
+    OPENAI_BASE_URL=http://127.0.0.1:18999/v1 OPENAI_API_KEY=mock \\
+        uvicorn copilot_api:app --port 8080 --log-level warning &
+    python loadtest/api_load_test.py --url http://127.0.0.1:8080 --concurrency 300 --duration 30 --stream
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from completion_budget import percentile  # noqa: E402
+
+SAMPLE_INPUT = (
+    "Aggregate aggr_data01 on cluster fas-prod-01 reports 98% used. Volume vol_sap_prd grew 400 GB "
+    "overnight; snapshot reserve exceeded. Explain the likely cause and the immediate actions."
+)
+
+
+class Connection:
+    """Minimal HTTP/1.1 keep-alive client (Content-Length and chunked bodies)."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, path: str, body: bytes, on_chunk=None) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers: Dict[str, str] = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding") == "chunked":
+            parts = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                data = await self.reader.readexactly(size)
+                await self.reader.readline()
+                if on_chunk:
+                    on_chunk(data)
+                parts.append(data)
+            payload = b"".join(parts)
+        else:
+            payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, payload
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def client(url, path: str, body: bytes, stream: bool, deadline: float, results: Dict) -> None:
+    connection = Connection(url.hostname, url.port or 80)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        first_token: List[float] = []
+
+        def on_chunk(data: bytes) -> None:
+            if not first_token and b"event: token" in data:
+                first_token.append(time.perf_counter() - start)
+
+        try:
+            status, payload = await connection.request(path, body, on_chunk if stream else None)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            results["errors"][type(e).__name__] = results["errors"].get(type(e).__name__, 0) + 1
+            connection.close()
+            await asyncio.sleep(0.1)
+            continue
+        elapsed = time.perf_counter() - start
+
+        ok = status == 200 and (b"event: done" in payload if stream else b'"output"' in payload)
+        if not ok:
+            key = f"HTTP {status}" if status != 200 else "incomplete"
+            results["errors"][key] = results["errors"].get(key, 0) + 1
+            continue
+        results["latencies"].append(elapsed)
+        results["first_token"].extend(first_token)
+        results["completed_at"].append(time.perf_counter())
+    connection.close()
+
+
+async def run(args) -> Dict:
+    url = urlparse(args.url)
+    path = f"/v1/use-cases/{args.use_case}"
+    body = json.dumps({"vendor": args.vendor, "input": SAMPLE_INPUT, "stream": args.stream,
+                       "max_tokens": args.max_tokens}).encode()
+    results = {"latencies": [], "first_token": [], "completed_at": [], "errors": {}}
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(client(url, path, body, args.stream, deadline, results)
+                           for _ in range(args.concurrency)))
+    wall = time.perf_counter() - start
+
+    # Sustained rate: completions after the warm-up, over the steady-state part of the run
+    steady = [t for t in results["completed_at"] if start + args.warmup <= t <= deadline]
+    steady_window = max(1e-9, args.duration - args.warmup)
+    return {
+        "concurrency": args.concurrency,
+        "mode": "sse" if args.stream else "json",
+        "duration_s": round(wall, 1),
+        "completed": len(results["latencies"]),
+        "errors": results["errors"],
+        "sustained_rps": round(len(steady) / steady_window, 1),
+        "latency_p50_s": round(percentile(results["latencies"], 50), 3),
+        "latency_p95_s": round(percentile(results["latencies"], 95), 3),
+        "latency_p99_s": round(percentile(results["latencies"], 99), 3),
+        "first_token_p50_s": round(percentile(results["first_token"], 50), 3) if args.stream else None,
+        "first_token_p95_s": round(percentile(results["first_token"], 95), 3) if args.stream else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the copilot REST API")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds excluded from the sustained rate")
+    parser.add_argument("--use-case", default="explain-issue-and-error")
+    parser.add_argument("--vendor", default="NetApp ONTAP")
+    parser.add_argument("--max-tokens", type=int, default=1500)
+    parser.add_argument("--stream", action="store_true", help="request SSE streams instead of JSON")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
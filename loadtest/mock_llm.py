@@ -0,0 +1,121 @@
+"""
+Local mock of an OpenAI-compatible chat completions endpoint for load tests.
+
+Answers POST /v1/chat/completions (plain and streamed) with a canned Markdown document
+after a configurable time to first token and token rate, so API and app throughput can
+be measured without spending real tokens. Requests with a json_schema `response_format`
+get a JSON object with every schema property filled (structured output).
+
+    python loadtest/mock_llm.py --port 18999 --first-token-ms 300 --tokens 400 --tokens-per-s 200
+    export OPENAI_BASE_URL=http://127.0.0.1:18999/v1 OPENAI_API_KEY=mock
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+SETTINGS = {"first_token_ms": 300, "tokens": 400, "tokens_per_s": 200.0, "chunk_tokens": 4}
+
+WORDS = (
+    "## Summary\nThe aggregate reached its space threshold after snapshot growth exceeded the reserve. "
+    "## Root Cause\nSnapshot autodelete was disabled on the volume and the schedule kept hourly copies. "
+    "## Remediation\n1. Enable autodelete.\n2. Resize the volume.\n3. Validate free space and alerts. "
+).split(" ")
+
+
+def completion_words(count: int) -> list:
+    # One word ~ one token is close enough for throughput numbers
+    return [(WORDS[i % len(WORDS)] + " ") for i in range(count)]
+
+
+def structured_words(schema: dict, count: int) -> list:
+    """JSON document for a json_schema response_format, split into ~count word tokens."""
+    properties = schema.get("properties") or {"answer": {"type": "string"}}
+    per_field = max(1, count // len(properties))
+    document = {}
+    for i, (name, spec) in enumerate(properties.items()):
+        words = [WORDS[(i * per_field + j) % len(WORDS)] for j in range(per_field)]
+        if spec.get("type") == "array":
+            document[name] = [" ".join(words[j:j + 6]) for j in range(0, len(words), 6)]
+        else:
+            document[name] = " ".join(words)
+    text = json.dumps(document, ensure_ascii=False)
+    return [part + " " for part in text.split(" ")[:-1]] + [text.split(" ")[-1]]
+
+
+def usage(request_body: dict, completion_tokens: int) -> dict:
+    prompt_chars = sum(len(m.get("content") or "") for m in request_body.get("messages", []))
+    prompt_tokens = prompt_chars // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+async def chat_completions(request: Request):
+    body = await request.json()
+    tokens = min(SETTINGS["tokens"], int(body.get("max_tokens") or SETTINGS["tokens"]))
+    finish_reason = "length" if tokens < SETTINGS["tokens"] else "stop"
+    schema = ((body.get("response_format") or {}).get("json_schema") or {}).get("schema")
+    words = structured_words(schema, tokens) if schema else completion_words(tokens)
+    model = body.get("model", "mock")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        await asyncio.sleep(SETTINGS["first_token_ms"] / 1000 + tokens / SETTINGS["tokens_per_s"])
+        return JSONResponse({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": finish_reason,
+                         "message": {"role": "assistant", "content": "".join(words)}}],
+            "usage": usage(body, tokens),
+        })
+
+    def chunk(delta: dict, finish=None, chunk_usage=None) -> str:
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if delta is not None else []}
+        if chunk_usage:
+            payload["usage"] = chunk_usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def events():
+        await asyncio.sleep(SETTINGS["first_token_ms"] / 1000)
+        yield chunk({"role": "assistant", "content": ""})
+        step = SETTINGS["chunk_tokens"]
+        for i in range(0, len(words), step):
+            yield chunk({"content": "".join(words[i:i + step])})
+            await asyncio.sleep(step / SETTINGS["tokens_per_s"])
+        yield chunk({}, finish=finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, chunk_usage=usage(body, tokens))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+app = Starlette(routes=[Route("/v1/chat/completions", chat_completions, methods=["POST"])])
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18999)
+    parser.add_argument("--first-token-ms", type=int, default=SETTINGS["first_token_ms"])
+    parser.add_argument("--tokens", type=int, default=SETTINGS["tokens"], help="completion tokens per answer")
+    parser.add_argument("--tokens-per-s", type=float, default=SETTINGS["tokens_per_s"])
+    parser.add_argument("--chunk-tokens", type=int, default=SETTINGS["chunk_tokens"], help="tokens per stream chunk")
+    args = parser.parse_args()
+    SETTINGS.update(first_token_ms=args.first_token_ms, tokens=args.tokens,
+                    tokens_per_s=args.tokens_per_s, chunk_tokens=max(1, args.chunk_tokens))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", backlog=2048)
+
+
+if __name__ == "__main__":
+    main()
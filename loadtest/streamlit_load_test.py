@@ -0,0 +1,490 @@
+"""
+Concurrent-session load test and capacity report for the Streamlit app.
+
+Starts the app (`streamlit run`, headless) against the mock LLM (loadtest/mock_llm.py),
+then drives N simulated engineers over Streamlit's own websocket protocol, the same
+protobuf BackMsg / ForwardMsg frames a browser sends and receives. Every virtual user
+repeatedly picks a vendor and use case, moves the temperature slider, types an input
+and clicks "Run AI Assistant", with think time in between.
+
+Per load level it measures:
+  - rerun latency (rerun request -> script finished) for widget interactions and for
+    generate clicks, separately, since the latter include the LLM call
+  - websocket bytes and messages per rerun, and the largest single message
+  - server CPU (cores used, CPU ms per rerun) and resident memory per session
+
+The degradation point is the first level whose interaction p95 exceeds the SLO or
+twice the single-session p95. The report lists the largest level before it.
+
+    python loadtest/streamlit_load_test.py --sessions 1,5,10,20,40 --duration 60 \\
+        --report capacity_report.md
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "engineering_copilot_st_enhanced.py")
+MOCK_PATH = os.path.join(REPO_DIR, "loadtest", "mock_llm.py")
+sys.path.insert(0, REPO_DIR)
+from completion_budget import percentile  # noqa: E402
+RUN_LABEL = "Run AI Assistant"
+INPUT_LABEL_PREFIX = "Input ("
+TEMPERATURE_LABEL_PREFIX = "Temperature"
+VENDOR_LABEL = "Select Storage Vendor"
+USE_CASE_LABEL = "Select Use Case"
+RERUN_TIMEOUT_S = 120.0
+INTERACTION_STEPS = ("vendor", "use case", "slider", "input")
+DEGRADATION_FLOOR_MS = 250      # "2x single-session p95" never triggers below this
+
+SAMPLE_INPUTS = [
+    "Aggregate {id} reports 97% used after overnight snapshot growth on the SAP volumes.",
+    "SnapMirror relationship to DR site lagging 6 hours for {id}; transfer keeps failing with a network error.",
+    "Host group {id}: latency spikes to 25 ms on the Oracle LUNs every night at 02:00.",
+    "Plan the replacement of array {id}: 280 TB used, 8% monthly growth, DORA evidence needed.",
+    "Change request to expand volume {id} by 2 TB during the Saturday maintenance window.",
+]
+
+# ============================
+# Measurements
+# ============================
+
+@dataclass
+class Rerun:
+    kind: str               # "load", "generate" or the interaction step ("vendor", "slider", ...)
+    latency_s: float
+    bytes: int
+    messages: int
+    max_message: int
+    error: bool = False
+
+
+@dataclass
+class LevelResult:
+    sessions: int
+    duration_s: float
+    reruns: List[Rerun] = field(default_factory=list)
+    cpu_s: float = 0.0
+    rss_idle_mb: float = 0.0
+    rss_peak_mb: float = 0.0
+    failed_sessions: int = 0
+
+
+class ProcessSampler:
+    """CPU seconds and RSS of the server process tree from /proc (Linux)."""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def _pids(self) -> List[int]:
+        pids, queue = [], [self.pid]
+        while queue:
+            pid = queue.pop()
+            pids.append(pid)
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as f:
+                    queue.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu_s(self) -> float:
+        if not self.pid:
+            return 0.0
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])      # utime + stime
+            except (OSError, IndexError, ValueError):
+                pass
+        return total / self.ticks
+
+    def rss_mb(self) -> float:
+        if not self.pid:
+            return 0.0
+        total_kb = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total_kb += int(line.split()[1])
+            except (OSError, ValueError):
+                pass
+        return total_kb / 1024
+
+# ============================
+# Virtual User (Streamlit websocket protocol)
+# ============================
+
+class Session:
+    """One browser tab: a websocket session that reruns the script with widget states."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ws = None
+        self.widgets: Dict[str, Tuple[str, str, object, str]] = {}   # label -> (id, type, element, fragment id)
+        self.states: Dict[str, Tuple[str, object]] = {}         # widget id -> (value field, value)
+
+    async def connect(self) -> Rerun:
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None,
+                                           open_timeout=RERUN_TIMEOUT_S)
+        return await self.rerun("load")
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+
+    def _widget(self, label_prefix: str) -> Tuple[str, str, object, str]:
+        for label, widget in self.widgets.items():
+            if label.startswith(label_prefix):
+                return widget
+        raise KeyError(f"widget '{label_prefix}' not rendered")
+
+    def _collect_widgets(self, msg: ForwardMsg) -> None:
+        if msg.WhichOneof("type") != "delta" or msg.delta.WhichOneof("type") != "new_element":
+            return
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type")
+        widget = getattr(element, kind, None) if kind else None
+        if widget is not None and getattr(widget, "id", "") and hasattr(widget, "label"):
+            self.widgets[widget.label] = (widget.id, kind, widget, msg.delta.fragment_id)
+
+    async def rerun(self, kind: str, trigger: Optional[str] = None, fragment_id: str = "") -> Rerun:
+        """Rerun like the browser does: only the fragment when the widget lives in one."""
+        back = BackMsg()
+        back.rerun_script.query_string = ""
+        back.rerun_script.page_script_hash = ""
+        back.rerun_script.fragment_id = fragment_id
+        for widget_id, (value_field, value) in self.states.items():
+            state = back.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            if value_field == "double_array_value":
+                state.double_array_value.data.extend(value)
+            else:
+                setattr(state, value_field, value)
+        if trigger:
+            state = back.rerun_script.widget_states.widgets.add()
+            state.id = trigger
+            state.trigger_value = True
+
+        start = time.perf_counter()
+        await self.ws.send(back.SerializeToString())
+        total, count, largest, error = 0, 0, 0, False
+        while True:
+            data = await asyncio.wait_for(self.ws.recv(), RERUN_TIMEOUT_S)
+            total, count, largest = total + len(data), count + 1, max(largest, len(data))
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            self._collect_widgets(msg)
+            if msg.WhichOneof("type") == "delta" and msg.delta.new_element.WhichOneof("type") == "exception":
+                error = True
+            if msg.WhichOneof("type") == "script_finished":
+                if msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    break
+        return Rerun(kind, time.perf_counter() - start, total, count, largest, error)
+
+    # ---------- User actions ----------
+
+    async def select(self, label: str, option: str, step: str) -> Rerun:
+        widget_id, _, _, fragment_id = self._widget(label)
+        self.states[widget_id] = ("string_value", option)
+        return await self.rerun(step, fragment_id=fragment_id)
+
+    def options(self, label: str) -> List[str]:
+        return list(self._widget(label)[2].options)
+
+    async def slide(self, label_prefix: str, value: float, step: str) -> Rerun:
+        widget_id, _, _, fragment_id = self._widget(label_prefix)
+        self.states[widget_id] = ("double_array_value", [value])
+        return await self.rerun(step, fragment_id=fragment_id)
+
+    async def type_text(self, label_prefix: str, text: str, step: str) -> Rerun:
+        widget_id, _, _, fragment_id = self._widget(label_prefix)
+        self.states[widget_id] = ("string_value", text)
+        return await self.rerun(step, fragment_id=fragment_id)
+
+    async def click(self, label: str) -> Rerun:
+        widget_id, _, _, fragment_id = self._widget(label)
+        return await self.rerun("generate", trigger=widget_id, fragment_id=fragment_id)
+
+
+async def virtual_user(number: int, url: str, deadline: float, think_s: float, result: LevelResult,
+                       connected: asyncio.Event, ready: List[int], total: int) -> None:
+    rng = random.Random(number)
+    session = Session(url)
+    try:
+        result.reruns.append(await session.connect())
+    except Exception:
+        result.failed_sessions += 1
+        ready.append(number)
+        if len(ready) == total:
+            connected.set()
+        return
+    ready.append(number)
+    if len(ready) == total:
+        connected.set()
+
+    iteration = 0
+    try:
+        while time.time() < deadline:
+            iteration += 1
+            steps = [
+                lambda: session.select(VENDOR_LABEL, rng.choice(session.options(VENDOR_LABEL)), "vendor"),
+                lambda: session.select(USE_CASE_LABEL, rng.choice(session.options(USE_CASE_LABEL)), "use case"),
+                lambda: session.slide(TEMPERATURE_LABEL_PREFIX, round(rng.uniform(0.1, 0.5) / 0.05) * 0.05, "slider"),
+                # Unique text per iteration so the shared result cache does not short-circuit the LLM call
+                lambda: session.type_text(INPUT_LABEL_PREFIX, rng.choice(SAMPLE_INPUTS).format(id=f"u{number}-{iteration}"),
+                                          "input"),
+                lambda: session.click(RUN_LABEL),
+            ]
+            for step in steps:
+                if time.time() >= deadline:
+                    break
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * think_s)
+                result.reruns.append(await step())
+    except Exception:
+        result.failed_sessions += 1
+    finally:
+        await session.close()
+
+# ============================
+# Test Run
+# ============================
+
+async def run_level(url: str, sessions: int, duration_s: float, think_s: float,
+                    sampler: ProcessSampler) -> LevelResult:
+    result = LevelResult(sessions=sessions, duration_s=duration_s)
+    result.rss_idle_mb = sampler.rss_mb()
+    connected, ready = asyncio.Event(), []
+    deadline = time.time() + duration_s
+    cpu_start = sampler.cpu_s()
+
+    async def watch_memory():
+        await connected.wait()
+        while time.time() < deadline:
+            result.rss_peak_mb = max(result.rss_peak_mb, sampler.rss_mb())
+            await asyncio.sleep(1.0)
+
+    watcher = asyncio.create_task(watch_memory())
+    await asyncio.gather(*(virtual_user(n, url, deadline, think_s, result, connected, ready, sessions)
+                           for n in range(sessions)))
+    watcher.cancel()
+    result.cpu_s = sampler.cpu_s() - cpu_start
+    result.rss_peak_mb = max(result.rss_peak_mb, sampler.rss_mb())
+    return result
+
+
+def summarize(result: LevelResult) -> Dict:
+    interactions = [r for r in result.reruns if r.kind in INTERACTION_STEPS]
+    generates = [r for r in result.reruns if r.kind == "generate"]
+    loads = [r for r in result.reruns if r.kind == "load"]
+    reruns = len(result.reruns)
+    return {
+        "sessions": result.sessions,
+        "reruns": reruns,
+        "reruns_per_s": round(reruns / result.duration_s, 2),
+        "generates": len(generates),
+        "errors": sum(r.error for r in result.reruns) + result.failed_sessions,
+        "load_p95_ms": round(percentile([r.latency_s for r in loads], 95) * 1000),
+        "interaction_p50_ms": round(percentile([r.latency_s for r in interactions], 50) * 1000),
+        "interaction_p95_ms": round(percentile([r.latency_s for r in interactions], 95) * 1000),
+        "generate_p50_ms": round(percentile([r.latency_s for r in generates], 50) * 1000),
+        "generate_p95_ms": round(percentile([r.latency_s for r in generates], 95) * 1000),
+        "kb_per_rerun": round(sum(r.bytes for r in result.reruns) / max(1, reruns) / 1024, 1),
+        "kb_per_page_load": round(sum(r.bytes for r in loads) / max(1, len(loads)) / 1024, 1),
+        "msgs_per_rerun": round(sum(r.messages for r in result.reruns) / max(1, reruns), 1),
+        "max_message_kb": round(max((r.max_message for r in result.reruns), default=0) / 1024, 1),
+        "cpu_cores": round(result.cpu_s / result.duration_s, 2),
+        "cpu_ms_per_rerun": round(result.cpu_s * 1000 / max(1, reruns), 1),
+        "rss_mb": round(result.rss_peak_mb, 1),
+        "rss_mb_per_session": round(max(0.0, result.rss_peak_mb - result.rss_idle_mb) / result.sessions, 2),
+        "steps": {
+            step: {
+                "p50_ms": round(percentile([r.latency_s for r in runs], 50) * 1000),
+                "kb_per_rerun": round(sum(r.bytes for r in runs) / len(runs) / 1024, 2),
+                "msgs_per_rerun": round(sum(r.messages for r in runs) / len(runs), 1),
+            }
+            for step in INTERACTION_STEPS + ("generate",)
+            for runs in [[r for r in result.reruns if r.kind == step]] if runs
+        },
+    }
+
+
+def find_degradation(rows: List[Dict], slo_ms: float) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """(largest healthy level, first degraded level)."""
+    baseline = rows[0]["interaction_p95_ms"] if rows else 0
+    healthy = None
+    for row in rows:
+        limit = min(slo_ms, max(2 * baseline, DEGRADATION_FLOOR_MS))
+        if row["interaction_p95_ms"] > limit or row["errors"]:
+            return healthy, row
+        healthy = row
+    return healthy, None
+
+
+def render_report(rows: List[Dict], args, healthy: Optional[Dict], degraded: Optional[Dict]) -> str:
+    lines = [
+        "# Streamlit Capacity Report",
+        "",
+        f"- Date: {time.strftime('%Y-%m-%d %H:%M')}",
+        f"- Host: {os.cpu_count()} CPU(s), Python {sys.version.split()[0]}",
+        f"- Flow per user: vendor -> use case -> temperature -> input -> Run AI Assistant, "
+        f"think time ~{args.think_s}s per step",
+        f"- Mock LLM: {args.llm_first_token_ms} ms first token, {args.llm_tokens} tokens at "
+        f"{args.llm_tokens_per_s:g} tokens/s",
+        f"- Interaction SLO: p95 <= {args.slo_ms:g} ms (or 2x the single-session p95)",
+        "",
+        "| Sessions | Reruns/s | Interaction p50 / p95 (ms) | Generate p50 / p95 (ms) | Page load p95 (ms) "
+        "| KB/rerun | KB/page load | Max msg (KB) | CPU cores | CPU ms/rerun | RSS (MB) | MB/session | Errors |",
+        "|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|---:|",
+    ]
+    for r in rows:
+        lines.append(
+            f"| {r['sessions']} | {r['reruns_per_s']} | {r['interaction_p50_ms']} / {r['interaction_p95_ms']} "
+            f"| {r['generate_p50_ms']} / {r['generate_p95_ms']} | {r['load_p95_ms']} | {r['kb_per_rerun']} "
+            f"| {r['kb_per_page_load']} | {r['max_message_kb']} | {r['cpu_cores']} | {r['cpu_ms_per_rerun']} "
+            f"| {r['rss_mb']} | {r['rss_mb_per_session']} | {r['errors']} |"
+        )
+    lines += [
+        "",
+        f"Per user action at {rows[0]['sessions']} session(s) (fragment reruns send only the fragment's elements):",
+        "",
+        "| Action | Rerun p50 (ms) | KB/rerun | Messages/rerun |",
+        "|---|---:|---:|---:|",
+    ]
+    for step, stats in rows[0]["steps"].items() if rows else []:
+        lines.append(f"| {step} | {stats['p50_ms']} | {stats['kb_per_rerun']} | {stats['msgs_per_rerun']} |")
+    lines.append("")
+    if degraded:
+        lines.append(f"**Degradation point:** {degraded['sessions']} concurrent sessions "
+                     f"(interaction p95 {degraded['interaction_p95_ms']} ms, {degraded['errors']} errors).")
+    else:
+        lines.append("**Degradation point:** not reached at the tested levels.")
+    if healthy:
+        sessions = healthy["sessions"]
+        memory = healthy["rss_mb"] * 1.25
+        lines += [
+            "",
+            f"**Sizing:** one replica serves up to **{sessions}** concurrent active sessions within the SLO. "
+            f"Plan replicas as `ceil(peak concurrent engineers / {sessions})` and request ~{healthy['cpu_cores']:.2f} CPU "
+            f"and ~{memory:.0f} MB memory per replica (peak RSS + 25% headroom). "
+            "One Streamlit process is limited by the GIL to roughly one core, so add replicas rather than CPUs.",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def wait_for_http(url: str, timeout_s: float) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return
+        except Exception:
+            time.sleep(0.3)
+    raise RuntimeError(f"{url} did not come up within {timeout_s:.0f}s")
+
+
+def start_servers(args, workdir: str) -> List[subprocess.Popen]:
+    """Mock LLM plus a headless Streamlit server running in a scratch directory."""
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w") as f:
+        f.write(
+            'OPENAI_API_KEY = "mock"\n'
+            f'INCIDENT_INDEX_PATH = "{os.path.join(workdir, "incidents.jsonl")}"\n'
+            "[llm_backends.openai]\nmax_concurrency = 1000\n"
+            "[quota]\nuser_tokens_per_minute = 0\nuser_requests_per_minute = 0\nteam_tokens_per_minute = 0\n"
+        )
+    mock = subprocess.Popen([
+        sys.executable, MOCK_PATH, "--port", str(args.mock_port),
+        "--first-token-ms", str(args.llm_first_token_ms), "--tokens", str(args.llm_tokens),
+        "--tokens-per-s", str(args.llm_tokens_per_s),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{args.mock_port}/v1")
+    app = subprocess.Popen([
+        sys.executable, "-m", "streamlit", "run", APP_PATH,
+        "--server.headless", "true", "--server.port", str(args.port),
+        "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false",
+    ], cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_http(f"http://127.0.0.1:{args.port}/_stcore/health", 60)
+    return [app, mock]
+
+
+async def main_async(args) -> List[Dict]:
+    url = f"ws://127.0.0.1:{args.port}/_stcore/stream"
+    sampler = ProcessSampler(args.server_pid)
+    # Warm-up page load: module imports and cached resources must not count as per-session memory
+    warmup = Session(url)
+    await warmup.connect()
+    await warmup.close()
+    rows = []
+    for sessions in args.sessions:
+        result = await run_level(url, sessions, args.duration, args.think_s, sampler)
+        rows.append(summarize(result))
+        print(json.dumps(rows[-1]), file=sys.stderr)
+        await asyncio.sleep(args.cooldown)
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the Streamlit app")
+    parser.add_argument("--sessions", default="1,5,10,20,40",
+                        type=lambda s: [int(x) for x in s.split(",")], help="comma-separated load levels")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds per load level")
+    parser.add_argument("--think-s", type=float, default=2.0, help="mean think time between user actions")
+    parser.add_argument("--slo-ms", type=float, default=1000.0, help="interaction rerun p95 target")
+    parser.add_argument("--cooldown", type=float, default=3.0)
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--mock-port", type=int, default=18999)
+    parser.add_argument("--llm-first-token-ms", type=int, default=800)
+    parser.add_argument("--llm-tokens", type=int, default=600)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=120.0)
+    parser.add_argument("--external", action="store_true",
+                        help="use an app already running on --port (pass --server-pid for CPU/memory)")
+    parser.add_argument("--server-pid", type=int, default=None)
+    parser.add_argument("--report", default=None, help="write the Markdown report to this file")
+    args = parser.parse_args()
+
+    workdir, processes = None, []
+    try:
+        if not args.external:
+            workdir = tempfile.mkdtemp(prefix="copilot-loadtest-")
+            processes = start_servers(args, workdir)
+            args.server_pid = processes[0].pid
+        rows = asyncio.run(main_async(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    healthy, degraded = find_degradation(rows, args.slo_ms)
+    report = render_report(rows, args, healthy, degraded)
+    print(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Section-level helpers for generated Markdown documents.
+
+Generated runbooks, CRs and RCAs are structured by headings ("## Rollback Plan",
+"**3. Risk Assessment**"). These helpers split a document into sections, build a
+compact outline, pick the sections relevant to a request and splice revised
+sections back into the original without touching the rest.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+ATX_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+BOLD_HEADING = re.compile(r"^\*\*([^*]{2,120})\*\*:?\s*$")
+FENCE = re.compile(r"^\s*(```|~~~)")
+WORD = re.compile(r"[a-zA-ZäöüÄÖÜß0-9_\-]{3,}")
+
+STOPWORDS = {
+    "the", "and", "for", "with", "add", "make", "instead", "please", "this", "that", "from",
+    "into", "also", "all", "each", "der", "die", "das", "und", "mit", "für", "bitte", "auch",
+}
+
+
+@dataclass
+class Section:
+    heading: str        # Heading line as written, "" for text before the first heading
+    level: int          # 1-6 for "#" headings, 4 for bold-only lines, 0 for the preamble
+    body: str
+
+    @property
+    def key(self) -> str:
+        return normalize_heading(self.heading)
+
+    def render(self) -> str:
+        if not self.heading:
+            return self.body
+        return f"{self.heading}\n{self.body}" if self.body else self.heading
+
+
+def normalize_heading(heading: str) -> str:
+    """Heading text without markup and numbering, lowercased: '## 3. Rollback Plan' -> 'rollback plan'."""
+    text = heading.strip().lstrip("#").strip().strip("*").strip()
+    text = re.sub(r"^(step\s+)?[0-9ivx]+[.)]\s*", "", text, flags=re.IGNORECASE)
+    return re.sub(r"\s+", " ", text.rstrip(":")).lower()
+
+
+def _heading_level(line: str) -> Optional[int]:
+    if ATX_HEADING.match(line):
+        return len(ATX_HEADING.match(line).group(1))
+    if BOLD_HEADING.match(line):
+        return 4
+    return None
+
+
+def split_sections(text: str) -> List[Section]:
+    """Split Markdown into sections at headings; headings inside code fences are ignored."""
+    sections: List[Section] = []
+    heading, level, body = "", 0, []
+    in_fence = False
+
+    for line in text.splitlines():
+        if FENCE.match(line):
+            in_fence = not in_fence
+        found = None if in_fence else _heading_level(line)
+        if found is not None:
+            if heading or "".join(body).strip():
+                sections.append(Section(heading, level, "\n".join(body).strip("\n")))
+            heading, level, body = line.rstrip(), found, []
+        else:
+            body.append(line)
+
+    if heading or "".join(body).strip():
+        sections.append(Section(heading, level, "\n".join(body).strip("\n")))
+    return sections
+
+
+def join_sections(sections: List[Section]) -> str:
+    return "\n\n".join(section.render() for section in sections).strip() + "\n"
+
+
+def outline(sections: List[Section]) -> str:
+    """Indented heading list, a few tokens per section."""
+    lines = []
+    for section in sections:
+        if section.heading:
+            indent = "  " * max(0, section.level - 1) if section.level <= 3 else "      "
+            lines.append(f"{indent}- {section.heading.strip().lstrip('#').strip()}")
+    return "\n".join(lines)
+
+
+def _terms(text: str) -> List[str]:
+    return [w for w in (m.lower() for m in WORD.findall(text)) if w not in STOPWORDS]
+
+
+def relevant_sections(sections: List[Section], query: str, limit: int = 2) -> List[Section]:
+    """Sections sharing the most terms with `query`; heading matches weigh more than body matches."""
+    query_terms = set(_terms(query))
+    scored = []
+    for index, section in enumerate(sections):
+        heading_terms = set(_terms(section.heading))
+        body_terms = _terms(section.body)
+        score = 3 * len(query_terms & heading_terms) + sum(1 for t in body_terms if t in query_terms) / (1 + len(body_terms)) ** 0.5
+        if score > 0:
+            scored.append((score, index))
+    chosen = sorted(index for _, index in sorted(scored, reverse=True)[:limit])
+    return [sections[i] for i in chosen]
+
+
+def splice_sections(document: str, revised: str) -> Tuple[str, List[str]]:
+    """Replace sections of `document` with same-heading sections from `revised`.
+
+    Revised sections without a counterpart are appended. A revision without any
+    headings replaces the whole document only if that has no headings either (e.g. a
+    YAML playbook); otherwise the document is kept and nothing is reported as changed.
+    Returns the new document and the headings that changed.
+    """
+    updates = [s for s in split_sections(revised) if s.heading]
+    sections = split_sections(document)
+    if not updates:
+        if any(s.heading for s in sections):
+            # Plain prose against a structured runbook/CR: replacing would wipe every section
+            return document, []
+        return revised.strip() + "\n", ["(entire document)"]
+
+    index = {s.key: i for i, s in enumerate(sections) if s.heading}
+    changed = []
+    for update in updates:
+        if update.key in index:
+            sections[index[update.key]] = update
+        else:
+            sections.append(update)
+            index[update.key] = len(sections) - 1
+        changed.append(update.heading.strip().lstrip("#").strip())
+    return join_sections(sections), changed
@@ -0,0 +1,352 @@
+"""
+Priority lanes in front of the LLM backends' concurrency slots.
+
+Every backend allows a bounded number of requests in flight. Without lanes, waiting
+requests get the next free slot in arrival order, so a compliance evidence batch or a
+fan-out of decommissioning procedures can hold up an on-call engineer's issue analysis.
+With lanes, every request is assigned a lane (incident triage > RCA > documentation >
+batch) from its use case and requester, and free slots are handed out by:
+
+- weighted fair queuing: each request gets a virtual finish tag of
+  max(virtual time, lane's last tag) + 1 / lane weight; the smallest tag goes next, so
+  backlogged lanes share the slots in proportion to their weights and a request of a
+  higher lane that arrives at a saturated backend is next in line;
+- a share cap per lane: batch work never occupies more than half of the slots, so
+  interactive requests find free slots even while a large batch is queued;
+- aging (starvation protection): a request that has waited longer than its lane's
+  max_wait_s goes ahead of the weighted order.
+
+Per-lane metrics (queued, in flight, served, aged, wait and slot-hold percentiles) are
+kept by every dispatcher. The dispatcher serves threads (Streamlit app) and asyncio
+tasks (REST API, prompt evaluation) alike.
+
+Usage:
+    python priority_lanes.py simulate [--capacity 8] [--seconds 20]   # saturated load, lanes vs. FIFO
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from completion_budget import percentile
+
+STATS_WINDOW = 500                  # Recent requests per lane the percentiles are computed over
+
+# Lanes in priority order: (name, weight, max_wait_s, max_share)
+DEFAULT_LANES = (
+    ("incident", 8.0, 2.0, 1.0),
+    ("rca", 4.0, 10.0, 1.0),
+    ("documentation", 2.0, 30.0, 1.0),
+    ("batch", 1.0, 60.0, 0.5),
+)
+DEFAULT_LANE = "documentation"
+DEFAULT_USE_CASE_LANES = {
+    "Explain Issue and Error": "incident",
+    "Performance Analysis": "incident",
+    "Generate Incident RCA": "rca",
+}
+
+
+@dataclass(frozen=True)
+class Lane:
+    name: str
+    weight: float           # Share of the slots while several lanes are backlogged
+    max_wait_s: float       # Waiting longer than this goes ahead of the weighted order (aging)
+    max_share: float        # Fraction of the backend's slots this lane may hold at once
+
+
+class LanePolicy:
+    """Lane definitions plus the use case / requester -> lane rules."""
+
+    def __init__(self, lanes: List[Lane], use_cases: Optional[Dict[str, str]] = None,
+                 users: Optional[Dict[str, str]] = None, teams: Optional[Dict[str, str]] = None,
+                 default: str = DEFAULT_LANE):
+        self.lanes = list(lanes)
+        self.by_name = {lane.name: lane for lane in self.lanes}
+        self.rank = {lane.name: rank for rank, lane in enumerate(self.lanes)}
+        self.use_cases = {k: v for k, v in dict(use_cases or {}).items() if v in self.by_name}
+        self.users = {k: v for k, v in dict(users or {}).items() if v in self.by_name}
+        self.teams = {k: v for k, v in dict(teams or {}).items() if v in self.by_name}
+        self.default = default if default in self.by_name else self.lanes[-1].name
+
+    def lane_for(self, task_key: Optional[str], user: Optional[str] = None, team: Optional[str] = None,
+                 requested: Optional[str] = None) -> str:
+        """Lane of one request: requester rules over use case rules over the default.
+
+        A `requested` lane (batch jobs, API callers) is honored only if it does not rank
+        above the lane the rules give, so callers can step down but never jump the queue.
+        """
+        lane = self.users.get(user or "") or self.teams.get(team or "") \
+            or self.use_cases.get(task_key or "") or self.default
+        if requested in self.by_name and self.rank[requested] > self.rank[lane]:
+            return requested
+        return lane
+
+    def get(self, name: Optional[str]) -> Lane:
+        return self.by_name.get(name or "") or self.by_name[self.default]
+
+
+class LaneStats:
+    """Counters and recent wait / slot-hold times of one lane."""
+
+    def __init__(self):
+        self.waits = deque(maxlen=STATS_WINDOW)
+        self.holds = deque(maxlen=STATS_WINDOW)
+        self.served = 0
+        self.aged = 0
+
+    def snapshot(self) -> Dict[str, float]:
+        waits, holds = list(self.waits), list(self.holds)
+        return {
+            "served": self.served,
+            "aged": self.aged,
+            "wait_p50_ms": round(percentile(waits, 50) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(percentile(waits, 95) * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(max(waits) * 1000, 1) if waits else 0.0,
+            "hold_p50_s": round(percentile(holds, 50), 3) if holds else 0.0,
+            "hold_p95_s": round(percentile(holds, 95), 3) if holds else 0.0,
+        }
+
+
+class _Ticket:
+    __slots__ = ("lane", "tag", "enqueued", "granted", "state", "event", "future", "loop")
+
+    def __init__(self, lane: Lane, tag: float, event=None, future=None, loop=None):
+        self.lane = lane
+        self.tag = tag
+        self.enqueued = time.monotonic()
+        self.granted = 0.0
+        self.state = "waiting"          # -> "granted" -> "released", or -> "abandoned"
+        self.event, self.future, self.loop = event, future, loop
+
+    @property
+    def wait_s(self) -> float:
+        return self.granted - self.enqueued
+
+
+def _resolve(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class PriorityDispatcher:
+    """Bounded slots handed out by lane: weighted fair queuing, share caps and aging."""
+
+    def __init__(self, capacity: int, policy: Optional[LanePolicy] = None):
+        self.capacity = max(1, int(capacity))
+        self.policy = policy or default_policy()
+        self._lock = threading.Lock()
+        self._queues = {lane.name: deque() for lane in self.policy.lanes}
+        self._last_tag = {lane.name: 0.0 for lane in self.policy.lanes}
+        self._lane_in_flight = {lane.name: 0 for lane in self.policy.lanes}
+        self._stats = {lane.name: LaneStats() for lane in self.policy.lanes}
+        self._virtual = 0.0
+        self._in_flight = 0
+
+    def _limit(self, lane: Lane) -> int:
+        return max(1, int(self.capacity * lane.max_share))
+
+    def _submit(self, lane_name: Optional[str], **wake) -> _Ticket:
+        lane = self.policy.get(lane_name)
+        with self._lock:
+            tag = max(self._virtual, self._last_tag[lane.name]) + 1.0 / max(lane.weight, 1e-6)
+            self._last_tag[lane.name] = tag
+            ticket = _Ticket(lane, tag, **wake)
+            self._queues[lane.name].append(ticket)
+            self._dispatch()
+        return ticket
+
+    def _pick(self, now: float) -> Optional[_Ticket]:
+        best, oldest_aged = None, None
+        for lane in self.policy.lanes:
+            queue = self._queues[lane.name]
+            if not queue or self._lane_in_flight[lane.name] >= self._limit(lane):
+                continue
+            head = queue[0]
+            if now - head.enqueued >= lane.max_wait_s and (oldest_aged is None or head.enqueued < oldest_aged.enqueued):
+                oldest_aged = head
+            # Lanes are visited in priority order, so ties go to the higher lane
+            if best is None or head.tag < best.tag:
+                best = head
+        if oldest_aged is not None and oldest_aged is not best:
+            self._stats[oldest_aged.lane.name].aged += 1
+            return oldest_aged
+        return best
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting tickets; caller holds the lock."""
+        now = time.monotonic()
+        while self._in_flight < self.capacity:
+            ticket = self._pick(now)
+            if ticket is None:
+                return
+            self._queues[ticket.lane.name].popleft()
+            if ticket.future is not None:
+                try:
+                    ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+                except RuntimeError:            # Event loop already closed: nobody is waiting any more
+                    ticket.state = "abandoned"
+                    continue
+            self._virtual = max(self._virtual, ticket.tag)
+            self._in_flight += 1
+            self._lane_in_flight[ticket.lane.name] += 1
+            ticket.state, ticket.granted = "granted", now
+            stats = self._stats[ticket.lane.name]
+            stats.served += 1
+            stats.waits.append(ticket.wait_s)
+            if ticket.event is not None:
+                ticket.event.set()
+
+    def _release(self, ticket: _Ticket) -> None:
+        with self._lock:
+            if ticket.state == "granted":
+                self._in_flight -= 1
+                self._lane_in_flight[ticket.lane.name] -= 1
+                self._stats[ticket.lane.name].holds.append(time.monotonic() - ticket.granted)
+                ticket.state = "released"
+            elif ticket.state == "waiting":
+                self._queues[ticket.lane.name].remove(ticket)
+                ticket.state = "abandoned"
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, lane: Optional[str] = None) -> Iterator[float]:
+        """Hold one slot (blocking until granted); yields the seconds spent waiting."""
+        ticket = self._submit(lane, event=threading.Event())
+        try:
+            ticket.event.wait()
+            yield ticket.wait_s
+        finally:
+            self._release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, lane: Optional[str] = None) -> AsyncIterator[float]:
+        """Async variant of `slot`; a cancelled waiter leaves the queue (or frees its slot)."""
+        loop = asyncio.get_running_loop()
+        ticket = self._submit(lane, future=loop.create_future(), loop=loop)
+        try:
+            await ticket.future
+            yield ticket.wait_s
+        finally:
+            self._release(ticket)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Per-lane metrics, in priority order."""
+        with self._lock:
+            result = {}
+            for lane in self.policy.lanes:
+                result[lane.name] = {
+                    "queued": len(self._queues[lane.name]),
+                    "in_flight": self._lane_in_flight[lane.name],
+                    "slots": self._limit(lane),
+                    **self._stats[lane.name].snapshot(),
+                }
+        return result
+
+
+def default_policy() -> LanePolicy:
+    return LanePolicy([Lane(*lane) for lane in DEFAULT_LANES], DEFAULT_USE_CASE_LANES)
+
+
+def lanes_from_settings(cfg: Dict) -> LanePolicy:
+    """Build the policy from a secrets-style [priority_lanes] table.
+
+    [priority_lanes.lanes.<name>] weight / max_wait_s / max_share override or add lanes
+    (`order` lists the lane names by priority); [priority_lanes.use_cases],
+    [priority_lanes.users] and [priority_lanes.teams] map to lane names.
+    enabled = false puts every request in one lane (arrival order).
+    """
+    cfg = dict(cfg or {})
+    if not cfg.get("enabled", True):
+        return LanePolicy([Lane("default", 1.0, float("inf"), 1.0)], default="default")
+    lanes = {name: {"weight": weight, "max_wait_s": max_wait_s, "max_share": max_share}
+             for name, weight, max_wait_s, max_share in DEFAULT_LANES}
+    for name, values in dict(cfg.get("lanes", {})).items():
+        lanes[name] = {**lanes.get(name, {"weight": 1.0, "max_wait_s": 60.0, "max_share": 1.0}), **dict(values)}
+    order = list(cfg.get("order", [])) or list(lanes)
+    order += [name for name in lanes if name not in order]
+    return LanePolicy(
+        [Lane(name, float(lanes[name]["weight"]), float(lanes[name]["max_wait_s"]),
+              min(1.0, max(0.0, float(lanes[name]["max_share"])))) for name in order if name in lanes],
+        use_cases={**DEFAULT_USE_CASE_LANES, **dict(cfg.get("use_cases", {}))},
+        users=dict(cfg.get("users", {})),
+        teams=dict(cfg.get("teams", {})),
+        default=cfg.get("default_lane", DEFAULT_LANE),
+    )
+
+# ============================
+# CLI (load simulation)
+# ============================
+
+async def _simulate(policy: LanePolicy, capacity: int, seconds: float, mix: Dict[str, float],
+                    service_s: float, seed: int) -> Dict[str, List[float]]:
+    """Open-loop arrivals at 1.5x the slots' throughput; `mix` = share of arrivals per lane.
+
+    Returns the queue waits per lane; requests still queued at the end count with the
+    time they have waited so far.
+    """
+    rng = random.Random(seed)
+    dispatcher = PriorityDispatcher(capacity, policy)
+    rate = 1.5 * capacity / service_s
+    lanes, shares = list(mix), list(mix.values())
+    waits: Dict[str, List[float]] = {lane: [] for lane in lanes}
+    queued: Dict[asyncio.Task, Tuple[str, float]] = {}
+
+    async def request(lane: str) -> None:
+        async with dispatcher.aslot(lane) as wait_s:
+            waits[lane].append(wait_s)
+            await asyncio.sleep(rng.expovariate(1.0 / service_s))
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        lane = rng.choices(lanes, shares)[0]
+        queued[asyncio.create_task(request(lane))] = (lane, time.monotonic())
+        await asyncio.sleep(rng.expovariate(rate))
+    now = time.monotonic()
+    granted = {lane: len(values) for lane, values in waits.items()}
+    pending = []
+    for lane, started in queued.values():
+        if granted[lane]:
+            granted[lane] -= 1          # Within a lane, requests are granted in arrival order
+        else:
+            pending.append((lane, started))
+    for task in queued:
+        task.cancel()
+    await asyncio.gather(*queued, return_exceptions=True)
+    for lane, started in pending:
+        waits[lane].append(now - started)
+    return waits
+
+
+def _main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Priority lane dispatcher tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sim = sub.add_parser("simulate", help="saturated synthetic load: per-lane waits with lanes and in FIFO order")
+    sim.add_argument("--capacity", type=int, default=8)
+    sim.add_argument("--seconds", type=float, default=20.0)
+    sim.add_argument("--service-s", type=float, default=0.5, help="mean slot hold time per request")
+    sim.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    mix = {"incident": 0.1, "rca": 0.1, "documentation": 0.3, "batch": 0.5}
+    # Baseline: one lane, i.e. plain arrival order as without lanes
+    fifo = LanePolicy([Lane("fifo", 1.0, float("inf"), 1.0)], default="fifo")
+    for label, policy in (("lanes", default_policy()), ("fifo", fifo)):
+        waits = asyncio.run(_simulate(policy, args.capacity, args.seconds, mix, args.service_s, args.seed))
+        print(f"{label}: {args.capacity} slots, {args.seconds:.0f}s of arrivals at 1.5x their throughput")
+        print(f"  {'lane':14} {'requests':>8} {'p50 wait':>10} {'p95 wait':>10}")
+        for lane, values in waits.items():
+            p50, p95 = (percentile(values, 50), percentile(values, 95)) if values else (0.0, 0.0)
+            print(f"  {lane:14} {len(values):>8} {p50 * 1000:>8.0f}ms {p95 * 1000:>8.0f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,459 @@
+"""
+Evaluation harness for changes to SYSTEM_PROMPT and PROMPT_TEMPLATES.
+
+Prompt variants run over the fixture set (prompt_eval_fixtures.json) for every use case,
+vendor and language, with a bounded number of requests in flight. A variant is
+
+    current             copilot_core as it is in the working tree
+    git:<ref>           copilot_core.py at a git revision (e.g. git:HEAD before an edit)
+    path/to/file.py     a file defining SYSTEM_PROMPT and/or some PROMPT_TEMPLATES entries,
+                        applied on top of the current copilot_core
+
+Every output is scored with cheap local checks:
+
+- coverage: share of the "Include:" items of the baseline template (the first variant)
+  that the output addresses, by keyword stems with English synonyms and German
+  equivalents. Items always come from the baseline, so a variant that drops "Backout and
+  recovery plan" from its template shows up as lower coverage.
+- YAML: Ansible playbooks must parse and consist of plays; ```yaml blocks in other
+  outputs must parse (skipped without PyYAML).
+- length: words within the fixture's min_words / max_words, and no truncation at max_tokens.
+
+    score = 100 * coverage - 25 (truncated) - 30 (invalid YAML) - 10 (length out of bounds)
+
+The report shows tokens, latency and score per variant, and the deltas against the
+baseline per use case together with the items a variant drops. The runs of one fixture
+are queued next to each other for all variants, so load changes on the backend affect
+all variants alike. --dry-run only compares prompt sizes, without LLM calls.
+
+Usage:
+    python prompt_eval.py run --variant git:HEAD --variant current [--use-case "Generate Runbook"]
+        [--vendor ...] [--language English] [--repeats 2] [--concurrency 4] [--json results.json]
+    python prompt_eval.py run --variant current --variant prompts/short_rca.py --dry-run
+    python prompt_eval.py items ["Generate Incident RCA"]
+    python prompt_eval.py score output.md --use-case "Generate Runbook"
+"""
+
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import copilot_core
+from completion_budget import percentile
+from copilot_core import MAX_OUTPUT_TOKENS, MODEL_VERSION, VENDORS, get_response_language, include_items
+
+try:
+    import yaml
+except ImportError:                     # YAML checks are skipped without PyYAML
+    yaml = None
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_eval_fixtures.json")
+LANGUAGES = ("English", "German / Deutsch")
+DEFAULT_CONCURRENCY = 4
+EVAL_LANE = "batch"                 # Priority lane of evaluation requests (priority_lanes)
+ITEM_COVERAGE = 0.6                 # Share of an item's keywords the output must contain
+STEM_CHARS = 5
+TRUNCATION_PENALTY = 25
+YAML_PENALTY = 30
+LENGTH_PENALTY = 10
+
+ITEM_WORD = re.compile(r"[a-z0-9äöüß]+(?:-[a-z0-9]+)*")
+FENCED_BLOCK = re.compile(r"```([^\n`]*)\n(.*?)```", re.DOTALL)
+GENERIC_WORDS = frozenset(
+    "and or of the to a an in on for with if any all by use etc step steps clearly detailed required "
+    "appropriate explaining high level include included taken term based current pre post long off".split()
+)
+
+# Keyword stem -> other stems that address the same item (English synonyms, German terms)
+STEM_ALTERNATIVES = {
+    "rollb": ("rückf", "rücks", "zurück", "backo", "fallb"), "recov": ("wiede",), "backo": ("rollb", "rückf"),
+    "fallb": ("rollb", "rückf"), "failb": ("rückf", "rollb"), "valid": ("prüf", "überp", "verif", "check"),
+    "check": ("prüf", "kontr", "valid", "verif"), "risks": ("risik", "risk"), "risk": ("risik",),
+    "mitig": ("minde", "gegen", "maßna"), "timel": ("zeitl", "zeita", "ablau", "chron"),
+    "sympt": ("sympt", "anzei"), "cause": ("ursac",), "remed": ("beheb", "abhil", "maßna", "fix"),
+    "preve": ("präve", "vorbe", "vermei"), "pract": ("prakt", "empfe"), "purpo": ("zweck", "ziel", "objec"),
+    "scope": ("umfan", "gelt", "abgre"), "preco": ("vorau", "vorbe", "prere"), "assum": ("annah", "vorau"),
+    "execu": ("ausfü", "durch", "imple"), "proce": ("verfa", "proze", "ablau", "vorge"), "succe": ("erfol",),
+    "summa": ("zusam", "übers", "overv"), "techn": ("techn",), "busin": ("gesch",), "impac": ("auswi", "betro"),
+    "corre": ("korre", "sofor"), "actio": ("maßna", "aktio"), "impro": ("verbe", "optim"),
+    "lesso": ("erken", "lekti", "learn"), "learn": ("gelern", "erken", "lesso"), "capac": ("kapaz",),
+    "usage": ("nutzu", "ausla", "beleg", "utili"), "utili": ("ausla", "nutzu", "usage"), "trend": ("entwi",),
+    "growt": ("wachs",), "proje": ("progn", "hochr", "forec"), "perfo": ("leist",), "tieri": ("tier", "stufe"),
+    "thres": ("schwe", "grenz", "limit"), "point": ("punkt",), "procu": ("besch", "einka"),
+    "expan": ("erwei", "ausba"), "cost": ("koste",), "estim": ("schät", "absch"), "obser": ("beoba", "festg"),
+    "affec": ("betro",), "workl": ("arbei", "anwen"), "metri": ("kennz", "metri"), "revie": ("prüf", "überp"),
+    "bottl": ("engpä", "engpa"), "const": ("einsc", "engpä", "begre"), "tunin": ("optim", "anpas"),
+    "confi": ("konfi", "einst"), "chang": ("änder",), "monit": ("überw",), "alert": ("alarm", "warn"),
+    "optim": ("optim",), "objec": ("ziel",), "crite": ("krite",), "syste": ("syste",),
+    "roles": ("rolle",), "respo": ("veran", "zustä", "raci"), "evide": ("nachw", "beleg"),
+    "docum": ("dokum",), "requi": ("anfor",), "migra": ("migra",), "prere": ("vorau", "voraus"),
+    "strat": ("strat",), "appro": ("ansat", "vorge", "genehm", "freig"), "consi": ("konsi",),
+    "activ": ("aktiv", "tätig"), "varia": ("varia",), "input": ("einga", "param"), "named": ("benan", "name"),
+    "struc": ("struk",), "tasks": ("task", "aufga"), "idemp": ("idemp",), "logic": ("logik",),
+    "error": ("fehle", "failed_when", "rescue"), "handl": ("behan", "rescue", "failed_when"),
+    "modul": ("modul",), "comme": ("komme", "#"), "criti": ("kriti",), "title": ("titel",),
+    "refer": ("refer", "verwe"), "place": ("platz",), "justi": ("begrü",), "asses": ("bewer", "einsc"),
+    "imple": ("umset", "durch"), "outag": ("ausfa", "unter", "downt", "auszei"), "windo": ("fenst", "zeitf"),
+    "4-eye": ("4-aug", "vier-a", "four-"), "regul": ("regul", "aufsi"), "ecb": ("ezb",), "gdpr": ("dsgvo",),
+    "statu": ("zusta",), "expla": ("erklä", "erläu"), "colle": ("samml", "erheb", "erfas"),
+    "comma": ("befeh", "komma"), "repor": ("beric",), "gap": ("lücke",), "analy": ("analy",),
+    "recom": ("empfe",), "targe": ("ziel",), "platf": ("platt",), "compa": ("kompa",), "inter": ("inter",),
+    "chose": ("gewäh", "ausge"), "workf": ("ablau", "workf"), "cutov": ("umsch", "cut-o"), "effor": ("aufwa",),
+    "asset": ("kompo", "geräte", "hardw"), "sanit": ("berei", "lösch", "crypt", "wipe"),
+    "stand": ("norm", "nist"), "audit": ("prüfe", "revis"), "sign-": ("abnah", "freig", "sign"),
+    "stake": ("betei", "stake"), "notif": ("benac", "infor", "kommu"), "decom": ("außer", "stilll", "decom"),
+    "data": ("daten",), "test": ("test",), "princ": ("prinz",), "state": ("zusta", "ist-z"),
+    "tools": ("tool", "werkz"),
+}
+
+
+def item_keywords(item: str) -> List[str]:
+    """Keyword stems of an item: 'Backout and recovery plan' -> ['backo', 'recov', 'plan']."""
+    words = []
+    for word in ITEM_WORD.findall(item.lower()):
+        parts = word.split("-")
+        words.extend([word] if parts[0].isdigit() else parts)
+    return [w[:STEM_CHARS] for w in words if w not in GENERIC_WORDS and len(w) >= 3]
+
+
+def _stem_pattern(stem: str) -> "re.Pattern":
+    alternatives = (stem,) + STEM_ALTERNATIVES.get(stem, ())
+    return re.compile(r"(?<![a-z0-9äöüß])(?:" + "|".join(re.escape(a) for a in alternatives) + ")")
+
+
+_STEM_PATTERNS: Dict[str, "re.Pattern"] = {}
+
+
+def item_covered(item: str, text: str) -> bool:
+    """`text` must be lowercased."""
+    stems = item_keywords(item)
+    if not stems:
+        return True
+    found = 0
+    for stem in stems:
+        pattern = _STEM_PATTERNS.get(stem)
+        if pattern is None:
+            pattern = _STEM_PATTERNS[stem] = _stem_pattern(stem)
+        found += bool(pattern.search(text))
+    return found >= max(1, math.ceil(ITEM_COVERAGE * len(stems)))
+
+
+def yaml_valid(template: str, output: str) -> Optional[bool]:
+    """True/False for YAML the output must or does contain; None when there is none or no PyYAML."""
+    if yaml is None:
+        return None
+    playbook = "YAML" in template
+    blocks = [body for tag, body in FENCED_BLOCK.findall(output)
+              if tag.strip().lower() in (("", "yaml", "yml") if playbook else ("yaml", "yml"))]
+    if playbook and not blocks:
+        blocks = [output]
+    if not blocks:
+        return None
+    for block in blocks:
+        try:
+            document = yaml.safe_load(block)
+        except yaml.YAMLError:
+            return False
+        if playbook and not (isinstance(document, list) and document and all(
+                isinstance(play, dict) and ("hosts" in play or "import_playbook" in play) for play in document)):
+            return False
+    return True
+
+
+def score_output(template: str, output: str, finish_reason: Optional[str] = None,
+                 min_words: Optional[int] = None, max_words: Optional[int] = None) -> Dict:
+    """Local checks of one output against the template it was generated from (or the baseline's)."""
+    items = include_items(template)
+    text = output.lower()
+    missing = [item for item in items if not item_covered(item, text)]
+    coverage = 1.0 - len(missing) / len(items) if items else 1.0
+    words = len(output.split())
+    length_ok = (min_words is None or words >= min_words) and (max_words is None or words <= max_words)
+    truncated = finish_reason == "length"
+    valid_yaml = yaml_valid(template, output)
+    score = 100 * coverage
+    score -= TRUNCATION_PENALTY if truncated else 0
+    score -= YAML_PENALTY if valid_yaml is False else 0
+    score -= LENGTH_PENALTY if not length_ok else 0
+    return {"coverage": round(coverage, 3), "missing": missing, "words": words, "length_ok": length_ok,
+            "truncated": truncated, "yaml_valid": valid_yaml, "score": round(score, 1)}
+
+
+# ============================
+# Variants & Fixtures
+# ============================
+
+@dataclass
+class Variant:
+    name: str
+    system_prompt: str
+    templates: Dict[str, str]
+
+    def messages(self, task_key: str, vendor: str, language: str, user_input: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system_prompt.format(response_language=get_response_language(language))},
+            {"role": "user", "content": self.templates[task_key].format(vendor=vendor, user_input=user_input)},
+        ]
+
+
+def load_variant(spec: str) -> Variant:
+    if spec == "current":
+        namespace = vars(copilot_core)
+    elif spec.startswith("git:"):
+        source = subprocess.run(
+            ["git", "show", f"{spec[4:]}:copilot_core.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout
+        namespace = {"__name__": "copilot_core_variant"}
+        exec(compile(source, f"{spec}/copilot_core.py", "exec"), namespace)
+    else:
+        module_spec = importlib.util.spec_from_file_location("prompt_variant", spec)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+        namespace = {
+            "SYSTEM_PROMPT": getattr(module, "SYSTEM_PROMPT", copilot_core.SYSTEM_PROMPT),
+            "PROMPT_TEMPLATES": {**copilot_core.PROMPT_TEMPLATES, **getattr(module, "PROMPT_TEMPLATES", {})},
+        }
+    return Variant(spec, namespace["SYSTEM_PROMPT"], dict(namespace["PROMPT_TEMPLATES"]))
+
+
+@dataclass
+class Fixture:
+    id: str
+    use_case: str
+    input: str
+    vendors: List[str] = field(default_factory=lambda: list(VENDORS))
+    min_words: Optional[int] = None
+    max_words: Optional[int] = None
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> List[Fixture]:
+    with open(path, encoding="utf-8") as f:
+        return [Fixture(**raw) for raw in json.load(f)["fixtures"]]
+
+
+@dataclass
+class EvalRun:
+    variant: str
+    fixture: str
+    use_case: str
+    vendor: str
+    language: str
+    repeat: int
+    prompt_chars: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_s: float = 0.0
+    finish_reason: Optional[str] = None
+    words: int = 0
+    coverage: float = 0.0
+    missing: List[str] = field(default_factory=list)
+    yaml_valid: Optional[bool] = None
+    length_ok: bool = True
+    score: float = 0.0
+    error: Optional[str] = None
+
+
+async def run_variants(variants: List[Variant], fixtures: List[Fixture], languages: List[str],
+                       llm_for: Callable, redactor,
+                       repeats: int = 1, concurrency: int = DEFAULT_CONCURRENCY, temperature: float = 0.2,
+                       top_p: float = 0.9, max_tokens: int = MAX_OUTPUT_TOKENS,
+                       dry_run: bool = False) -> List[EvalRun]:
+    """All variant x fixture x vendor x language x repeat runs, at most `concurrency` in flight.
+
+    `llm_for(task_key)` returns the backend for a use case (the app's routing or a fixed one).
+    """
+    baseline = variants[0]
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(variant: Variant, fixture: Fixture, vendor: str, language: str, repeat: int) -> EvalRun:
+        run = EvalRun(variant.name, fixture.id, fixture.use_case, vendor, language, repeat)
+        if fixture.use_case not in variant.templates:
+            run.error = "no template"
+            return run
+        messages = variant.messages(fixture.use_case, vendor, language, fixture.input)
+        run.prompt_chars = sum(len(m["content"]) for m in messages)
+        run.prompt_tokens = run.prompt_chars // 4
+        if dry_run:
+            return run
+        # Fixtures are synthetic, but eval prompts go through the same redaction as the app
+        redaction = redactor.session()
+        messages = [{**m, "content": redaction.redact(m["content"])} for m in messages]
+        async with slots:
+            try:
+                response = await llm_for(fixture.use_case).acomplete(messages, temperature=temperature, top_p=top_p,
+                                               max_tokens=max_tokens, lane=EVAL_LANE)
+            except Exception as e:
+                run.error = type(e).__name__
+                return run
+        output = redaction.restore(response.content) or ""
+        run.prompt_tokens = response.usage.get("prompt_tokens", run.prompt_tokens)
+        run.completion_tokens = response.usage.get("completion_tokens", 0)
+        run.latency_s = round(response.latency_s, 3)
+        run.finish_reason = response.finish_reason
+        checks = score_output(baseline.templates.get(fixture.use_case, ""), output, response.finish_reason,
+                              fixture.min_words, fixture.max_words)
+        for key in ("coverage", "missing", "words", "length_ok", "yaml_valid", "score"):
+            setattr(run, key, checks[key])
+        return run
+
+    # Variants of the same fixture run next to each other
+    jobs = [one(variant, fixture, vendor, language, repeat)
+            for fixture in fixtures for vendor in fixture.vendors for language in languages
+            for repeat in range(repeats) for variant in variants]
+    return list(await asyncio.gather(*jobs))
+
+
+# ============================
+# Report
+# ============================
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def summarize(runs: List[EvalRun]) -> Dict:
+    ok = [r for r in runs if r.error is None]
+    yaml_checked = [r for r in ok if r.yaml_valid is not None]
+    return {
+        "runs": len(runs),
+        "errors": len(runs) - len(ok),
+        "prompt_tokens": _mean([r.prompt_tokens for r in ok]),
+        "completion_tokens": _mean([r.completion_tokens for r in ok]),
+        "latency_p50": percentile([r.latency_s for r in ok], 50),
+        "latency_p95": percentile([r.latency_s for r in ok], 95),
+        "coverage": _mean([r.coverage for r in ok]),
+        "truncated": sum(r.finish_reason == "length" for r in ok),
+        "yaml": f"{sum(bool(r.yaml_valid) for r in yaml_checked)}/{len(yaml_checked)}" if yaml_checked else "-",
+        "score": _mean([r.score for r in ok]),
+        "missing": Counter(item for r in ok for item in r.missing),
+        "ok": len(ok),
+    }
+
+
+def _delta_pct(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+
+def format_report(variants: List[Variant], runs: List[EvalRun], dry_run: bool = False) -> str:
+    names = [v.name for v in variants]
+    lines = [f"{'variant':28} {'runs':>5} {'err':>4} {'prompt tok':>10} {'compl tok':>9} "
+             f"{'p50 s':>6} {'p95 s':>6} {'cover':>6} {'trunc':>5} {'yaml':>6} {'score':>6}"]
+    for name in names:
+        s = summarize([r for r in runs if r.variant == name])
+        lines.append(f"{name[:28]:28} {s['runs']:5d} {s['errors']:4d} {s['prompt_tokens']:10.0f} "
+                     f"{s['completion_tokens']:9.0f} {s['latency_p50']:6.2f} {s['latency_p95']:6.2f} "
+                     f"{s['coverage']:6.1%} {s['truncated']:5d} {s['yaml']:>6} {s['score']:6.1f}")
+    if len(names) < 2:
+        return "\n".join(lines)
+
+    baseline = names[0]
+    for name in names[1:]:
+        lines += ["", f"{name} vs {baseline} per use case:",
+                  f"{'use case':44} {'prompt':>7} {'compl':>7} {'p50':>7} {'cover':>7} {'score':>7}  dropped items"]
+        for use_case in dict.fromkeys(r.use_case for r in runs):
+            old = summarize([r for r in runs if r.variant == baseline and r.use_case == use_case])
+            new = summarize([r for r in runs if r.variant == name and r.use_case == use_case])
+            if not old["ok"] or not new["ok"]:
+                lines.append(f"{use_case[:44]:44} (errors: {old['errors']} / {new['errors']})")
+                continue
+            # Items the variant misses in more runs than the baseline, with the miss rates
+            dropped = [f"{item} ({new['missing'][item]}/{new['ok']} vs {old['missing'][item]}/{old['ok']})"
+                       for item in new["missing"]
+                       if new["missing"][item] / new["ok"] > old["missing"][item] / old["ok"]]
+            if dry_run:
+                lines.append(f"{use_case[:44]:44} {_delta_pct(new['prompt_tokens'], old['prompt_tokens']):>7}")
+                continue
+            lines.append(
+                f"{use_case[:44]:44} {_delta_pct(new['prompt_tokens'], old['prompt_tokens']):>7} "
+                f"{_delta_pct(new['completion_tokens'], old['completion_tokens']):>7} "
+                f"{_delta_pct(new['latency_p50'], old['latency_p50']):>7} "
+                f"{(new['coverage'] - old['coverage']) * 100:+6.0f}p {new['score'] - old['score']:+7.1f}  "
+                + "; ".join(dropped)
+            )
+    return "\n".join(lines)
+
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prompt variant evaluation")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run")
+    run_cmd.add_argument("--variant", action="append", required=True,
+                         help="current | git:<ref> | override file; the first one is the baseline")
+    run_cmd.add_argument("--fixtures", default=FIXTURES_PATH)
+    run_cmd.add_argument("--use-case", action="append", help="use case key (default: all)")
+    run_cmd.add_argument("--vendor", action="append", choices=VENDORS)
+    run_cmd.add_argument("--language", action="append", choices=LANGUAGES)
+    run_cmd.add_argument("--repeats", type=int, default=1)
+    run_cmd.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    run_cmd.add_argument("--backend", help="LLM backend name (default: the [use_case_backends] routing)")
+    run_cmd.add_argument("--temperature", type=float, default=0.2)
+    run_cmd.add_argument("--top-p", type=float, default=0.9)
+    run_cmd.add_argument("--max-tokens", type=int, default=MAX_OUTPUT_TOKENS)
+    run_cmd.add_argument("--dry-run", action="store_true", help="prompt sizes only, no LLM calls")
+    run_cmd.add_argument("--json", help="write all runs to this file")
+    items_cmd = sub.add_parser("items")
+    items_cmd.add_argument("use_case", nargs="?")
+    score_cmd = sub.add_parser("score")
+    score_cmd.add_argument("path")
+    score_cmd.add_argument("--use-case", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "items":
+        for task_key, template in copilot_core.PROMPT_TEMPLATES.items():
+            if args.use_case in (None, task_key):
+                print(task_key)
+                for item in include_items(template):
+                    print(f"  - {item}  {item_keywords(item)}")
+        return 0
+    if args.command == "score":
+        with open(args.path, encoding="utf-8") as f:
+            print(json.dumps(score_output(copilot_core.PROMPT_TEMPLATES[args.use_case], f.read()), indent=2))
+        return 0
+
+    from copilot_api import load_settings
+    from llm_backends import registry_from_settings
+    from redaction import redactor_from_settings
+
+    variants = [load_variant(spec) for spec in args.variant]
+    fixtures = [f for f in load_fixtures(args.fixtures) if not args.use_case or f.use_case in args.use_case]
+    for fixture in fixtures:
+        fixture.vendors = [v for v in fixture.vendors if not args.vendor or v in args.vendor]
+    if not fixtures:
+        print("no fixtures selected")
+        return 1
+    settings = load_settings()
+    registry = registry_from_settings(settings, os.environ.get("OPENAI_API_KEY") or settings.get("OPENAI_API_KEY"),
+                                      MODEL_VERSION)
+    llm_for = (lambda task_key: registry.get(args.backend)) if args.backend else registry.for_use_case
+    redactor = redactor_from_settings(settings.get("redaction", {}))
+
+    start = time.perf_counter()
+    runs = asyncio.run(run_variants(
+        variants, fixtures, args.language or list(LANGUAGES), llm_for, redactor, repeats=args.repeats,
+        concurrency=args.concurrency, temperature=args.temperature, top_p=args.top_p,
+        max_tokens=args.max_tokens, dry_run=args.dry_run
+    ))
+    print(format_report(variants, runs, args.dry_run))
+    backends = sorted({llm_for(f.use_case).name for f in fixtures})
+    print(f"\n{len(runs)} runs on {', '.join(backends)} in {time.perf_counter() - start:.1f}s, "
+          f"concurrency {args.concurrency}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([asdict(r) for r in runs], f, ensure_ascii=False, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,195 @@
+"""
+Process-wide token and request quota governor with per-user and per-team budgets.
+
+Every LLM call first reserves its estimated token cost against sliding-window budgets
+(per minute and per day) of the requesting user and their team. Requests over budget
+wait in line for up to `queue_timeout_s` and are then rejected with `QuotaExceeded`.
+After the call, the reservation is settled with the actual token usage.
+
+Counters live in a counter store. `MemoryCounterStore` covers a single process; any
+store with the same `add` / `total` / `lock` methods (e.g. a shared SQLite or Redis
+store) makes the budgets hold across worker processes and replicas.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BUCKETS_PER_WINDOW = 60         # Sliding window resolution: 1 s buckets for the 1 min window
+MINUTE, DAY = 60, 86400
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, scope: str, limit_name: str, retry_after: float):
+        self.scope = scope
+        self.limit_name = limit_name
+        self.retry_after = retry_after
+        if retry_after == float("inf"):
+            super().__init__(f"request exceeds the {limit_name} budget of {scope}")
+        else:
+            super().__init__(f"{limit_name} budget exhausted for {scope}; retry in {retry_after:.0f}s")
+
+
+@dataclass
+class Budget:
+    """Limits for one user or team; 0 means unlimited."""
+    tokens_per_minute: int = 0
+    requests_per_minute: int = 0
+    tokens_per_day: int = 0
+
+    def limits(self) -> List[Tuple[str, str, int, int]]:
+        """(name, counter, window seconds, limit) for every configured limit."""
+        configured = [
+            ("tokens_per_minute", "tokens", MINUTE, self.tokens_per_minute),
+            ("requests_per_minute", "requests", MINUTE, self.requests_per_minute),
+            ("tokens_per_day", "tokens", DAY, self.tokens_per_day),
+        ]
+        return [limit for limit in configured if limit[3] > 0]
+
+
+class MemoryCounterStore:
+    """Thread-safe bucketed sliding-window counters for one process."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._buckets: Dict[str, Dict[int, int]] = defaultdict(dict)
+
+    @staticmethod
+    def _bucket(window_s: int, now: float) -> Tuple[int, int]:
+        size = max(1, window_s // BUCKETS_PER_WINDOW)
+        return size, int(now // size)
+
+    def add(self, key: str, amount: int, window_s: int, now: float) -> None:
+        size, bucket = self._bucket(window_s, now)
+        with self._lock:
+            buckets = self._buckets[f"{key}:{window_s}"]
+            buckets[bucket] = buckets.get(bucket, 0) + amount
+            for old in [b for b in buckets if b <= bucket - BUCKETS_PER_WINDOW]:
+                del buckets[old]
+
+    def total(self, key: str, window_s: int, now: float) -> Tuple[int, float]:
+        """Sum over the window and seconds until the oldest non-empty bucket expires."""
+        size, bucket = self._bucket(window_s, now)
+        with self._lock:
+            live = {b: v for b, v in self._buckets.get(f"{key}:{window_s}", {}).items()
+                    if b > bucket - BUCKETS_PER_WINDOW and v}
+        if not live:
+            return 0, 0.0
+        oldest = min(live)
+        return sum(live.values()), max(0.0, (oldest + BUCKETS_PER_WINDOW) * size - now)
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        with self._lock:
+            yield
+
+
+@dataclass
+class Reservation:
+    user: str
+    team: str
+    tokens: int
+    created: float = field(default_factory=time.time)
+
+
+class QuotaGovernor:
+    def __init__(self, user_budget: Budget, team_budget: Budget,
+                 team_budgets: Optional[Dict[str, Budget]] = None,
+                 user_budgets: Optional[Dict[str, Budget]] = None,
+                 store=None, queue_timeout_s: float = 15.0):
+        self.user_budget = user_budget
+        self.team_budget = team_budget
+        self.team_budgets = dict(team_budgets or {})
+        self.user_budgets = dict(user_budgets or {})
+        self.store = store or MemoryCounterStore()
+        self.queue_timeout_s = queue_timeout_s
+        self._waiters = threading.Condition()
+
+    def _scopes(self, user: str, team: str) -> List[Tuple[str, Budget]]:
+        return [
+            (f"user:{user}", self.user_budgets.get(user, self.user_budget)),
+            (f"team:{team}", self.team_budgets.get(team, self.team_budget)),
+        ]
+
+    def _blocking_limit(self, user: str, team: str, tokens: int, now: float) -> Optional[QuotaExceeded]:
+        for scope, budget in self._scopes(user, team):
+            for name, counter, window_s, limit in budget.limits():
+                used, frees_in = self.store.total(f"{scope}:{counter}", window_s, now)
+                needed = tokens if counter == "tokens" else 1
+                if used + needed > limit:
+                    # A single request larger than the whole budget can never pass
+                    retry = frees_in if needed <= limit else float("inf")
+                    return QuotaExceeded(scope, name, retry)
+        return None
+
+    def acquire(self, user: str, team: str, tokens: int, timeout_s: Optional[float] = None) -> Reservation:
+        """Reserve `tokens` for one request, waiting up to `timeout_s` for budget to free up."""
+        deadline = time.time() + (self.queue_timeout_s if timeout_s is None else timeout_s)
+        while True:
+            now = time.time()
+            with self.store.lock("quota"):
+                blocked = self._blocking_limit(user, team, tokens, now)
+                if blocked is None:
+                    for scope, _ in self._scopes(user, team):
+                        for window_s in (MINUTE, DAY):
+                            self.store.add(f"{scope}:tokens", tokens, window_s, now)
+                            self.store.add(f"{scope}:requests", 1, window_s, now)
+                    return Reservation(user, team, tokens, now)
+            if now + blocked.retry_after > deadline:
+                raise blocked
+            with self._waiters:
+                # Woken early when another request settles with fewer tokens than reserved
+                self._waiters.wait(timeout=min(max(blocked.retry_after, 0.05), deadline - now))
+
+    def settle(self, reservation: Reservation, actual_tokens: int) -> None:
+        """Replace the reserved estimate with the actual usage (in the original buckets)."""
+        delta = int(actual_tokens) - reservation.tokens
+        if delta:
+            with self.store.lock("quota"):
+                for scope, _ in self._scopes(reservation.user, reservation.team):
+                    for window_s in (MINUTE, DAY):
+                        self.store.add(f"{scope}:tokens", delta, window_s, reservation.created)
+        if delta < 0:
+            with self._waiters:
+                self._waiters.notify_all()
+
+    def remaining(self, user: str, team: str) -> Dict[str, Dict[str, int]]:
+        """Remaining budget per scope and limit, for display."""
+        now = time.time()
+        result = {}
+        for scope, budget in self._scopes(user, team):
+            result[scope] = {
+                name: max(0, limit - self.store.total(f"{scope}:{counter}", window_s, now)[0])
+                for name, counter, window_s, limit in budget.limits()
+            }
+        return result
+
+
+DEFAULT_TEAM = "storage-engineering"
+
+
+def governor_from_settings(cfg: Dict, store=None) -> QuotaGovernor:
+    """Build a governor from a secrets-style [quota] table; 0 = unlimited."""
+    cfg = dict(cfg or {})
+    user_budget = Budget(
+        tokens_per_minute=int(cfg.get("user_tokens_per_minute", 30000)),
+        requests_per_minute=int(cfg.get("user_requests_per_minute", 20)),
+        tokens_per_day=int(cfg.get("user_tokens_per_day", 0))
+    )
+    team_budget = Budget(
+        tokens_per_minute=int(cfg.get("team_tokens_per_minute", 150000)),
+        requests_per_minute=int(cfg.get("team_requests_per_minute", 0)),
+        tokens_per_day=int(cfg.get("team_tokens_per_day", 0))
+    )
+    team_budgets = {name: Budget(**dict(limits)) for name, limits in dict(cfg.get("teams", {})).items()}
+    return QuotaGovernor(user_budget, team_budget, team_budgets, store=store,
+                         queue_timeout_s=float(cfg.get("queue_timeout_s", 15)))
+
+
+def team_for(cfg: Dict, user: str) -> str:
+    """Team of `user` from the [quota.members] table."""
+    cfg = dict(cfg or {})
+    return dict(cfg.get("members", {})).get(user, cfg.get("default_team", DEFAULT_TEAM))
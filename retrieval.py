@@ -0,0 +1,511 @@
+"""
+Local BM25 retrieval over vendor documentation, KB articles and approved runbooks.
+
+Source files under the knowledge directory are chunked into passages and indexed into
+immutable segments:
+
+    <index_dir>/manifest.json        segments, indexed files and deleted passages
+    <index_dir>/<seg>.lex.json       term -> [postings offset, postings count]
+    <index_dir>/<seg>.post           uint32 pairs (passage id, term frequency), memory-mapped
+    <index_dir>/<seg>.docs.json      passage metadata (source, vendor, text offset/length, length)
+    <index_dir>/<seg>.text           passage text (UTF-8), memory-mapped
+
+Indexing is incremental: new or modified files go into a new segment and the passages
+of modified or removed files are marked deleted. When too many segments accumulate,
+everything is rebuilt into one. The manifest is replaced atomically, so any number of
+worker processes can query the same index while it is being updated; the postings and
+text files are shared through the OS page cache. Queries score postings as numpy
+views on the mapped file; passage count and average length are kept per manifest.
+Updates take an exclusive lock file, so concurrent `index` runs do not allocate the same
+segment or overwrite each other's manifest.
+
+The vendor of a passage is taken from its path (first matching directory or file name,
+e.g. knowledge/netapp/snapmirror.md), otherwise it is "common".
+
+Usage:
+    python retrieval.py index [knowledge_dir] [--index-dir DIR] [--rebuild]
+    python retrieval.py search "snapmirror lag" [--vendor "NetApp ONTAP"] [-k 5]
+"""
+
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:                     # Windows: the thread lock still serializes this process
+    fcntl = None
+
+KNOWLEDGE_DIR = "knowledge"
+INDEX_DIR = os.path.join(".index", "retrieval")
+LOCK_FILE = "write.lock"
+INDEXED_EXTENSIONS = (".md", ".txt", ".rst", ".yml", ".yaml")
+PASSAGE_WORDS = 180                 # Target passage size
+MAX_SEGMENTS = 8                    # Rebuild into one segment beyond this
+MAX_QUERY_TERMS = 32                # Rarest query terms kept; pasted logs can have hundreds
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+VENDOR_ALIASES = {
+    "NetApp ONTAP": ("netapp", "ontap"),
+    "Pure FlashArray": ("pure", "purity", "flasharray"),
+    "Dell EMC PowerMax": ("powermax", "dell", "emc", "symmetrix", "vmax"),
+}
+
+TOKEN = re.compile(r"[a-z0-9][a-z0-9_\-]*[a-z0-9]|[a-z0-9]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "will with which not can you your all any if into than then there these they also may should".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound CLI tokens ("lag-time", "vol_db01") also yield their parts."""
+    terms = []
+    for token in TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if "-" in token or "_" in token:
+            terms.extend(p for p in re.split(r"[-_]+", token) if p and p not in STOPWORDS)
+    return terms
+
+
+def vendor_from_path(relpath: str) -> str:
+    parts = [p.lower() for p in re.split(r"[\\/_.\-\s]+", relpath)]
+    for vendor, aliases in VENDOR_ALIASES.items():
+        if any(alias in parts for alias in aliases):
+            return vendor
+    return "common"
+
+
+def split_passages(text: str, words: int = PASSAGE_WORDS) -> List[str]:
+    """Greedy paragraph packing into passages of roughly `words` words."""
+    passages, current, count = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        n = len(paragraph.split())
+        if current and count + n > words:
+            passages.append("\n\n".join(current))
+            current, count = [], 0
+        current.append(paragraph)
+        count += n
+    if current:
+        passages.append("\n\n".join(current))
+    return passages
+
+
+@dataclass
+class Passage:
+    source: str
+    vendor: str
+    text: str
+    score: float
+
+
+class _Segment:
+    """Read-only view of one on-disk segment.
+
+    `readers` counts searches in progress; a segment dropped from the manifest is only
+    retired (closed once the last reader is done), never unmapped under a running scan.
+    """
+
+    def __init__(self, index_dir: str, name: str):
+        self.name = name
+        self.readers = 0
+        self.retired = False
+        base = os.path.join(index_dir, name)
+        with open(base + ".lex.json", encoding="utf-8") as f:
+            self.lexicon: Dict[str, List[int]] = json.load(f)
+        with open(base + ".docs.json", encoding="utf-8") as f:
+            self.docs: List[List] = json.load(f)
+        self._post_file = open(base + ".post", "rb")
+        self._text_file = open(base + ".text", "rb")
+        self._post = _map(self._post_file)
+        self._text = _map(self._text_file)
+        self.postings_array = np.frombuffer(self._post, dtype=np.uint32) if self._post else np.zeros(0, np.uint32)
+        # Per-passage columns for vectorized scoring
+        self.doc_len = np.array([d[4] for d in self.docs], dtype=np.float64)
+        vendors = sorted({d[1] for d in self.docs})
+        self._vendor_codes = {v: i for i, v in enumerate(vendors)}
+        self._vendor_ids = np.array([self._vendor_codes[d[1]] for d in self.docs], dtype=np.int16)
+        self._vendor_masks: Dict[frozenset, np.ndarray] = {}
+
+    def postings(self, term: str) -> np.ndarray:
+        """Interleaved (passage id, term frequency) pairs, a view on the mapped file."""
+        entry = self.lexicon.get(term)
+        if not entry:
+            return self.postings_array[0:0]
+        offset, count = entry
+        return self.postings_array[offset:offset + 2 * count]
+
+    def vendor_mask(self, allowed: frozenset) -> np.ndarray:
+        """True for passages of the allowed vendors (cached per vendor set)."""
+        mask = self._vendor_masks.get(allowed)
+        if mask is None:
+            codes = [self._vendor_codes[v] for v in allowed if v in self._vendor_codes]
+            mask = self._vendor_masks[allowed] = np.isin(self._vendor_ids, codes)
+        return mask
+
+    def text(self, doc_id: int) -> str:
+        _, _, offset, length, _ = self.docs[doc_id]
+        return bytes(self._text[offset:offset + length]).decode("utf-8")
+
+    def close(self) -> None:
+        self.postings_array = None
+        for m in (self._post, self._text):
+            if m:
+                try:
+                    m.close()
+                except BufferError:
+                    pass                # A slice is still referenced (e.g. by a traceback); freed with it
+        self._post_file.close()
+        self._text_file.close()
+
+
+def _map(f) -> Optional[mmap.mmap]:
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _write_segment(index_dir: str, name: str, passages: List[Tuple[str, str, str]]) -> Dict:
+    """Write (source, vendor, text) passages as a new segment; returns its manifest entry."""
+    inverted: Dict[str, List[Tuple[int, int]]] = {}
+    docs, text_parts, text_offset, total_len = [], [], 0, 0
+    for doc_id, (source, vendor, text) in enumerate(passages):
+        terms = tokenize(text)
+        for term, tf in Counter(terms).items():
+            inverted.setdefault(term, []).append((doc_id, tf))
+        encoded = text.encode("utf-8")
+        docs.append([source, vendor, text_offset, len(encoded), len(terms)])
+        text_parts.append(encoded)
+        text_offset += len(encoded)
+        total_len += len(terms)
+
+    postings, lexicon = array("I"), {}
+    for term in sorted(inverted):
+        lexicon[term] = [len(postings), len(inverted[term])]
+        for doc_id, tf in inverted[term]:
+            postings.append(doc_id)
+            postings.append(tf)
+
+    base = os.path.join(index_dir, name)
+    with open(base + ".post", "wb") as f:
+        postings.tofile(f)
+    with open(base + ".text", "wb") as f:
+        f.write(b"".join(text_parts))
+    with open(base + ".docs.json", "w", encoding="utf-8") as f:
+        json.dump(docs, f)
+    with open(base + ".lex.json", "w", encoding="utf-8") as f:
+        json.dump(lexicon, f)
+    return {"name": name, "docs": len(docs), "total_len": total_len}
+
+
+class BM25Index:
+    """Incrementally maintained, memory-mapped BM25 index shared by all workers."""
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._manifest_mtime = None
+        self._manifest: Dict = {}
+        self._segments: Dict[str, _Segment] = {}
+        self._deleted: Dict[str, frozenset] = {}
+        self._dead: Dict[str, np.ndarray] = {}                 # Deleted passages as a mask per segment
+        self._n_docs, self._avgdl = 0, 1.0                     # Corpus statistics of the current manifest
+
+    # ---------- Indexing ----------
+
+    def _load_manifest(self) -> Dict:
+        path = os.path.join(self.index_dir, "manifest.json")
+        if not os.path.exists(path):
+            return {"version": 1, "next_segment": 0, "segments": [], "files": {}, "deleted": {}}
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: Dict) -> None:
+        path = os.path.join(self.index_dir, "manifest.json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Thread lock plus an exclusive file lock, so only one process updates the index at a time."""
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(os.path.join(self.index_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
+
+    def update(self, knowledge_dir: str = KNOWLEDGE_DIR, rebuild: bool = False) -> Dict[str, int]:
+        """Index new/changed files under `knowledge_dir` and drop removed ones."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._exclusive():
+            return self._update(knowledge_dir, rebuild)
+
+    def _update(self, knowledge_dir: str, rebuild: bool) -> Dict[str, int]:
+        manifest = self._load_manifest()
+        current = {}
+        for root, _, files in os.walk(knowledge_dir):
+            for filename in files:
+                if filename.lower().endswith(INDEXED_EXTENSIONS):
+                    path = os.path.join(root, filename)
+                    stat = os.stat(path)
+                    current[os.path.relpath(path, knowledge_dir)] = [stat.st_mtime_ns, stat.st_size]
+
+        rebuild = rebuild or len(manifest["segments"]) >= MAX_SEGMENTS
+        if rebuild:
+            changed = sorted(current)
+            old_segments = [s["name"] for s in manifest["segments"]]
+            manifest.update(segments=[], files={}, deleted={})
+        else:
+            changed = sorted(p for p, sig in current.items() if manifest["files"].get(p, {}).get("sig") != sig)
+            old_segments = []
+        removed = [p for p in manifest["files"] if p not in current]
+
+        # Tombstone passages of modified and removed files
+        for relpath in removed + [p for p in changed if p in manifest["files"]]:
+            entry = manifest["files"].pop(relpath)
+            deleted = set(manifest["deleted"].get(entry["segment"], []))
+            deleted.update(range(entry["first"], entry["first"] + entry["count"]))
+            manifest["deleted"][entry["segment"]] = sorted(deleted)
+
+        if changed:
+            name = f"seg_{manifest['next_segment']:05d}"
+            manifest["next_segment"] += 1
+            passages: List[Tuple[str, str, str]] = []
+            for relpath in changed:
+                with open(os.path.join(knowledge_dir, relpath), encoding="utf-8", errors="replace") as f:
+                    chunks = split_passages(f.read())
+                vendor = vendor_from_path(relpath)
+                manifest["files"][relpath] = {
+                    "sig": current[relpath], "segment": name, "first": len(passages), "count": len(chunks)
+                }
+                passages.extend((relpath, vendor, chunk) for chunk in chunks)
+            manifest["segments"].append(_write_segment(self.index_dir, name, passages))
+
+        # Drop segments whose passages are all deleted
+        live = []
+        for segment in manifest["segments"]:
+            if len(manifest["deleted"].get(segment["name"], [])) < segment["docs"]:
+                live.append(segment)
+            else:
+                manifest["deleted"].pop(segment["name"], None)
+                old_segments.append(segment["name"])
+        manifest["segments"] = live
+        self._save_manifest(manifest)
+
+        # Replaced segment files are unlinked after the new manifest is in place; readers that
+        # still map them keep working. Segments dropped outside a rebuild are cleaned up later.
+        if rebuild:
+            self._remove_unreferenced(manifest)
+        return {"indexed_files": len(changed), "removed_files": len(removed), "segments": len(live)}
+
+    def _remove_unreferenced(self, manifest: Dict) -> None:
+        referenced = {s["name"] for s in manifest["segments"]}
+        for filename in os.listdir(self.index_dir):
+            if filename.startswith("seg_") and filename.split(".")[0] not in referenced:
+                try:
+                    os.remove(os.path.join(self.index_dir, filename))
+                except OSError:
+                    pass
+
+    # ---------- Querying ----------
+
+    def _refresh(self) -> None:
+        """Reload the manifest (and map new segments) when another process updated it."""
+        path = os.path.join(self.index_dir, "manifest.json")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        try:
+            manifest = self._load_manifest()
+            names = {s["name"] for s in manifest["segments"]}
+            opened = {name: _Segment(self.index_dir, name) for name in names if name not in self._segments}
+        except (OSError, ValueError):
+            # Caught mid-rebuild by another process; keep serving the previous view
+            return
+        for name in list(self._segments):
+            if name not in names:
+                self._retire(self._segments.pop(name))
+        self._segments.update(opened)
+        self._deleted = {name: frozenset(ids) for name, ids in manifest["deleted"].items()}
+        self._dead = {}
+        for name, ids in self._deleted.items():
+            if name in self._segments and ids:
+                dead = np.zeros(len(self._segments[name].docs), dtype=bool)
+                dead[list(ids)] = True
+                self._dead[name] = dead
+        # Computed once per manifest instead of on every query (tombstoned passages count for avgdl)
+        live = [self._segments[s["name"]] for s in manifest["segments"]]
+        total_docs = sum(len(segment.docs) for segment in live)
+        self._n_docs = total_docs - sum(len(ids) for ids in self._deleted.values())
+        self._avgdl = float(sum(segment.doc_len.sum() for segment in live)) / max(1, total_docs)
+        self._manifest, self._manifest_mtime = manifest, mtime
+
+    @staticmethod
+    def _retire(segment: _Segment) -> None:
+        """Close a segment that left the manifest, or leave that to its last reader (under _lock)."""
+        segment.retired = True
+        if segment.readers == 0:
+            segment.close()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            self._refresh()
+            segments = self._manifest.get("segments", [])
+            deleted = sum(len(ids) for ids in self._deleted.values())
+        return {
+            "passages": sum(s["docs"] for s in segments) - deleted,
+            "files": len(self._manifest.get("files", {})),
+            "segments": len(segments),
+        }
+
+    def search(self, query: str, k: int = 5, vendor: Optional[str] = None) -> List[Passage]:
+        """Top-k passages by BM25; with `vendor`, only that vendor's and "common" passages."""
+        with self._lock:
+            self._refresh()
+            segments = [self._segments[s["name"]] for s in self._manifest.get("segments", [])]
+            dead, n_docs, avgdl = self._dead, self._n_docs, self._avgdl
+            for segment in segments:
+                segment.readers += 1
+        try:
+            return self._rank(segments, dead, n_docs, avgdl, query, k, vendor)
+        finally:
+            with self._lock:
+                for segment in segments:
+                    segment.readers -= 1
+                    if segment.retired and segment.readers == 0:
+                        segment.close()
+
+    @staticmethod
+    def _rank(segments: List[_Segment], dead: Dict[str, np.ndarray], n_docs: int, avgdl: float, query: str,
+              k: int, vendor: Optional[str]) -> List[Passage]:
+        """BM25 over segments the caller holds a reader reference on, one numpy pass per term and segment."""
+        if not segments or n_docs <= 0:
+            return []
+
+        # Document frequency from lexicon counts (tombstones included - close enough for ranking)
+        terms = set(tokenize(query))
+        df = {t: sum(s.lexicon.get(t, (0, 0))[1] for s in segments) for t in terms}
+        terms = sorted((t for t in terms if df[t]), key=lambda t: df[t])[:MAX_QUERY_TERMS]
+        idf = {t: math.log(1 + (n_docs - df[t] + 0.5) / (df[t] + 0.5)) for t in terms}
+
+        allowed = None if not vendor else frozenset((vendor, "common"))
+        candidates: List[Tuple[float, int, int]] = []
+        for seg_index, segment in enumerate(segments):
+            scores = None
+            for term in terms:
+                postings = segment.postings(term)
+                if not len(postings):
+                    continue
+                doc_ids, tf = postings[0::2], postings[1::2].astype(np.float64)
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * segment.doc_len[doc_ids] / avgdl)
+                if scores is None:
+                    scores = np.zeros(len(segment.docs), dtype=np.float64)
+                # A term lists each passage once, so the fancy-indexed += does not collide
+                scores[doc_ids] += idf[term] * tf * (BM25_K1 + 1) / norm
+            if scores is None:
+                continue
+            if segment.name in dead:
+                scores[dead[segment.name]] = 0.0
+            if allowed:
+                scores[~segment.vendor_mask(allowed)] = 0.0
+            hits = np.flatnonzero(scores > 0)
+            if len(hits) > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            candidates.extend((float(scores[d]), seg_index, int(d)) for d in hits)
+
+        top = sorted(candidates, key=lambda c: (-c[0], c[1], c[2]))[:k]
+        return [
+            Passage(
+                source=segments[s].docs[d][0],
+                vendor=segments[s].docs[d][1],
+                text=segments[s].text(d),
+                score=round(score, 3),
+            )
+            for score, s, d in top
+        ]
+
+
+def format_context(passages: Iterable[Passage], token_budget: int = 800) -> str:
+    """Numbered reference block for the prompt, cut off at roughly `token_budget` tokens."""
+    blocks, used = [], 0
+    for number, passage in enumerate(passages, start=1):
+        block = f"[{number}] ({passage.source})\n{passage.text.strip()}"
+        cost = len(block) // 4
+        if used + cost > token_budget:
+            remaining = (token_budget - used) * 4
+            if remaining < 200:
+                break
+            block = block[:remaining].rsplit(" ", 1)[0] + " [...]"
+            cost = token_budget - used
+        blocks.append(block)
+        used += cost
+    return "\n\n".join(blocks)
+
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local BM25 knowledge index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    index_cmd = sub.add_parser("index")
+    index_cmd.add_argument("knowledge_dir", nargs="?", default=KNOWLEDGE_DIR)
+    index_cmd.add_argument("--index-dir", default=INDEX_DIR)
+    index_cmd.add_argument("--rebuild", action="store_true")
+    search_cmd = sub.add_parser("search")
+    search_cmd.add_argument("query")
+    search_cmd.add_argument("--index-dir", default=INDEX_DIR)
+    search_cmd.add_argument("--vendor")
+    search_cmd.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    index = BM25Index(args.index_dir)
+    if args.command == "index":
+        start = time.perf_counter()
+        result = index.update(args.knowledge_dir, rebuild=args.rebuild)
+        print(f"{result} in {time.perf_counter() - start:.2f}s; {index.stats()}")
+        return 0
+
+    index.search("warm up", k=1)
+    start = time.perf_counter()
+    passages = index.search(args.query, k=args.k, vendor=args.vendor)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for passage in passages:
+        first_line = passage.text.strip().splitlines()[0][:100]
+        print(f"{passage.score:8.3f}  [{passage.vendor}] {passage.source}: {first_line}")
+    print(f"{len(passages)} passages in {elapsed_ms:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,216 @@
+"""
+Section-wise generation of long documents.
+
+DR test plans, change requests and cross-vendor migration plans list six to eight
+required sections; written in one completion they are the slowest requests of the
+assistant and the most likely to hit max_tokens. In sectioned mode a short outline is
+generated first (scope, key facts, names and numbers every section must agree on), then
+every section of the template's "Include:" list is generated as its own request with the
+outline as shared context, all of them concurrently. `SectionedDocument` collects the
+streamed pieces and renders them in template order at any time, so the wall-clock time
+approaches the time of the longest section instead of the sum of all of them.
+
+This module has no Streamlit dependency; the caller supplies the LLM call.
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from continuation import merge_usage
+from copilot_core import PROMPT_TEMPLATES, include_items
+from markdown_sections import ATX_HEADING, BOLD_HEADING
+
+SECTIONED_USE_CASES = ("DR Test Planning", "Generate Change Request Documentation", "Cross-Vendor Migration")
+OUTLINE_MAX_TOKENS = 400            # The outline is context for the sections, not part of the document
+MAX_SECTION_WORKERS = 8             # Upper bound on sections in flight (the templates list at most 8)
+RENDER_INTERVAL_S = 0.15            # How often the caller's progress callback runs while sections stream
+
+OUTLINE_TEMPLATE = """
+
+OUTLINE MODE:
+Do not write the document yet. Write a compact outline of at most 200 words that the
+sections listed above will be written from, independently of each other:
+- the scope, systems and objects involved, with the names and numbers from the details
+- key decisions and assumptions every section must use consistently (strategy, tools, dates, roles)
+- one line per section on what it will cover
+Bullets only, no headings, no preamble.
+"""
+
+SECTION_TEMPLATE = """
+
+Shared outline of the whole document (written beforehand; keep names, numbers and decisions consistent with it):
+{outline}
+
+SECTION MODE:
+The document is written section by section, by separate authors at the same time. Write ONLY
+section {number} of {count}: "{title}". The other sections are: {others}.
+Start with the level-2 heading "## {number}. {title}" (translated into the response language),
+cover this section completely and in depth, and do not repeat content that belongs to the
+other sections. No document title, no introduction or closing remarks.
+"""
+
+PENDING_MARK = "…"
+
+
+def supports_sectioned(task_key: Optional[str]) -> bool:
+    return task_key in SECTIONED_USE_CASES and len(document_sections(task_key)) > 1
+
+
+def document_sections(task_key: str) -> List[str]:
+    """Section titles of a use case, in template order."""
+    return include_items(PROMPT_TEMPLATES.get(task_key, ""))
+
+
+def outline_prompt(prompt: str) -> str:
+    """The full use case prompt (with any reference material), asking for the outline only."""
+    return prompt + OUTLINE_TEMPLATE
+
+
+def section_prompt(prompt: str, outline: str, titles: List[str], index: int) -> str:
+    others = "; ".join(f"{number}. {title}" for number, title in enumerate(titles, start=1) if number != index + 1)
+    return prompt + SECTION_TEMPLATE.format(outline=outline.strip(), number=index + 1, count=len(titles),
+                                            title=titles[index], others=others)
+
+
+def format_section(content: str, title: str, number: int) -> str:
+    """One section with a uniform "## n. Title" heading; the model's (translated) heading wins if it wrote one."""
+    lines = content.strip().splitlines()
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    heading = title
+    if lines:
+        first = lines[0].strip()
+        match = ATX_HEADING.match(first) or BOLD_HEADING.match(first)
+        if match:
+            text = match.group(match.lastindex).strip().strip("*").strip().rstrip(":")
+            heading = re.sub(r"^(?:section\s+|abschnitt\s+)?\d+[.)]\s*", "", text, flags=re.IGNORECASE) or title
+            lines = lines[1:]
+    body = "\n".join(lines).strip("\n")
+    return f"## {number}. {heading}\n\n{body}" if body else f"## {number}. {heading}"
+
+# ============================
+# Assembly
+# ============================
+
+class SectionedDocument:
+    """Thread-safe collector of concurrently streamed sections, rendered in template order."""
+
+    def __init__(self, titles: List[str]):
+        self.titles = list(titles)
+        self._parts = ["" for _ in self.titles]
+        self._done = [False for _ in self.titles]
+        self._lock = threading.Lock()
+
+    def append(self, index: int, delta: str) -> None:
+        with self._lock:
+            self._parts[index] += delta
+
+    def finish(self, index: int, content: Optional[str]) -> None:
+        """Final text of a section (with continuations and restored values); None keeps what streamed."""
+        with self._lock:
+            if content is not None:
+                self._parts[index] = content
+            self._done[index] = True
+
+    def text(self, index: int) -> str:
+        """Raw text of one section so far."""
+        with self._lock:
+            return self._parts[index]
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._done.count(False)
+
+    def render(self, failed_note: str = "") -> str:
+        """All sections in order; unfinished ones show what has streamed so far."""
+        with self._lock:
+            parts, done = list(self._parts), list(self._done)
+        rendered = []
+        for index, (title, text, finished) in enumerate(zip(self.titles, parts, done)):
+            section = format_section(text, title, index + 1)
+            if not text.strip():
+                section += f"\n\n{failed_note if finished else PENDING_MARK}"
+            rendered.append(section)
+        return "\n\n".join(rendered).strip() + "\n"
+
+
+def generate_sections(titles: List[str],
+                      generate: Callable[[int, Callable[[str], None]], Tuple[Optional[str], Optional[Dict]]],
+                      on_progress: Optional[Callable[["SectionedDocument"], None]] = None,
+                      max_workers: int = MAX_SECTION_WORKERS
+                      ) -> Tuple["SectionedDocument", List[Optional[Dict]], float]:
+    """Run `generate(index, on_delta)` for every section concurrently.
+
+    `on_progress(document)` runs in the calling thread every RENDER_INTERVAL_S while
+    sections stream, and once more at the end. Returns the document, the metadata of
+    every section (None where it failed) and the wall-clock time.
+    """
+    document = SectionedDocument(titles)
+    metadata: List[Optional[Dict]] = [None] * len(titles)
+    started = time.perf_counter()
+
+    def run(index: int) -> None:
+        content, meta = None, None
+        try:
+            content, meta = generate(index, lambda delta: document.append(index, delta))
+        finally:
+            # A failed section keeps nothing half-written: its text is cleared, the note is shown instead
+            document.finish(index, content if content else "")
+            metadata[index] = meta if content else None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(titles))),
+                            thread_name_prefix="section") as pool:
+        pending = {pool.submit(run, index) for index in range(len(titles))}
+        while pending:
+            finished, pending = wait(pending, timeout=RENDER_INTERVAL_S, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.exception()          # Failures are reported by `generate`; the section stays empty
+            if on_progress:
+                on_progress(document)
+    elapsed_s = time.perf_counter() - started
+    if on_progress:
+        on_progress(document)
+    return document, metadata, elapsed_s
+
+
+def merge_section_metadata(outline_meta: Dict, section_metas: List[Optional[Dict]], titles: List[str],
+                           outline_s: float, sections_s: float) -> Dict:
+    """One metadata record for the whole document: usage summed, latency as the user saw it."""
+    done = [meta for meta in section_metas if meta]
+    usage = dict(outline_meta.get("usage") or {})
+    redactions: Dict[str, int] = dict(outline_meta.get("redactions") or {})
+    for meta in done:
+        usage = merge_usage(usage, meta.get("usage") or {})
+        # Every request carries the same details, so a value redacted in each of them still counts once
+        for kind, count in (meta.get("redactions") or {}).items():
+            redactions[kind] = max(redactions.get(kind, 0), count)
+    latency_s = outline_s + sections_s
+    completion_tokens = usage.get("completion_tokens", 0)
+    section_latencies = [meta.get("latency_s", 0.0) for meta in done]
+    return {
+        **outline_meta,
+        "model": done[0].get("model") if done else outline_meta.get("model"),
+        "usage": usage,
+        "finish_reason": "length" if any(meta.get("finish_reason") == "length" for meta in done) else "stop",
+        "continuations": sum(meta.get("continuations", 0) for meta in done),
+        "requested_max_tokens": sum(meta.get("requested_max_tokens", 0) for meta in done),
+        "redactions": redactions,
+        "latency_s": round(latency_s, 3),
+        # Sections queue side by side: the outline's wait plus the longest section wait
+        "queue_s": round(outline_meta.get("queue_s", 0.0) + max([meta.get("queue_s", 0.0) for meta in done],
+                                                                 default=0.0), 3),
+        "tokens_per_s": round(completion_tokens / latency_s, 1) if latency_s else 0.0,
+        "sectioned": {
+            "sections": len(titles),
+            "failed": [title for title, meta in zip(titles, section_metas) if not meta],
+            "outline_s": round(outline_s, 3),
+            "sections_s": round(sections_s, 3),
+            "longest_section_s": round(max(section_latencies, default=0.0), 3),
+            "sequential_s": round(outline_s + sum(section_latencies), 3),
+            "request_ids": [meta.get("request_id") for meta in done],
+        },
+    }
@@ -0,0 +1,476 @@
+"""
+Shared state for multi-replica deployments: counters, cache entries, job records, locks.
+
+Several Streamlit replicas behind a load balancer only see consistent quota counters
+and cache hits if they share state. Three interchangeable backends, chosen by URL:
+
+    memory://                       single process (default; lost on restart)
+    sqlite:////var/lib/copilot.db   one host, many worker processes (WAL mode)
+    redis://redis.internal:6379/0   many hosts; any Redis-protocol server (Redis, Valkey, ...)
+
+The counter methods (`add`, `total`, `lock`) match the counter store interface of
+`quota_governor`, so any store can back the `QuotaGovernor` directly. Values of cache
+entries and job records must be JSON-serializable.
+"""
+
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from quota_governor import BUCKETS_PER_WINDOW, MemoryCounterStore
+
+LOCK_TTL_S = 10.0           # Locks expire if a worker dies while holding one
+LOCK_WAIT_S = 5.0
+JOB_TTL_S = 7 * 86400
+MEMORY_CACHE_ENTRIES = 1024     # memory:// keeps the most recently used cache entries (results, budgets)
+MEMORY_JOBS = 10000             # ... and the most recently updated job records
+
+
+class StateStoreError(Exception):
+    pass
+
+
+# What a store call raises when the backend is unreachable or unhealthy (Redis down, locked SQLite file)
+STORE_ERRORS = (StateStoreError, OSError, sqlite3.Error)
+
+
+class StateStore(ABC):
+    """Interface shared by all backends."""
+
+    # Sliding-window counters (see quota_governor.MemoryCounterStore)
+    @abstractmethod
+    def add(self, key: str, amount: int, window_s: int, now: float) -> None: ...
+
+    @abstractmethod
+    def total(self, key: str, window_s: int, now: float) -> Tuple[int, float]: ...
+
+    # Cache entries
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]: ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None: ...
+
+    # Job records
+    @abstractmethod
+    def put_job(self, job_id: str, record: Dict) -> None: ...
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[Dict]: ...
+
+    # Locks
+    @abstractmethod
+    def lock(self, name: str, ttl_s: float = LOCK_TTL_S, wait_s: float = LOCK_WAIT_S):
+        """Context manager holding `name` across every process sharing the store (re-entrant per thread)."""
+
+
+def _bucket(window_s: int, now: float) -> Tuple[int, int]:
+    size = max(1, window_s // BUCKETS_PER_WINDOW)
+    return size, int(now // size)
+
+
+def _window_total(buckets: Dict[int, int], window_s: int, now: float) -> Tuple[int, float]:
+    size, current = _bucket(window_s, now)
+    live = {b: v for b, v in buckets.items() if b > current - BUCKETS_PER_WINDOW and v}
+    if not live:
+        return 0, 0.0
+    return sum(live.values()), max(0.0, (min(live) + BUCKETS_PER_WINDOW) * size - now)
+
+
+# ============================
+# In-process
+# ============================
+
+class MemoryStateStore(MemoryCounterStore, StateStore):
+    """Bounded like the per-process caches it replaces: LRU cache entries, job records by age and count."""
+
+    def __init__(self, cache_entries: int = MEMORY_CACHE_ENTRIES, jobs: int = MEMORY_JOBS):
+        super().__init__()
+        self.cache_entries, self.jobs = cache_entries, jobs
+        self._cache: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._jobs: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value, expires = self._cache.get(key, (None, None))
+            if expires is not None and expires < time.time():
+                self._cache.pop(key, None)
+                return None
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        with self._lock:
+            self._cache[key] = (value, time.time() + ttl_s if ttl_s else None)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def put_job(self, job_id: str, record: Dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = (dict(record), now)
+            self._jobs.move_to_end(job_id)
+            # Oldest first: drop what is past the TTL or over the count
+            while self._jobs and (len(self._jobs) > self.jobs or next(iter(self._jobs.values()))[1] < now - JOB_TTL_S):
+                self._jobs.popitem(last=False)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            record, updated = self._jobs.get(job_id, (None, 0.0))
+            return record if record is not None and updated >= time.time() - JOB_TTL_S else None
+
+    @contextmanager
+    def lock(self, name: str, ttl_s: float = LOCK_TTL_S, wait_s: float = LOCK_WAIT_S) -> Iterator[None]:
+        with self._lock:
+            yield
+
+
+# ============================
+# SQLite (WAL) - shared by processes on one host
+# ============================
+
+class SQLiteStateStore(StateStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS counters (key TEXT, bucket INTEGER, value INTEGER, PRIMARY KEY (key, bucket));
+    CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL);
+    CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, record TEXT, updated_at REAL);
+    CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        # Re-entrant per thread: the governor's reserve step nests store calls inside lock()
+        self._held: Dict[Tuple[int, str], int] = {}
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, key: str, amount: int, window_s: int, now: float) -> None:
+        _, bucket = _bucket(window_s, now)
+        counter_key = f"{key}:{window_s}"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO counters (key, bucket, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (key, bucket) DO UPDATE SET value = value + excluded.value",
+                (counter_key, bucket, int(amount)),
+            )
+            conn.execute("DELETE FROM counters WHERE key = ? AND bucket <= ?", (counter_key, bucket - BUCKETS_PER_WINDOW))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def total(self, key: str, window_s: int, now: float) -> Tuple[int, float]:
+        rows = self._conn().execute("SELECT bucket, value FROM counters WHERE key = ?", (f"{key}:{window_s}",)).fetchall()
+        return _window_total(dict(rows), window_s, now)
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if not row or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), now + ttl_s if ttl_s else None),
+        )
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+
+    def put_job(self, job_id: str, record: Dict) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO jobs (id, record, updated_at) VALUES (?, ?, ?)", (job_id, json.dumps(record), now))
+        conn.execute("DELETE FROM jobs WHERE updated_at < ?", (now - JOB_TTL_S,))
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT record FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @contextmanager
+    def lock(self, name: str, ttl_s: float = LOCK_TTL_S, wait_s: float = LOCK_WAIT_S) -> Iterator[None]:
+        held_key = (threading.get_ident(), name)
+        if self._held.get(held_key):
+            self._held[held_key] += 1
+            try:
+                yield
+            finally:
+                self._held[held_key] -= 1
+            return
+
+        owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex}"
+        conn = self._conn()
+        deadline = time.time() + wait_s
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM locks WHERE name = ? AND expires_at < ?", (name, now))
+                acquired = conn.execute(
+                    "INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)", (name, owner, now + ttl_s)
+                ).rowcount == 1
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if acquired:
+                break
+            if now > deadline:
+                raise StateStoreError(f"Timed out waiting for lock '{name}'")
+            time.sleep(0.005)
+
+        self._held[held_key] = 1
+        try:
+            yield
+        finally:
+            self._held.pop(held_key, None)
+            conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+
+# ============================
+# Redis protocol (RESP2) - shared by all replicas
+# ============================
+
+class _ErrorReply(StateStoreError):
+    """Error reply from the server (the connection itself is fine)."""
+
+
+class _RespConnection:
+    """Minimal blocking RESP2 client connection."""
+
+    def __init__(self, host: str, port: int, db: int, password: Optional[str], timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", db)
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def command(self, *args) -> Any:
+        return self.pipeline(args)[0]
+
+    def pipeline(self, *commands) -> List[Any]:
+        """Send several commands in one round trip."""
+        self.send(commands)
+        return self.receive(len(commands))
+
+    def send(self, commands) -> None:
+        self.sock.sendall(b"".join(self._encode(args) for args in commands))
+
+    def receive(self, count: int) -> List[Any]:
+        """All `count` replies; an error reply is raised only after the rest are read, so the
+        connection stays in step for the next command."""
+        replies, error = [], None
+        for _ in range(count):
+            try:
+                replies.append(self._read())
+            except _ErrorReply as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+    def stale(self) -> bool:
+        """RESP2 servers never send unprompted: a readable idle socket was closed (restart, idle timeout)."""
+        try:
+            return bool(select.select([self.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _read(self) -> Any:
+        line = self.reader.readline()
+        if not line:
+            raise StateStoreError("Connection closed by Redis server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise _ErrorReply(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [self._read() for _ in range(count)]
+        raise StateStoreError(f"Unexpected RESP reply: {line!r}")
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisStateStore(StateStore):
+    # Delete the lock only if we still own it
+    RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 prefix: str = "copilot:", timeout: float = 5.0):
+        self.host, self.port, self.db, self.password, self.timeout = host, port, db, password, timeout
+        self.prefix = prefix
+        self._local = threading.local()
+        self._held: Dict[Tuple[int, str], int] = {}
+
+    def _connection(self, fresh: bool = False) -> _RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and fresh:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = _RespConnection(self.host, self.port, self.db, self.password, self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _pipeline(self, *commands, idempotent: bool = True) -> List[Any]:
+        """Run commands in one round trip, reconnecting once after a dropped connection.
+
+        Commands are only resent when they cannot have been applied (stale socket, failed
+        send) or are idempotent. After a read failure, a non-idempotent pipeline (counter
+        increments, lock acquisition) is not resent, so it is never applied twice.
+        """
+        conn = self._connection()
+        if conn.stale():
+            conn = self._connection(fresh=True)
+        try:
+            conn.send(commands)
+        except OSError:
+            conn = self._connection(fresh=True)
+            conn.send(commands)
+        try:
+            return conn.receive(len(commands))
+        except _ErrorReply:
+            raise
+        except (OSError, StateStoreError):
+            # Timeout or dropped connection after sending: the commands may or may not have run
+            self._drop()
+            if not idempotent:
+                raise
+            return self._connection().pipeline(*commands)
+
+    def _command(self, *args, idempotent: bool = True) -> Any:
+        return self._pipeline(args, idempotent=idempotent)[0]
+
+    def add(self, key: str, amount: int, window_s: int, now: float) -> None:
+        size, bucket = _bucket(window_s, now)
+        counter_key = f"{self.prefix}counter:{key}:{window_s}"
+        self._pipeline(
+            ("HINCRBY", counter_key, bucket, int(amount)),
+            ("EXPIRE", counter_key, size * BUCKETS_PER_WINDOW * 2),
+            idempotent=False,
+        )
+
+    def total(self, key: str, window_s: int, now: float) -> Tuple[int, float]:
+        counter_key = f"{self.prefix}counter:{key}:{window_s}"
+        flat = self._command("HGETALL", counter_key) or []
+        buckets = {int(flat[i]): int(flat[i + 1]) for i in range(0, len(flat), 2)}
+        _, current = _bucket(window_s, now)
+        stale = [b for b in buckets if b <= current - BUCKETS_PER_WINDOW]
+        if stale:
+            self._command("HDEL", counter_key, *stale)
+        return _window_total(buckets, window_s, now)
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._command("GET", f"{self.prefix}cache:{key}")
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        args = ["SET", f"{self.prefix}cache:{key}", json.dumps(value)]
+        if ttl_s:
+            args += ["PX", int(ttl_s * 1000)]
+        self._command(*args)
+
+    def put_job(self, job_id: str, record: Dict) -> None:
+        self._command("SET", f"{self.prefix}job:{job_id}", json.dumps(record), "EX", JOB_TTL_S)
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        raw = self._command("GET", f"{self.prefix}job:{job_id}")
+        return json.loads(raw) if raw is not None else None
+
+    @contextmanager
+    def lock(self, name: str, ttl_s: float = LOCK_TTL_S, wait_s: float = LOCK_WAIT_S) -> Iterator[None]:
+        held_key = (threading.get_ident(), name)
+        if self._held.get(held_key):
+            self._held[held_key] += 1
+            try:
+                yield
+            finally:
+                self._held[held_key] -= 1
+            return
+
+        lock_key = f"{self.prefix}lock:{name}"
+        token = uuid.uuid4().hex
+        deadline = time.time() + wait_s
+        while self._command("SET", lock_key, token, "NX", "PX", int(ttl_s * 1000), idempotent=False) is None:
+            if time.time() > deadline:
+                raise StateStoreError(f"Timed out waiting for lock '{name}'")
+            time.sleep(0.005)
+
+        self._held[held_key] = 1
+        try:
+            yield
+        finally:
+            self._held.pop(held_key, None)
+            self._command("EVAL", self.RELEASE_SCRIPT, 1, lock_key, token)
+
+
+def open_state_store(url: str = "memory://") -> StateStore:
+    """Create a store from a URL: memory://, sqlite:///state.db, sqlite:////abs/state.db or redis://[:password@]host:port/db."""
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "memory"):
+        return MemoryStateStore()
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative/state.db or sqlite:////absolute/state.db
+        path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else ""
+        return SQLiteStateStore(path or os.path.join(".index", "state.db"))
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisStateStore(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unsupported state store URL: {url}")
@@ -0,0 +1,255 @@
+"""
+Structured (JSON) output for the document-style use cases of the Storage Engineering AI Assistant.
+
+CR, RCA, DR test plan and decommissioning outputs can be generated as one JSON object
+per document, one member per section, constrained by a JSON schema (OpenAI structured
+outputs, `response_format` json_schema). The model emits the members in schema order,
+so `IncrementalJSONParser` can hand out each section the moment its value closes while
+the stream is still running. `to_markdown` renders the same sections as the usual
+Markdown document for display, translation, the conversation and the incident index.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# ============================
+# Section Schemas
+# ============================
+
+@dataclass(frozen=True)
+class SectionField:
+    key: str
+    title_en: str
+    title_de: str
+    kind: str                  # "text" (Markdown prose), "list" (bullets) or "steps" (numbered)
+    description: str           # Content and length guidance, sent to the model with the schema
+
+    def title(self, language: str = "English") -> str:
+        return self.title_de if language.startswith("German") else self.title_en
+
+
+SECTION_SCHEMAS: Dict[str, List[SectionField]] = {
+    "Generate Change Request Documentation": [
+        SectionField("title", "Change Title", "Change-Titel", "text",
+                     "One line: change title with a CR reference placeholder (CHG-XXXXXXX)."),
+        SectionField("justification", "Business and Technical Justification",
+                     "Fachliche und technische Begründung", "text", "2-4 sentences."),
+        SectionField("risk_assessment", "Risk Assessment and Mitigation", "Risikobewertung und Maßnahmen", "list",
+                     "One risk per item with its likelihood, impact and mitigation."),
+        SectionField("implementation_steps", "Implementation Steps", "Implementierungsschritte", "steps",
+                     "One step per item, vendor CLI commands in backticks."),
+        SectionField("backout_plan", "Backout and Recovery Plan", "Backout- und Wiederherstellungsplan", "steps",
+                     "One backout step per item, including the trigger for backing out."),
+        SectionField("impact", "Impacted Systems and Outage Window", "Betroffene Systeme und Ausfallfenster",
+                     "text", "Affected systems, services and the expected outage window."),
+        SectionField("approvals", "Required Approvals", "Erforderliche Genehmigungen", "list",
+                     "CAB, 4-eyes and owner approvals, one per item."),
+        SectionField("validation", "Post-Implementation Validation", "Validierung nach der Umsetzung", "steps",
+                     "One verification check per item."),
+    ],
+    "Generate Incident RCA": [
+        SectionField("summary", "Executive Summary", "Zusammenfassung", "text", "2-3 sentences for management."),
+        SectionField("timeline", "Timeline", "Zeitlicher Ablauf", "list",
+                     "One event per item: '<timestamp or placeholder> - <event>'."),
+        SectionField("root_cause", "Technical Root Cause", "Technische Ursache", "text",
+                     "The technical root cause and the contributing factors."),
+        SectionField("impact", "Impact Analysis", "Auswirkungsanalyse", "text",
+                     "Affected services, users and duration."),
+        SectionField("corrective_actions", "Corrective Actions", "Korrekturmaßnahmen", "list",
+                     "One action per item with owner placeholder."),
+        SectionField("preventive_actions", "Preventive Actions", "Präventivmaßnahmen", "list",
+                     "One action per item."),
+        SectionField("lessons_learned", "Lessons Learned", "Erkenntnisse", "list", "One lesson per item."),
+    ],
+    "DR Test Planning": [
+        SectionField("objectives", "Objectives and Success Criteria", "Ziele und Erfolgskriterien", "list",
+                     "Objectives including RPO/RTO targets, one per item."),
+        SectionField("scope", "Scope", "Umfang", "text", "Systems, sites and data sets in and out of scope."),
+        SectionField("test_procedure", "Test Procedure", "Testablauf", "steps",
+                     "One step per item, vendor CLI commands in backticks."),
+        SectionField("roles", "Roles and Responsibilities", "Rollen und Verantwortlichkeiten", "list",
+                     "One role per item: '<role>: <responsibility>'."),
+        SectionField("failback", "Rollback and Failback", "Rollback und Failback", "steps",
+                     "One failback step per item."),
+        SectionField("evidence", "Evidence Collection", "Nachweise", "list",
+                     "Evidence to collect for audit, one per item."),
+    ],
+    "Decommissioning & Data Retirement Procedure": [
+        SectionField("scope", "Scope and Assets", "Umfang und Assets", "text",
+                     "Systems, arrays and data sets to retire."),
+        SectionField("pre_checks", "Pre-Decommissioning Checks", "Prüfungen vor der Stilllegung", "list",
+                     "Dependencies, backups, retention holds; one check per item."),
+        SectionField("sanitization", "Data Sanitization Method", "Datenbereinigungsmethode", "text",
+                     "Method and standard (e.g. NIST 800-88 clear/purge/destroy) with vendor commands."),
+        SectionField("validation", "Validation and Evidence", "Validierung und Nachweise", "list",
+                     "Verification and evidence (certificates, logs), one per item."),
+        SectionField("sign_off", "Documentation and Sign-off", "Dokumentation und Freigabe", "list",
+                     "Records to update and approvals, one per item."),
+        SectionField("notifications", "Stakeholder Notification", "Benachrichtigung der Stakeholder", "list",
+                     "Who is informed and when, one per item."),
+    ],
+}
+
+
+def supports_structured(task_key: Optional[str]) -> bool:
+    return task_key in SECTION_SCHEMAS
+
+
+def json_schema(task_key: str) -> Dict[str, Any]:
+    """JSON schema of one document: every section required, no extra members (strict mode)."""
+    properties = {}
+    for section in SECTION_SCHEMAS[task_key]:
+        if section.kind == "text":
+            properties[section.key] = {"type": "string", "description": section.description}
+        else:
+            properties[section.key] = {"type": "array", "items": {"type": "string"},
+                                       "description": section.description}
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": [section.key for section in SECTION_SCHEMAS[task_key]],
+        "additionalProperties": False,
+    }
+
+
+def response_format(task_key: str, schema_supported: bool = True) -> Dict[str, Any]:
+    """`response_format` for the chat completion.
+
+    Servers without json_schema support get plain JSON mode; the field list in
+    `structured_instructions` then carries the structure.
+    """
+    if not schema_supported:
+        return {"type": "json_object"}
+    name = "".join(c if c.isalnum() else "_" for c in task_key.lower()).strip("_")[:64]
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": json_schema(task_key)}}
+
+
+def structured_instructions(task_key: str, schema_supported: bool = True) -> str:
+    """Prompt suffix asking for the JSON document instead of Markdown."""
+    text = ("\n\nOUTPUT FORMAT:\nReturn the document as one JSON object, no Markdown fences. "
+            "Field values are Markdown text in the response language; list fields are arrays "
+            "with one entry per item, without bullet or number prefixes.")
+    if schema_supported:
+        return text
+    fields = "\n".join(
+        f"- {s.key} ({'string' if s.kind == 'text' else 'array of strings'}): {s.description}"
+        for s in SECTION_SCHEMAS[task_key]
+    )
+    return f"{text}\nFields, in this order:\n{fields}"
+
+# ============================
+# Incremental Parsing
+# ============================
+
+class IncrementalJSONParser:
+    """Feeds a streamed JSON object and returns its top-level members as soon as they close.
+
+    Only tracks nesting depth and string state per character; each completed member is
+    decoded with json.loads, so the work per chunk stays linear in the chunk size.
+    """
+
+    def __init__(self):
+        self.buffer: List[str] = []       # Characters of the current top-level member
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.closed = False
+        self.members: Dict[str, Any] = {}
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        completed = []
+        for char in chunk:
+            if self.closed:
+                break
+            if not self.started:
+                if char == "{":
+                    self.started, self.depth = True, 1
+                continue
+
+            if self.in_string:
+                self.buffer.append(char)
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in "[{":
+                self.depth += 1
+            elif char in "]}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._complete(completed)
+                    self.closed = True
+                    break
+            elif char == "," and self.depth == 1:
+                self._complete(completed)
+                continue
+            self.buffer.append(char)
+        return completed
+
+    def _complete(self, completed: List[Tuple[str, Any]]) -> None:
+        member = "".join(self.buffer).strip()
+        self.buffer = []
+        if not member:
+            return
+        try:
+            (key, value), = json.loads("{" + member + "}").items()
+        except (ValueError, TypeError):
+            return
+        self.members[key] = value
+        completed.append((key, value))
+
+
+def parse_document(task_key: str, text: str) -> Tuple[Dict[str, Any], List[str]]:
+    """Sections of a finished response and the schema keys still missing.
+
+    A truncated response (finish_reason "length") keeps every section that closed.
+    """
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            data = {}
+    except ValueError:
+        parser = IncrementalJSONParser()
+        parser.feed(text)
+        data = parser.members
+    keys = [s.key for s in SECTION_SCHEMAS.get(task_key, [])]
+    sections = {key: data[key] for key in keys if key in data}
+    return sections, [key for key in keys if key not in sections]
+
+# ============================
+# Rendering
+# ============================
+
+def _field(task_key: str, key: str) -> Optional[SectionField]:
+    return next((s for s in SECTION_SCHEMAS.get(task_key, []) if s.key == key), None)
+
+
+def section_markdown(task_key: str, key: str, value: Any, language: str = "English") -> str:
+    section = _field(task_key, key)
+    if section is None:
+        return ""
+    if isinstance(value, list):
+        if section.kind == "steps":
+            body = "\n".join(f"{i}. {item}" for i, item in enumerate(value, 1))
+        else:
+            body = "\n".join(f"- {item}" for item in value)
+    else:
+        body = str(value).strip()
+    return f"## {section.title(language)}\n\n{body or '-'}"
+
+
+def to_markdown(task_key: str, sections: Dict[str, Any], language: str = "English") -> str:
+    """Markdown document in schema order (same headings as the free-form templates)."""
+    return "\n\n".join(
+        section_markdown(task_key, s.key, sections[s.key], language)
+        for s in SECTION_SCHEMAS.get(task_key, []) if s.key in sections
+    )
@@ -0,0 +1,434 @@
+"""
+Cross-vendor mapping table: equivalent objects, CLI commands, Ansible modules and
+replication features across NetApp ONTAP, Pure FlashArray and Dell EMC PowerMax.
+
+The table is a versioned JSON file reviewed like code (vendor_mapping.json). On load,
+every vendor name, alias, Ansible module and CLI command prefix becomes a phrase of up
+to MAX_PHRASE_TOKENS tokens in an in-memory index, so a lookup only tokenizes the text
+and probes its n-grams:
+
+- Migration prompts get the few rows the migration details actually mention, limited to
+  the source and target vendors, instead of the whole table.
+- An input that is only a short question like "What is the equivalent of SRDF/A on
+  NetApp?" is answered straight from the table without an LLM call; a request that just
+  mentions an equivalent gets the rows it mentions as context.
+
+Usage:
+    python vendor_mapping.py lookup "snapmirror and igroups" [--vendor "NetApp ONTAP"]
+    python vendor_mapping.py equivalent "masking view" --target "Pure FlashArray"
+    python vendor_mapping.py ask "what's the equivalent of SRDF/A on NetApp?"
+    python vendor_mapping.py validate [path]
+    python vendor_mapping.py bench
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from retrieval import STOPWORDS, VENDOR_ALIASES
+
+VENDOR_MAPPING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendor_mapping.json")
+MAPPING_USE_CASES = ("Cross-Vendor Migration", "Storage Migration")
+MAX_PHRASE_TOKENS = 4
+MAX_CONTEXT_ROWS = 8                # Rows added to one migration prompt
+MIN_ROW_SCORE = 3                   # One vendor term, or three concept words
+MAX_QUESTION_CHARS = 200            # Longer input is a migration request, not a quick question
+
+# Phrase weights per token: vendor names and aliases identify a row, CLI prefixes and
+# concept words only hint at it
+NAME_WEIGHT = 3
+CLI_WEIGHT = 2
+HINT_WEIGHT = 1
+
+# Keeps "srdf/a", "sm-bc", "na_ontap_volume" and "netapp.ontap" as single tokens
+TOKEN = re.compile(r"[a-z0-9][a-z0-9_\-/.]*[a-z0-9]|[a-z0-9]")
+PART = re.compile(r"[_\-/.]+")
+NAME_SEGMENT = re.compile(r"\s*(?:/|\(|\)|,)\s*")
+
+# Whole-input questions only: an "equivalent" inside a playbook, CR or plan request is not one
+QUESTION_LEAD = r"^(?:(?:what|which)(?:'s|\s+is|\s+are)\s+)?(?:the\s+)?"
+FRAGE_LEAD = r"^(?:(?:was|welche[rs]?)\s+ist\s+)?(?:die\s+|das\s+|der\s+)?"
+EQUIVALENT_QUESTIONS = [
+    re.compile(QUESTION_LEAD + r"(?:equivalent|counterpart|analog(?:ue)?)\s+(?:of|to|for)\s+(?P<term>.+?)\s+"
+               r"(?:on|in|for|with)\s+(?P<target>[^?!]+?)[\s?.!]*$", re.IGNORECASE),
+    re.compile(QUESTION_LEAD + r"(?P<term>.+?)\s+(?:equivalent|counterpart)\s+"
+               r"(?:on|in|for|with)\s+(?P<target>[^?!]+?)[\s?.!]*$", re.IGNORECASE),
+    re.compile(QUESTION_LEAD + r"(?P<target>[\w/ ]+?)\s+(?:equivalent|counterpart)\s+"
+               r"(?:of|to|for)\s+(?P<term>[^?!]+?)[\s?.!]*$", re.IGNORECASE),
+    re.compile(r"^what(?:'s|\s+is)\s+(?P<term>.+?)\s+called\s+(?:on|in)\s+(?P<target>[^?!]+?)[\s?.!]*$",
+               re.IGNORECASE),
+    re.compile(FRAGE_LEAD + r"(?:entsprechung|pendant|äquivalent|gegenstück)\s+(?:von|zu|für)\s+(?P<term>.+?)\s+"
+               r"(?:auf|bei|in|unter|für|mit)\s+(?P<target>[^?!]+?)[\s?.!]*$", re.IGNORECASE),
+    re.compile(r"^wie\s+heißt\s+(?P<term>.+?)\s+(?:auf|bei|in|unter)\s+(?P<target>[^?!]+?)[\s?.!]*$",
+               re.IGNORECASE),
+]
+# Anywhere in the input: the rows it mentions go into the prompt as context instead
+EQUIVALENT_MENTION = re.compile(r"\b(?:equivalent|counterpart|analog(?:ue)?|entsprechung|pendant|äquivalent|"
+                                r"gegenstück)\b", re.IGNORECASE)
+MAX_TERM_WORDS = 4                  # "masking view", "srdf/a", not "create a cr to replace snapmirror"
+VENDOR_WORDS = frozenset(alias for aliases in VENDOR_ALIASES.values() for alias in aliases)
+ARTICLES = frozenset("a an the der die das ein eine einer einem einen".split())
+# Besides vendor names, the only words a question target may have ("on a Pure array")
+TARGET_WORDS = ARTICLES | {"array", "system", "cluster", "side", "storage"}
+
+ANSWER_LABELS = {
+    "English": {"term": "Term", "cli": "CLI", "ansible": "Ansible", "notes": "Note", "none": "—"},
+    "German / Deutsch": {"term": "Begriff", "cli": "CLI", "ansible": "Ansible", "notes": "Hinweis", "none": "—"},
+}
+
+
+def _singular(token: str) -> str:
+    """"luns" -> "lun", "igroups" -> "igroup"; applied to the index and queries alike."""
+    if len(token) > 3 and token[-1] == "s" and token[-2].isalpha() and token[-2] != "s":
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [_singular(token) for token in TOKEN.findall(text.lower())]
+
+
+def _vendor_word(token: str) -> bool:
+    return token in VENDOR_WORDS or any(part in VENDOR_WORDS for part in PART.split(token))
+
+
+def mentions_equivalent(text: str) -> bool:
+    """Whether `text` asks for cross-vendor equivalents anywhere (gets the mapping rows as context)."""
+    return EQUIVALENT_MENTION.search(text) is not None
+
+
+def vendors_in(text: str) -> List[str]:
+    """Vendors named in `text`, in table order."""
+    tokens = set()
+    for token in tokenize(text):
+        tokens.add(token)
+        tokens.update(PART.split(token))
+    return [vendor for vendor, aliases in VENDOR_ALIASES.items() if tokens & set(aliases)]
+
+
+@dataclass(frozen=True)
+class VendorTerm:
+    name: str
+    aliases: Tuple[str, ...]
+    cli: Tuple[str, ...]
+    ansible: Optional[str]
+
+
+@dataclass(frozen=True)
+class MappingRow:
+    id: str
+    category: str
+    concept: str
+    notes: str
+    terms: Dict[str, VendorTerm]
+
+
+@dataclass
+class Equivalent:
+    row: MappingRow
+    term: str
+    source_vendor: Optional[str]
+    target_vendor: str
+    version: str
+
+    def render(self, language: str = "English") -> str:
+        labels = ANSWER_LABELS.get(language, ANSWER_LABELS["English"])
+        target = self.row.terms[self.target_vendor]
+        vendors = [v for v in (self.source_vendor, self.target_vendor) if v]
+        lines = [
+            f"**{target.name}** ({self.target_vendor}) — {self.row.concept}",
+            "",
+            "| | " + " | ".join(vendors) + " |",
+            "|---|" + "---|" * len(vendors),
+        ]
+        cells = [self.row.terms[v] for v in vendors]
+        lines.append(f"| {labels['term']} | " + " | ".join(c.name for c in cells) + " |")
+        lines.append(f"| {labels['cli']} | " + " | ".join(
+            "<br>".join(f"`{cmd}`" for cmd in c.cli) or labels["none"] for c in cells) + " |")
+        lines.append(f"| {labels['ansible']} | " + " | ".join(
+            f"`{c.ansible}`" if c.ansible else labels["none"] for c in cells) + " |")
+        if self.row.notes:
+            lines += ["", f"{labels['notes']}: {self.row.notes}"]
+        return "\n".join(lines)
+
+
+def _row_from_json(raw: Dict) -> MappingRow:
+    terms = {
+        vendor: VendorTerm(
+            name=cell["name"],
+            aliases=tuple(cell.get("aliases") or ()),
+            cli=tuple(cell.get("cli") or ()),
+            ansible=cell.get("ansible"),
+        )
+        for vendor, cell in raw["terms"].items()
+    }
+    return MappingRow(id=raw["id"], category=raw["category"], concept=raw["concept"],
+                      notes=raw.get("notes", ""), terms=terms)
+
+
+def validate(data: Dict) -> List[str]:
+    """Schema problems in a parsed mapping file; empty when it is usable."""
+    problems = []
+    if not data.get("version"):
+        problems.append("missing version")
+    seen = set()
+    for n, raw in enumerate(data.get("rows", [])):
+        row_id = raw.get("id") or f"row {n}"
+        if row_id in seen:
+            problems.append(f"{row_id}: duplicate id")
+        seen.add(row_id)
+        for key in ("category", "concept", "terms"):
+            if not raw.get(key):
+                problems.append(f"{row_id}: missing {key}")
+        for vendor, cell in (raw.get("terms") or {}).items():
+            if vendor not in VENDOR_ALIASES:
+                problems.append(f"{row_id}: unknown vendor {vendor!r}")
+            if not cell.get("name"):
+                problems.append(f"{row_id}/{vendor}: missing name")
+            if not isinstance(cell.get("cli") or [], list):
+                problems.append(f"{row_id}/{vendor}: cli must be a list")
+        missing = set(VENDOR_ALIASES) - set(raw.get("terms") or {})
+        if missing:
+            problems.append(f"{row_id}: no cell for {', '.join(sorted(missing))}")
+    return problems
+
+
+class VendorMapping:
+    def __init__(self, version: str, rows: List[MappingRow]):
+        self.version = version
+        self.rows = rows
+        # phrase -> [(row index, vendor or None for the concept, weight per token)]
+        self._index: Dict[str, List[Tuple[int, Optional[str], int]]] = defaultdict(list)
+        for i, row in enumerate(rows):
+            self._index_row(i, row)
+
+    @classmethod
+    def load(cls, path: str = VENDOR_MAPPING_PATH) -> "VendorMapping":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        problems = validate(data)
+        if problems:
+            raise ValueError(f"{path}: " + "; ".join(problems[:5]))
+        return cls(data["version"], [_row_from_json(raw) for raw in data["rows"]])
+
+    # ---- index ----
+
+    def _add(self, phrase: List[str], i: int, vendor: Optional[str], weight: int) -> None:
+        if not phrase or len(phrase) > MAX_PHRASE_TOKENS or set(phrase) <= VENDOR_WORDS:
+            return
+        entry = (i, vendor, weight)
+        postings = self._index[" ".join(phrase)]
+        if entry not in postings:
+            postings.append(entry)
+
+    def _index_row(self, i: int, row: MappingRow) -> None:
+        for vendor, term in row.terms.items():
+            for name in [*NAME_SEGMENT.split(term.name), *term.aliases]:
+                tokens = tokenize(name)
+                self._add(tokens, i, vendor, NAME_WEIGHT)
+                for token in tokens:
+                    parts = [p for p in PART.split(token) if len(p) > 1]
+                    if len(parts) > 1:
+                        for part in parts:
+                            self._add([part], i, vendor, HINT_WEIGHT)
+            if term.ansible:
+                module = tokenize(term.ansible.split(" ")[0])
+                if module:
+                    self._add(module, i, vendor, NAME_WEIGHT)
+                    # "na_ontap_snapmirror" is specific on its own, dellemc.powermax's "snapshot" is not
+                    short = module[0].rsplit(".", 1)[-1]
+                    if "_" in short:
+                        self._add([short], i, vendor, NAME_WEIGHT)
+            for command in term.cli:
+                tokens = tokenize(command)
+                self._add(tokens[:2], i, vendor, CLI_WEIGHT)
+                self._add(tokens[:1], i, vendor, HINT_WEIGHT)
+        for token in tokenize(row.concept):
+            if token not in STOPWORDS:
+                self._add([token], i, None, HINT_WEIGHT)
+
+    def _hits(self, text: str) -> Dict[int, Dict[Optional[str], int]]:
+        """Row index -> vendor (None = concept) -> score, each distinct phrase counted once."""
+        tokens = tokenize(text)
+        hits: Dict[int, Dict[Optional[str], int]] = defaultdict(lambda: defaultdict(int))
+        seen = set()
+        for n in range(MAX_PHRASE_TOKENS, 0, -1):
+            for start in range(len(tokens) - n + 1):
+                phrase = " ".join(tokens[start:start + n])
+                if phrase in seen:
+                    continue
+                seen.add(phrase)
+                for i, vendor, weight in self._index.get(phrase, ()):
+                    hits[i][vendor] += weight * n
+        return hits
+
+    # ---- queries ----
+
+    def lookup(self, text: str, vendor: Optional[str] = None, k: int = MAX_CONTEXT_ROWS,
+               min_score: int = MIN_ROW_SCORE) -> List[Tuple[MappingRow, int]]:
+        """Rows mentioned in `text`, best first; terms of `vendor` count double."""
+        ranked = []
+        for i, by_vendor in self._hits(text).items():
+            score = sum(by_vendor.values()) + (by_vendor.get(vendor, 0) if vendor else 0)
+            if score >= min_score:
+                ranked.append((score, -i))
+        ranked.sort(reverse=True)
+        return [(self.rows[-i], score) for score, i in ranked[:k]]
+
+    def equivalent(self, term: str, target_vendor: str,
+                   source_vendor: Optional[str] = None) -> Optional[Equivalent]:
+        """Row whose `source_vendor` (or any other vendor's) term matches `term`, seen from `target_vendor`."""
+        if target_vendor not in VENDOR_ALIASES:
+            return None
+        best = None
+        for i, by_vendor in self._hits(term).items():
+            others = {v: s for v, s in by_vendor.items() if v and v != target_vendor}
+            score = sum(others.values()) + by_vendor.get(None, 0)
+            if source_vendor and source_vendor != target_vendor:
+                score += others.get(source_vendor, 0)
+            if not others:
+                score = max(score, by_vendor.get(target_vendor, 0))
+            if score >= MIN_ROW_SCORE and (best is None or score > best[0]):
+                matched = max(others, key=others.get) if others else None
+                best = (score, i, matched)
+        if best is None:
+            return None
+        _, i, matched = best
+        source = source_vendor if source_vendor and source_vendor != target_vendor else matched
+        return Equivalent(self.rows[i], term, source, target_vendor, self.version)
+
+    def answer(self, text: str, default_source: Optional[str] = None) -> Optional[Equivalent]:
+        """Answer a short "equivalent of X on Y" question from the table; None when it is not one."""
+        text = text.strip()
+        if not text or len(text) > MAX_QUESTION_CHARS or "\n" in text:
+            return None
+        for pattern in EQUIVALENT_QUESTIONS:
+            match = pattern.search(text)
+            if not match:
+                continue
+            targets = vendors_in(match.group("target"))
+            # "on Pure FlashArray", not "on Pure is failing"
+            if len(targets) != 1 or any(not _vendor_word(w) and w not in TARGET_WORDS
+                                        for w in tokenize(match.group("target"))):
+                continue
+            term = match.group("term")
+            named = vendors_in(term)
+            source = named[0] if len(named) == 1 else default_source
+            words = [w for w in tokenize(term) if w not in ARTICLES and w != "s" and w not in VENDOR_WORDS]
+            if words and len(words) <= MAX_TERM_WORDS:
+                return self.equivalent(" ".join(words), targets[0], source)
+        return None
+
+
+def load_mapping(path: str = VENDOR_MAPPING_PATH) -> Optional[VendorMapping]:
+    """The table at `path`, or None when it is missing or invalid (prompts then go out without it)."""
+    try:
+        return VendorMapping.load(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def mapping_vendors(task_key: str, vendor: str, text: str) -> List[str]:
+    """Table columns for a migration prompt: the source vendor plus the vendors the details name."""
+    named = vendors_in(text)
+    if task_key == "Cross-Vendor Migration" and not [v for v in named if v != vendor]:
+        return list(VENDOR_ALIASES)
+    return [v for v in VENDOR_ALIASES if v == vendor or v in named]
+
+
+def format_mapping_context(rows: List[MappingRow], vendors: List[str]) -> str:
+    lines = []
+    for row in rows:
+        cells = []
+        for vendor in vendors:
+            term = row.terms[vendor]
+            details = [f"`{term.cli[0]}`"] if term.cli else []
+            if term.ansible:
+                details.append(term.ansible)
+            cells.append(f"{vendor} = {term.name}" + (f" ({'; '.join(details)})" if details else ""))
+        line = f"- {row.concept}: " + " | ".join(cells)
+        if row.notes:
+            line += f". Note: {row.notes}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cross-vendor mapping table")
+    parser.add_argument("--path", default=VENDOR_MAPPING_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    lookup_cmd = sub.add_parser("lookup")
+    lookup_cmd.add_argument("text")
+    lookup_cmd.add_argument("--vendor")
+    lookup_cmd.add_argument("-k", type=int, default=MAX_CONTEXT_ROWS)
+    equivalent_cmd = sub.add_parser("equivalent")
+    equivalent_cmd.add_argument("term")
+    equivalent_cmd.add_argument("--target", required=True)
+    equivalent_cmd.add_argument("--source")
+    ask_cmd = sub.add_parser("ask")
+    ask_cmd.add_argument("question")
+    ask_cmd.add_argument("--language", default="English")
+    sub.add_parser("validate")
+    bench_cmd = sub.add_parser("bench")
+    bench_cmd.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if args.command == "validate":
+        with open(args.path, encoding="utf-8") as f:
+            data = json.load(f)
+        problems = validate(data)
+        for problem in problems:
+            print(problem)
+        print(f"{args.path}: version {data.get('version')}, {len(data.get('rows', []))} rows, "
+              f"{len(problems)} problems")
+        return 1 if problems else 0
+
+    start = time.perf_counter()
+    mapping = VendorMapping.load(args.path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    if args.command == "lookup":
+        for row, score in mapping.lookup(args.text, vendor=args.vendor, k=args.k):
+            print(f"{score:4d}  {row.id}: {row.concept}")
+        return 0
+    if args.command in ("equivalent", "ask"):
+        if args.command == "equivalent":
+            result = mapping.equivalent(args.term, args.target, args.source)
+        else:
+            result = mapping.answer(args.question)
+        if result is None:
+            print("no match in the mapping table")
+            return 1
+        print(result.render(getattr(args, "language", "English")))
+        return 0
+
+    migration = ("Migrate 40 LUNs in igroup esx_prod from ONTAP to PowerMax. SnapMirror to the DR site "
+                 "must be replaced by SRDF/A; keep the hourly snapshot policy and QoS limits. ") * 3
+    questions = ["What's the equivalent of SRDF/A on NetApp?", "equivalent of igroup on Pure",
+                 "Was ist die Entsprechung von masking view auf ONTAP?"]
+    timings = {"lookup (migration details)": [], "answer (question)": []}
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        mapping.lookup(migration, vendor="NetApp ONTAP")
+        timings["lookup (migration details)"].append(time.perf_counter() - start)
+        for question in questions:
+            start = time.perf_counter()
+            mapping.answer(question)
+            timings["answer (question)"].append(time.perf_counter() - start)
+    print(f"load + index: {load_ms:.1f} ms ({len(mapping.rows)} rows, {len(mapping._index)} phrases)")
+    for label, values in timings.items():
+        values.sort()
+        print(f"{label}: p50 {values[len(values) // 2] * 1e6:.0f} µs, "
+              f"p99 {values[int(len(values) * 0.99)] * 1e6:.0f} µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))